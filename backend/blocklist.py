@@ -0,0 +1,169 @@
+"""
+In-process set of blocked users for the login gate.
+
+is_user_fingerprinted runs on every protected-platform event and every
+/api/v1/check-and-login call. BlockedUsers keeps {user_id: {fingerprint_id: risk}}
+for BLOCKED fingerprints in memory, so the check is a dict lookup:
+
+- loaded lazily from the database on first use;
+- updated by the storage write functions after their transaction commits;
+- shared across worker processes through a version counter row in
+  `cache_versions`: every change to the blocked set bumps it in the same
+  transaction, and each process polls it (at most once per `poll_seconds`)
+  and reloads when another process moved it.
+"""
+
+import threading
+import time
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+from db import CacheVersionDB, FingerprintDB
+
+# (fingerprint_id, user_id, status, risk_score) after a committed change
+BlockChange = Tuple[str, str, str, int]
+
+
+class BlockedUsers:
+    """Blocked users cache with version-counter invalidation."""
+
+    CACHE_NAME = "blocked_users"
+
+    def __init__(self, session_factory: Callable, poll_seconds: float = 1.0):
+        self.session_factory = session_factory
+        self.poll_seconds = poll_seconds
+        self._by_user: Dict[str, Dict[str, int]] = {}
+        self._user_of: Dict[str, str] = {}
+        self._version: Optional[int] = None
+        self._stale = True
+        self._last_poll = 0.0
+        self._lock = threading.RLock()
+        self._reloads = 0
+
+    # ---------- reads ----------
+
+    def is_blocked(self, user_id: str, min_risk: int = 0) -> bool:
+        """True if the user has a BLOCKED fingerprint with risk_score >= min_risk."""
+        self._refresh()
+        with self._lock:
+            fingerprints = self._by_user.get(user_id)
+            return bool(fingerprints) and any(risk >= min_risk for risk in fingerprints.values())
+
+    def _refresh(self) -> None:
+        now = time.monotonic()
+        if not self._stale and now - self._last_poll < self.poll_seconds:
+            return
+        with self._lock:
+            if self._stale:
+                self.load()
+                return
+            self._last_poll = now
+            if self._read_version() != self._version:
+                self.load()
+
+    def _read_version(self) -> Optional[int]:
+        """Shared version, or None if cache_versions is missing (database not migrated yet)."""
+        session = self.session_factory()
+        try:
+            row = session.get(CacheVersionDB, self.CACHE_NAME)
+            return row.version if row else 0
+        except OperationalError:
+            return None
+        finally:
+            session.close()
+
+    def load(self) -> None:
+        """(Re)load the blocked set and its version from the database."""
+        version = self._read_version()
+        session = self.session_factory()
+        try:
+            rows = session.query(
+                FingerprintDB.fingerprint_id, FingerprintDB.user_id, FingerprintDB.risk_score
+            ).filter(FingerprintDB.status == "BLOCKED").all()
+        finally:
+            session.close()
+
+        by_user: Dict[str, Dict[str, int]] = {}
+        user_of: Dict[str, str] = {}
+        for fingerprint_id, user_id, risk_score in rows:
+            by_user.setdefault(user_id, {})[fingerprint_id] = risk_score
+            user_of[fingerprint_id] = user_id
+        with self._lock:
+            self._by_user = by_user
+            self._user_of = user_of
+            self._version = version
+            self._stale = False
+            self._last_poll = time.monotonic()
+            self._reloads += 1
+
+    # ---------- writes (called by storage) ----------
+
+    def bump(self, session) -> int:
+        """
+        Increment the shared version inside the caller's transaction (before commit).
+        Returns the new version, to be passed to apply() after the commit.
+        """
+        updated = session.query(CacheVersionDB).filter(
+            CacheVersionDB.name == self.CACHE_NAME
+        ).update({CacheVersionDB.version: CacheVersionDB.version + 1}, synchronize_session=False)
+        if not updated:
+            try:
+                with session.begin_nested():
+                    session.add(CacheVersionDB(name=self.CACHE_NAME, version=1))
+            except IntegrityError:
+                # Another process created the row meanwhile
+                session.query(CacheVersionDB).filter(
+                    CacheVersionDB.name == self.CACHE_NAME
+                ).update({CacheVersionDB.version: CacheVersionDB.version + 1}, synchronize_session=False)
+        return session.get(CacheVersionDB, self.CACHE_NAME, populate_existing=True).version
+
+    def apply(self, changes: Iterable[BlockChange], version: Optional[int] = None) -> None:
+        """Apply committed fingerprint changes to the in-memory set."""
+        with self._lock:
+            for fingerprint_id, user_id, status, risk_score in changes:
+                self._discard(fingerprint_id)
+                if status == "BLOCKED":
+                    self._by_user.setdefault(user_id, {})[fingerprint_id] = risk_score
+                    self._user_of[fingerprint_id] = user_id
+            self._advance(version)
+
+    def clear_user(self, user_id: str, version: Optional[int] = None) -> None:
+        """All of the user's fingerprints left BLOCKED (committed)."""
+        with self._lock:
+            for fingerprint_id in self._by_user.pop(user_id, {}):
+                self._user_of.pop(fingerprint_id, None)
+            self._advance(version)
+
+    def _advance(self, version: Optional[int]) -> None:
+        if version is None:
+            return
+        if self._version is not None and version == self._version + 1:
+            self._version = version
+        else:
+            # Another process changed the set too (or we never loaded): reload on next read
+            self._stale = True
+
+    def _discard(self, fingerprint_id: str) -> None:
+        user_id = self._user_of.pop(fingerprint_id, None)
+        if user_id is None:
+            return
+        fingerprints = self._by_user.get(user_id)
+        if fingerprints is not None:
+            fingerprints.pop(fingerprint_id, None)
+            if not fingerprints:
+                del self._by_user[user_id]
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._stale = True
+
+    def stats(self):
+        with self._lock:
+            return {
+                "blocked_users": len(self._by_user),
+                "blocked_fingerprints": len(self._user_of),
+                "version": self._version,
+                "reloads": self._reloads,
+                "poll_seconds": self.poll_seconds,
+            }
@@ -0,0 +1,175 @@
+"""
+Push channel for fingerprint changes (Server-Sent Events, /api/v1/fingerprints/stream).
+
+Dashboards used to poll the fingerprint list every 5 seconds each. ChangeBroadcaster
+runs ONE reader for all viewers: a daemon thread follows the changes feed
+(changes.py) and fans every batch out to the subscribers, so the database cost
+does not grow with the number of open dashboards.
+
+- The reader wakes up as soon as this process commits a fingerprint write
+  (wake(), called from a storage listener), and otherwise every `poll_seconds`
+  to pick up writes made by other worker processes.
+- It only runs while somebody is subscribed: no viewers, no queries.
+- Each subscriber has a bounded buffer of `buffer_size` messages. A subscriber
+  that falls that far behind is dropped (its buffer is replaced by a "dropped"
+  message) instead of slowing down the others or growing memory; the client
+  reconnects and reloads its list.
+- Messages are serialized once per batch, not once per viewer.
+"""
+
+import json
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Set
+
+
+def format_sse(event: str, data: Any) -> str:
+    """One Server-Sent Events message."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class Subscription:
+    """Bounded message buffer of one connected viewer."""
+
+    def __init__(self, buffer_size: int):
+        self.messages: "queue.Queue[Optional[str]]" = queue.Queue(maxsize=buffer_size)
+        self.dropped = False
+
+    def get(self, timeout: float) -> Optional[str]:
+        """Next message, "" on timeout (send a keepalive), None once the subscription is closed."""
+        try:
+            return self.messages.get(timeout=timeout)
+        except queue.Empty:
+            return ""
+
+
+class ChangeBroadcaster:
+    """Follows the changes feed with one thread and fans it out to subscribers."""
+
+    def __init__(self, read_changes: Callable[[Optional[str]], Dict[str, Any]],
+                 poll_seconds: float = 1.0, buffer_size: int = 100, name: str = "fingerprint-stream"):
+        self.read_changes = read_changes
+        self.poll_seconds = poll_seconds
+        self.buffer_size = buffer_size
+        self.name = name
+
+        self._subscribers: Set[Subscription] = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._cursor: Optional[str] = None
+
+        self._published = 0
+        self._dropped = 0
+        self._reads = 0
+        self._last_error: Optional[str] = None
+
+    # ---------- subscribers ----------
+
+    def subscribe(self) -> Subscription:
+        """
+        Register a viewer. Changes committed from now on are delivered; the client
+        catches up on anything older from its own cursor (/api/v1/fingerprints/changes).
+        """
+        subscription = Subscription(self.buffer_size)
+        with self._lock:
+            if self._cursor is None:
+                # First viewer: start following the feed from the current head
+                self._cursor = self.read_changes(None)["cursor"]
+            self._subscribers.add(subscription)
+            self._ensure_thread()
+        self._wake.set()
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def wake(self) -> None:
+        """A fingerprint write was committed in this process: read the feed now."""
+        self._wake.set()
+
+    # ---------- fan-out ----------
+
+    def publish(self, event: str, data: Any) -> int:
+        """Queue one message for every subscriber. Returns the number of subscribers reached."""
+        message = format_sse(event, data)
+        with self._lock:
+            subscribers = list(self._subscribers)
+        delivered = 0
+        for subscription in subscribers:
+            try:
+                subscription.messages.put_nowait(message)
+                delivered += 1
+            except queue.Full:
+                self._drop(subscription)
+        self._published += 1
+        return delivered
+
+    def _drop(self, subscription: Subscription) -> None:
+        """Slow consumer: discard its backlog, tell it to reload, close it."""
+        self.unsubscribe(subscription)
+        subscription.dropped = True
+        while True:
+            try:
+                subscription.messages.get_nowait()
+            except queue.Empty:
+                break
+        subscription.messages.put_nowait(format_sse("dropped", {"reason": "slow consumer"}))
+        subscription.messages.put_nowait(None)
+        self._dropped += 1
+
+    # ---------- reader thread ----------
+
+    def _ensure_thread(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            self._wake.wait(self.poll_seconds)
+            self._wake.clear()
+            with self._lock:
+                if not self._subscribers:
+                    # Idle: stop the thread, the next subscribe() starts a new one
+                    self._thread = None
+                    self._cursor = None
+                    return
+            try:
+                self._poll()
+            except Exception as e:
+                self._last_error = str(e)
+                print(f"❌ [STREAM] Reading fingerprint changes failed: {e}")
+                time.sleep(self.poll_seconds)
+
+    def _poll(self) -> None:
+        while True:
+            feed = self.read_changes(self._cursor)
+            self._reads += 1
+            self._cursor = feed["cursor"]
+            if feed["reset"]:
+                self.publish("reset", {"cursor": feed["cursor"]})
+            elif feed["changes"] or feed["deleted"]:
+                self.publish("fingerprints", {
+                    "changes": feed["changes"],
+                    "deleted": feed["deleted"],
+                    "cursor": feed["cursor"],
+                })
+            if not feed["has_more"]:
+                return
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            subscribers = len(self._subscribers)
+        return {
+            "subscribers": subscribers,
+            "running": self._thread is not None and self._thread.is_alive(),
+            "buffer_size": self.buffer_size,
+            "poll_seconds": self.poll_seconds,
+            "published": self._published,
+            "dropped_subscribers": self._dropped,
+            "feed_reads": self._reads,
+            "last_error": self._last_error,
+        }
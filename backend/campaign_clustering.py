@@ -0,0 +1,341 @@
+"""
+Offline campaign clustering over stored fingerprints (for analyst triage).
+
+Loads every fingerprint's numeric behavioural features (typed columns, no JSON
+parsing) and device/IP keys in chunks (keyset pagination on the primary key), clusters the feature vectors
+with scikit-learn and writes the cluster ids in bulk to the
+`fingerprint_clusters` table.
+
+- minibatch (default): MiniBatchKMeans.partial_fit over the chunks, then a second
+  chunked pass to predict and write labels. Memory is bounded by --chunk-size.
+- dbscan: loads all vectors at once (small databases only).
+
+Each cluster is summarised with its size and the approximate number of distinct
+devices and IPs it spans (HyperLogLog), so "many fingerprints, few devices"
+clusters stand out as campaigns.
+
+Run:
+    python backend/campaign_clustering.py                       # cluster the database
+    python backend/campaign_clustering.py --algorithm dbscan --eps 0.3
+    python backend/campaign_clustering.py --benchmark 5000000   # synthetic runtime / memory
+"""
+
+import os
+import sys
+import json
+import time
+import resource
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+# Add backend to path
+sys.path.insert(0, os.path.dirname(__file__))
+
+from db import get_db_session, init_db, FingerprintDB, FingerprintClusterDB
+from sketches import HyperLogLog
+
+# Same metrics as engine.extract_numeric_features
+CLUSTER_FEATURES = (
+    "total_events",
+    "events_per_minute",
+    "update_mobile_attempt_count",
+    "pages_visited_count",
+)
+
+DEFAULT_CHUNK_SIZE = 50000
+DEFAULT_CLUSTERS = 32
+
+Chunk = Tuple[List[str], np.ndarray, List[Optional[str]], List[Optional[str]]]
+
+
+def features_from_json(behavioral_features_json: Optional[str]) -> List[float]:
+    """Numeric feature vector of a fingerprint (missing / non-numeric values are 0)."""
+    if not behavioral_features_json:
+        return [0.0] * len(CLUSTER_FEATURES)
+    try:
+        features = json.loads(behavioral_features_json)
+    except json.JSONDecodeError:
+        return [0.0] * len(CLUSTER_FEATURES)
+    return [
+        float(value) if isinstance(value, (int, float)) else 0.0
+        for value in (features.get(key, 0) for key in CLUSTER_FEATURES)
+    ]
+
+
+def features_from_columns(values) -> List[float]:
+    """Numeric feature vector from the typed feature columns (NULL = 0)."""
+    return [float(value) if value is not None else 0.0 for value in values]
+
+
+def to_matrix(rows: List[List[float]]) -> np.ndarray:
+    # log1p keeps counts and rates on comparable scales without a fitted scaler
+    return np.log1p(np.maximum(np.asarray(rows, dtype=np.float32), 0.0))
+
+
+def iter_fingerprint_chunks(session, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[Chunk]:
+    """Yield (fingerprint_ids, feature matrix, device_ids, ip_addresses) chunks in primary key order."""
+    last_id = 0
+    while True:
+        rows = session.query(
+            FingerprintDB.id,
+            FingerprintDB.fingerprint_id,
+            FingerprintDB.device_id,
+            FingerprintDB.ip_address,
+            *[getattr(FingerprintDB, column) for column in CLUSTER_FEATURES],
+        ).filter(FingerprintDB.id > last_id).order_by(FingerprintDB.id).limit(chunk_size).all()
+        if not rows:
+            return
+        last_id = rows[-1][0]
+        yield (
+            [row[1] for row in rows],
+            to_matrix([features_from_columns(row[4:]) for row in rows]),
+            [row[2] for row in rows],
+            [row[3] for row in rows],
+        )
+
+
+class ClusterSummary:
+    """Size and approximate distinct devices / IPs per cluster."""
+
+    def __init__(self):
+        self.sizes: Dict[int, int] = {}
+        self.devices: Dict[int, HyperLogLog] = {}
+        self.ips: Dict[int, HyperLogLog] = {}
+
+    def add(self, labels: np.ndarray, device_ids: List[Optional[str]], ip_addresses: List[Optional[str]]) -> None:
+        for label, device_id, ip_address in zip(labels.tolist(), device_ids, ip_addresses):
+            self.sizes[label] = self.sizes.get(label, 0) + 1
+            if device_id:
+                self.devices.setdefault(label, HyperLogLog()).add(device_id)
+            if ip_address:
+                self.ips.setdefault(label, HyperLogLog()).add(ip_address)
+
+    def clusters(self) -> List[Dict[str, Any]]:
+        result = [
+            {
+                "cluster_id": label,
+                "fingerprints": size,
+                "distinct_devices": self.devices[label].count() if label in self.devices else 0,
+                "distinct_ips": self.ips[label].count() if label in self.ips else 0,
+            }
+            for label, size in self.sizes.items()
+        ]
+        result.sort(key=lambda c: c["fingerprints"], reverse=True)
+        return result
+
+
+def _write_assignments(session, fingerprint_ids: List[str], labels: np.ndarray, algorithm: str, clustered_at: datetime) -> None:
+    session.execute(
+        FingerprintClusterDB.__table__.insert(),
+        [
+            {"fingerprint_id": fp_id, "cluster_id": int(label), "algorithm": algorithm, "clustered_at": clustered_at}
+            for fp_id, label in zip(fingerprint_ids, labels.tolist())
+        ],
+    )
+
+
+def cluster_minibatch(session, n_clusters: int = DEFAULT_CLUSTERS, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                      write: bool = True) -> Dict[str, Any]:
+    """
+    Two chunked passes: partial_fit, then predict + bulk write.
+    Only one chunk of rows is in memory at a time.
+    """
+    from sklearn.cluster import MiniBatchKMeans
+
+    model = MiniBatchKMeans(n_clusters=n_clusters, batch_size=min(chunk_size, 4096), random_state=42, n_init=3)
+    fitted_rows = 0
+    pending: Optional[np.ndarray] = None
+    for _, matrix, _, _ in iter_fingerprint_chunks(session, chunk_size):
+        # partial_fit needs at least n_clusters samples in its first call
+        pending = matrix if pending is None else np.vstack([pending, matrix])
+        if fitted_rows == 0 and len(pending) < n_clusters:
+            continue
+        model.partial_fit(pending)
+        fitted_rows += len(pending)
+        pending = None
+
+    if pending is not None and len(pending):
+        # Fewer fingerprints than clusters in the whole table
+        model.set_params(n_clusters=len(pending))
+        model.partial_fit(pending)
+        fitted_rows += len(pending)
+
+    if fitted_rows == 0:
+        return {"algorithm": "minibatch", "fingerprints": 0, "clusters": []}
+
+    summary = ClusterSummary()
+    clustered_at = datetime.utcnow()
+    if write:
+        session.query(FingerprintClusterDB).delete(synchronize_session=False)
+    for fingerprint_ids, matrix, device_ids, ip_addresses in iter_fingerprint_chunks(session, chunk_size):
+        labels = model.predict(matrix)
+        summary.add(labels, device_ids, ip_addresses)
+        if write:
+            _write_assignments(session, fingerprint_ids, labels, "minibatch", clustered_at)
+    if write:
+        session.commit()
+
+    return {
+        "algorithm": "minibatch",
+        "fingerprints": sum(summary.sizes.values()),
+        "clusters": summary.clusters(),
+    }
+
+
+def cluster_dbscan(session, eps: float = 0.3, min_samples: int = 5, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                   write: bool = True) -> Dict[str, Any]:
+    """DBSCAN over all fingerprints at once (not chunked: use for small databases)."""
+    from sklearn.cluster import DBSCAN
+
+    fingerprint_ids: List[str] = []
+    matrices: List[np.ndarray] = []
+    device_ids: List[Optional[str]] = []
+    ip_addresses: List[Optional[str]] = []
+    for ids, matrix, devices, ips in iter_fingerprint_chunks(session, chunk_size):
+        fingerprint_ids.extend(ids)
+        matrices.append(matrix)
+        device_ids.extend(devices)
+        ip_addresses.extend(ips)
+
+    if not fingerprint_ids:
+        return {"algorithm": "dbscan", "fingerprints": 0, "clusters": []}
+
+    labels = DBSCAN(eps=eps, min_samples=min_samples).fit_predict(np.vstack(matrices))
+    summary = ClusterSummary()
+    summary.add(labels, device_ids, ip_addresses)
+
+    if write:
+        clustered_at = datetime.utcnow()
+        session.query(FingerprintClusterDB).delete(synchronize_session=False)
+        for start in range(0, len(fingerprint_ids), chunk_size):
+            end = start + chunk_size
+            _write_assignments(session, fingerprint_ids[start:end], labels[start:end], "dbscan", clustered_at)
+        session.commit()
+
+    return {
+        "algorithm": "dbscan",
+        "fingerprints": len(fingerprint_ids),
+        "clusters": summary.clusters(),
+    }
+
+
+def run_clustering(algorithm: str = "minibatch", session_factory: Callable = get_db_session, **kwargs) -> Dict[str, Any]:
+    """Cluster all stored fingerprints and write fingerprint_clusters. Returns a summary."""
+    session = session_factory()
+    try:
+        if algorithm == "dbscan":
+            return cluster_dbscan(session, **kwargs)
+        if algorithm == "minibatch":
+            return cluster_minibatch(session, **kwargs)
+        raise ValueError(f"Unknown algorithm: {algorithm}")
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+# ========== BENCHMARK ==========
+
+def _peak_rss_mb() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    return usage / (1024 * 1024) if sys.platform == "darwin" else usage / 1024
+
+
+def _synthetic_chunks(total: int, chunk_size: int, seed: int = 7) -> Iterator[List[Tuple]]:
+    """Chunks of feature column tuples drawn from a few behaviour profiles."""
+    rng = np.random.default_rng(seed)
+    profiles = np.array([
+        [5, 1.0, 0, 2],      # normal browsing
+        [40, 12.0, 6, 1],    # SIM-swap style update attempts
+        [200, 60.0, 0, 20],  # scraping / fast drain
+        [15, 4.0, 2, 8],
+    ], dtype=np.float64)
+    for start in range(0, total, chunk_size):
+        size = min(chunk_size, total - start)
+        picks = profiles[rng.integers(0, len(profiles), size)]
+        values = np.maximum(picks * rng.normal(1.0, 0.2, picks.shape), 0)
+        yield [(int(row[0]), round(float(row[1]), 2), int(row[2]), int(row[3])) for row in values]
+
+
+def benchmark(total: int, n_clusters: int = DEFAULT_CLUSTERS, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Dict[str, Any]:
+    """
+    Time the chunked clustering pipeline (column rows -> matrix -> partial_fit -> predict) on
+    synthetic fingerprints, without a database. Reports seconds per phase and peak RSS.
+    """
+    from sklearn.cluster import MiniBatchKMeans
+
+    model = MiniBatchKMeans(n_clusters=n_clusters, batch_size=min(chunk_size, 4096), random_state=42, n_init=3)
+    timings = {"load_seconds": 0.0, "fit_seconds": 0.0, "predict_seconds": 0.0}
+
+    for rows in _synthetic_chunks(total, chunk_size):
+        t0 = time.perf_counter()
+        matrix = to_matrix([features_from_columns(row) for row in rows])
+        t1 = time.perf_counter()
+        model.partial_fit(matrix)
+        timings["load_seconds"] += t1 - t0
+        timings["fit_seconds"] += time.perf_counter() - t1
+
+    sizes = np.zeros(n_clusters, dtype=np.int64)
+    for rows in _synthetic_chunks(total, chunk_size):
+        t0 = time.perf_counter()
+        matrix = to_matrix([features_from_columns(row) for row in rows])
+        t1 = time.perf_counter()
+        sizes += np.bincount(model.predict(matrix), minlength=n_clusters)
+        timings["load_seconds"] += t1 - t0
+        timings["predict_seconds"] += time.perf_counter() - t1
+
+    total_seconds = sum(timings.values())
+    return {
+        "fingerprints": total,
+        "chunk_size": chunk_size,
+        "clusters": n_clusters,
+        **{key: round(value, 2) for key, value in timings.items()},
+        "total_seconds": round(total_seconds, 2),
+        "fingerprints_per_second": int(total / total_seconds) if total_seconds else 0,
+        "peak_rss_mb": round(_peak_rss_mb(), 1),
+        "largest_clusters": sorted(sizes.tolist(), reverse=True)[:5],
+    }
+
+
+def main():
+    """Main function"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description='تجميع البصمات في حملات (Offline campaign clustering)')
+    parser.add_argument('--algorithm', choices=['minibatch', 'dbscan'], default='minibatch')
+    parser.add_argument('--clusters', type=int, default=DEFAULT_CLUSTERS, help='عدد العناقيد (minibatch)')
+    parser.add_argument('--eps', type=float, default=0.3, help='DBSCAN eps')
+    parser.add_argument('--min-samples', type=int, default=5, help='DBSCAN min_samples')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='عدد البصمات في كل دفعة')
+    parser.add_argument('--dry-run', action='store_true', help='لا تكتب النتائج في قاعدة البيانات')
+    parser.add_argument('--benchmark', type=int, metavar='N', help='قياس الأداء على N بصمة اصطناعية')
+    args = parser.parse_args()
+
+    if args.benchmark:
+        print(f"⏱️ [CLUSTERING] Benchmark on {args.benchmark} synthetic fingerprints (chunk={args.chunk_size})")
+        print(json.dumps(benchmark(args.benchmark, args.clusters, args.chunk_size), indent=2))
+        return
+
+    init_db()
+    started = time.perf_counter()
+    if args.algorithm == 'dbscan':
+        result = run_clustering('dbscan', eps=args.eps, min_samples=args.min_samples,
+                                chunk_size=args.chunk_size, write=not args.dry_run)
+    else:
+        result = run_clustering('minibatch', n_clusters=args.clusters,
+                                chunk_size=args.chunk_size, write=not args.dry_run)
+    elapsed = time.perf_counter() - started
+
+    print(f"✅ [CLUSTERING] {result['fingerprints']} fingerprint(s) → {len(result['clusters'])} cluster(s) "
+          f"with {result['algorithm']} in {elapsed:.1f}s (peak RSS {_peak_rss_mb():.0f} MB)")
+    for cluster in result['clusters'][:20]:
+        print(f"   • cluster {cluster['cluster_id']:>4}: {cluster['fingerprints']:>8} fingerprints, "
+              f"~{cluster['distinct_devices']} devices, ~{cluster['distinct_ips']} IPs")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+"""
+Attack campaigns as connected components of users, devices and IP addresses.
+
+Fingerprints carry linked_user_id (multi-account) and related_fingerprints
+(similar behaviour), and events tie users to devices, but nothing aggregated
+these links. CampaignGraph is a disjoint-set (union-find) forest over nodes
+"user:<id>", "device:<id>" and "ip:<addr>", maintained incrementally:
+
+- every event links its user and device (a device is strong evidence of one operator);
+- every fingerprint links its user, device and IP, the linked user and the users of
+  related fingerprints.
+
+IP addresses are only linked through fingerprints: shared NAT / mobile carrier IPs
+would otherwise merge unrelated users into one giant component. Union-find cannot
+split components, so the links it is fed must be ones worth keeping.
+
+"Which campaign is this user in, and how big is it?" is a find() with path halving
+plus the aggregates kept at each root (near-constant time).
+"""
+
+import json
+import os
+import threading
+import time
+import zlib
+from typing import Any, Dict, Iterable, List, Optional
+
+PERSISTENCE_FORMAT = "campaign-graph"
+PERSISTENCE_VERSION = 1
+
+NODE_KINDS = ("user", "device", "ip")
+
+
+def node(kind: str, key: Optional[str]) -> Optional[str]:
+    """Node name for an entity, or None for missing/unknown values."""
+    if not key or key in ("unknown", "Unknown"):
+        return None
+    return f"{kind}:{key}"
+
+
+class CampaignGraph:
+    """Incremental union-find over user/device/IP nodes with per-component aggregates."""
+
+    def __init__(self):
+        self._parent: Dict[str, str] = {}
+        # Aggregates, kept only for roots
+        self._members: Dict[str, List[str]] = {}
+        self._users: Dict[str, int] = {}
+        self._events: Dict[str, int] = {}
+        self._fingerprints: Dict[str, int] = {}
+        self._max_risk: Dict[str, int] = {}
+        self._lock = threading.RLock()
+        self.updates = 0
+
+    # ---------- union-find ----------
+
+    def _add(self, name: str) -> None:
+        if name not in self._parent:
+            self._parent[name] = name
+            self._members[name] = [name]
+            self._users[name] = 1 if name.startswith("user:") else 0
+            self._events[name] = 0
+            self._fingerprints[name] = 0
+            self._max_risk[name] = 0
+
+    def _find(self, name: str) -> str:
+        parent = self._parent
+        while parent[name] != name:
+            parent[name] = parent[parent[name]]  # path halving
+            name = parent[name]
+        return name
+
+    def _union(self, a: str, b: str) -> str:
+        root_a, root_b = self._find(a), self._find(b)
+        if root_a == root_b:
+            return root_a
+        # Union by size: attach the smaller member list to the larger one
+        if len(self._members[root_a]) < len(self._members[root_b]):
+            root_a, root_b = root_b, root_a
+        self._parent[root_b] = root_a
+        self._members[root_a].extend(self._members.pop(root_b))
+        self._users[root_a] += self._users.pop(root_b)
+        self._events[root_a] += self._events.pop(root_b)
+        self._fingerprints[root_a] += self._fingerprints.pop(root_b)
+        self._max_risk[root_a] = max(self._max_risk[root_a], self._max_risk.pop(root_b))
+        return root_a
+
+    def link(self, names: Iterable[Optional[str]]) -> Optional[str]:
+        """Put all given nodes in one component. Returns its root."""
+        names = [name for name in names if name]
+        if not names:
+            return None
+        with self._lock:
+            for name in names:
+                self._add(name)
+            root = names[0]
+            for name in names[1:]:
+                root = self._union(root, name)
+            self.updates += 1
+            return self._find(root)
+
+    # ---------- incremental updates ----------
+
+    def record_event(self, event) -> None:
+        root = self.link([node("user", event.user_id), node("device", event.device_id)])
+        if root is not None:
+            with self._lock:
+                self._events[self._find(root)] += 1
+
+    def record_fingerprint(self, fingerprint, is_new: bool = True) -> None:
+        features = fingerprint.behavioral_features or {}
+        names = [
+            node("user", fingerprint.user_id),
+            node("device", fingerprint.device_id),
+            node("ip", fingerprint.ip_address),
+            node("user", features.get("linked_user_id")),
+        ]
+        for related in getattr(fingerprint, "related_fingerprints", None) or []:
+            names.append(node("user", related.get("user_id")))
+
+        root = self.link(names)
+        if root is None:
+            return
+        with self._lock:
+            root = self._find(root)
+            if is_new:
+                self._fingerprints[root] += 1
+            self._max_risk[root] = max(self._max_risk[root], int(fingerprint.risk_score or 0))
+
+    # ---------- queries ----------
+
+    def campaign_of(self, kind: str, key: str, members_limit: int = 200) -> Optional[Dict[str, Any]]:
+        """Campaign containing an entity, or None if it was never seen."""
+        name = node(kind, key)
+        with self._lock:
+            if name not in self._parent:
+                return None
+            return self._describe(self._find(name), members_limit)
+
+    def campaigns(self, min_users: int = 2, limit: int = 20) -> List[Dict[str, Any]]:
+        """Largest campaigns (by number of users), without member lists."""
+        with self._lock:
+            roots = [root for root, users in self._users.items() if users >= min_users]
+            described = [self._describe(root, members_limit=0) for root in roots]
+        described.sort(key=lambda c: (c["users"], c["fingerprints"], c["max_risk_score"]), reverse=True)
+        return described[:limit]
+
+    @staticmethod
+    def _count(members: List[str], kind: str) -> int:
+        prefix = kind + ":"
+        return sum(1 for member in members if member.startswith(prefix))
+
+    def _describe(self, root: str, members_limit: int) -> Dict[str, Any]:
+        members = self._members[root]
+        summary = {
+            # Root-derived id: stable (also across snapshot reloads) until the campaign is merged into a larger one
+            "campaign_id": f"cmp-{zlib.crc32(root.encode('utf-8')):08x}",
+            "users": self._users[root],
+            "devices": self._count(members, "device"),
+            "ips": self._count(members, "ip"),
+            "events": self._events[root],
+            "fingerprints": self._fingerprints[root],
+            "max_risk_score": self._max_risk[root],
+        }
+        if members_limit:
+            grouped = {kind: [] for kind in NODE_KINDS}
+            for member in members[:members_limit]:
+                kind, _, key = member.partition(":")
+                grouped[kind].append(key)
+            summary["members"] = grouped
+            summary["members_truncated"] = len(members) > members_limit
+        return summary
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "nodes": len(self._parent),
+                "campaigns": len(self._members),
+                "multi_user_campaigns": sum(1 for users in self._users.values() if users >= 2),
+                "updates": self.updates,
+            }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._parent.clear()
+            self._members.clear()
+            self._users.clear()
+            self._events.clear()
+            self._fingerprints.clear()
+            self._max_risk.clear()
+            self.updates = 0
+
+    # ---------- persistence ----------
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Serializable snapshot: one entry per component (root, members + aggregates).
+        Parent pointers are not stored; load() rebuilds a flat forest from the members
+        under the same root, so campaign ids survive a restart.
+        """
+        with self._lock:
+            components = [
+                {
+                    "root": root,
+                    "members": list(members),
+                    "events": self._events[root],
+                    "fingerprints": self._fingerprints[root],
+                    "max_risk_score": self._max_risk[root],
+                }
+                for root, members in self._members.items()
+                if len(members) > 1 or self._fingerprints[root]
+            ]
+        return {"format": PERSISTENCE_FORMAT, "version": PERSISTENCE_VERSION, "components": components}
+
+    def load_dict(self, data: Dict[str, Any]) -> int:
+        """Replace the graph with a snapshot from to_dict(). Returns the number of components."""
+        if data.get("format") != PERSISTENCE_FORMAT or data.get("version") != PERSISTENCE_VERSION:
+            raise ValueError("unsupported campaign graph snapshot")
+        with self._lock:
+            self.clear()
+            for component in data.get("components", []):
+                members = component["members"]
+                root = component.get("root")
+                if root not in members:
+                    root = members[0]
+                for member in members:
+                    self._parent[member] = root
+                self._members[root] = list(members)
+                self._users[root] = self._count(members, "user")
+                self._events[root] = int(component.get("events", 0))
+                self._fingerprints[root] = int(component.get("fingerprints", 0))
+                self._max_risk[root] = int(component.get("max_risk_score", 0))
+            return len(self._members)
+
+    def save(self, path: str) -> None:
+        """Write a snapshot atomically (temp file + rename)."""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def load(self, path: str) -> int:
+        """Load a snapshot if the file exists. Returns the number of components loaded."""
+        if not os.path.exists(path):
+            return 0
+        with open(path, "r", encoding="utf-8") as f:
+            return self.load_dict(json.load(f))
+
+
+def start_snapshot_thread(graph: CampaignGraph, path: str, interval_seconds: float) -> threading.Thread:
+    """Save the graph every `interval_seconds` when it has changed (daemon thread)."""
+    def run():
+        saved_updates = graph.updates
+        while True:
+            time.sleep(interval_seconds)
+            if graph.updates == saved_updates:
+                continue
+            try:
+                saved_updates = graph.updates
+                graph.save(path)
+            except OSError as e:
+                print(f"❌ [CAMPAIGNS] Error saving campaign graph: {e}")
+
+    thread = threading.Thread(target=run, name="campaign-graph-snapshots", daemon=True)
+    thread.start()
+    return thread
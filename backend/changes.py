@@ -0,0 +1,222 @@
+"""
+Changes feed over the fingerprints table (/api/v1/fingerprints/changes).
+
+A client keeps an opaque cursor and asks for what changed after it instead of
+re-downloading the whole list. Positions come from one counter (a cache_versions
+row) that every fingerprint write increments inside its own transaction
+(next_change_seq):
+
+- inserted and updated rows store the value in fingerprints.change_seq (all rows
+  of one transaction share it) and are read by (change_seq, id) > cursor;
+- deletes leave a row in fingerprint_tombstones (same transaction as the
+  delete), each with its own change_seq.
+
+The counter row stays locked until the writing transaction commits, so positions
+follow commit order: a reader never sees a change at a position it has already
+passed, whatever the clocks of the writers say or in which order concurrent
+transactions started (updated_at is informational only). The cost of a poll is
+proportional to the number of changes, not to the table.
+
+Tombstones are pruned after TOMBSTONE_RETENTION_HOURS; a cursor older than the
+pruned range (or from an older version of this feed) gets reset=True and the
+client reloads its list.
+"""
+
+import base64
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from sqlalchemy import func, tuple_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from db import CacheVersionDB, FingerprintDB, FingerprintTombstoneDB
+
+# cache_versions row holding the last position handed out by next_change_seq
+CHANGE_SEQ_NAME = "fingerprint_changes"
+
+# cache_versions row holding the change_seq of the last pruned tombstone
+TOMBSTONES_PRUNED_NAME = "fingerprint_changes_pruned"
+
+ChangesCursor = Tuple[int, int]  # (change_seq, fingerprint row id; 0 after a tombstone)
+
+
+def encode_changes_cursor(change_seq: int, row_id: int) -> str:
+    raw = f"{change_seq}|{row_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_changes_cursor(cursor: str) -> Optional[ChangesCursor]:
+    """
+    Inverse of encode_changes_cursor. Returns None for a cursor of the former
+    (updated_at, id, tombstone id) format. Raises ValueError on a malformed cursor.
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        parts = raw.split("|")
+        if len(parts) == 3:
+            datetime.fromisoformat(parts[0])
+            return None
+        change_seq, row_id = parts
+        return int(change_seq), int(row_id)
+    except (UnicodeDecodeError, ValueError, TypeError) as e:
+        raise ValueError(f"invalid cursor: {cursor!r}") from e
+
+
+def _counter(session: Session, name: str) -> int:
+    row = session.get(CacheVersionDB, name, populate_existing=True)
+    return row.version if row is not None else 0
+
+
+def next_change_seq(session: Session, count: int = 1) -> int:
+    """
+    Reserve `count` feed positions inside the caller's transaction (before commit)
+    and return the first one. Call it before BLOCKED_USERS.bump() so every writer
+    locks the two cache_versions rows in the same order.
+    """
+    increment = {CacheVersionDB.version: CacheVersionDB.version + count}
+    updated = session.query(CacheVersionDB).filter(
+        CacheVersionDB.name == CHANGE_SEQ_NAME
+    ).update(increment, synchronize_session=False)
+    if not updated:
+        try:
+            with session.begin_nested():
+                session.add(CacheVersionDB(name=CHANGE_SEQ_NAME, version=count))
+        except IntegrityError:
+            # Another process created the row meanwhile
+            session.query(CacheVersionDB).filter(
+                CacheVersionDB.name == CHANGE_SEQ_NAME
+            ).update(increment, synchronize_session=False)
+    return _counter(session, CHANGE_SEQ_NAME) - count + 1
+
+
+def _pruned_through(session: Session) -> int:
+    return _counter(session, TOMBSTONES_PRUNED_NAME)
+
+
+def head_cursor(session: Session) -> str:
+    """Cursor positioned after the latest committed change (nothing to report yet)."""
+    latest = session.query(FingerprintDB.change_seq, FingerprintDB.id).filter(
+        FingerprintDB.change_seq.isnot(None)
+    ).order_by(FingerprintDB.change_seq.desc(), FingerprintDB.id.desc()).first()
+    tombstone_seq = session.query(func.max(FingerprintTombstoneDB.change_seq)).scalar() or 0
+    position = max(tuple(latest) if latest else (0, 0), (tombstone_seq, 0), (_pruned_through(session), 0))
+    return encode_changes_cursor(*position)
+
+
+def record_tombstones(session: Session, deleted: Iterable[Tuple[str, Optional[str]]]) -> None:
+    """Add tombstones for (fingerprint_id, user_id) pairs. Call inside the deleting transaction."""
+    deleted = list(deleted)
+    if not deleted:
+        return
+    now = datetime.utcnow()
+    first_seq = next_change_seq(session, len(deleted))
+    session.add_all([
+        FingerprintTombstoneDB(fingerprint_id=fingerprint_id, user_id=user_id, deleted_at=now,
+                               change_seq=first_seq + offset)
+        for offset, (fingerprint_id, user_id) in enumerate(deleted)
+    ])
+
+
+def prune_tombstones(session: Session, retention: timedelta) -> int:
+    """
+    Delete tombstones older than `retention` and remember the highest pruned
+    change_seq, so cursors from before it are told to reload. Returns the number deleted.
+    """
+    through = session.query(func.max(FingerprintTombstoneDB.change_seq)).filter(
+        FingerprintTombstoneDB.deleted_at < datetime.utcnow() - retention
+    ).scalar()
+    if not through:
+        return 0
+    deleted = session.query(FingerprintTombstoneDB).filter(
+        FingerprintTombstoneDB.change_seq <= through
+    ).delete(synchronize_session=False)
+    updated = session.query(CacheVersionDB).filter(
+        CacheVersionDB.name == TOMBSTONES_PRUNED_NAME
+    ).update({CacheVersionDB.version: through}, synchronize_session=False)
+    if not updated:
+        try:
+            with session.begin_nested():
+                session.add(CacheVersionDB(name=TOMBSTONES_PRUNED_NAME, version=through))
+        except IntegrityError:
+            # Another process created the row meanwhile
+            session.query(CacheVersionDB).filter(
+                CacheVersionDB.name == TOMBSTONES_PRUNED_NAME
+            ).update({CacheVersionDB.version: through}, synchronize_session=False)
+    return deleted
+
+
+def backfill_change_seq(session: Session) -> int:
+    """
+    Give feed positions to rows written without one (tables from before change_seq,
+    older processes still running against a migrated table, or writers that bypass
+    storage.py): all such fingerprints share one new position, tombstones get one
+    each in id order. Returns the number of rows. Run by init_db and before every
+    feed read; with nothing to fill it costs two change_seq index probes.
+    """
+    filled = 0
+    if session.query(FingerprintDB.id).filter(FingerprintDB.change_seq.is_(None)).first() is not None:
+        change_seq = next_change_seq(session)
+        filled += session.query(FingerprintDB).filter(FingerprintDB.change_seq.is_(None)).update(
+            {FingerprintDB.change_seq: change_seq}, synchronize_session=False)
+    tombstone_ids = [row_id for (row_id,) in session.query(FingerprintTombstoneDB.id).filter(
+        FingerprintTombstoneDB.change_seq.is_(None)
+    ).order_by(FingerprintTombstoneDB.id)]
+    if tombstone_ids:
+        first_seq = next_change_seq(session, len(tombstone_ids))
+        session.bulk_update_mappings(FingerprintTombstoneDB, [
+            {"id": row_id, "change_seq": first_seq + offset} for offset, row_id in enumerate(tombstone_ids)
+        ])
+        filled += len(tombstone_ids)
+    if filled:
+        session.commit()
+    return filled
+
+
+def read_changes(session: Session, cursor: str, limit: int = 500) -> Dict[str, Any]:
+    """
+    Fingerprints written and deleted after `cursor`, in commit order:
+        {"changes": [fingerprint dicts], "deleted": [fingerprint_ids],
+         "cursor": next cursor, "has_more": bool, "reset": bool}
+    has_more: more than `limit` changes and deletions are pending, ask again with
+    the returned cursor. reset: deletions since the cursor were pruned (or the
+    cursor predates change_seq), reload.
+    """
+    position = decode_changes_cursor(cursor)
+    if position is None or position[0] < _pruned_through(session):
+        return {"changes": [], "deleted": [], "cursor": head_cursor(session), "has_more": False, "reset": True}
+    change_seq, row_id = position
+
+    # Tombstones never share a position with fingerprint rows, so both follow the same cursor
+    rows = session.query(FingerprintDB).filter(
+        tuple_(FingerprintDB.change_seq, FingerprintDB.id) > (change_seq, row_id)
+    ).order_by(FingerprintDB.change_seq, FingerprintDB.id).limit(limit + 1).all()
+    tombstones = session.query(FingerprintTombstoneDB.change_seq, FingerprintTombstoneDB.fingerprint_id).filter(
+        FingerprintTombstoneDB.change_seq > change_seq
+    ).order_by(FingerprintTombstoneDB.change_seq).limit(limit + 1).all()
+
+    merged = sorted(
+        [((row.change_seq, row.id), row) for row in rows]
+        + [((seq, 0), fingerprint_id) for seq, fingerprint_id in tombstones],
+        key=lambda item: item[0]
+    )
+    has_more = len(merged) > limit
+    merged = merged[:limit]
+    if merged:
+        change_seq, row_id = merged[-1][0]
+
+    changes = [item for _, item in merged if isinstance(item, FingerprintDB)]
+    # A fingerprint_id stored again after its delete is reported as a change, not a deletion
+    deleted_ids = {item for _, item in merged if isinstance(item, str)}
+    if deleted_ids:
+        deleted_ids -= {fingerprint_id for (fingerprint_id,) in session.query(FingerprintDB.fingerprint_id).filter(
+            FingerprintDB.fingerprint_id.in_(deleted_ids)
+        )}
+
+    return {
+        "changes": [row.to_dict() for row in changes],
+        "deleted": sorted(deleted_ids),
+        "cursor": encode_changes_cursor(change_seq, row_id),
+        "has_more": has_more,
+        "reset": False,
+    }
@@ -0,0 +1,128 @@
+"""
+Rolling fingerprints: one fingerprint row per user per time bucket.
+
+process_event records every visit (NORMAL_VISIT_LOG included), which used to
+write a brand-new fp-... row per request. FingerprintCoalescer keeps the
+user's current rolling fingerprint in memory and folds new events into it:
+
+- risk_score keeps the maximum seen in the bucket,
+- behavioral_features are the latest ones,
+- detection_reasons accumulate (first occurrence order), coalesced_events counts events.
+
+A new row is only started when the bucket changes, the risk tier escalates, or
+the row's status was changed (admin block / clear / delete: see forget_fingerprint).
+
+merge() never modifies the stored object: the previous version may still be
+queued in (or being flushed by) the write-behind writer, so every merge builds
+a copy and makes that the rolling fingerprint.
+"""
+
+import dataclasses
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from models import ThreatFingerprint
+
+# Upper bounds (exclusive) of the risk tiers: <50, 50-74, 75-84, >=85
+RISK_TIER_BOUNDS = (50, 75, 85)
+
+
+def risk_tier(risk_score: int) -> int:
+    for tier, bound in enumerate(RISK_TIER_BOUNDS):
+        if risk_score < bound:
+            return tier
+    return len(RISK_TIER_BOUNDS)
+
+
+class FingerprintCoalescer:
+    """user_id -> (bucket id, tier, rolling ThreatFingerprint)."""
+
+    def __init__(self, window_seconds: int = 3600, max_users: int = 100000):
+        self.window_seconds = window_seconds
+        self.max_users = max_users
+        self._rolling: "OrderedDict[str, Tuple[int, int, ThreatFingerprint]]" = OrderedDict()
+        self._user_by_fingerprint: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self._merged = 0
+        self._started = 0
+
+    def bucket_of(self, ts: datetime) -> int:
+        return int(ts.timestamp() // self.window_seconds)
+
+    def merge(self, user_id: str, ts: datetime, risk_score: int, behavioral_features: Dict[str, Any],
+              detection_reasons: List[str], **fields: Any) -> Optional[ThreatFingerprint]:
+        """
+        Fold an event into the user's rolling fingerprint and return the new version
+        (a copy, with `fields` such as device_id set on it), or None if a new
+        fingerprint must be started (call start() with it).
+        """
+        bucket = self.bucket_of(ts)
+        tier = risk_tier(risk_score)
+        with self._lock:
+            current = self._rolling.get(user_id)
+            if current is None:
+                return None
+            row_bucket, row_tier, fingerprint = current
+            # Late events fold into the current row instead of reopening an old bucket
+            if bucket > row_bucket or tier > row_tier:
+                return None
+
+            previous = fingerprint.behavioral_features
+            reasons = list(previous.get("detection_reasons", []))
+            reasons.extend(reason for reason in detection_reasons if reason not in reasons)
+
+            features = dict(behavioral_features)
+            if reasons:
+                features["detection_reasons"] = reasons
+            features["coalesced_events"] = previous.get("coalesced_events", 1) + 1
+            features["first_seen_at"] = previous.get("first_seen_at")
+            features["last_seen_at"] = ts.isoformat()
+
+            merged = dataclasses.replace(
+                fingerprint, behavioral_features=features,
+                risk_score=max(fingerprint.risk_score, risk_score), **fields
+            )
+            self._rolling[user_id] = (row_bucket, row_tier, merged)
+            self._rolling.move_to_end(user_id)
+            self._merged += 1
+            return merged
+
+    def start(self, fingerprint: ThreatFingerprint, ts: datetime) -> None:
+        """Make a freshly created fingerprint the user's rolling one."""
+        fingerprint.behavioral_features.setdefault("coalesced_events", 1)
+        fingerprint.behavioral_features.setdefault("first_seen_at", ts.isoformat())
+        fingerprint.behavioral_features.setdefault("last_seen_at", ts.isoformat())
+        with self._lock:
+            previous = self._rolling.pop(fingerprint.user_id, None)
+            if previous is not None:
+                self._user_by_fingerprint.pop(previous[2].fingerprint_id, None)
+            self._rolling[fingerprint.user_id] = (self.bucket_of(ts), risk_tier(fingerprint.risk_score), fingerprint)
+            self._user_by_fingerprint[fingerprint.fingerprint_id] = fingerprint.user_id
+            self._started += 1
+            while len(self._rolling) > self.max_users:
+                _, (_, _, evicted) = self._rolling.popitem(last=False)
+                self._user_by_fingerprint.pop(evicted.fingerprint_id, None)
+
+    def forget_fingerprint(self, fingerprint_id: str) -> None:
+        """The row changed outside the engine (status update / delete): start a new one next time."""
+        with self._lock:
+            user_id = self._user_by_fingerprint.pop(fingerprint_id, None)
+            if user_id is not None:
+                self._rolling.pop(user_id, None)
+
+    def forget_user(self, user_id: str) -> None:
+        with self._lock:
+            current = self._rolling.pop(user_id, None)
+            if current is not None:
+                self._user_by_fingerprint.pop(current[2].fingerprint_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "window_seconds": self.window_seconds,
+                "rolling_fingerprints": len(self._rolling),
+                "rows_started": self._started,
+                "events_coalesced": self._merged,
+            }
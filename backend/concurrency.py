@@ -0,0 +1,47 @@
+"""
+Concurrency helpers for the threat engine.
+
+Flask's threaded server and gunicorn gthread workers call process_event() from
+several threads at once. The engine keeps per-user state in plain dicts, so we
+guard each user's state with a lock taken from a fixed pool ("lock striping"):
+events of the same user serialize, while different users almost always land on
+different stripes and run in parallel.
+"""
+
+import threading
+import zlib
+from contextlib import contextmanager
+from typing import Iterator, List
+
+
+class StripedLock:
+    """
+    A fixed pool of re-entrant locks addressed by key.
+
+    The same key always maps to the same lock, so a read-modify-write on one
+    user's state is atomic. Locks are re-entrant because detection helpers that
+    take the lock may be called while the caller already holds it.
+    """
+
+    def __init__(self, stripes: int = 64):
+        if stripes <= 0:
+            raise ValueError("stripes must be a positive integer")
+        self._locks: List[threading.RLock] = [threading.RLock() for _ in range(stripes)]
+
+    def __len__(self) -> int:
+        return len(self._locks)
+
+    def index_for(self, key: str) -> int:
+        """Return the stripe index for a key (stable across processes)."""
+        return zlib.crc32(str(key).encode("utf-8")) % len(self._locks)
+
+    def lock_for(self, key: str) -> threading.RLock:
+        """Return the lock guarding a key."""
+        return self._locks[self.index_for(key)]
+
+    @contextmanager
+    def hold(self, key: str) -> Iterator[None]:
+        """Context manager that holds the lock for a key."""
+        lock = self.lock_for(key)
+        with lock:
+            yield
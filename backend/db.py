@@ -6,8 +6,10 @@ Creates tables automatically on startup if they don't exist.
 """
 
 import os
+import threading
 from datetime import datetime
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime
+from sqlalchemy import create_engine, event, inspect, text, Column, Integer, Float, String, Text, DateTime, Index
+from sqlalchemy.engine import Engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, Session
 from typing import Optional
@@ -23,6 +25,24 @@ class FingerprintDB(Base):
     Stores all fingerprint data with behavioral features as JSON.
     """
     __tablename__ = 'fingerprints'
+    __table_args__ = (
+        # Block checks / clear_user_fingerprints: user_id + status (+ risk threshold)
+        Index('ix_fingerprints_user_status_risk', 'user_id', 'status', 'risk_score'),
+        # Per-user listings, newest first (view_database.py)
+        Index('ix_fingerprints_user_created', 'user_id', 'created_at'),
+        # Counts by status / BLOCKED set loads, optionally with a risk threshold.
+        # Covers the single GROUP BY of /api/v1/database-stats (fingerprint_stats.py)
+        Index('ix_fingerprints_status_risk_platform', 'status', 'risk_score', 'platform'),
+        # Risk-level counts
+        Index('ix_fingerprints_risk_score', 'risk_score'),
+        # Listings sorted by creation time, keyset pages on (created_at, id)
+        Index('ix_fingerprints_created_id', 'created_at', 'id'),
+        # Filtered pages of /api/v1/fingerprints
+        Index('ix_fingerprints_status_created', 'status', 'created_at'),
+        Index('ix_fingerprints_platform_created', 'platform', 'created_at'),
+        # Changes feed: keyset on (change_seq, id)
+        Index('ix_fingerprints_change_seq_id', 'change_seq', 'id'),
+    )
     
     # Primary key
     id = Column(Integer, primary_key=True, autoincrement=True)
@@ -31,18 +51,28 @@ class FingerprintDB(Base):
     fingerprint_id = Column(String(255), unique=True, nullable=False, index=True)
     
     # User and device identifiers
-    user_id = Column(String(255), nullable=False, index=True)
+    user_id = Column(String(255), nullable=False)  # indexed by the composite indexes above
     device_id = Column(String(255), nullable=True)
     ip_address = Column(String(255), nullable=True, index=True)
     user_agent = Column(String(512), nullable=True)
     
     # Risk assessment
     risk_score = Column(Integer, nullable=False, default=0)
-    status = Column(String(50), nullable=False, default='ACTIVE', index=True)  # ACTIVE, BLOCKED, CLEARED
+    status = Column(String(50), nullable=False, default='ACTIVE')  # ACTIVE, BLOCKED, CLEARED
     
-    # Behavioral features stored as JSON string
+    # Behavioral features stored as JSON string (all features, including the typed ones below)
     behavioral_features_json = Column(Text, nullable=True)
     
+    # Hot features as typed columns, so similarity / clustering / analytics read them
+    # without parsing the JSON (filled by feature_columns(); nullable for migrated tables)
+    total_events = Column(Integer, nullable=True)
+    events_per_minute = Column(Float, nullable=True)
+    update_mobile_attempt_count = Column(Integer, nullable=True)
+    pages_visited_count = Column(Integer, nullable=True)
+    attack_mode = Column(String(50), nullable=True)
+    trigger_source = Column(String(50), nullable=True)
+    platform = Column(String(50), nullable=True)
+    
     # Related/similar fingerprints (for similarity detection) stored as JSON
     related_fingerprints_json = Column(Text, nullable=True)
     
@@ -50,6 +80,9 @@ class FingerprintDB(Base):
     created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
     updated_at = Column(DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    # Position of the last write in the changes feed (changes.next_change_seq, commit order)
+    change_seq = Column(Integer, nullable=True)
+    
     def to_dict(self) -> dict:
         """Convert database model to dictionary format compatible with ThreatFingerprint."""
         behavioral_features = {}
@@ -75,6 +108,7 @@ class FingerprintDB(Base):
             "device_id": self.device_id,
             "ip_address": self.ip_address,
             "user_agent": self.user_agent,
+            "platform": self.platform,
             "created_at": self.created_at.isoformat() if self.created_at else None,
             "updated_at": self.updated_at.isoformat() if self.updated_at else None,
         }
@@ -86,6 +120,151 @@ class FingerprintDB(Base):
         return result
 
 
+# Typed feature columns of FingerprintDB and the Python type of each
+NUMERIC_FEATURE_COLUMNS = {
+    "total_events": int,
+    "events_per_minute": float,
+    "update_mobile_attempt_count": int,
+    "pages_visited_count": int,
+}
+TEXT_FEATURE_COLUMNS = ("attack_mode", "trigger_source", "platform")
+
+
+def feature_columns(behavioral_features: Optional[dict]) -> dict:
+    """
+    Typed column values of a behavioral_features dict. Missing or non-numeric
+    numbers become 0 (as in the similarity code), missing strings None.
+    """
+    behavioral_features = behavioral_features or {}
+    columns = {}
+    for name, kind in NUMERIC_FEATURE_COLUMNS.items():
+        value = behavioral_features.get(name, 0)
+        columns[name] = kind(value) if isinstance(value, (int, float)) else kind(0)
+    for name in TEXT_FEATURE_COLUMNS:
+        value = behavioral_features.get(name)
+        columns[name] = str(value)[:50] if value is not None else None
+    return columns
+
+
+class FingerprintArchiveDB(Base):
+    """
+    Fingerprints moved out of the live table by the retention job (retention.py):
+    the same columns as FingerprintDB plus when and why the row was archived.
+    Read by view_database.py --archive.
+    """
+    __tablename__ = 'fingerprints_archive'
+    __table_args__ = (
+        Index('ix_fingerprints_archive_user_created', 'user_id', 'created_at'),
+    )
+
+    # Own key: SQLite can hand a deleted fingerprints.id out again
+    archive_id = Column(Integer, primary_key=True, autoincrement=True)
+    source_id = Column(Integer, nullable=False)  # fingerprints.id of the archived row
+    fingerprint_id = Column(String(255), nullable=False, index=True)
+    user_id = Column(String(255), nullable=False)
+    device_id = Column(String(255), nullable=True)
+    ip_address = Column(String(255), nullable=True)
+    user_agent = Column(String(512), nullable=True)
+    risk_score = Column(Integer, nullable=False, default=0)
+    status = Column(String(50), nullable=False)
+    behavioral_features_json = Column(Text, nullable=True)
+    total_events = Column(Integer, nullable=True)
+    events_per_minute = Column(Float, nullable=True)
+    update_mobile_attempt_count = Column(Integer, nullable=True)
+    pages_visited_count = Column(Integer, nullable=True)
+    attack_mode = Column(String(50), nullable=True)
+    trigger_source = Column(String(50), nullable=True)
+    platform = Column(String(50), nullable=True)
+    related_fingerprints_json = Column(Text, nullable=True)
+    created_at = Column(DateTime, nullable=False)
+    updated_at = Column(DateTime, nullable=False)
+    archived_at = Column(DateTime, nullable=False, default=datetime.utcnow, index=True)
+    archive_rule = Column(String(50), nullable=False)  # name of the retention rule that moved it
+
+    to_dict = FingerprintDB.to_dict
+
+
+class FingerprintClusterDB(Base):
+    """
+    Cluster assignment of a fingerprint from the offline campaign clustering job
+    (campaign_clustering.py). Rewritten in bulk on every run.
+    """
+    __tablename__ = 'fingerprint_clusters'
+
+    fingerprint_id = Column(String(255), primary_key=True)
+    cluster_id = Column(Integer, nullable=False, index=True)  # -1 = noise (DBSCAN)
+    algorithm = Column(String(50), nullable=False)
+    clustered_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+
+class CacheVersionDB(Base):
+    """
+    Version counters for in-process caches shared by several worker processes.
+    A writer bumps the counter in the same transaction as its change; other
+    processes poll it and reload their cache when it moved (see blocklist.py).
+    """
+    __tablename__ = 'cache_versions'
+
+    name = Column(String(100), primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+
+class FingerprintTombstoneDB(Base):
+    """
+    Record of a deleted fingerprint for the changes feed (/api/v1/fingerprints/changes).
+    Written in the same transaction as the delete; change_seq is the feed position
+    (changes.next_change_seq). Rows older than TOMBSTONE_RETENTION_HOURS are pruned.
+    """
+    __tablename__ = 'fingerprint_tombstones'
+    # Never reuse ids on SQLite, even after pruning every row: cursors hold the last id seen
+    __table_args__ = {'sqlite_autoincrement': True}
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    fingerprint_id = Column(String(255), nullable=False)
+    user_id = Column(String(255), nullable=True)
+    deleted_at = Column(DateTime, nullable=False, default=datetime.utcnow, index=True)
+    change_seq = Column(Integer, nullable=True, index=True)
+
+
+class UserRiskStateDB(Base):
+    """
+    Current risk state of a user, one row per user (see risk_state.py).
+    Maintained in the same transaction as the user's fingerprint writes.
+    """
+    __tablename__ = 'user_risk_state'
+
+    user_id = Column(String(255), primary_key=True)
+    status = Column(String(50), nullable=False, default='ACTIVE')  # BLOCKED > ACTIVE > PENDING > CLEARED
+    max_risk = Column(Integer, nullable=False, default=0)  # over non-CLEARED fingerprints
+    max_active_risk = Column(Integer, nullable=False, default=0)
+    max_blocked_risk = Column(Integer, nullable=False, default=0)
+    fingerprint_count = Column(Integer, nullable=False, default=0)
+    active_count = Column(Integer, nullable=False, default=0)
+    blocked_count = Column(Integer, nullable=False, default=0)
+    pending_count = Column(Integer, nullable=False, default=0)
+    cleared_count = Column(Integer, nullable=False, default=0)
+    last_fingerprint_id = Column(String(255), nullable=True)
+    last_seen_at = Column(DateTime, nullable=True)
+    updated_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+    def to_dict(self) -> dict:
+        return {
+            "user_id": self.user_id,
+            "status": self.status,
+            "max_risk": self.max_risk,
+            "max_active_risk": self.max_active_risk,
+            "max_blocked_risk": self.max_blocked_risk,
+            "fingerprint_count": self.fingerprint_count,
+            "active_count": self.active_count,
+            "blocked_count": self.blocked_count,
+            "pending_count": self.pending_count,
+            "cleared_count": self.cleared_count,
+            "last_fingerprint_id": self.last_fingerprint_id,
+            "last_seen_at": self.last_seen_at.isoformat() if self.last_seen_at else None,
+            "updated_at": self.updated_at.isoformat() if self.updated_at else None,
+        }
+
+
 # Database connection setup
 def get_database_url() -> str:
     """
@@ -106,14 +285,90 @@ def get_database_url() -> str:
     return f'sqlite:///{db_path}'
 
 
+# Storage profiles:
+# - "production" (default): SQLite in WAL mode with tuned pragmas and a sized pool,
+#   or a sized, pre-pinged pool for PostgreSQL.
+# - "default": SQLAlchemy / SQLite defaults (rollback journal, fsync per commit).
+DB_PROFILE = os.environ.get('DB_PROFILE', 'production')
+
+# Applied on every new SQLite connection with the production profile
+SQLITE_PRAGMAS = {
+    # Lets the retention job (retention.py) return freed pages with incremental_vacuum.
+    # Only takes effect on a new database file (existing ones need one full VACUUM).
+    'auto_vacuum': 'INCREMENTAL',
+    'journal_mode': 'WAL',  # readers don't block the writer, one fsync per checkpoint
+    'synchronous': 'NORMAL',  # durable in WAL mode except for the last commits on power loss
+    'busy_timeout': int(os.environ.get('DB_SQLITE_BUSY_TIMEOUT_MS', 5000)),
+    'cache_size': -1024 * int(os.environ.get('DB_SQLITE_CACHE_MB', 64)),  # negative = KiB
+    'mmap_size': 1024 * 1024 * int(os.environ.get('DB_SQLITE_MMAP_MB', 256)),
+    'temp_store': 'MEMORY',
+}
+
+
+def _is_sqlite_memory(url: str) -> bool:
+    return url in ('sqlite://', 'sqlite:///:memory:') or 'mode=memory' in url
+
+
+def engine_options(url: str, profile: str = DB_PROFILE) -> dict:
+    """create_engine() keyword arguments for a database URL and storage profile."""
+    is_sqlite = url.startswith('sqlite')
+    options = {
+        # SQLite-specific options
+        'connect_args': {'check_same_thread': False} if is_sqlite else {},
+        'echo': False,  # Set to True for SQL query logging
+    }
+    if profile != 'production':
+        return options
+    if is_sqlite:
+        if _is_sqlite_memory(url):
+            return options
+        # One writer at a time anyway: a small pool, waiting on the busy timeout
+        options['connect_args']['timeout'] = SQLITE_PRAGMAS['busy_timeout'] / 1000.0
+        options.update(
+            pool_size=int(os.environ.get('DB_POOL_SIZE', 8)),
+            max_overflow=int(os.environ.get('DB_MAX_OVERFLOW', 8)),
+            pool_timeout=float(os.environ.get('DB_POOL_TIMEOUT', 30)),
+        )
+    else:
+        options.update(
+            pool_size=int(os.environ.get('DB_POOL_SIZE', 10)),
+            max_overflow=int(os.environ.get('DB_MAX_OVERFLOW', 20)),
+            pool_timeout=float(os.environ.get('DB_POOL_TIMEOUT', 30)),
+            pool_recycle=int(os.environ.get('DB_POOL_RECYCLE_SECONDS', 1800)),
+            pool_pre_ping=True,
+        )
+    return options
+
+
+def make_engine(url: str, profile: str = DB_PROFILE) -> Engine:
+    """Create an engine for `url` configured with the given storage profile."""
+    new_engine = create_engine(url, **engine_options(url, profile))
+    if profile == 'production' and url.startswith('sqlite') and not _is_sqlite_memory(url):
+        @event.listens_for(new_engine, 'connect')
+        def _set_sqlite_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            try:
+                for name, value in SQLITE_PRAGMAS.items():
+                    cursor.execute(f"PRAGMA {name}={value}")
+            finally:
+                cursor.close()
+    return new_engine
+
+
+def storage_profile_stats() -> dict:
+    """Profile, pool status and effective SQLite pragmas (for /api/v1/engine-stats)."""
+    stats = {"profile": DB_PROFILE, "dialect": engine.dialect.name, "pool": engine.pool.status()}
+    if engine.dialect.name == 'sqlite':
+        with engine.connect() as connection:
+            stats["pragmas"] = {
+                name: connection.execute(text(f"PRAGMA {name}")).scalar() for name in SQLITE_PRAGMAS
+            }
+    return stats
+
+
 # Create engine and session factory
 _database_url = get_database_url()
-engine = create_engine(
-    _database_url,
-    # SQLite-specific options
-    connect_args={'check_same_thread': False} if 'sqlite' in _database_url else {},
-    echo=False  # Set to True for SQL query logging
-)
+engine = make_engine(_database_url)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
@@ -130,11 +385,17 @@ def get_db() -> Session:
         db.close()
 
 
+# Set once init_db() ran in this process (see get_db_session)
+_schema_ready = False
+_schema_lock = threading.Lock()
+
+
 def init_db():
     """
     Initialize the database by creating all tables if they don't exist.
     Call this on application startup.
     """
+    global _schema_ready
     try:
         print(f"[DB] Initializing database: {_database_url}")
         Base.metadata.create_all(bind=engine)
@@ -144,6 +405,140 @@ def init_db():
         print(f"[DB] Initializing database: {_database_url}")
         Base.metadata.create_all(bind=engine)
         print("[DB] Database tables created/verified successfully")
+    _migrate_columns()
+    _migrate_indexes()
+    _backfill_user_risk_state()
+    _backfill_change_seq()
+    _schema_ready = True
+
+
+def _migrate_columns():
+    """
+    Add the columns missing from tables made by older versions (create_all() only
+    creates new tables), then fill the typed feature columns from the JSON.
+    """
+    inspector = inspect(engine)
+    added = []
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        missing = [column for column in table.columns if column.name not in existing]
+        if not missing:
+            continue
+        with engine.begin() as connection:
+            for column in missing:
+                column_type = column.type.compile(dialect=engine.dialect)
+                connection.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+                added.append(f"{table.name}.{column.name}")
+    if added:
+        print(f"[DB] Added missing column(s): {', '.join(added)}")
+    feature_names = set(NUMERIC_FEATURE_COLUMNS) | set(TEXT_FEATURE_COLUMNS)
+    # A newly added feature column is filled for every row
+    _backfill_feature_columns(all_rows=any(
+        name.split('.', 1)[1] in feature_names for name in added if name.startswith('fingerprints.')
+    ))
+
+
+def _backfill_feature_columns(chunk_size: int = 5000, all_rows: bool = False):
+    """
+    Fill the typed feature columns from behavioral_features_json: for every row
+    when a feature column was just added, otherwise only for rows written without
+    them (total_events IS NULL, e.g. by an older process).
+    """
+    session = SessionLocal()
+    try:
+        filled = 0
+        last_id = 0
+        while True:
+            query = session.query(FingerprintDB.id, FingerprintDB.behavioral_features_json).filter(
+                FingerprintDB.id > last_id
+            )
+            if not all_rows:
+                query = query.filter(FingerprintDB.total_events.is_(None))
+            rows = query.order_by(FingerprintDB.id).limit(chunk_size).all()
+            if not rows:
+                break
+            updates = []
+            for row_id, features_json in rows:
+                try:
+                    features = json.loads(features_json) if features_json else {}
+                except json.JSONDecodeError:
+                    features = {}
+                updates.append({"id": row_id, **feature_columns(features if isinstance(features, dict) else {})})
+            session.bulk_update_mappings(FingerprintDB, updates)
+            session.commit()
+            filled += len(updates)
+            last_id = rows[-1][0]
+        if filled:
+            print(f"[DB] Backfilled feature columns for {filled} fingerprint(s)")
+    finally:
+        session.close()
+
+
+# Indexes replaced by a composite index with the same leading column(s)
+SUPERSEDED_INDEXES = {
+    'fingerprints': ('ix_fingerprints_user_id', 'ix_fingerprints_status', 'ix_fingerprints_created_at',
+                     'ix_fingerprints_status_risk', 'ix_fingerprints_updated_id'),
+}
+
+
+def _migrate_indexes():
+    """
+    create_all() does not add indexes to tables that already exist: create the
+    ones missing from databases made by older versions (e.g. an existing predictai.db)
+    and drop the superseded single-column ones.
+    """
+    inspector = inspect(engine)
+    created = []
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(bind=engine)
+                created.append(index.name)
+        superseded = [name for name in SUPERSEDED_INDEXES.get(table.name, ()) if name in existing]
+        if superseded:
+            with engine.begin() as connection:
+                for name in superseded:
+                    connection.execute(text(f"DROP INDEX {name}"))
+    if created:
+        if engine.dialect.name == "sqlite":
+            # Refresh planner statistics for the new indexes
+            with engine.begin() as connection:
+                connection.execute(text("ANALYZE"))
+        print(f"[DB] Created missing index(es): {', '.join(created)}")
+
+
+def _backfill_user_risk_state():
+    """Build user_risk_state from existing fingerprints the first time it is created."""
+    from risk_state import backfill_user_risk_state
+
+    session = SessionLocal()
+    try:
+        if session.query(UserRiskStateDB.user_id).first() is not None:
+            return
+        if session.query(FingerprintDB.id).first() is None:
+            return
+        users = backfill_user_risk_state(session)
+        print(f"[DB] Backfilled user_risk_state for {users} user(s)")
+    finally:
+        session.close()
+
+
+def _backfill_change_seq():
+    """Give changes-feed positions to rows from before change_seq (see changes.py)."""
+    from changes import backfill_change_seq
+
+    session = SessionLocal()
+    try:
+        filled = backfill_change_seq(session)
+        if filled:
+            print(f"[DB] Backfilled change_seq for {filled} row(s)")
+    finally:
+        session.close()
 
 
 def get_db_session() -> Session:
@@ -154,7 +549,15 @@ def get_db_session() -> Session:
     Usage:
         with get_db_session() as session:
             # use session
+    
+    The first call in a process creates / migrates the schema if init_db() has not
+    run yet (scripts, tests, workers importing storage directly), so the tables and
+    columns the modules expect exist before their first query.
     """
+    if not _schema_ready:
+        with _schema_lock:
+            if not _schema_ready:
+                init_db()
     return SessionLocal()
 
 
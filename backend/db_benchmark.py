@@ -0,0 +1,133 @@
+"""
+Write-throughput benchmark for the database storage profiles (db.py).
+
+Runs the same workload against a fresh temporary SQLite file per profile:
+`--threads` writer threads each commit `--writes` single-fingerprint
+transactions (the shape of a synchronous store_fingerprint), while one reader
+thread keeps counting BLOCKED fingerprints. Reports commits/s, latency
+percentiles and busy errors.
+
+Usage:
+    python db_benchmark.py
+    python db_benchmark.py --threads 8 --writes 500 --profiles default production
+"""
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List
+
+from sqlalchemy import func
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+from db import Base, FingerprintDB, make_engine
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def run_profile(profile: str, threads: int, writes: int) -> Dict[str, Any]:
+    """Run the workload for one profile on a temporary database file."""
+    directory = tempfile.mkdtemp(prefix="db-benchmark-")
+    engine = make_engine(f"sqlite:///{os.path.join(directory, 'bench.db')}", profile)
+    Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(bind=engine, autoflush=False)
+
+    latencies: List[float] = []
+    errors = [0]
+    lock = threading.Lock()
+    done = threading.Event()
+    reads = [0]
+
+    def writer(worker: int):
+        features = json.dumps({"total_events": 12, "events_per_minute": 3.5})
+        for i in range(writes):
+            started = time.perf_counter()
+            session = Session()
+            try:
+                session.add(FingerprintDB(
+                    fingerprint_id=f"fp-bench-{worker}-{i}",
+                    user_id=f"user-bench-{i % 200}",
+                    device_id=f"device-{worker}",
+                    ip_address="10.0.0.1",
+                    risk_score=(i * 7) % 100,
+                    status="BLOCKED" if i % 10 == 0 else "PENDING",
+                    behavioral_features_json=features,
+                    created_at=datetime.utcnow(),
+                    updated_at=datetime.utcnow(),
+                ))
+                session.commit()
+            except OperationalError:
+                session.rollback()
+                with lock:
+                    errors[0] += 1
+                continue
+            finally:
+                session.close()
+            with lock:
+                latencies.append(time.perf_counter() - started)
+
+    def reader():
+        while not done.is_set():
+            session = Session()
+            try:
+                session.query(func.count(FingerprintDB.id)).filter(FingerprintDB.status == "BLOCKED").scalar()
+                reads[0] += 1
+            except OperationalError:
+                with lock:
+                    errors[0] += 1
+            finally:
+                session.close()
+
+    reader_thread = threading.Thread(target=reader, daemon=True)
+    workers = [threading.Thread(target=writer, args=(n,)) for n in range(threads)]
+    started = time.perf_counter()
+    reader_thread.start()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - started
+    done.set()
+    reader_thread.join()
+    engine.dispose()
+    shutil.rmtree(directory, ignore_errors=True)
+
+    return {
+        "profile": profile,
+        "commits": len(latencies),
+        "seconds": round(elapsed, 2),
+        "commits_per_second": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(_percentile(latencies, 50) * 1000, 2),
+        "p99_ms": round(_percentile(latencies, 99) * 1000, 2),
+        "reads": reads[0],
+        "errors": errors[0],
+    }
+
+
+def main():
+    """Main function"""
+    import argparse
+
+    parser = argparse.ArgumentParser(description='قياس سرعة الكتابة لملفات تعريف قاعدة البيانات')
+    parser.add_argument('--threads', type=int, default=4, help='عدد خيوط الكتابة')
+    parser.add_argument('--writes', type=int, default=250, help='عدد المعاملات لكل خيط')
+    parser.add_argument('--profiles', nargs='+', default=['default', 'production'])
+    args = parser.parse_args()
+
+    for profile in args.profiles:
+        result = run_profile(profile, args.threads, args.writes)
+        print(f"⏱️ [BENCHMARK] {json.dumps(result)}")
+
+
+if __name__ == "__main__":
+    main()
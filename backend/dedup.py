@@ -0,0 +1,81 @@
+"""
+Idempotent event ingestion.
+
+events.js attaches an event_id to every payload and retries from its offline
+queue on failure, so the same event can reach /api/v1/event several times.
+SeenEventIds remembers recently accepted event_ids in an LRU hash set that is
+bounded both in time (ttl) and in memory (max_entries); receive_event checks it
+before store_event and acknowledges duplicates without touching the engine.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+
+class SeenEventIds:
+    """Time-bounded, memory-capped set of event ids (oldest entries evicted first)."""
+
+    def __init__(self, ttl_seconds: float = 3600.0, max_entries: int = 100000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._seen: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._checked = 0
+        self._duplicates = 0
+        self._evicted = 0
+
+    def check_and_add(self, event_id: Optional[str], now: Optional[float] = None) -> bool:
+        """
+        Return True if event_id was already seen within the TTL (a duplicate).
+        Otherwise remember it and return False. Events without an id are never duplicates.
+        """
+        if not event_id:
+            return False
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            self._checked += 1
+            self._expire(now)
+
+            first_seen = self._seen.get(event_id)
+            if first_seen is not None:
+                self._duplicates += 1
+                return True
+
+            self._seen[event_id] = now
+            while len(self._seen) > self.max_entries:
+                self._seen.popitem(last=False)
+                self._evicted += 1
+            return False
+
+    def forget(self, event_id: Optional[str]) -> None:
+        """Drop an id so a retry is processed again (used when ingestion fails)."""
+        if not event_id:
+            return
+        with self._lock:
+            self._seen.pop(event_id, None)
+
+    def _expire(self, now: float) -> None:
+        # Entries are kept in insertion order, so expired ones are at the front
+        cutoff = now - self.ttl_seconds
+        while self._seen:
+            event_id, first_seen = next(iter(self._seen.items()))
+            if first_seen >= cutoff:
+                break
+            self._seen.popitem(last=False)
+            self._evicted += 1
+
+    def __len__(self) -> int:
+        return len(self._seen)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "ttl_seconds": self.ttl_seconds,
+                "max_entries": self.max_entries,
+                "size": len(self._seen),
+                "checked": self._checked,
+                "duplicates": self._duplicates,
+                "evicted": self._evicted,
+            }
@@ -0,0 +1,177 @@
+"""
+Per-user ordered event dispatching.
+
+Detections such as impossible travel and attack-profile change depend on the
+order of a user's events. The dispatcher hashes user_id onto one of N worker
+queues: every event of a user is handled serially by the same worker thread,
+while events of different users are processed in parallel.
+
+Each queue keeps simple metrics (depth, processed count, wait and processing
+latency) that are exposed through /api/v1/engine-stats.
+"""
+
+import queue
+import threading
+import time
+import zlib
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional
+
+from models import Event
+
+
+class _QueueMetrics:
+    """Counters for a single worker queue (updated by its worker thread only)."""
+
+    def __init__(self):
+        self.processed = 0
+        self.failed = 0
+        self.total_wait_ms = 0.0
+        self.total_latency_ms = 0.0
+        self.max_latency_ms = 0.0
+        self.last_latency_ms = 0.0
+
+    def record(self, wait_ms: float, latency_ms: float, failed: bool) -> None:
+        self.processed += 1
+        if failed:
+            self.failed += 1
+        self.total_wait_ms += wait_ms
+        self.total_latency_ms += latency_ms
+        self.last_latency_ms = latency_ms
+        if latency_ms > self.max_latency_ms:
+            self.max_latency_ms = latency_ms
+
+
+class EventDispatcher:
+    """
+    Route events to N single-threaded worker queues keyed by user_id.
+
+    Usage:
+        dispatcher = EventDispatcher(process_event, workers=4)
+        fingerprint = dispatcher.submit(event).result()
+    """
+
+    def __init__(self, handler: Callable[[Event], Any], workers: int = 4, max_queue_size: int = 10000):
+        if workers <= 0:
+            raise ValueError("workers must be a positive integer")
+        self._handler = handler
+        self._queues: List[queue.Queue] = [queue.Queue(maxsize=max_queue_size) for _ in range(workers)]
+        self._metrics: List[_QueueMetrics] = [_QueueMetrics() for _ in range(workers)]
+        self._threads: List[threading.Thread] = []
+        self._closed = False
+        for index in range(workers):
+            thread = threading.Thread(
+                target=self._worker_loop,
+                args=(index,),
+                name=f"event-dispatcher-{index}",
+                daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    @property
+    def workers(self) -> int:
+        return len(self._queues)
+
+    def queue_index(self, user_id: str) -> int:
+        """Return the worker queue that owns a user (stable across restarts)."""
+        return zlib.crc32(str(user_id).encode("utf-8")) % len(self._queues)
+
+    def submit(self, event: Event) -> Future:
+        """
+        Enqueue an event on its user's queue.
+        Returns a Future resolved with the handler's return value.
+        Blocks if the queue is full (back-pressure on the request thread).
+        """
+        if self._closed:
+            raise RuntimeError("dispatcher is shut down")
+        future: Future = Future()
+        index = self.queue_index(event.user_id)
+        self._queues[index].put((event, future, time.perf_counter()))
+        return future
+
+    def _worker_loop(self, index: int) -> None:
+        work_queue = self._queues[index]
+        metrics = self._metrics[index]
+        while True:
+            item = work_queue.get()
+            if item is None:
+                work_queue.task_done()
+                break
+
+            event, future, enqueued_at = item
+            if not future.set_running_or_notify_cancel():
+                work_queue.task_done()
+                continue
+
+            started_at = time.perf_counter()
+            result, error = None, None
+            try:
+                result = self._handler(event)
+            except BaseException as e:
+                error = e
+            finished_at = time.perf_counter()
+
+            # Record metrics before resolving the future so callers see them
+            metrics.record(
+                wait_ms=(started_at - enqueued_at) * 1000.0,
+                latency_ms=(finished_at - enqueued_at) * 1000.0,
+                failed=error is not None
+            )
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+            work_queue.task_done()
+
+    def stats(self) -> Dict[str, Any]:
+        """Return per-queue depth and latency metrics."""
+        queues = []
+        for index, (work_queue, metrics) in enumerate(zip(self._queues, self._metrics)):
+            processed = metrics.processed
+            queues.append({
+                "queue": index,
+                "depth": work_queue.qsize(),
+                "processed": processed,
+                "failed": metrics.failed,
+                "avg_wait_ms": round(metrics.total_wait_ms / processed, 3) if processed else 0.0,
+                "avg_latency_ms": round(metrics.total_latency_ms / processed, 3) if processed else 0.0,
+                "max_latency_ms": round(metrics.max_latency_ms, 3),
+                "last_latency_ms": round(metrics.last_latency_ms, 3),
+            })
+        return {
+            "workers": self.workers,
+            "total_depth": sum(q["depth"] for q in queues),
+            "total_processed": sum(q["processed"] for q in queues),
+            "queues": queues,
+        }
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Stop accepting events and let workers drain their queues."""
+        if self._closed:
+            return
+        self._closed = True
+        for work_queue in self._queues:
+            work_queue.put(None)
+        if wait:
+            for thread in self._threads:
+                thread.join()
+
+
+_dispatcher: Optional[EventDispatcher] = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_event_dispatcher(handler: Callable[[Event], Any], workers: int) -> Optional[EventDispatcher]:
+    """
+    Return the process-wide dispatcher, creating it on first use.
+    Returns None when workers is 0 (events are then processed inline).
+    """
+    global _dispatcher
+    if workers <= 0:
+        return None
+    if _dispatcher is None:
+        with _dispatcher_lock:
+            if _dispatcher is None:
+                _dispatcher = EventDispatcher(handler, workers=workers)
+    return _dispatcher
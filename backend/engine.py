@@ -9,15 +9,20 @@ from sklearn.ensemble import IsolationForest
 
 from models import Event, ThreatFingerprint
 from storage import (
-    EVENTS_STORE, 
+    EVENT_TIME,
+    ENTITY_WINDOWS,
+    DISTINCT_COUNTERS,
+    TOP_TALKERS,
+    USERS_BY_ENTITY,
+    BLOCKED_USERS,
     store_fingerprint, 
-    FINGERPRINTS_STORE, 
-    get_all_fingerprints_db,
-    get_fingerprints
+    get_fingerprint_feature_rows,
+    get_events_in_window,
+    add_fingerprint_change_listener,
+    add_user_fingerprints_change_listener
 )
-from db import FingerprintDB
-import json
-import json
+from concurrency import StripedLock
+from coalescing import FingerprintCoalescer
 
 # Path to the pre-trained Isolation Forest model
 MODEL_PATH = os.path.join(os.path.dirname(__file__), "..", "ml", "models", "isoforest_absher.pkl")
@@ -62,6 +67,15 @@ fingerprint_last_location: Dict[str, Tuple[str, datetime]] = {}  # {user_id: (ci
 # Track IP addresses and locations used by each user for geographic jump detection
 fingerprint_location_history: Dict[str, List[Tuple[str, str, datetime]]] = {}  # {user_id: [(ip_address, location, timestamp), ...]}
 
+# Distinct IP / location counts come from DISTINCT_COUNTERS sketches; the raw history
+# above is only used to name locations in detection reasons, so it is capped per user.
+LOCATION_HISTORY_MAX_ENTRIES = 50
+
+# ================== FEATURE 3: Multi-Account Linking ==================
+# Other users on the same device/IP (from storage.USERS_BY_ENTITY) are only linked when
+# their latest risk score reached this level, so households and shared offices are not flagged.
+MULTI_ACCOUNT_MIN_LINKED_RISK = int(os.environ.get("MULTI_ACCOUNT_MIN_LINKED_RISK", 50))
+
 # City coordinates dictionary (latitude, longitude) for major Saudi cities
 CITY_COORDINATES: Dict[str, Tuple[float, float]] = {
     "Riyadh": (24.7136, 46.6753),
@@ -94,6 +108,23 @@ LAST_DEVICE_INFO_BY_USER: Dict[str, Dict[str, Any]] = {}
 # For each user, we remember the last attack mode we saw
 LAST_ATTACK_MODE_BY_USER: Dict[str, str] = {}
 
+# ================== Per-User State Locking ==================
+# All per-user dicts above are read-modify-written under the user's stripe lock,
+# so concurrent requests for the same user never lose updates while requests
+# for different users proceed in parallel.
+USER_STATE_LOCKS = StripedLock(stripes=int(os.environ.get("ENGINE_LOCK_STRIPES", 64)))
+
+# One rolling fingerprint per user per time bucket instead of one row per event
+# (FINGERPRINT_COALESCE=0 restores a new fingerprint row for every event).
+FINGERPRINT_COALESCER: Optional[FingerprintCoalescer] = None
+if os.environ.get("FINGERPRINT_COALESCE", "1") != "0":
+    FINGERPRINT_COALESCER = FingerprintCoalescer(
+        window_seconds=int(os.environ.get("FINGERPRINT_COALESCE_WINDOW_SECONDS", 3600))
+    )
+    # Admin status changes / deletes close the rolling row, so the next event starts a new one
+    add_fingerprint_change_listener(FINGERPRINT_COALESCER.forget_fingerprint)
+    add_user_fingerprints_change_listener(FINGERPRINT_COALESCER.forget_user)
+
 
 def get_device_type_from_user_agent(user_agent: str) -> str:
     """
@@ -236,19 +267,20 @@ def detect_device_change(user_id: str, device_type: Optional[str]) -> Optional[s
     # Normalize device_type (lowercase for consistency)
     device_type_normalized = device_type.lower().strip()
     
-    # Check if we have a previous device_type for this user
-    if user_id in fingerprint_last_device:
-        previous_device = fingerprint_last_device[user_id]
+    with USER_STATE_LOCKS.hold(user_id):
+        # Check if we have a previous device_type for this user
+        if user_id in fingerprint_last_device:
+            previous_device = fingerprint_last_device[user_id]
+            
+            # If device type changed
+            if previous_device != device_type_normalized:
+                reason = f"Fingerprint reused on different device (previous: {previous_device}, now: {device_type_normalized})"
+                print(f"🔍 [DEVICE CHANGE] {reason}")
+                return reason
         
-        # If device type changed
-        if previous_device != device_type_normalized:
-            reason = f"Fingerprint reused on different device (previous: {previous_device}, now: {device_type_normalized})"
-            print(f"🔍 [DEVICE CHANGE] {reason}")
-            return reason
-    
-    # Update the last device_type for this user
-    fingerprint_last_device[user_id] = device_type_normalized
-    return None
+        # Update the last device_type for this user
+        fingerprint_last_device[user_id] = device_type_normalized
+        return None
 
 
 def detect_geographic_jump(user_id: str, ip_address: Optional[str], location: Optional[str], current_time: datetime) -> Optional[str]:
@@ -268,106 +300,111 @@ def detect_geographic_jump(user_id: str, ip_address: Optional[str], location: Op
     location_normalized = location.strip().title() if location else "Unknown"
     ip_address = ip_address or "Unknown"
     
-    # Initialize history if needed
-    if user_id not in fingerprint_location_history:
-        fingerprint_location_history[user_id] = []
-    
-    # Add current location/IP to history
-    fingerprint_location_history[user_id].append((ip_address, location_normalized, current_time))
-    
-    # Keep only last 2 hours of history (to prevent memory bloat)
-    two_hours_ago = current_time - timedelta(hours=2)
-    fingerprint_location_history[user_id] = [
-        (ip, loc, ts) for ip, loc, ts in fingerprint_location_history[user_id]
-        if ts >= two_hours_ago
-    ]
-    
-    recent_history = fingerprint_location_history[user_id]
-    
-    # Check 1: Impossible Travel (if we have location data)
-    if location and location_normalized != "Unknown":
-        current_coords = get_city_coordinates(location_normalized)
-        if current_coords and user_id in fingerprint_last_location:
-            previous_location, previous_timestamp = fingerprint_last_location[user_id]
-            previous_coords = get_city_coordinates(previous_location)
+    with USER_STATE_LOCKS.hold(user_id):
+        # Initialize history if needed
+        if user_id not in fingerprint_location_history:
+            fingerprint_location_history[user_id] = []
+    
+        # Add current location/IP to history
+        fingerprint_location_history[user_id].append((ip_address, location_normalized, current_time))
+    
+        # Keep only last 2 hours of history, capped in length (to prevent memory bloat)
+        two_hours_ago = current_time - timedelta(hours=2)
+        fingerprint_location_history[user_id] = [
+            (ip, loc, ts) for ip, loc, ts in fingerprint_location_history[user_id]
+            if ts >= two_hours_ago
+        ][-LOCATION_HISTORY_MAX_ENTRIES:]
+    
+        recent_history = fingerprint_location_history[user_id]
+    
+        # Check 1: Impossible Travel (if we have location data)
+        if location and location_normalized != "Unknown":
+            current_coords = get_city_coordinates(location_normalized)
+            if current_coords and user_id in fingerprint_last_location:
+                previous_location, previous_timestamp = fingerprint_last_location[user_id]
+                previous_coords = get_city_coordinates(previous_location)
             
-            if previous_coords:
-                distance_km = haversine_distance(
-                    previous_coords[0], previous_coords[1],
-                    current_coords[0], current_coords[1]
-                )
-                time_diff_seconds = (current_time - previous_timestamp).total_seconds()
+                if previous_coords:
+                    distance_km = haversine_distance(
+                        previous_coords[0], previous_coords[1],
+                        current_coords[0], current_coords[1]
+                    )
+                    time_diff_seconds = (current_time - previous_timestamp).total_seconds()
                 
-                if time_diff_seconds > 0:
-                    time_diff_hours = time_diff_seconds / 3600.0
-                    speed_kmh = distance_km / time_diff_hours if time_diff_hours > 0 else 0
+                    if time_diff_seconds > 0:
+                        time_diff_hours = time_diff_seconds / 3600.0
+                        speed_kmh = distance_km / time_diff_hours if time_diff_hours > 0 else 0
                     
-                    # If speed > 900 km/h, flag as impossible travel
-                    if speed_kmh > 900:
-                        reason = (
-                            f"Impossible travel: moved {distance_km:.2f} km "
-                            f"from {previous_location} to {location_normalized} "
-                            f"in {time_diff_seconds:.0f}s (speed = {speed_kmh:.2f} km/h)"
-                        )
-                        print(f"🚨 [GEOGRAPHIC JUMP - IMPOSSIBLE TRAVEL] {reason}")
-                        fingerprint_last_location[user_id] = (location_normalized, current_time)
-                        return reason
+                        # If speed > 900 km/h, flag as impossible travel
+                        if speed_kmh > 900:
+                            reason = (
+                                f"Impossible travel: moved {distance_km:.2f} km "
+                                f"from {previous_location} to {location_normalized} "
+                                f"in {time_diff_seconds:.0f}s (speed = {speed_kmh:.2f} km/h)"
+                            )
+                            print(f"🚨 [GEOGRAPHIC JUMP - IMPOSSIBLE TRAVEL] {reason}")
+                            fingerprint_last_location[user_id] = (location_normalized, current_time)
+                            return reason
         
-        # Update last location
-        fingerprint_last_location[user_id] = (location_normalized, current_time)
-    
-    # Check 2: Multiple Locations in Short Time (within last 30 minutes)
-    thirty_minutes_ago = current_time - timedelta(minutes=30)
-    recent_locations = [
-        (ip, loc, ts) for ip, loc, ts in recent_history
-        if ts >= thirty_minutes_ago
-    ]
+            # Update last location (a late, replayed event must not overwrite a newer one)
+            previous = fingerprint_last_location.get(user_id)
+            if previous is None or current_time >= previous[1]:
+                fingerprint_last_location[user_id] = (location_normalized, current_time)
+    
+        # Check 2: Multiple Locations in Short Time (within last 30 minutes)
+        thirty_minutes_ago = current_time - timedelta(minutes=30)
+        recent_locations = [
+            (ip, loc, ts) for ip, loc, ts in recent_history
+            if ts >= thirty_minutes_ago
+        ]
+    
+        # Count unique locations / IPs with the user's windowed sketches (bounded memory
+        # even when an attacker rotates through thousands of IPs)
+        entity = f"user:{user_id}"
+        DISTINCT_COUNTERS.add("location", entity, location_normalized, current_time)
+        DISTINCT_COUNTERS.add("ip", entity, ip_address, current_time)
+        unique_locations_count = DISTINCT_COUNTERS.count("location", [entity], current_time, timedelta(minutes=30))
+        unique_ips_count = DISTINCT_COUNTERS.count("ip", [entity], current_time, timedelta(minutes=30))
+    
+        # If user appears in 3+ different locations in 30 minutes → geographic jump attack
+        if unique_locations_count >= 3:
+            recent_names = {loc for _, loc, _ in recent_locations if loc and loc != "Unknown"}
+            locations_str = ", ".join(sorted(recent_names))
+            reason = (
+                f"Geographic jump attack: user appeared in {unique_locations_count} different locations "
+                f"in 30 minutes ({locations_str}). Possible VPN/Proxy hopping or account sharing."
+            )
+            print(f"🚨 [GEOGRAPHIC JUMP - MULTIPLE LOCATIONS] {reason}")
+            return reason
     
-    # Count unique locations
-    unique_locations = set()
-    unique_ips = set()
-    for ip, loc, ts in recent_locations:
-        if loc and loc != "Unknown":
-            unique_locations.add(loc)
-        if ip and ip != "Unknown":
-            unique_ips.add(ip)
-    
-    # If user appears in 3+ different locations in 30 minutes → geographic jump attack
-    if len(unique_locations) >= 3:
-        locations_str = ", ".join(sorted(unique_locations))
-        reason = (
-            f"Geographic jump attack: user appeared in {len(unique_locations)} different locations "
-            f"in 30 minutes ({locations_str}). Possible VPN/Proxy hopping or account sharing."
-        )
-        print(f"🚨 [GEOGRAPHIC JUMP - MULTIPLE LOCATIONS] {reason}")
-        return reason
-    
-    # Check 3: Multiple IPs from different locations (even if location unknown)
-    if len(unique_ips) >= 3 and len(recent_locations) >= 3:
-        ips_str = ", ".join(list(unique_ips)[:3])  # Show first 3 IPs
-        reason = (
-            f"Geographic jump: user used {len(unique_ips)} different IP addresses "
-            f"in 30 minutes ({ips_str}). Suspicious location switching pattern."
-        )
-        print(f"🚨 [GEOGRAPHIC JUMP - IP SWITCHING] {reason}")
-        return reason
+        # Check 3: Multiple IPs from different locations (even if location unknown)
+        if unique_ips_count >= 3 and len(recent_locations) >= 3:
+            recent_ips = []
+            for ip, _, _ in reversed(recent_locations):
+                if ip and ip != "Unknown" and ip not in recent_ips:
+                    recent_ips.append(ip)
+            ips_str = ", ".join(recent_ips[:3])  # Show up to 3 recent IPs
+            reason = (
+                f"Geographic jump: user used {unique_ips_count} different IP addresses "
+                f"in 30 minutes ({ips_str}). Suspicious location switching pattern."
+            )
+            print(f"🚨 [GEOGRAPHIC JUMP - IP SWITCHING] {reason}")
+            return reason
     
-    return None
+        return None
 
 
 def calculate_behavioral_features(user_id: str, device_id: str, current_time: datetime) -> Dict[str, Any]:
     """
-    Aggregate events for the last 10 minutes and calculate behavioral features.
+    Aggregate events for the 10 minutes up to current_time and calculate behavioral features.
     Uses OR logic: matches events if EITHER user_id OR device_id matches.
     This ensures detection works even when device changes.
+    The window is taken in event time, so a late (replayed) event sees the
+    events around it rather than newer ones.
     """
     time_window_start = current_time - timedelta(minutes=10)
     
-    recent_events = [
-        event for event in EVENTS_STORE
-        if (event.user_id == user_id or event.device_id == device_id)
-        and event.timestamp1 >= time_window_start
-    ]
+    recent_events = get_events_in_window(user_id, device_id, time_window_start, current_time)
     
     # --- 1. Basic Feature Calculation ---
     total_events = len(recent_events)
@@ -378,7 +415,7 @@ def calculate_behavioral_features(user_id: str, device_id: str, current_time: da
     
     time_span_minutes = 10.0
     if total_events > 0:
-        earliest_event = min(event.timestamp1 for event in recent_events)
+        earliest_event = recent_events[0].timestamp1  # events are ordered by event time
         actual_span = (current_time - earliest_event).total_seconds() / 60.0
         time_span_minutes = max(actual_span, 1.0)
     
@@ -409,6 +446,34 @@ def calculate_behavioral_features(user_id: str, device_id: str, current_time: da
     return features
 
 
+def calculate_volume_features(event: Event) -> Dict[str, Any]:
+    """
+    Event volume per user, device and IP over 1 hour and 24 hours.
+    Read from ENTITY_WINDOWS bucket counters in O(buckets), so these horizons
+    do not require keeping a day of raw events in memory.
+    
+    Also reports whether the event's IP / device is a global top talker across
+    all users (count-min sketch + top-k in TOP_TALKERS).
+    """
+    now = event.timestamp1
+    ip_address = getattr(event, "ip_address", None)
+    features: Dict[str, Any] = {
+        "user_events_1h": ENTITY_WINDOWS.count("user", event.user_id, now, timedelta(hours=1)),
+        "user_events_24h": ENTITY_WINDOWS.count("user", event.user_id, now, timedelta(hours=24)),
+        "device_events_24h": ENTITY_WINDOWS.count("device", event.device_id, now, timedelta(hours=24)),
+        "ip_events_1h": ENTITY_WINDOWS.count("ip", ip_address, now, timedelta(hours=1)),
+        "ip_global_events": TOP_TALKERS.estimate("ip", ip_address),
+        "device_global_events": TOP_TALKERS.estimate("device", event.device_id),
+    }
+    ip_rank = TOP_TALKERS.rank("ip", ip_address)
+    if ip_rank is not None:
+        features["ip_top_talker_rank"] = ip_rank
+    device_rank = TOP_TALKERS.rank("device", event.device_id)
+    if device_rank is not None:
+        features["device_top_talker_rank"] = device_rank
+    return features
+
+
 def get_risk_score(raw_score: float) -> int:
     """
     Convert Isolation Forest decision function score to Risk Score (0-100).
@@ -422,31 +487,24 @@ def get_risk_score(raw_score: float) -> int:
 
 def is_user_fingerprinted(user_id: str) -> bool:
     """
-    Check if a user has an ACTIVE high-risk threat fingerprint registered.
-    Reads directly from database to ensure latest status is checked.
+    Check if a user has a BLOCKED high-risk threat fingerprint registered.
+    Answered from the in-memory blocked-user set (storage.BLOCKED_USERS), which
+    the storage write functions keep current and other processes invalidate.
     """
-    from storage import get_fingerprints
-    from db import get_db_session, FingerprintDB
-    
-    # Read directly from database to get latest status
-    session = get_db_session()
-    try:
-        db_fingerprints = session.query(FingerprintDB).filter(
-            FingerprintDB.user_id == user_id,
-            FingerprintDB.status == "BLOCKED",
-            FingerprintDB.risk_score >= RISK_SCORE_BLOCKING_THRESHOLD
-        ).all()
-        
-        if db_fingerprints:
-            return True
-        
-        return False
-    finally:
-        session.close()
+    return BLOCKED_USERS.is_blocked(user_id, min_risk=RISK_SCORE_BLOCKING_THRESHOLD)
 
 
 # ================== FEATURE 3: Multi-Account Linking Detection ==================
 
+# Key metrics compared between accounts
+MULTI_ACCOUNT_METRICS = (
+    "events_per_minute",
+    "update_mobile_attempt_count",
+    "total_events",
+    "pages_visited_count",
+)
+
+
 def compare_behavior(event_features: Dict[str, Any], fingerprint_features: Dict[str, Any], tolerance: float = 0.3) -> bool:
     """
     Compare behavioral features between an event and a fingerprint to detect similar patterns.
@@ -464,18 +522,10 @@ def compare_behavior(event_features: Dict[str, Any], fingerprint_features: Dict[
     Returns:
         True if behaviors are similar within tolerance, False otherwise
     """
-    # Key metrics to compare
-    metrics_to_compare = [
-        "events_per_minute",
-        "update_mobile_attempt_count",
-        "total_events",
-        "pages_visited_count"
-    ]
-    
     similar_count = 0
     compared_count = 0
     
-    for metric in metrics_to_compare:
+    for metric in MULTI_ACCOUNT_METRICS:
         event_val = event_features.get(metric, 0)
         fp_val = fingerprint_features.get(metric, 0)
         
@@ -502,113 +552,64 @@ def compare_behavior(event_features: Dict[str, Any], fingerprint_features: Dict[
     return False
 
 
-def is_multi_account_attack(event: Event, fingerprint: ThreatFingerprint) -> bool:
+def find_linked_account(event: Event, event_features: Dict[str, Any]) -> Optional[Dict[str, Any]]:
     """
-    Detect if the same attacker is using multiple accounts (different user_id) from the same
-    device/IP with similar behavioral patterns.
-    
-    Security idea: Sophisticated attackers often create multiple accounts to evade detection
-    or to scale their attacks. By detecting when different accounts share the same device/IP
-    AND exhibit similar behavioral patterns, we can identify coordinated multi-account attacks
-    and treat them as high-risk threats.
-    
-    Args:
-        event: Current event being processed
-        fingerprint: Existing ACTIVE fingerprint to compare against
-    
+    Find another recently active account on the same device_id or ip_address whose
+    latest behaviour matches the current event (see compare_behavior).
+
+    Uses the reverse index maintained by store_event, so the cost is proportional to the
+    number of users seen on this device/IP, and accounts are linked from raw traffic
+    even before either of them has a fingerprint.
+
     Returns:
-        True if multi-account attack is detected, False otherwise
+        {"user_id", "fingerprint_id", "shared", "risk_score"} for the riskiest match, or None
     """
-    # Must be different accounts
-    if event.user_id == fingerprint.user_id:
-        return False
-    
-    # Must match on device_id OR ip_address
-    device_match = False
-    ip_match = False
-    
-    event_device_id = getattr(event, "device_id", None)
-    event_ip = getattr(event, "ip_address", None)
-    fp_device_id = getattr(fingerprint, "device_id", None)
-    fp_ip = getattr(fingerprint, "ip_address", None)
-    
-    if event_device_id and fp_device_id and event_device_id == fp_device_id:
-        device_match = True
-    
-    if event_ip and fp_ip and event_ip == fp_ip:
-        ip_match = True
-    
-    if not (device_match or ip_match):
-        return False
-    
-    # Calculate behavioral features for current event
-    event_features = calculate_behavioral_features(
+    best = None
+    for other_user_id, shared in USERS_BY_ENTITY.linked_users(event).items():
+        summary = USERS_BY_ENTITY.summary(other_user_id)
+        if not summary or summary["risk_score"] < MULTI_ACCOUNT_MIN_LINKED_RISK:
+            continue
+        if not compare_behavior(event_features, summary["features"], tolerance=0.3):
+            continue
+        if best is None or summary["risk_score"] > best["risk_score"]:
+            best = {
+                "user_id": other_user_id,
+                "fingerprint_id": summary.get("fingerprint_id"),
+                "shared": shared,
+                "risk_score": summary["risk_score"],
+            }
+    return best
+
+
+def summarize_behavior(event: Event, behavioral_features: Dict[str, Any], risk_score: int,
+                       fingerprint_id: Optional[str] = None) -> None:
+    """Record the user's latest comparable features and risk for multi-account linking."""
+    USERS_BY_ENTITY.update_summary(
         event.user_id,
-        event.device_id,
-        event.timestamp1
+        {metric: behavioral_features.get(metric, 0) for metric in MULTI_ACCOUNT_METRICS},
+        risk_score,
+        event.timestamp1,
+        fingerprint_id=fingerprint_id,
     )
-    
-    # Get behavioral features from fingerprint
-    fp_features = fingerprint.behavioral_features
-    
-    # Compare behavioral patterns
-    if compare_behavior(event_features, fp_features, tolerance=0.3):
-        return True
-    
-    return False
 
 
 # ================== FEATURE 4: Browser-Hopping Detection ==================
 
-def detect_browser_hopping(event: Event, recent_events: list[Event]) -> bool:
+def count_distinct_user_agents(event: Event, window: timedelta) -> int:
     """
-    Detect when an attacker is rapidly switching between browsers or browser modes
-    (normal/incognito) to evade detection.
-    
-    Security idea: Attackers may switch browsers quickly to avoid fingerprinting or to
-    bypass rate limits. Legitimate users rarely switch browsers multiple times within a
-    short time window. Detecting 3+ different user agents in 60 seconds is a strong
-    indicator of evasion attempts.
-    
-    Args:
-        event: Current event being processed
-        recent_events: List of recent events to analyze
-    
-    Returns:
-        True if browser hopping is detected, False otherwise
+    Approximate number of distinct user agents used by the event's user OR device
+    within `window` before the event (the event's own user agent included).
+    Uses the windowed HyperLogLog sketches in DISTINCT_COUNTERS, so the cost and
+    memory do not grow with the number of user agents an attacker rotates through.
     """
-    if not recent_events:
-        return False
-    
-    # Collect unique user agents from recent events (same user_id or device_id)
-    unique_user_agents = set()
-    
-    event_user_id = getattr(event, "user_id", None)
-    event_device_id = getattr(event, "device_id", None)
-    
-    for evt in recent_events:
-        # Match on user_id or device_id
-        evt_user_id = getattr(evt, "user_id", None)
-        evt_device_id = getattr(evt, "device_id", None)
-        
-        matches_user = event_user_id and evt_user_id and evt_user_id == event_user_id
-        matches_device = event_device_id and evt_device_id and evt_device_id == event_device_id
-        
-        if matches_user or matches_device:
-            user_agent = getattr(evt, "user_agent", None)
-            if user_agent and user_agent != "unknown":
-                unique_user_agents.add(user_agent)
-    
-    # Include current event's user agent
-    current_user_agent = getattr(event, "user_agent", None)
-    if current_user_agent and current_user_agent != "unknown":
-        unique_user_agents.add(current_user_agent)
-    
-    # If 3 or more different user agents in short time window, flag as browser hopping
-    if len(unique_user_agents) >= 3:
-        return True
-    
-    return False
+    entities = [f"user:{event.user_id}"]
+    if event.device_id:
+        entities.append(f"device:{event.device_id}")
+    user_agent = getattr(event, "user_agent", None)
+    for entity in entities:
+        # Adding to a HyperLogLog is idempotent, so events already stored are not double counted
+        DISTINCT_COUNTERS.add("user_agent", entity, user_agent, event.timestamp1)
+    return DISTINCT_COUNTERS.count("user_agent", entities, event.timestamp1, window)
 
 
 # ================== FEATURE 5: Similar-Behavior Detection ==================
@@ -698,35 +699,26 @@ def find_similar_fingerprints(behavioral_features: Dict[str, Any], top_k: int =
     if not current_features:
         return []
     
-    # Get all historical fingerprints from database
-    all_fingerprints = get_all_fingerprints_db()
+    # Historical fingerprints: typed feature columns only, no JSON parsing
+    all_fingerprints = get_fingerprint_feature_rows()
     
     similarities = []
     
-    for db_fp in all_fingerprints:
-        # Skip if no behavioral features
-        if not db_fp.behavioral_features_json:
-            continue
+    for fp_row in all_fingerprints:
+        fp_features = extract_numeric_features(fp_row)
         
-        try:
-            fp_features_dict = json.loads(db_fp.behavioral_features_json)
-            fp_features = extract_numeric_features(fp_features_dict)
-            
-            # Compute similarity
-            similarity = compute_similarity(current_features, fp_features)
-            
-            # Only include if above threshold
-            if similarity >= similarity_threshold:
-                similarities.append({
-                    "fingerprint_id": db_fp.fingerprint_id,
-                    "similarity": similarity,
-                    "status": db_fp.status,
-                    "risk_score": db_fp.risk_score,
-                    "user_id": db_fp.user_id
-                })
-        except (json.JSONDecodeError, Exception) as e:
-            # Skip fingerprints with invalid JSON
-            continue
+        # Compute similarity
+        similarity = compute_similarity(current_features, fp_features)
+        
+        # Only include if above threshold
+        if similarity >= similarity_threshold:
+            similarities.append({
+                "fingerprint_id": fp_row["fingerprint_id"],
+                "similarity": similarity,
+                "status": fp_row["status"],
+                "risk_score": fp_row["risk_score"],
+                "user_id": fp_row["user_id"]
+            })
     
     # Sort by similarity (highest first) and return top K
     similarities.sort(key=lambda x: x["similarity"], reverse=True)
@@ -744,6 +736,9 @@ def reset_user_behavior_history(user_id: str) -> None:
     - fingerprint_last_device: Last device type used
     - fingerprint_last_location: Last location and timestamp
     - fingerprint_location_history: History of IP/location changes
+    - DISTINCT_COUNTERS: Distinct IP / location / user-agent sketches of the user
+    - USERS_BY_ENTITY: The user's summary used for multi-account linking
+    - FINGERPRINT_COALESCER: The user's rolling fingerprint
     - LAST_DEVICE_INFO_BY_USER: Last device context info
     - LAST_ATTACK_MODE_BY_USER: Last attack mode detected
     """
@@ -753,28 +748,33 @@ def reset_user_behavior_history(user_id: str) -> None:
     global LAST_DEVICE_INFO_BY_USER
     global LAST_ATTACK_MODE_BY_USER
     
-    # 1. Clear Device History
-    if user_id in fingerprint_last_device:
-        del fingerprint_last_device[user_id]
-        print(f"🧹 [RESET] Cleared device history for {user_id}")
-
-    # 2. Clear Location History (Fixes Geo-Jump re-blocking)
-    if user_id in fingerprint_last_location:
-        del fingerprint_last_location[user_id]
-        print(f"🧹 [RESET] Cleared last location for {user_id}")
-    
-    if user_id in fingerprint_location_history:
-        del fingerprint_location_history[user_id]
-        print(f"🧹 [RESET] Cleared location history for {user_id}")
-
-    # 3. Clear Context Info
-    if user_id in LAST_DEVICE_INFO_BY_USER:
-        del LAST_DEVICE_INFO_BY_USER[user_id]
-        print(f"🧹 [RESET] Cleared device context info for {user_id}")
-
-    if user_id in LAST_ATTACK_MODE_BY_USER:
-        del LAST_ATTACK_MODE_BY_USER[user_id]
-        print(f"🧹 [RESET] Cleared attack mode history for {user_id}")
+    with USER_STATE_LOCKS.hold(user_id):
+        # 1. Clear Device History
+        if user_id in fingerprint_last_device:
+            del fingerprint_last_device[user_id]
+            print(f"🧹 [RESET] Cleared device history for {user_id}")
+
+        # 2. Clear Location History (Fixes Geo-Jump re-blocking)
+        if user_id in fingerprint_last_location:
+            del fingerprint_last_location[user_id]
+            print(f"🧹 [RESET] Cleared last location for {user_id}")
+    
+        if user_id in fingerprint_location_history:
+            del fingerprint_location_history[user_id]
+            print(f"🧹 [RESET] Cleared location history for {user_id}")
+        DISTINCT_COUNTERS.forget(f"user:{user_id}")
+        USERS_BY_ENTITY.forget_user(user_id)
+        if FINGERPRINT_COALESCER is not None:
+            FINGERPRINT_COALESCER.forget_user(user_id)
+
+        # 3. Clear Context Info
+        if user_id in LAST_DEVICE_INFO_BY_USER:
+            del LAST_DEVICE_INFO_BY_USER[user_id]
+            print(f"🧹 [RESET] Cleared device context info for {user_id}")
+
+        if user_id in LAST_ATTACK_MODE_BY_USER:
+            del LAST_ATTACK_MODE_BY_USER[user_id]
+            print(f"🧹 [RESET] Cleared attack mode history for {user_id}")
         
     print(f"✅ [RESET] User {user_id} behavioral memory wiped clean.")
 
@@ -792,6 +792,9 @@ def process_event(event: Event) -> Optional[ThreatFingerprint]:
         event.timestamp1
     )
 
+    # Longer-horizon volume from the bucketed per-entity counters (no raw event scan)
+    behavioral_features.update(calculate_volume_features(event))
+
     # اطبعها للتشخيص
     print(f"🧠 [FEATURES] user={event.user_id[:8]} dev={event.device_id[:8]} → {behavioral_features}")
 
@@ -810,7 +813,15 @@ def process_event(event: Event) -> Optional[ThreatFingerprint]:
         "last_seen_at": event.timestamp1.isoformat(),
     }
 
-    previous_device_info = LAST_DEVICE_INFO_BY_USER.get(event.user_id)
+    # Swap in the new device context atomically for this user.
+    # Events behind the user's watermark (late offline replays) are compared
+    # against the current context but do not replace it.
+    is_late_event = EVENT_TIME.is_late(event.user_id, event.timestamp1)
+    with USER_STATE_LOCKS.hold(event.user_id):
+        previous_device_info = LAST_DEVICE_INFO_BY_USER.get(event.user_id)
+        if not is_late_event:
+            LAST_DEVICE_INFO_BY_USER[event.user_id] = current_device_info
+
     device_switch_detected = False
     geo_hop_suspected = False
 
@@ -826,11 +837,10 @@ def process_event(event: Event) -> Optional[ThreatFingerprint]:
         if prev_ip and ip_address and prev_ip != ip_address:
             geo_hop_suspected = True
 
-    # Always update last-seen device info for this user
-    LAST_DEVICE_INFO_BY_USER[event.user_id] = current_device_info
-
     # Persist this context in the behavioral features so it appears in the dashboard
     behavioral_features["device_type"] = current_device_type
+    if is_late_event:
+        behavioral_features["late_event"] = True
     if ip_address:
         behavioral_features["ip_address"] = ip_address
     if user_agent:
@@ -856,8 +866,11 @@ def process_event(event: Event) -> Optional[ThreatFingerprint]:
     current_attack_mode = infer_attack_mode(event, behavioral_features)
     behavioral_features["attack_mode"] = current_attack_mode
     
-    # Track attack mode change
-    previous_attack_mode = LAST_ATTACK_MODE_BY_USER.get(event.user_id)
+    # Track attack mode change (read and update last seen attack mode atomically)
+    with USER_STATE_LOCKS.hold(event.user_id):
+        previous_attack_mode = LAST_ATTACK_MODE_BY_USER.get(event.user_id)
+        if not is_late_event:
+            LAST_ATTACK_MODE_BY_USER[event.user_id] = current_attack_mode
     attack_profile_changed = False
     
     if previous_attack_mode and previous_attack_mode != current_attack_mode:
@@ -869,9 +882,6 @@ def process_event(event: Event) -> Optional[ThreatFingerprint]:
             f"🔄 [ATTACK PROFILE CHANGE] user={event.user_id[:8]} "
             f"changed from '{previous_attack_mode}' → '{current_attack_mode}'"
         )
-    
-    # Always update last seen attack mode for this user
-    LAST_ATTACK_MODE_BY_USER[event.user_id] = current_attack_mode
 
     # 2) تجهيز نموذج العزل
     model = None
@@ -1021,47 +1031,37 @@ def process_event(event: Event) -> Optional[ThreatFingerprint]:
 
     # ================== FEATURE 3: Multi-Account Linking Detection ==================
     multi_account_detected = False
-    # Get all ACTIVE fingerprints from database
-    active_fingerprints = get_fingerprints()
-    for existing_fp in active_fingerprints:
-        # Only check ACTIVE fingerprints
-        if existing_fp.status == "ACTIVE" and is_multi_account_attack(event, existing_fp):
-            multi_account_detected = True
-            risk_score = max(risk_score, 95)  # Very high risk for multi-account attacks
-            detection_reasons.append("multi_account_attack")
-            behavioral_features["reason"] = "multi_account_attack"
-            behavioral_features["linked_fingerprint_id"] = existing_fp.fingerprint_id
-            behavioral_features["linked_user_id"] = existing_fp.user_id
-            if not should_create_fingerprint:
-                should_create_fingerprint = True
-                trigger_source = "MULTI_ACCOUNT_ATTACK"
-            print(
-                f"🚨 [MULTI-ACCOUNT ATTACK] Detected same attacker using different accounts | "
-                f"Event user_id: {event.user_id}, Linked fingerprint: {existing_fp.fingerprint_id} "
-                f"(user_id: {existing_fp.user_id}) | Risk score set to {risk_score}"
-            )
-            break  # Only need to detect once
+    # Other recently active users on this device/IP (reverse index), compared by summary features
+    linked_account = find_linked_account(event, behavioral_features)
+    if linked_account:
+        multi_account_detected = True
+        risk_score = max(risk_score, 95)  # Very high risk for multi-account attacks
+        detection_reasons.append("multi_account_attack")
+        behavioral_features["reason"] = "multi_account_attack"
+        behavioral_features["linked_fingerprint_id"] = linked_account["fingerprint_id"]
+        behavioral_features["linked_user_id"] = linked_account["user_id"]
+        behavioral_features["linked_via"] = linked_account["shared"]
+        if not should_create_fingerprint:
+            should_create_fingerprint = True
+            trigger_source = "MULTI_ACCOUNT_ATTACK"
+        print(
+            f"🚨 [MULTI-ACCOUNT ATTACK] Detected same attacker using different accounts | "
+            f"Event user_id: {event.user_id}, Linked user_id: {linked_account['user_id']} "
+            f"(shared {'/'.join(linked_account['shared'])}, fingerprint: {linked_account['fingerprint_id']}) | "
+            f"Risk score set to {risk_score}"
+        )
 
     # ================== FEATURE 4: Browser-Hopping Detection ==================
-    # Get recent events for the last 60 seconds (same user_id or device_id)
-    time_window_start = event.timestamp1 - timedelta(seconds=60)
-    recent_events = [
-        evt for evt in EVENTS_STORE
-        if (evt.user_id == event.user_id or evt.device_id == event.device_id)
-        and evt.timestamp1 >= time_window_start
-        and evt.timestamp1 <= event.timestamp1
-    ]
+    # Distinct user agents in the last 60 seconds (same user_id or device_id),
+    # from the merged user + device sketches instead of a set over raw events
+    unique_user_agents_count = count_distinct_user_agents(event, timedelta(seconds=60))
     
-    browser_hopping_detected = detect_browser_hopping(event, recent_events)
+    browser_hopping_detected = unique_user_agents_count >= 3
     if browser_hopping_detected:
         risk_score = max(risk_score, 90)  # High risk for browser hopping
         detection_reasons.append("browser_hopping")
         behavioral_features["reason"] = "browser_hopping"
-        behavioral_features["unique_user_agents_count"] = len(set(
-            getattr(evt, "user_agent", None) or "unknown"
-            for evt in recent_events + [event]
-            if getattr(evt, "user_agent", None) and getattr(evt, "user_agent", None) != "unknown"
-        ))
+        behavioral_features["unique_user_agents_count"] = unique_user_agents_count
         if not should_create_fingerprint:
             should_create_fingerprint = True
             trigger_source = "BROWSER_HOPPING"
@@ -1134,6 +1134,9 @@ def process_event(event: Event) -> Optional[ThreatFingerprint]:
                     f"Highest similarity: {highest_similarity:.2%}"
                 )
 
+    # Late events do not overwrite the user's newer summary (see update_summary)
+    summarize_behavior(event, behavioral_features, risk_score)
+
     # 7) إنشاء وحفظ البصمة إن لزم
     print(f"🔍 [FINGERPRINT DECISION] should_create_fingerprint={should_create_fingerprint}, trigger_source={trigger_source}, risk_score={risk_score}")
     if should_create_fingerprint:
@@ -1141,24 +1144,47 @@ def process_event(event: Event) -> Optional[ThreatFingerprint]:
         behavioral_features["platform"] = getattr(event, "platform", None)
         behavioral_features["ip_address"] = getattr(event, "ip_address", None)
         behavioral_features["user_agent"] = getattr(event, "user_agent", None)
+        behavioral_features["trigger_source"] = trigger_source
         
-        fingerprint = ThreatFingerprint(
-            fingerprint_id=f"fp-{uuid.uuid4().hex[:12]}",
-            risk_score=risk_score,
-            user_id=event.user_id,
-            status="PENDING",
-            behavioral_features=behavioral_features,
-            device_id=event.device_id,
-            ip_address=getattr(event, "ip_address", None),
-            user_agent=getattr(event, "user_agent", None)
-        )
+        # Fold the event into the user's rolling fingerprint for this time bucket when possible
+        fingerprint = None
+        if FINGERPRINT_COALESCER is not None:
+            with USER_STATE_LOCKS.hold(event.user_id):
+                fingerprint = FINGERPRINT_COALESCER.merge(
+                    event.user_id, event.timestamp1, risk_score, behavioral_features, detection_reasons,
+                    device_id=event.device_id,
+                    ip_address=getattr(event, "ip_address", None),
+                    user_agent=getattr(event, "user_agent", None)
+                )
+        is_new_fingerprint = fingerprint is None
+        if is_new_fingerprint:
+            fingerprint = ThreatFingerprint(
+                fingerprint_id=f"fp-{uuid.uuid4().hex[:12]}",
+                risk_score=risk_score,
+                user_id=event.user_id,
+                status="PENDING",
+                behavioral_features=behavioral_features,
+                device_id=event.device_id,
+                ip_address=getattr(event, "ip_address", None),
+                user_agent=getattr(event, "user_agent", None)
+            )
+            if FINGERPRINT_COALESCER is not None:
+                FINGERPRINT_COALESCER.start(fingerprint, event.timestamp1)
+
+        # Risk of this event (a rolling fingerprint keeps the maximum of its bucket)
+        fingerprint.event_risk_score = risk_score
         
         # Attach related/similar fingerprints metadata
         if similar_fingerprints:
             fingerprint.related_fingerprints = similar_fingerprints
         
         store_fingerprint(fingerprint)
-        print(f"   ✅ Fingerprint created: {fingerprint.fingerprint_id} (Blocking Activated)")
+        summarize_behavior(event, behavioral_features, risk_score, fingerprint.fingerprint_id)
+        if is_new_fingerprint:
+            print(f"   ✅ Fingerprint created: {fingerprint.fingerprint_id} (Blocking Activated)")
+        else:
+            print(f"   ✅ Fingerprint updated: {fingerprint.fingerprint_id} "
+                  f"({fingerprint.behavioral_features.get('coalesced_events')} events, max risk {fingerprint.risk_score})")
         print(f"      User: {event.user_id}, Device: {event.device_id}, IP: {getattr(event, 'ip_address', 'N/A')}")
         if similar_fingerprints:
             print(f"      Related to {len(similar_fingerprints)} similar fingerprint(s)")
@@ -1192,81 +1218,75 @@ def test_compare_behavior():
     return True
 
 
-def test_detect_browser_hopping():
+def test_count_distinct_user_agents():
     """
-    Simple sanity check for detect_browser_hopping function.
-    Tests that browser hopping is detected when 3+ different user agents are present.
+    Simple sanity check for count_distinct_user_agents (browser-hopping detection).
+    Tests that 3 different user agents of the same device within 60 seconds are counted.
     """
     from datetime import datetime, timedelta
     now = datetime.now()
-    
-    # Create events with 3 different user agents
-    events = [
-        Event(
-            event_type="login_attempt",
-            user_id="test_user",
-            device_id="test_device",
-            timestamp1=now - timedelta(seconds=10),
-            user_agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64) Chrome/91.0"
-        ),
-        Event(
-            event_type="login_attempt",
-            user_id="test_user",
-            device_id="test_device",
-            timestamp1=now - timedelta(seconds=5),
-            user_agent="Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) Safari/14.0"
-        ),
+    user_agents = [
+        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) Chrome/91.0",
+        "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) Safari/14.0",
+        "Mozilla/5.0 (X11; Linux x86_64) Firefox/89.0",
     ]
-    
-    current_event = Event(
-        event_type="login_attempt",
-        user_id="test_user",
-        device_id="test_device",
-        timestamp1=now,
-        user_agent="Mozilla/5.0 (X11; Linux x86_64) Firefox/89.0"
-    )
-    
-    result = detect_browser_hopping(current_event, events)
-    assert result == True, "Should detect browser hopping with 3 different user agents"
-    print("✅ [TEST] detect_browser_hopping: PASSED")
+    count = 0
+    for seconds_ago, user_agent in zip((10, 5, 0), user_agents):
+        event = Event(
+            event_type="login_attempt",
+            user_id="selftest_user",
+            device_id="selftest_device",
+            timestamp1=now - timedelta(seconds=seconds_ago),
+            user_agent=user_agent
+        )
+        count = count_distinct_user_agents(event, timedelta(seconds=60))
+    DISTINCT_COUNTERS.forget("user:selftest_user")
+    DISTINCT_COUNTERS.forget("device:selftest_device")
+    assert count >= 3, "Should detect browser hopping with 3 different user agents"
+    print("✅ [TEST] count_distinct_user_agents: PASSED")
     return True
 
 
-def test_is_multi_account_attack():
+def test_find_linked_account():
     """
-    Simple sanity check for is_multi_account_attack function.
-    Tests that multi-account attacks are detected when same device/IP with different user_id.
+    Simple sanity check for find_linked_account (multi-account detection).
+    Tests that another risky account on the same device with similar behavior is linked.
     """
     from datetime import datetime
-    
-    # Create an existing fingerprint
-    existing_fp = ThreatFingerprint(
-        fingerprint_id="fp-test-123",
-        risk_score=85,
-        user_id="attacker_account_1",
-        status="ACTIVE",
-        behavioral_features={
-            "events_per_minute": 10.0,
-            "update_mobile_attempt_count": 3,
-            "total_events": 25,
-            "pages_visited_count": 4
-        },
-        device_id="same_device_123",
+    now = datetime.now()
+    features = {
+        "events_per_minute": 10.0,
+        "update_mobile_attempt_count": 3,
+        "total_events": 25,
+        "pages_visited_count": 4
+    }
+
+    # An existing risky account seen on the device/IP
+    first_account = Event(
+        event_type="login_attempt",
+        user_id="selftest_account_1",
+        device_id="selftest_device",
+        timestamp1=now,
         ip_address="192.168.1.100"
     )
-    
-    # Create a new event with different user_id but same device/IP and similar behavior
+    USERS_BY_ENTITY.record_event(first_account)
+    USERS_BY_ENTITY.update_summary("selftest_account_1", features, 85, now)
+
+    # A new event with different user_id but same device/IP and similar behavior
     new_event = Event(
         event_type="login_attempt",
-        user_id="attacker_account_2",  # Different account
-        device_id="same_device_123",  # Same device
-        timestamp1=datetime.now(),
+        user_id="selftest_account_2",  # Different account
+        device_id="selftest_device",  # Same device
+        timestamp1=now,
         ip_address="192.168.1.100"  # Same IP
     )
-    
-    # Note: This test requires the event to have enough behavioral history to match
-    # For a real test, you'd need to populate EVENTS_STORE first
-    print("⚠️ [TEST] is_multi_account_attack: Manual test required (needs event history)")
+    try:
+        linked = find_linked_account(new_event, features)
+    finally:
+        USERS_BY_ENTITY.forget_user("selftest_account_1")
+    assert linked is not None and linked["user_id"] == "selftest_account_1", "Should link the accounts"
+    assert sorted(linked["shared"]) == ["device", "ip"], "Should share device and IP"
+    print("✅ [TEST] find_linked_account: PASSED")
     return True
 
 
@@ -1275,8 +1295,8 @@ if __name__ == "__main__":
     print("Running unit test helpers...")
     try:
         test_compare_behavior()
-        test_detect_browser_hopping()
-        test_is_multi_account_attack()
+        test_count_distinct_user_agents()
+        test_find_linked_account()
         print("\n✅ All unit test helpers passed!")
     except AssertionError as e:
         print(f"\n❌ Test failed: {e}")
@@ -0,0 +1,159 @@
+"""
+Event-time handling for out-of-order events.
+
+events.js replays offline-queued events with their original timestamp1, so a
+user's events can reach the server after newer ones. This module provides:
+
+- EventTimeIndex: a bounded, per-key buffer of events kept sorted by event time.
+  Late events are inserted at their position with bisect (no full re-sort), and
+  window queries are answered with two binary searches instead of a full scan.
+- WatermarkTracker: a per-user watermark (latest event time seen minus the
+  allowed lateness) plus lateness statistics exported on /api/v1/engine-stats.
+"""
+
+import bisect
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from concurrency import StripedLock
+from models import Event
+
+# Classification returned by WatermarkTracker.observe()
+IN_ORDER = "in_order"
+OUT_OF_ORDER = "out_of_order"   # older than the newest event, but within allowed lateness
+LATE = "late"                   # older than the watermark
+
+# Upper bounds (seconds) of the lateness histogram buckets
+LATENESS_BUCKETS: Tuple[float, ...] = (1.0, 10.0, 60.0, 600.0, 3600.0)
+
+
+class EventTimeIndex:
+    """
+    Per-key (user_id or device_id) list of events ordered by timestamp1.
+
+    Each key holds at most `max_events_per_key` events and nothing older than
+    `retention` behind the key's newest event, so memory stays bounded.
+    """
+
+    def __init__(self, retention: timedelta = timedelta(hours=2), max_events_per_key: int = 10000):
+        self.retention = retention
+        self.max_events_per_key = max_events_per_key
+        self._timestamps: Dict[str, List[datetime]] = {}
+        self._events: Dict[str, List[Event]] = {}
+        self._locks = StripedLock()
+
+    def insert(self, key: str, event: Event) -> int:
+        """
+        Insert an event at its event-time position.
+        Returns how many newer events it was placed behind (0 for in-order events).
+        """
+        ts = event.timestamp1
+        with self._locks.hold(key):
+            timestamps = self._timestamps.setdefault(key, [])
+            events = self._events.setdefault(key, [])
+
+            position = bisect.bisect_right(timestamps, ts)
+            timestamps.insert(position, ts)
+            events.insert(position, event)
+            displaced = len(timestamps) - position - 1
+
+            # Evict by age (relative to the newest event) and by count
+            cutoff = timestamps[-1] - self.retention
+            drop = bisect.bisect_left(timestamps, cutoff)
+            drop = max(drop, len(timestamps) - self.max_events_per_key)
+            if drop > 0:
+                del timestamps[:drop]
+                del events[:drop]
+            return displaced
+
+    def window(self, key: str, start: datetime, end: Optional[datetime] = None) -> List[Event]:
+        """Return the key's events with start <= timestamp1 <= end, oldest first."""
+        with self._locks.hold(key):
+            timestamps = self._timestamps.get(key)
+            if not timestamps:
+                return []
+            lo = bisect.bisect_left(timestamps, start)
+            hi = len(timestamps) if end is None else bisect.bisect_right(timestamps, end)
+            return self._events[key][lo:hi]
+
+    def discard(self, key: str) -> None:
+        """Drop everything indexed under a key."""
+        with self._locks.hold(key):
+            self._timestamps.pop(key, None)
+            self._events.pop(key, None)
+
+    def clear(self) -> None:
+        self._timestamps.clear()
+        self._events.clear()
+
+    def rebuild(self, events: Iterable[Tuple[str, Event]]) -> None:
+        """Re-index (key, event) pairs from scratch."""
+        self.clear()
+        for key, event in events:
+            self.insert(key, event)
+
+
+class WatermarkTracker:
+    """
+    Track the newest event time per user and classify arriving events.
+
+    watermark(user) = newest event time seen for the user - allowed_lateness.
+    Events below the watermark are still indexed for windows, but callers should
+    not let them overwrite "last seen" state.
+    """
+
+    def __init__(self, allowed_lateness: timedelta = timedelta(minutes=5)):
+        self.allowed_lateness = allowed_lateness
+        self._max_event_time: Dict[str, datetime] = {}
+        self._lock = threading.Lock()
+        self._counts = {IN_ORDER: 0, OUT_OF_ORDER: 0, LATE: 0}
+        self._histogram = [0] * (len(LATENESS_BUCKETS) + 1)
+        self._total_lateness = 0.0
+        self._max_lateness = 0.0
+
+    def observe(self, user_id: str, ts: datetime) -> str:
+        """Record an event time for a user and return IN_ORDER, OUT_OF_ORDER or LATE."""
+        with self._lock:
+            newest = self._max_event_time.get(user_id)
+            if newest is None or ts >= newest:
+                self._max_event_time[user_id] = ts
+                self._counts[IN_ORDER] += 1
+                return IN_ORDER
+
+            lateness = (newest - ts).total_seconds()
+            self._total_lateness += lateness
+            self._max_lateness = max(self._max_lateness, lateness)
+            self._histogram[bisect.bisect_left(LATENESS_BUCKETS, lateness)] += 1
+
+            kind = LATE if ts < newest - self.allowed_lateness else OUT_OF_ORDER
+            self._counts[kind] += 1
+            return kind
+
+    def watermark(self, user_id: str) -> Optional[datetime]:
+        newest = self._max_event_time.get(user_id)
+        return newest - self.allowed_lateness if newest else None
+
+    def is_late(self, user_id: str, ts: datetime) -> bool:
+        mark = self.watermark(user_id)
+        return mark is not None and ts < mark
+
+    def forget(self, user_id: str) -> None:
+        with self._lock:
+            self._max_event_time.pop(user_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        """Return lateness statistics for monitoring."""
+        with self._lock:
+            delayed = self._counts[OUT_OF_ORDER] + self._counts[LATE]
+            labels = [f"<={int(b)}s" for b in LATENESS_BUCKETS] + [f">{int(LATENESS_BUCKETS[-1])}s"]
+            return {
+                "allowed_lateness_seconds": self.allowed_lateness.total_seconds(),
+                "tracked_users": len(self._max_event_time),
+                "in_order": self._counts[IN_ORDER],
+                "out_of_order": self._counts[OUT_OF_ORDER],
+                "late": self._counts[LATE],
+                "avg_lateness_seconds": round(self._total_lateness / delayed, 3) if delayed else 0.0,
+                "max_lateness_seconds": round(self._max_lateness, 3),
+                "lateness_histogram": dict(zip(labels, self._histogram)),
+            }
@@ -0,0 +1,192 @@
+"""
+Bounded read cache of ThreatFingerprint objects (storage.FINGERPRINT_CACHE).
+
+It replaces the legacy FINGERPRINTS_STORE list, which get_fingerprints() rebuilt
+as a full copy of the table on every call and readers scanned linearly:
+
+- entries are indexed by fingerprint_id, user_id and status, so lookups cost
+  O(result), and bounded to `max_entries` (least recently used evicted first);
+- a user's fingerprints are served from the cache only after the complete list
+  was loaded once (put_user) and no write touched that user since;
+- storage's write paths invalidate what they change; every invalidation moves
+  the version, and put() / put_user() with a version read before the database
+  query are ignored if a write happened meanwhile, so a slow reader cannot
+  cache a row that was just changed;
+- writes from other worker processes are not seen: entries expire after
+  `ttl_seconds`.
+
+The object still behaves like the old list for legacy callers (len, iteration,
+indexing, `FINGERPRINTS_STORE[:] = []`).
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from models import ThreatFingerprint
+
+
+class FingerprintCache:
+    """LRU cache of fingerprints with user / status indexes and write invalidation."""
+
+    def __init__(self, max_entries: int = 10000, ttl_seconds: float = 30.0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.RLock()
+        self._entries: "OrderedDict[str, Tuple[ThreatFingerprint, float]]" = OrderedDict()
+        self._by_user: Dict[str, Set[str]] = {}
+        self._by_status: Dict[str, Set[str]] = {}
+        self._complete_users: Dict[str, float] = {}  # user_id -> when its full list was loaded
+        self._version = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    # ---------- reads ----------
+
+    @property
+    def version(self) -> int:
+        """Read before querying the database, pass to put() / put_user()."""
+        return self._version
+
+    def get(self, fingerprint_id: str) -> Optional[ThreatFingerprint]:
+        with self._lock:
+            entry = self._entries.get(fingerprint_id)
+            if entry is None or self._expired(entry[1]):
+                if entry is not None:
+                    self._remove(fingerprint_id)
+                self._misses += 1
+                return None
+            self._entries.move_to_end(fingerprint_id)
+            self._hits += 1
+            return entry[0]
+
+    def get_user(self, user_id: str, status: Optional[str] = None) -> Optional[List[ThreatFingerprint]]:
+        """All fingerprints of the user (optionally only `status`), or None if not fully cached."""
+        with self._lock:
+            loaded_at = self._complete_users.get(user_id)
+            if loaded_at is None or self._expired(loaded_at):
+                self._misses += 1
+                return None
+            ids = self._by_user.get(user_id, set())
+            if status is not None:
+                ids = ids & self._by_status.get(status, set())
+            self._hits += 1
+            for fingerprint_id in ids:
+                self._entries.move_to_end(fingerprint_id)
+            return [self._entries[fingerprint_id][0] for fingerprint_id in ids]
+
+    def _expired(self, cached_at: float) -> bool:
+        return time.monotonic() - cached_at > self.ttl_seconds
+
+    # ---------- fills ----------
+
+    def put(self, fingerprint: ThreatFingerprint, version: int) -> None:
+        with self._lock:
+            if version != self._version:
+                return
+            self._add(fingerprint, time.monotonic())
+            self._evict()
+
+    def put_user(self, user_id: str, fingerprints: Iterable[ThreatFingerprint], version: int) -> None:
+        """Cache the complete list of a user's fingerprints."""
+        fingerprints = list(fingerprints)
+        with self._lock:
+            if version != self._version or len(fingerprints) > self.max_entries:
+                return
+            now = time.monotonic()
+            for fingerprint in fingerprints:
+                self._add(fingerprint, now)
+            self._complete_users[user_id] = now
+            self._evict()
+
+    def _add(self, fingerprint: ThreatFingerprint, now: float) -> None:
+        self._remove(fingerprint.fingerprint_id)
+        self._entries[fingerprint.fingerprint_id] = (fingerprint, now)
+        self._by_user.setdefault(fingerprint.user_id, set()).add(fingerprint.fingerprint_id)
+        self._by_status.setdefault(fingerprint.status, set()).add(fingerprint.fingerprint_id)
+
+    def _remove(self, fingerprint_id: str) -> None:
+        entry = self._entries.pop(fingerprint_id, None)
+        if entry is None:
+            return
+        fingerprint = entry[0]
+        for index, key in ((self._by_user, fingerprint.user_id), (self._by_status, fingerprint.status)):
+            ids = index.get(key)
+            if ids is not None:
+                ids.discard(fingerprint_id)
+                if not ids:
+                    del index[key]
+        # The user's cached list is no longer complete
+        self._complete_users.pop(fingerprint.user_id, None)
+
+    def _evict(self) -> None:
+        while len(self._entries) > self.max_entries:
+            fingerprint_id = next(iter(self._entries))
+            self._remove(fingerprint_id)
+            self._evictions += 1
+
+    # ---------- invalidation (called by storage write paths) ----------
+
+    def invalidate(self, fingerprint_ids: Iterable[str], user_ids: Iterable[str] = ()) -> None:
+        """Fingerprints were written or deleted (their users, if known, gained or lost one)."""
+        with self._lock:
+            self._version += 1
+            for fingerprint_id in fingerprint_ids:
+                self._remove(fingerprint_id)
+            for user_id in user_ids:
+                self._complete_users.pop(user_id, None)
+
+    def invalidate_user(self, user_id: str) -> None:
+        """Several fingerprints of the user changed at once."""
+        with self._lock:
+            self._version += 1
+            for fingerprint_id in list(self._by_user.get(user_id, ())):
+                self._remove(fingerprint_id)
+            self._complete_users.pop(user_id, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._version += 1
+            self._entries.clear()
+            self._by_user.clear()
+            self._by_status.clear()
+            self._complete_users.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "complete_users": len(self._complete_users),
+                "version": self._version,
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+            }
+
+    # ---------- legacy list interface (FINGERPRINTS_STORE) ----------
+
+    def _values(self) -> List[ThreatFingerprint]:
+        with self._lock:
+            return [fingerprint for fingerprint, _ in self._entries.values()]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __iter__(self):
+        return iter(self._values())
+
+    def __getitem__(self, index):
+        return self._values()[index]
+
+    def __setitem__(self, index, fingerprints) -> None:
+        """Only whole-list assignment (`cache[:] = [...]`) is supported."""
+        if not isinstance(index, slice) or index != slice(None):
+            raise TypeError("FingerprintCache only supports cache[:] = fingerprints")
+        with self._lock:
+            self.clear()
+            for fingerprint in fingerprints:
+                self.put(fingerprint, self._version)
@@ -0,0 +1,128 @@
+"""
+Fingerprint statistics for /api/v1/database-stats.
+
+The endpoint used to run one COUNT query per status and per risk tier (seven
+passes over the fingerprints table per call) and is now polled by every open
+dashboard. FingerprintStats computes everything in ONE grouped aggregate
+(status x risk_score x platform, answered from a covering index) and folds
+the groups into the response:
+
+- totals by status and by risk tier (high / medium / low),
+- a risk-score histogram in buckets of 10 (90-100 is the last one),
+- per-platform breakdowns.
+
+The result is cached for `ttl_seconds`, so concurrent viewers share one query.
+"""
+
+import threading
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional
+
+from sqlalchemy import func
+
+from db import FingerprintDB
+
+STATUSES = ("ACTIVE", "BLOCKED", "PENDING", "CLEARED")
+HISTOGRAM_BUCKETS = 10
+MEDIUM_RISK_THRESHOLD = 50
+
+
+def _risk_level(risk_score: int, high_threshold: int, medium_threshold: int) -> str:
+    if risk_score >= high_threshold:
+        return "high"
+    return "medium" if risk_score >= medium_threshold else "low"
+
+
+def _empty_breakdown() -> Dict[str, Any]:
+    return {
+        "total": 0,
+        "by_status": {status.lower(): 0 for status in STATUSES},
+        "by_risk_level": {"high": 0, "medium": 0, "low": 0},
+    }
+
+
+def aggregate_fingerprint_stats(session, high_threshold: int, medium_threshold: int = MEDIUM_RISK_THRESHOLD) -> Dict[str, Any]:
+    """
+    All counts from a single GROUP BY status, risk_score, platform. The groups
+    (at most statuses x 101 scores x platforms) are read in index order from the
+    covering ix_fingerprints_status_risk_platform index and folded here.
+    """
+    groups = session.query(
+        FingerprintDB.status, FingerprintDB.risk_score, FingerprintDB.platform, func.count()
+    ).group_by(FingerprintDB.status, FingerprintDB.risk_score, FingerprintDB.platform).all()
+
+    overall = _empty_breakdown()
+    histogram = [0] * HISTOGRAM_BUCKETS
+    by_platform: Dict[str, Dict[str, Any]] = {}
+    for status, risk_score, platform, count in groups:
+        risk_score = risk_score or 0
+        status_key = (status or "unknown").lower()
+        risk_level = _risk_level(risk_score, high_threshold, medium_threshold)
+        histogram[max(0, min(risk_score // 10, HISTOGRAM_BUCKETS - 1))] += count
+        for breakdown in (overall, by_platform.setdefault(platform or "unknown", _empty_breakdown())):
+            breakdown["total"] += count
+            breakdown["by_status"][status_key] = breakdown["by_status"].get(status_key, 0) + count
+            breakdown["by_risk_level"][risk_level] += count
+
+    return {
+        "total_fingerprints": overall["total"],
+        "by_status": overall["by_status"],
+        "by_risk_level": overall["by_risk_level"],
+        "risk_thresholds": {"high": high_threshold, "medium": medium_threshold},
+        "risk_histogram": [
+            {"from": i * 10, "to": 100 if i == HISTOGRAM_BUCKETS - 1 else i * 10 + 9, "count": count}
+            for i, count in enumerate(histogram)
+        ],
+        "by_platform": by_platform,
+    }
+
+
+class FingerprintStats:
+    """aggregate_fingerprint_stats() behind a short TTL cache shared by all requests."""
+
+    def __init__(self, session_factory: Callable, ttl_seconds: float = 2.0,
+                 before_compute: Optional[Callable[[], Any]] = None):
+        self.session_factory = session_factory
+        self.ttl_seconds = ttl_seconds
+        self.before_compute = before_compute
+        self._lock = threading.RLock()
+        self._cached: Optional[Dict[str, Any]] = None
+        self._cached_key = None
+        self._cached_at = 0.0
+        self._hits = 0
+        self._computes = 0
+        self._last_compute_ms = 0.0
+
+    def get(self, high_threshold: int) -> Dict[str, Any]:
+        # One computation at a time: concurrent callers wait for it and reuse the result
+        with self._lock:
+            now = time.monotonic()
+            if self._cached is not None and self._cached_key == high_threshold and now - self._cached_at < self.ttl_seconds:
+                self._hits += 1
+                return self._cached
+            if self.before_compute is not None:
+                self.before_compute()
+            started = time.perf_counter()
+            session = self.session_factory()
+            try:
+                stats = aggregate_fingerprint_stats(session, high_threshold)
+            finally:
+                session.close()
+            self._last_compute_ms = (time.perf_counter() - started) * 1000
+            self._computes += 1
+            stats["computed_at"] = datetime.utcnow().isoformat()
+            self._cached, self._cached_key, self._cached_at = stats, high_threshold, time.monotonic()
+            return stats
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._cached = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self._hits,
+            "computes": self._computes,
+            "last_compute_ms": round(self._last_compute_ms, 2),
+        }
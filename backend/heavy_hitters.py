@@ -0,0 +1,169 @@
+"""
+Global heavy-hitter tracking for IP addresses and devices.
+
+Per-user features cannot see one IP driving hundreds of different user_ids.
+This module keeps a constant-memory, all-users view of event volume:
+
+- CountMinSketch: approximate per-key counts (never under-estimates).
+- HeavyHitters: a count-min sketch plus a top-k candidate heap. The sketch is
+  rotated every `rotate_seconds` and queries add the previous period, so the
+  ranking reflects the last one to two periods rather than all time.
+- TopTalkers: HeavyHitters for ip_address and device_id, updated in store_event.
+"""
+
+import hashlib
+import heapq
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+class CountMinSketch:
+    """Count-min sketch with `depth` rows of `width` int64 counters."""
+
+    def __init__(self, width: int = 2048, depth: int = 4):
+        self.width = width
+        self.depth = depth
+        self._table = np.zeros((depth, width), dtype=np.int64)
+        self._rows = np.arange(depth)
+
+    def _indexes(self, key: str) -> np.ndarray:
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "big")
+        h2 = int.from_bytes(digest[8:], "big") | 1
+        return np.array([(h1 + i * h2) % self.width for i in range(self.depth)])
+
+    def add(self, key: str, amount: int = 1) -> int:
+        """Add to a key and return its new estimated count."""
+        cols = self._indexes(key)
+        self._table[self._rows, cols] += amount
+        return int(self._table[self._rows, cols].min())
+
+    def estimate(self, key: str) -> int:
+        return int(self._table[self._rows, self._indexes(key)].min())
+
+    def memory_bytes(self) -> int:
+        return int(self._table.nbytes)
+
+
+class HeavyHitters:
+    """Approximate top-k keys by event count over a rotating window."""
+
+    def __init__(self, k: int = 50, width: int = 2048, depth: int = 4, rotate_seconds: float = 3600.0):
+        self.k = k
+        self.width = width
+        self.depth = depth
+        self.rotate_seconds = rotate_seconds
+        self._current = CountMinSketch(width, depth)
+        self._previous: Optional[CountMinSketch] = None
+        self._rotated_at = time.monotonic()
+        self._candidates: Dict[str, int] = {}
+        self._heap: List[Tuple[int, str]] = []
+        self._lock = threading.Lock()
+
+    def add(self, key: Optional[str], amount: int = 1) -> None:
+        if not key or key == "unknown":
+            return
+        with self._lock:
+            self._maybe_rotate()
+            estimate = self._current.add(key, amount)
+            if self._previous is not None:
+                estimate += self._previous.estimate(key)
+            self._offer(key, estimate)
+
+    def estimate(self, key: Optional[str]) -> int:
+        if not key:
+            return 0
+        with self._lock:
+            return self._estimate(key)
+
+    def _estimate(self, key: str) -> int:
+        estimate = self._current.estimate(key)
+        if self._previous is not None:
+            estimate += self._previous.estimate(key)
+        return estimate
+
+    def _offer(self, key: str, estimate: int) -> None:
+        if key in self._candidates or len(self._candidates) < self.k:
+            self._candidates[key] = estimate
+            heapq.heappush(self._heap, (estimate, key))
+        else:
+            # Pop stale heap entries until the top reflects a live candidate count
+            while self._heap and self._candidates.get(self._heap[0][1]) != self._heap[0][0]:
+                heapq.heappop(self._heap)
+            if self._heap and estimate > self._heap[0][0]:
+                _, evicted = heapq.heappop(self._heap)
+                del self._candidates[evicted]
+                self._candidates[key] = estimate
+                heapq.heappush(self._heap, (estimate, key))
+
+        if len(self._heap) > 4 * self.k:
+            self._heap = [(count, key) for key, count in self._candidates.items()]
+            heapq.heapify(self._heap)
+
+    def _maybe_rotate(self) -> None:
+        now = time.monotonic()
+        if now - self._rotated_at < self.rotate_seconds:
+            return
+        self._rotated_at = now
+        self._previous = self._current
+        self._current = CountMinSketch(self.width, self.depth)
+        # Re-score candidates against the new (previous + empty current) window
+        self._candidates = {key: self._previous.estimate(key) for key in self._candidates}
+        self._heap = [(count, key) for key, count in self._candidates.items()]
+        heapq.heapify(self._heap)
+
+    def top(self, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Current top talkers, highest estimated count first."""
+        with self._lock:
+            self._maybe_rotate()
+            ranked = sorted(self._candidates.items(), key=lambda item: item[1], reverse=True)
+        return [{"key": key, "count": count} for key, count in ranked[:limit or self.k]]
+
+    def rank(self, key: Optional[str]) -> Optional[int]:
+        """1-based rank of a key among the top-k, or None if it is not a top talker."""
+        if not key:
+            return None
+        with self._lock:
+            if key not in self._candidates:
+                return None
+            count = self._candidates[key]
+            return 1 + sum(1 for other in self._candidates.values() if other > count)
+
+    def memory_bytes(self) -> int:
+        total = self._current.memory_bytes()
+        if self._previous is not None:
+            total += self._previous.memory_bytes()
+        return total
+
+
+class TopTalkers:
+    """Heavy hitters over ip_address and device_id across all users."""
+
+    KINDS = ("ip", "device")
+
+    def __init__(self, k: int = 50, rotate_seconds: float = 3600.0):
+        self.trackers: Dict[str, HeavyHitters] = {
+            kind: HeavyHitters(k=k, rotate_seconds=rotate_seconds) for kind in self.KINDS
+        }
+
+    def record_event(self, event) -> None:
+        self.trackers["ip"].add(getattr(event, "ip_address", None))
+        self.trackers["device"].add(getattr(event, "device_id", None))
+
+    def estimate(self, kind: str, key: Optional[str]) -> int:
+        return self.trackers[kind].estimate(key)
+
+    def rank(self, kind: str, key: Optional[str]) -> Optional[int]:
+        return self.trackers[kind].rank(key)
+
+    def top(self, kind: str, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        return self.trackers[kind].top(limit)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            kind: {"k": tracker.k, "approx_memory_bytes": tracker.memory_bytes()}
+            for kind, tracker in self.trackers.items()
+        }
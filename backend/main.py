@@ -1,20 +1,44 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
-from datetime import datetime
+from datetime import datetime, timezone
 import os
 
 from models import Event, ThreatFingerprint
 from storage import (
     store_event,
     get_fingerprints,
-    get_fingerprint_by_id,
+    get_fingerprints_page,
+    get_fingerprint_changes,
+    get_fingerprint_changes_cursor,
     update_fingerprint_status,
     clear_user_fingerprints,
     FINGERPRINTS_STORE,
-    delete_fingerprint
+    EVENT_TIME,
+    ENTITY_WINDOWS,
+    DISTINCT_COUNTERS,
+    TOP_TALKERS,
+    USERS_BY_ENTITY,
+    CAMPAIGNS,
+    FINGERPRINT_WRITER,
+    BLOCKED_USERS,
+    FINGERPRINT_STATS,
+    FINGERPRINT_RETENTION,
+    FINGERPRINT_CACHE,
+    add_fingerprints_committed_listener,
+    add_fingerprint_change_listener,
+    add_user_fingerprints_change_listener,
+    get_user_risk_state,
+    delete_fingerprint,
+    bulk_update_fingerprint_status,
+    bulk_delete_fingerprints
 )
 from engine import process_event, is_user_fingerprinted ,reset_user_behavior_history  
-from db import init_db
+from db import init_db, storage_profile_stats
+from dispatcher import get_event_dispatcher
+from dedup import SeenEventIds
+from campaigns import start_snapshot_thread
+from broadcast import ChangeBroadcaster, format_sse
+from retention import start_retention_thread
 
 # ==================  Paths & App Setup  ==================
 
@@ -35,6 +59,64 @@ CORS(app, resources={
 })
 
 
+# Number of per-user ordered worker queues in front of process_event (0 = inline)
+EVENT_DISPATCHER_WORKERS = int(os.environ.get('EVENT_DISPATCHER_WORKERS', 4))
+
+
+# Recently accepted event_ids, so offline-queue retries are acknowledged without reprocessing
+SEEN_EVENT_IDS = SeenEventIds(
+    ttl_seconds=float(os.environ.get('EVENT_DEDUP_TTL_SECONDS', 3600)),
+    max_entries=int(os.environ.get('EVENT_DEDUP_MAX_ENTRIES', 100000))
+)
+
+
+# Push channel for the dashboards (/api/v1/fingerprints/stream): one feed reader for all
+# viewers, woken by local commits and polling every FINGERPRINT_STREAM_POLL_SECONDS for
+# writes from other processes. Viewers more than FINGERPRINT_STREAM_BUFFER messages
+# behind are dropped; above FINGERPRINT_STREAM_MAX_SUBSCRIBERS new viewers get 503 and poll.
+FINGERPRINT_STREAM = ChangeBroadcaster(
+    lambda cursor: get_fingerprint_changes(cursor),
+    poll_seconds=float(os.environ.get('FINGERPRINT_STREAM_POLL_SECONDS', 1.0)),
+    buffer_size=int(os.environ.get('FINGERPRINT_STREAM_BUFFER', 100))
+)
+add_fingerprints_committed_listener(FINGERPRINT_STREAM.wake)
+FINGERPRINT_STREAM_MAX_SUBSCRIBERS = int(os.environ.get('FINGERPRINT_STREAM_MAX_SUBSCRIBERS', 200))
+FINGERPRINT_STREAM_HEARTBEAT_SECONDS = float(os.environ.get('FINGERPRINT_STREAM_HEARTBEAT_SECONDS', 15))
+
+
+# Admin actions (block / clear / delete) show up in the statistics right away;
+# new fingerprints within DATABASE_STATS_TTL_SECONDS
+add_fingerprint_change_listener(lambda fingerprint_id: FINGERPRINT_STATS.invalidate())
+add_user_fingerprints_change_listener(lambda user_id: FINGERPRINT_STATS.invalidate())
+
+
+# Campaign graph snapshot (loaded at startup, saved periodically while it changes)
+CAMPAIGN_GRAPH_PATH = os.environ.get(
+    'CAMPAIGN_GRAPH_PATH',
+    os.path.join(os.path.dirname(__file__), '..', 'campaign_graph.json')
+)
+CAMPAIGN_GRAPH_SAVE_SECONDS = float(os.environ.get('CAMPAIGN_GRAPH_SAVE_SECONDS', 60))
+
+
+# Largest number of fingerprint_ids + user_ids accepted by one /api/v1/bulk/* call
+BULK_ADMIN_MAX_IDS = int(os.environ.get('BULK_ADMIN_MAX_IDS', 50000))
+
+
+# Fingerprint retention (archive + compaction, see retention.py) every RETENTION_INTERVAL_SECONDS (0 = off)
+RETENTION_INTERVAL_SECONDS = float(os.environ.get('RETENTION_INTERVAL_SECONDS', 3600))
+
+
+def dispatch_event(event):
+    """
+    Run process_event on the worker queue that owns event.user_id.
+    Events of the same user are processed in arrival order; different users in parallel.
+    """
+    dispatcher = get_event_dispatcher(process_event, EVENT_DISPATCHER_WORKERS)
+    if dispatcher is None:
+        return process_event(event)
+    return dispatcher.submit(event).result()
+
+
 # Helper function to add CORS headers to responses
 def add_cors_headers(response):
     """Add CORS headers to a response"""
@@ -84,10 +166,12 @@ def receive_event():
     
     """
     POST /api/v1/event endpoint to receive events.
-    1. Receive event from request
+    1. Receive event from request (duplicates by event_id are acknowledged and skipped)
     2. store_event
     3. process_event → may generate fingerprint
     """
+    event_id = None
+    stored = False
     try:
         data = request.get_json()
         
@@ -95,6 +179,23 @@ def receive_event():
             print("❌ [EVENT ERROR] No JSON data received")
             return add_cors_headers(jsonify({"status": "error", "message": "No JSON data provided"})), 400
 
+        # Idempotent ingestion: a retried event_id is acknowledged without being stored again
+        event_id = data.get('event_id')
+        if event_id is not None:
+            if isinstance(event_id, bool) or not isinstance(event_id, (str, int)):
+                return add_cors_headers(jsonify({
+                    "status": "error",
+                    "message": "event_id must be a string or an integer"
+                })), 400
+            event_id = str(event_id)
+        if SEEN_EVENT_IDS.check_and_add(event_id):
+            return add_cors_headers(jsonify({
+                "status": "ok",
+                "duplicate": True,
+                "event_id": event_id,
+                "message": "Duplicate event ignored"
+            })), 200
+
         # Parse timestamp
         timestamp_str = data.get('timestamp1')
         if isinstance(timestamp_str, str):
@@ -140,6 +241,7 @@ def receive_event():
 
         # Store the event
         store_event(event)
+        stored = True
         print(f"📥 [EVENT] {event.event_type} from {event.user_id} ({platform})")
 
         # ==================== BLOCKING ONLY ON PROTECTED PLATFORMS ====================
@@ -168,7 +270,7 @@ def receive_event():
                 "blocking_disabled": True
             }
             # Still process event for fingerprinting/logging purposes, but don't block
-            fingerprint = process_event(event)
+            fingerprint = dispatch_event(event)
             if fingerprint:
                 response["fingerprint_generated"] = True
                 response["fingerprint_id"] = fingerprint.fingerprint_id
@@ -178,7 +280,7 @@ def receive_event():
         # ==============================================================================
 
         # Process the event through the threat engine
-        fingerprint = process_event(event)
+        fingerprint = dispatch_event(event)
 
         # ==================== LOGIC UPDATE FOR LOGGING ALL VISITS ====================
         # Calculate behavioral features for checking (only on protected platforms)
@@ -200,9 +302,11 @@ def receive_event():
         
         # Priority 1: Trust the Fingerprint Risk Score (Source of Truth)
         if fingerprint:
-            if fingerprint.risk_score >= RISK_SCORE_BLOCKING_THRESHOLD:
+            # Rolling fingerprints keep the bucket's max risk; block on this event's own risk
+            event_risk_score = getattr(fingerprint, "event_risk_score", fingerprint.risk_score)
+            if event_risk_score >= RISK_SCORE_BLOCKING_THRESHOLD:
                 should_block_immediately = True
-                block_reason = f"High risk fingerprint created (risk_score: {fingerprint.risk_score})"
+                block_reason = f"High risk fingerprint created (risk_score: {event_risk_score})"
             # Important: If fingerprint exists but risk is low, DO NOT BLOCK.
             # This allows safe users to be logged without being blocked.
             
@@ -240,6 +344,9 @@ def receive_event():
 
     except Exception as e:
         print(f"❌ [ERROR] receive_event: {e}")
+        # If the event never reached the store, let the client's retry be processed
+        if not stored:
+            SEEN_EVENT_IDS.forget(event_id)
         error_response = jsonify({
             "status": "error",
             "message": str(e)
@@ -249,12 +356,33 @@ def receive_event():
 
 # ==================  Fingerprints API  ==================
 
+# Query parameters that switch /api/v1/fingerprints to paginated mode
+FINGERPRINT_PAGE_PARAMS = ("limit", "cursor", "status", "min_risk", "user_id", "platform", "since", "until")
+FINGERPRINTS_PAGE_DEFAULT_LIMIT = 50
+FINGERPRINTS_PAGE_MAX_LIMIT = 500
+FINGERPRINT_CHANGES_DEFAULT_LIMIT = 500
+FINGERPRINT_CHANGES_MAX_LIMIT = 1000
+
+
 @app.route('/api/v1/fingerprints', methods=['GET', 'OPTIONS'])
 def get_all_fingerprints():
-    """GET /api/v1/fingerprints - Returns all fingerprints for dashboard."""
+    """
+    GET /api/v1/fingerprints - Fingerprints for the dashboards.
+
+    With any of limit, cursor, status (comma-separated), min_risk, user_id, platform,
+    since, until (ISO created_at range): one keyset page, newest first:
+        {"status": "ok", "fingerprints": [...], "next_cursor": "..." | null, "limit": n,
+         "changes_cursor": "..."}
+    changes_cursor is taken before the page is read; pass it to
+    /api/v1/fingerprints/changes to follow the page without reloading it.
+    Without parameters: the legacy array of every fingerprint.
+    """
     if request.method == 'OPTIONS':
         return add_cors_headers(jsonify({})), 200
 
+    if any(param in request.args for param in FINGERPRINT_PAGE_PARAMS):
+        return get_fingerprints_page_response()
+
     try:
         try:
             fingerprints = get_fingerprints()
@@ -263,7 +391,7 @@ def get_all_fingerprints():
             fingerprints = None
 
         if fingerprints is None:
-            fingerprints = FINGERPRINTS_STORE
+            fingerprints = list(FINGERPRINTS_STORE)
 
         if not isinstance(fingerprints, (list, tuple)):
             fingerprints = []
@@ -285,20 +413,231 @@ def get_all_fingerprints():
         return add_cors_headers(jsonify({"status": "error", "message": str(e), "fingerprints": []})), 500
 
 
+def _parse_utc(value: str) -> datetime:
+    """ISO timestamp as naive UTC (how created_at is stored)."""
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def get_fingerprints_page_response():
+    try:
+        args = request.args
+        limit = min(max(int(args.get('limit', FINGERPRINTS_PAGE_DEFAULT_LIMIT)), 1), FINGERPRINTS_PAGE_MAX_LIMIT)
+        status = [value.strip().upper() for value in args.get('status', '').split(',') if value.strip()]
+        min_risk = int(args['min_risk']) if args.get('min_risk') else None
+        since = _parse_utc(args['since']) if args.get('since') else None
+        until = _parse_utc(args['until']) if args.get('until') else None
+        changes_cursor = get_fingerprint_changes_cursor()
+        fingerprints, next_cursor = get_fingerprints_page(
+            limit=limit, cursor=args.get('cursor') or None, status=status or None, min_risk=min_risk,
+            user_id=args.get('user_id') or None, platform=args.get('platform') or None,
+            since=since, until=until
+        )
+    except ValueError as e:
+        return add_cors_headers(jsonify({"status": "error", "message": f"invalid parameter: {e}"})), 400
+    except Exception as e:
+        print(f"❌ [ERROR] Error getting fingerprints page: {e}")
+        return add_cors_headers(jsonify({"status": "error", "message": str(e), "fingerprints": []})), 500
+
+    return add_cors_headers(jsonify({
+        "status": "ok",
+        "fingerprints": fingerprints,
+        "next_cursor": next_cursor,
+        "limit": limit,
+        "changes_cursor": changes_cursor
+    })), 200
+
+
+@app.route('/api/v1/fingerprints/changes', methods=['GET', 'OPTIONS'])
+def get_fingerprints_changes():
+    """
+    GET /api/v1/fingerprints/changes?since=<cursor>&limit=n - Fingerprints inserted,
+    updated or deleted after the cursor, oldest first:
+        {"status": "ok", "changes": [...], "deleted": [fingerprint_id, ...],
+         "cursor": "...", "has_more": bool, "reset": bool}
+    Without since: no changes and the cursor of the current head.
+    has_more: ask again right away with the returned cursor.
+    reset: the cursor is too old (deletions were pruned), reload the list.
+    """
+    if request.method == 'OPTIONS':
+        return add_cors_headers(jsonify({})), 200
+
+    try:
+        limit = min(max(int(request.args.get('limit', FINGERPRINT_CHANGES_DEFAULT_LIMIT)), 1),
+                    FINGERPRINT_CHANGES_MAX_LIMIT)
+        feed = get_fingerprint_changes(request.args.get('since') or None, limit)
+    except ValueError as e:
+        return add_cors_headers(jsonify({"status": "error", "message": f"invalid parameter: {e}"})), 400
+    except Exception as e:
+        print(f"❌ [ERROR] Error getting fingerprint changes: {e}")
+        return add_cors_headers(jsonify({"status": "error", "message": str(e)})), 500
+
+    return add_cors_headers(jsonify({"status": "ok", **feed})), 200
+
+
+@app.route('/api/v1/fingerprints/stream', methods=['GET', 'OPTIONS'])
+def stream_fingerprints():
+    """
+    GET /api/v1/fingerprints/stream - Server-Sent Events with fingerprint changes as they commit.
+    Events:
+        fingerprints  {"changes": [...], "deleted": [...], "cursor": "..."} (same shape as /changes)
+        reset         reload the list
+        dropped       this viewer fell too far behind and is disconnected; reconnect and reload
+    A ": keepalive" comment is sent every FINGERPRINT_STREAM_HEARTBEAT_SECONDS when idle.
+    """
+    if request.method == 'OPTIONS':
+        return add_cors_headers(jsonify({})), 200
+
+    if FINGERPRINT_STREAM.stats()["subscribers"] >= FINGERPRINT_STREAM_MAX_SUBSCRIBERS:
+        return add_cors_headers(jsonify({"status": "error", "message": "too many stream subscribers"})), 503
+    try:
+        subscription = FINGERPRINT_STREAM.subscribe()
+    except Exception as e:
+        print(f"❌ [ERROR] Error opening fingerprint stream: {e}")
+        return add_cors_headers(jsonify({"status": "error", "message": str(e)})), 500
+
+    def generate():
+        try:
+            yield "retry: 3000\n\n"
+            yield format_sse("ready", {"heartbeat_seconds": FINGERPRINT_STREAM_HEARTBEAT_SECONDS})
+            while True:
+                message = subscription.get(FINGERPRINT_STREAM_HEARTBEAT_SECONDS)
+                if message is None:
+                    return
+                yield message or ": keepalive\n\n"
+        finally:
+            FINGERPRINT_STREAM.unsubscribe(subscription)
+
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return add_cors_headers(response)
+
+
 @app.route('/api/v1/debug', methods=['GET'])
 def debug_status():
     """Simple debug endpoint."""
     from storage import EVENTS_STORE, FINGERPRINTS_STORE
+    from engine import RISK_SCORE_BLOCKING_THRESHOLD
     try:
         return jsonify({
             "status": "ok",
             "events_count": len(EVENTS_STORE),
-            "fingerprints_count": len(FINGERPRINTS_STORE)
+            # Fingerprints in the database (cached aggregate), not only the ones in the read cache
+            "fingerprints_count": FINGERPRINT_STATS.get(RISK_SCORE_BLOCKING_THRESHOLD)["total_fingerprints"],
+            "fingerprints_cached": len(FINGERPRINTS_STORE)
         }), 200
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
 
 
+@app.route('/api/v1/engine-stats', methods=['GET', 'OPTIONS'])
+def engine_stats():
+    """GET /api/v1/engine-stats - Runtime metrics of the event processing pipeline."""
+    if request.method == 'OPTIONS':
+        return add_cors_headers(jsonify({})), 200
+    try:
+        dispatcher = get_event_dispatcher(process_event, EVENT_DISPATCHER_WORKERS)
+        return add_cors_headers(jsonify({
+            "status": "ok",
+            "dispatcher": dispatcher.stats() if dispatcher else {"workers": 0, "queues": []},
+            "event_time": EVENT_TIME.stats(),
+            "windows": ENTITY_WINDOWS.stats(),
+            "distinct_sketches": DISTINCT_COUNTERS.stats(),
+            "top_talkers": TOP_TALKERS.stats(),
+            "multi_account_index": USERS_BY_ENTITY.stats(),
+            "campaigns": CAMPAIGNS.stats(),
+            "fingerprint_writer": FINGERPRINT_WRITER.stats() if FINGERPRINT_WRITER else {"enabled": False},
+            "blocked_users": BLOCKED_USERS.stats(),
+            "fingerprint_stream": FINGERPRINT_STREAM.stats(),
+            "database_stats": FINGERPRINT_STATS.stats(),
+            "retention": FINGERPRINT_RETENTION.stats(),
+            "fingerprint_cache": FINGERPRINT_CACHE.stats(),
+            "database": storage_profile_stats(),
+            "dedup": SEEN_EVENT_IDS.stats()
+        })), 200
+    except Exception as e:
+        return add_cors_headers(jsonify({"status": "error", "message": str(e)})), 500
+
+
+@app.route('/api/v1/top-talkers', methods=['GET', 'OPTIONS'])
+def top_talkers():
+    """
+    GET /api/v1/top-talkers - Heaviest IP addresses and devices across all users.
+    Query params: kind=ip|device (default: both), limit (default: 10).
+    """
+    if request.method == 'OPTIONS':
+        return add_cors_headers(jsonify({})), 200
+    try:
+        limit = int(request.args.get('limit', 10))
+        kind = request.args.get('kind')
+        if kind and kind not in TOP_TALKERS.KINDS:
+            return add_cors_headers(jsonify({"status": "error", "message": "kind must be 'ip' or 'device'"})), 400
+
+        kinds = [kind] if kind else list(TOP_TALKERS.KINDS)
+        response = {"status": "ok"}
+        for k in kinds:
+            response[k] = TOP_TALKERS.top(k, limit)
+        return add_cors_headers(jsonify(response)), 200
+    except ValueError:
+        return add_cors_headers(jsonify({"status": "error", "message": "limit must be an integer"})), 400
+    except Exception as e:
+        return add_cors_headers(jsonify({"status": "error", "message": str(e)})), 500
+
+
+@app.route('/api/v1/campaigns', methods=['GET', 'OPTIONS'])
+def list_campaigns():
+    """
+    GET /api/v1/campaigns - Largest campaigns (users linked through devices, IPs and fingerprints).
+    Query params: min_users (default: 2), limit (default: 20).
+    """
+    if request.method == 'OPTIONS':
+        return add_cors_headers(jsonify({})), 200
+    try:
+        min_users = int(request.args.get('min_users', 2))
+        limit = int(request.args.get('limit', 20))
+        return add_cors_headers(jsonify({
+            "status": "ok",
+            "campaigns": CAMPAIGNS.campaigns(min_users=min_users, limit=limit),
+            "stats": CAMPAIGNS.stats()
+        })), 200
+    except ValueError:
+        return add_cors_headers(jsonify({"status": "error", "message": "min_users and limit must be integers"})), 400
+    except Exception as e:
+        return add_cors_headers(jsonify({"status": "error", "message": str(e)})), 500
+
+
+@app.route('/api/v1/campaigns/lookup', methods=['GET', 'OPTIONS'])
+def lookup_campaign():
+    """
+    GET /api/v1/campaigns/lookup - Campaign of one entity and its members.
+    Query params: exactly one of user_id, device_id, ip_address.
+    """
+    if request.method == 'OPTIONS':
+        return add_cors_headers(jsonify({})), 200
+    try:
+        lookups = [
+            (kind, request.args.get(param))
+            for kind, param in (("user", "user_id"), ("device", "device_id"), ("ip", "ip_address"))
+            if request.args.get(param)
+        ]
+        if len(lookups) != 1:
+            return add_cors_headers(jsonify({
+                "status": "error",
+                "message": "Provide exactly one of user_id, device_id, ip_address"
+            })), 400
+
+        kind, key = lookups[0]
+        campaign = CAMPAIGNS.campaign_of(kind, key)
+        if campaign is None:
+            return add_cors_headers(jsonify({"status": "error", "message": f"{kind} {key} not found"})), 404
+        return add_cors_headers(jsonify({"status": "ok", "campaign": campaign})), 200
+    except Exception as e:
+        return add_cors_headers(jsonify({"status": "error", "message": str(e)})), 500
+
+
 @app.route('/api/v1/check-user-status', methods=['POST', 'OPTIONS'])
 def check_user_status():
     """Check detailed status of a user"""
@@ -311,17 +650,15 @@ def check_user_status():
         if not user_id:
             return add_cors_headers(jsonify({"status": "error", "message": "user_id required"})), 400
 
-        from storage import FINGERPRINTS_STORE
-        user_fingerprints = [fp for fp in FINGERPRINTS_STORE if fp.user_id == user_id]
         from engine import RISK_SCORE_BLOCKING_THRESHOLD
-        active_blocking = [fp for fp in user_fingerprints 
-                          if fp.status == "ACTIVE" and fp.risk_score >= RISK_SCORE_BLOCKING_THRESHOLD]
+        state = get_user_risk_state(user_id)
         
         return add_cors_headers(jsonify({
             "status": "ok",
             "user_id": user_id,
-            "is_blocked": len(active_blocking) > 0,
-            "total_fingerprints": len(user_fingerprints)
+            "is_blocked": bool(state) and state["max_active_risk"] >= RISK_SCORE_BLOCKING_THRESHOLD,
+            "total_fingerprints": state["fingerprint_count"] if state else 0,
+            "risk_state": state
         })), 200
     except Exception as e:
         return add_cors_headers(jsonify({"status": "error", "message": str(e)})), 500
@@ -374,28 +711,20 @@ def vpn_test():
     return app.send_static_file('vpn-test.html')
 
 
-@app.route('/api/v1/database-stats', methods=['GET'])
+@app.route('/api/v1/database-stats', methods=['GET', 'OPTIONS'])
 def get_database_stats():
-    """Get database statistics."""
-    from db import get_db_session, FingerprintDB
-    from sqlalchemy import func
+    """
+    Get database statistics: totals by status and risk level, a risk-score
+    histogram and per-platform breakdowns, from one grouped query cached for
+    DATABASE_STATS_TTL_SECONDS (see fingerprint_stats.py).
+    """
+    if request.method == 'OPTIONS':
+        return add_cors_headers(jsonify({})), 200
+    from engine import RISK_SCORE_BLOCKING_THRESHOLD
     try:
-        session = get_db_session()
-        total = session.query(FingerprintDB).count()
-        active = session.query(FingerprintDB).filter(FingerprintDB.status == "ACTIVE").count()
-        blocked = session.query(FingerprintDB).filter(FingerprintDB.status == "BLOCKED").count()
-        
-        from engine import RISK_SCORE_BLOCKING_THRESHOLD
-        high_risk = session.query(FingerprintDB).filter(FingerprintDB.risk_score >= RISK_SCORE_BLOCKING_THRESHOLD).count()
-        
-        session.close()
         return add_cors_headers(jsonify({
             "status": "ok",
-            "statistics": {
-                "total_fingerprints": total,
-                "by_status": {"active": active, "blocked": blocked},
-                "by_risk_level": {"high": high_risk}
-            }
+            "statistics": FINGERPRINT_STATS.get(RISK_SCORE_BLOCKING_THRESHOLD)
         })), 200
     except Exception as e:
         return add_cors_headers(jsonify({"status": "error", "message": str(e)})), 500
@@ -512,6 +841,108 @@ def delete_fingerprint_route():
         return add_cors_headers(jsonify({"status": "error", "message": str(e)})), 500
 
 
+def bulk_request_ids(data, allow_fingerprint_ids=True):
+    """
+    (fingerprint_ids, user_ids) of a /api/v1/bulk/* request body.
+    Raises ValueError when both are missing, not lists of strings or too many.
+    """
+    data = data or {}
+    fingerprint_ids = data.get('fingerprint_ids') if allow_fingerprint_ids else None
+    user_ids = data.get('user_ids')
+    for name, values in (('fingerprint_ids', fingerprint_ids), ('user_ids', user_ids)):
+        if values is not None and (not isinstance(values, list) or not all(isinstance(v, str) and v for v in values)):
+            raise ValueError(f"{name} must be a list of non-empty strings")
+    if not fingerprint_ids and not user_ids:
+        raise ValueError("fingerprint_ids or user_ids required" if allow_fingerprint_ids else "user_ids required")
+    if len(fingerprint_ids or ()) + len(user_ids or ()) > BULK_ADMIN_MAX_IDS:
+        raise ValueError(f"at most {BULK_ADMIN_MAX_IDS} ids per request")
+    return fingerprint_ids, user_ids
+
+
+@app.route('/api/v1/bulk/confirm-threat', methods=['POST', 'OPTIONS'])
+def bulk_confirm_threat():
+    """
+    POST /api/v1/bulk/confirm-threat - Block many fingerprints in one transaction.
+    Body: {"fingerprint_ids": [...], "user_ids": [...]} (either or both; user_ids
+    blocks all fingerprints of those users).
+    """
+    if request.method == 'OPTIONS':
+        return add_cors_headers(jsonify({})), 200
+    try:
+        fingerprint_ids, user_ids = bulk_request_ids(request.get_json(silent=True))
+    except ValueError as e:
+        return add_cors_headers(jsonify({"status": "error", "message": str(e)})), 400
+    try:
+        result = bulk_update_fingerprint_status("BLOCKED", fingerprint_ids, user_ids)
+        return add_cors_headers(jsonify({"status": "ok", "new_status": "BLOCKED", **result})), 200
+    except Exception as e:
+        return add_cors_headers(jsonify({"status": "error", "message": str(e)})), 500
+
+
+@app.route('/api/v1/bulk/clear-fingerprint', methods=['POST', 'OPTIONS'])
+def bulk_clear_fingerprints():
+    """
+    POST /api/v1/bulk/clear-fingerprint - Set many fingerprints to CLEARED in one transaction.
+    Body: {"fingerprint_ids": [...], "user_ids": [...]} (either or both).
+    """
+    if request.method == 'OPTIONS':
+        return add_cors_headers(jsonify({})), 200
+    try:
+        fingerprint_ids, user_ids = bulk_request_ids(request.get_json(silent=True))
+    except ValueError as e:
+        return add_cors_headers(jsonify({"status": "error", "message": str(e)})), 400
+    try:
+        result = bulk_update_fingerprint_status("CLEARED", fingerprint_ids, user_ids)
+        return add_cors_headers(jsonify({"status": "ok", "new_status": "CLEARED", **result})), 200
+    except Exception as e:
+        return add_cors_headers(jsonify({"status": "error", "message": str(e)})), 500
+
+
+@app.route('/api/v1/bulk/unblock-user', methods=['POST', 'OPTIONS'])
+def bulk_unblock_users():
+    """
+    POST /api/v1/bulk/unblock-user - /api/v1/unblock-user for many users at once:
+    clears their ACTIVE and BLOCKED fingerprints and resets their behavioral history.
+    Body: {"user_ids": [...]}.
+    """
+    if request.method == 'OPTIONS':
+        return add_cors_headers(jsonify({})), 200
+    try:
+        _, user_ids = bulk_request_ids(request.get_json(silent=True), allow_fingerprint_ids=False)
+    except ValueError as e:
+        return add_cors_headers(jsonify({"status": "error", "message": str(e)})), 400
+    try:
+        result = bulk_update_fingerprint_status("CLEARED", user_ids=user_ids, from_statuses=("ACTIVE", "BLOCKED"))
+        for user_id in set(user_ids):
+            reset_user_behavior_history(user_id)
+        return add_cors_headers(jsonify({
+            "status": "ok",
+            "users": len(set(user_ids)),
+            "cleared_fingerprints": result["updated"]
+        })), 200
+    except Exception as e:
+        return add_cors_headers(jsonify({"status": "error", "message": str(e)})), 500
+
+
+@app.route('/api/v1/bulk/delete-fingerprint', methods=['POST', 'OPTIONS'])
+def bulk_delete_fingerprints_route():
+    """
+    POST /api/v1/bulk/delete-fingerprint - Delete many fingerprints in one transaction.
+    Body: {"fingerprint_ids": [...], "user_ids": [...]} (either or both).
+    """
+    if request.method == 'OPTIONS':
+        return add_cors_headers(jsonify({})), 200
+    try:
+        fingerprint_ids, user_ids = bulk_request_ids(request.get_json(silent=True))
+    except ValueError as e:
+        return add_cors_headers(jsonify({"status": "error", "message": str(e)})), 400
+    try:
+        result = bulk_delete_fingerprints(fingerprint_ids, user_ids)
+        return add_cors_headers(jsonify({"status": "ok", **result})), 200
+    except Exception as e:
+        return add_cors_headers(jsonify({"status": "error", "message": str(e)})), 500
+
+
 @app.route('/api/v1/health', methods=['GET', 'OPTIONS'])
 def health_check():
     if request.method == 'OPTIONS':
@@ -523,6 +954,17 @@ def health_check():
 
 if __name__ == '__main__':
     init_db()
+    BLOCKED_USERS.load()
+    print(f"🚫 [BLOCKED-USERS] Loaded {BLOCKED_USERS.stats()['blocked_users']} blocked user(s)")
+    try:
+        loaded = CAMPAIGNS.load(CAMPAIGN_GRAPH_PATH)
+        print(f"🕸️ [CAMPAIGNS] Loaded {loaded} campaign component(s) from {CAMPAIGN_GRAPH_PATH}")
+    except (OSError, ValueError) as e:
+        print(f"⚠️ [CAMPAIGNS] Could not load campaign graph: {e}")
+    if CAMPAIGN_GRAPH_SAVE_SECONDS > 0:
+        start_snapshot_thread(CAMPAIGNS, CAMPAIGN_GRAPH_PATH, CAMPAIGN_GRAPH_SAVE_SECONDS)
+    if RETENTION_INTERVAL_SECONDS > 0:
+        start_retention_thread(FINGERPRINT_RETENTION, RETENTION_INTERVAL_SECONDS)
     model_dir = os.path.join(os.path.dirname(__file__), '..', 'ml', 'models')
     os.makedirs(model_dir, exist_ok=True)
     port = int(os.environ.get('PORT', 5000))
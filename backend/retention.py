@@ -0,0 +1,262 @@
+"""
+Fingerprint retention: archive old rows out of the live table and compact the database.
+
+Every visit can leave a fingerprint (NORMAL_VISIT_LOG included) and nothing used
+to remove them, so the fingerprints table, its indexes and the database file only
+grew. FingerprintRetention moves rows matched by a retention rule into
+fingerprints_archive (FingerprintArchiveDB), where view_database.py --archive
+still reads them:
+
+- cleared:      CLEARED fingerprints not updated for RETENTION_CLEARED_DAYS,
+- normal_visit: low-risk NORMAL_VISIT_LOG fingerprints not updated for
+                RETENTION_NORMAL_VISIT_DAYS.
+
+BLOCKED fingerprints are never archived. Rows move in batches of
+RETENTION_BATCH_ROWS, each batch one short transaction (copy, tombstone for the
+changes feed, delete, user_risk_state refresh), so request handlers are never
+locked out for long. After the batches, compact() returns freed pages to the
+file system (SQLite incremental vacuum) and refreshes planner statistics.
+
+Run it from the server (RETENTION_INTERVAL_SECONDS, see start_retention_thread)
+or by hand:
+    python retention.py [--dry-run]
+"""
+
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import insert, literal, select, text
+
+from db import FingerprintArchiveDB, FingerprintDB
+from changes import prune_tombstones, record_tombstones
+from risk_state import refresh_user_risk_state
+
+# Columns copied from fingerprints to fingerprints_archive (not the row id / feed position)
+ARCHIVED_COLUMNS = tuple(
+    column.name for column in FingerprintDB.__table__.columns if column.name not in ("id", "change_seq")
+)
+
+# Fingerprints below this score count as low risk for the normal_visit rule
+LOW_RISK_THRESHOLD = 50
+
+# (name, age, condition(cutoff)) - rows matching the condition are archived
+RetentionRule = Tuple[str, timedelta, Callable[[datetime], Any]]
+
+
+def default_rules(cleared_days: float, normal_visit_days: float) -> List[RetentionRule]:
+    """The retention rules; a rule with a non-positive age is disabled."""
+    rules: List[RetentionRule] = [
+        ("cleared", timedelta(days=cleared_days), lambda cutoff: (
+            (FingerprintDB.status == "CLEARED") & (FingerprintDB.updated_at < cutoff)
+        )),
+        ("normal_visit", timedelta(days=normal_visit_days), lambda cutoff: (
+            (FingerprintDB.trigger_source == "NORMAL_VISIT_LOG")
+            & (FingerprintDB.risk_score < LOW_RISK_THRESHOLD)
+            & (FingerprintDB.status != "BLOCKED")
+            & (FingerprintDB.updated_at < cutoff)
+        )),
+    ]
+    return [rule for rule in rules if rule[1] > timedelta(0)]
+
+
+def archive_batch(session, rule_name: str, condition, after_id: int, batch_rows: int) -> List[Tuple[int, str, str]]:
+    """
+    Move up to `batch_rows` fingerprints matching `condition` with id > after_id
+    (in id order) into the archive, inside the caller's transaction.
+    Returns the (id, fingerprint_id, user_id) of the moved rows.
+    """
+    rows = session.query(FingerprintDB.id, FingerprintDB.fingerprint_id, FingerprintDB.user_id).filter(
+        condition, FingerprintDB.id > after_id
+    ).order_by(FingerprintDB.id).limit(batch_rows).all()
+    if not rows:
+        return []
+    ids = [row[0] for row in rows]
+    source = FingerprintDB.__table__
+
+    # Set-based copy: the JSON columns are not loaded into Python
+    session.execute(insert(FingerprintArchiveDB.__table__).from_select(
+        ["source_id", *ARCHIVED_COLUMNS, "archived_at", "archive_rule"],
+        select(
+            source.c.id,
+            *[source.c[name] for name in ARCHIVED_COLUMNS],
+            literal(datetime.utcnow(), FingerprintArchiveDB.archived_at.type),
+            literal(rule_name, FingerprintArchiveDB.archive_rule.type),
+        ).where(source.c.id.in_(ids))
+    ))
+    session.query(FingerprintDB).filter(FingerprintDB.id.in_(ids)).delete(synchronize_session=False)
+    record_tombstones(session, [(fingerprint_id, user_id) for _, fingerprint_id, user_id in rows])
+    refresh_user_risk_state(session, [user_id for _, _, user_id in rows])
+    return [tuple(row) for row in rows]
+
+
+def compact(session_factory) -> Dict[str, Any]:
+    """
+    Give the space of archived rows back and refresh planner statistics.
+    SQLite: PRAGMA incremental_vacuum (databases created with auto_vacuum=INCREMENTAL,
+    see SQLITE_PRAGMAS; older files report their free pages, reclaimed by one manual
+    VACUUM) then PRAGMA optimize. PostgreSQL: ANALYZE (autovacuum reclaims the space).
+    """
+    session = session_factory()
+    try:
+        connection = session.connection()
+        dialect = connection.dialect.name
+        result: Dict[str, Any] = {"dialect": dialect}
+        if dialect == "sqlite":
+            result["freelist_pages_before"] = connection.execute(text("PRAGMA freelist_count")).scalar()
+            result["auto_vacuum"] = {0: "NONE", 1: "FULL", 2: "INCREMENTAL"}.get(
+                connection.execute(text("PRAGMA auto_vacuum")).scalar())
+            if result["auto_vacuum"] == "INCREMENTAL":
+                connection.execute(text("PRAGMA incremental_vacuum"))
+            result["freelist_pages_after"] = connection.execute(text("PRAGMA freelist_count")).scalar()
+            connection.execute(text("PRAGMA optimize"))
+        else:
+            connection.execute(text("ANALYZE fingerprints"))
+            connection.execute(text("ANALYZE fingerprints_archive"))
+        session.commit()
+        return result
+    finally:
+        session.close()
+
+
+class FingerprintRetention:
+    """Runs the retention rules in batches and keeps statistics for /api/v1/engine-stats."""
+
+    def __init__(self, session_factory: Callable, rules: List[RetentionRule], batch_rows: int = 1000,
+                 tombstone_retention: timedelta = timedelta(hours=168),
+                 before_run: Optional[Callable[[], Any]] = None,
+                 on_archived: Optional[Callable[[List[str]], None]] = None):
+        self.session_factory = session_factory
+        self.rules = rules
+        self.batch_rows = batch_rows
+        self.tombstone_retention = tombstone_retention
+        self.before_run = before_run
+        self.on_archived = on_archived
+        self._lock = threading.Lock()
+        self._runs = 0
+        self._archived_total = 0
+        self._last_run: Optional[Dict[str, Any]] = None
+        self._last_error: Optional[str] = None
+
+    def pending(self, now: Optional[datetime] = None) -> Dict[str, int]:
+        """Rows each rule would archive now (used by --dry-run)."""
+        now = now or datetime.utcnow()
+        session = self.session_factory()
+        try:
+            return {
+                name: session.query(FingerprintDB.id).filter(condition(now - age)).count()
+                for name, age, condition in self.rules
+            }
+        finally:
+            session.close()
+
+    def run(self, now: Optional[datetime] = None, compact_after: bool = True) -> Dict[str, Any]:
+        """Archive everything the rules match, then compact. One run at a time."""
+        with self._lock:
+            started = time.perf_counter()
+            now = now or datetime.utcnow()
+            if self.before_run is not None:
+                self.before_run()
+            archived: Dict[str, int] = {}
+            batches = 0
+            for name, age, condition in self.rules:
+                archived[name] = 0
+                after_id = 0
+                while True:
+                    session = self.session_factory()
+                    try:
+                        moved = archive_batch(session, name, condition(now - age), after_id, self.batch_rows)
+                        session.commit()
+                    except Exception:
+                        session.rollback()
+                        raise
+                    finally:
+                        session.close()
+                    if not moved:
+                        break
+                    batches += 1
+                    archived[name] += len(moved)
+                    after_id = moved[-1][0]
+                    if self.on_archived is not None:
+                        self.on_archived([fingerprint_id for _, fingerprint_id, _ in moved])
+                    if len(moved) < self.batch_rows:
+                        break
+
+            session = self.session_factory()
+            try:
+                tombstones_pruned = prune_tombstones(session, self.tombstone_retention)
+                session.commit()
+            finally:
+                session.close()
+
+            result = {
+                "archived": archived,
+                "batches": batches,
+                "tombstones_pruned": tombstones_pruned,
+                "compaction": compact(self.session_factory) if compact_after else None,
+                "finished_at": datetime.utcnow().isoformat(),
+                "duration_ms": round((time.perf_counter() - started) * 1000, 2),
+            }
+            self._runs += 1
+            self._archived_total += sum(archived.values())
+            self._last_run = result
+            return result
+
+    def run_safely(self) -> Optional[Dict[str, Any]]:
+        """run() for the background thread: errors are logged, not raised."""
+        try:
+            result = self.run()
+            self._last_error = None
+            total = sum(result["archived"].values())
+            if total:
+                print(f"🗄️ [RETENTION] Archived {total} fingerprint(s): {result['archived']}")
+            return result
+        except Exception as e:
+            self._last_error = str(e)
+            print(f"❌ [RETENTION] Retention run failed: {e}")
+            return None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "rules": {name: age.total_seconds() / 86400 for name, age, _ in self.rules},
+            "batch_rows": self.batch_rows,
+            "runs": self._runs,
+            "archived_total": self._archived_total,
+            "last_run": self._last_run,
+            "last_error": self._last_error,
+        }
+
+
+def start_retention_thread(retention: FingerprintRetention, interval_seconds: float) -> threading.Thread:
+    """Run retention every `interval_seconds` (daemon thread)."""
+    def run():
+        while True:
+            time.sleep(interval_seconds)
+            retention.run_safely()
+
+    thread = threading.Thread(target=run, name="fingerprint-retention", daemon=True)
+    thread.start()
+    return thread
+
+
+def main():
+    import argparse
+    import json
+
+    from db import init_db
+    from storage import FINGERPRINT_RETENTION
+
+    parser = argparse.ArgumentParser(description="Archive old fingerprints and compact the database")
+    parser.add_argument("--dry-run", action="store_true", help="only count the rows each rule would archive")
+    args = parser.parse_args()
+
+    init_db()
+    if args.dry_run:
+        print(json.dumps(FINGERPRINT_RETENTION.pending(), indent=2))
+    else:
+        print(json.dumps(FINGERPRINT_RETENTION.run(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""
+Windowed reverse index from device_id / ip_address to recently active user_ids.
+
+Multi-account linking used to compare the current event against every stored
+ACTIVE fingerprint, recomputing features for each one. With this index the
+engine asks "which other users were on this device or IP in the last N
+minutes?" and compares against their in-memory summaries, so the cost is
+O(users on this device/IP) and linking works before any fingerprint exists.
+"""
+
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from concurrency import StripedLock
+
+
+class EntityUserIndex:
+    """
+    (kind, key) -> OrderedDict[user_id, last_seen] for kind in ("device", "ip"),
+    plus a per-user summary of the latest behavioural features and risk.
+
+    Each entity keeps at most `max_users_per_entity` users (least recently seen
+    are dropped first), so a NAT gateway IP cannot grow without bound.
+    """
+
+    KINDS = ("device", "ip")
+
+    def __init__(self, window: timedelta = timedelta(minutes=30), max_users_per_entity: int = 500):
+        self.window = window
+        self.max_users_per_entity = max_users_per_entity
+        self._users: Dict[Tuple[str, str], "OrderedDict[str, datetime]"] = {}
+        self._summaries: Dict[str, Dict[str, Any]] = {}
+        self._locks = StripedLock()
+
+    def record(self, kind: str, key: Optional[str], user_id: str, ts: datetime) -> None:
+        if not key or key == "unknown" or not user_id:
+            return
+        with self._locks.hold(f"{kind}:{key}"):
+            users = self._users.get((kind, key))
+            if users is None:
+                users = self._users[(kind, key)] = OrderedDict()
+            previous = users.get(user_id)
+            if previous is not None and previous > ts:
+                return  # a late event does not make the user more recent
+            users[user_id] = ts
+            users.move_to_end(user_id)
+            while len(users) > self.max_users_per_entity:
+                users.popitem(last=False)
+
+    def record_event(self, event) -> None:
+        self.record("device", event.device_id, event.user_id, event.timestamp1)
+        self.record("ip", getattr(event, "ip_address", None), event.user_id, event.timestamp1)
+
+    def users_for(self, kind: str, key: Optional[str], now: datetime) -> List[str]:
+        """User ids seen on an entity within the window before `now` (stale entries are pruned)."""
+        if not key:
+            return []
+        cutoff = now - self.window
+        with self._locks.hold(f"{kind}:{key}"):
+            users = self._users.get((kind, key))
+            if not users:
+                return []
+            # Entries are (mostly) in arrival order, so stale ones collect at the front;
+            # a late event recorded after newer ones is still filtered by the cutoff below
+            while users:
+                user_id, last_seen = next(iter(users.items()))
+                if last_seen >= cutoff:
+                    break
+                users.popitem(last=False)
+            if not users:
+                del self._users[(kind, key)]
+                return []
+            return [user_id for user_id, last_seen in users.items() if cutoff <= last_seen <= now]
+
+    def linked_users(self, event) -> Dict[str, List[str]]:
+        """
+        Other users seen recently on the event's device or IP.
+        Returns {user_id: ["device", "ip", ...]} (which entities they share).
+        """
+        linked: Dict[str, List[str]] = {}
+        for kind, key in (("device", event.device_id), ("ip", getattr(event, "ip_address", None))):
+            for user_id in self.users_for(kind, key, event.timestamp1):
+                if user_id != event.user_id:
+                    linked.setdefault(user_id, []).append(kind)
+        return linked
+
+    def update_summary(self, user_id: str, features: Dict[str, Any], risk_score: int,
+                       ts: datetime, fingerprint_id: Optional[str] = None) -> None:
+        """Remember a user's latest behavioural features and risk for later comparisons."""
+        with self._locks.hold(f"user:{user_id}"):
+            summary = self._summaries.get(user_id)
+            if summary is not None and summary["last_seen"] > ts:
+                return
+            self._summaries[user_id] = {
+                "features": features,
+                "risk_score": risk_score,
+                "last_seen": ts,
+                "fingerprint_id": fingerprint_id or (summary or {}).get("fingerprint_id"),
+            }
+
+    def summary(self, user_id: str) -> Optional[Dict[str, Any]]:
+        return self._summaries.get(user_id)
+
+    def forget_user(self, user_id: str) -> None:
+        """Drop a user's summary (entity entries expire with the window)."""
+        with self._locks.hold(f"user:{user_id}"):
+            self._summaries.pop(user_id, None)
+
+    def sweep(self, now: datetime) -> int:
+        """Remove summaries and entities idle for longer than the window."""
+        cutoff = now - self.window
+        removed = 0
+        for user_id, summary in list(self._summaries.items()):
+            if summary["last_seen"] >= cutoff:
+                continue
+            # Re-check under the user's lock: update_summary may have refreshed it meanwhile
+            with self._locks.hold(f"user:{user_id}"):
+                summary = self._summaries.get(user_id)
+                if summary is not None and summary["last_seen"] < cutoff:
+                    del self._summaries[user_id]
+                    removed += 1
+        for entity in list(self._users.keys()):
+            self.users_for(entity[0], entity[1], now)
+        return removed
+
+    def stats(self) -> Dict[str, Any]:
+        entities = {kind: 0 for kind in self.KINDS}
+        for kind, _ in list(self._users.keys()):
+            entities[kind] += 1
+        return {
+            "window_seconds": self.window.total_seconds(),
+            "entities": entities,
+            "user_summaries": len(self._summaries),
+        }
@@ -0,0 +1,144 @@
+"""
+Materialized per-user risk state (`user_risk_state` table, one row per user).
+
+Block checks and /api/v1/check-user-status used to derive a user's state by
+filtering all of their fingerprint rows. The storage write functions call
+refresh_user_risk_state() for the users they touched, inside the same
+transaction as the fingerprint change, so readers get a single primary-key
+lookup however long the history grows.
+
+The refresh recomputes a user's row from the fingerprints table with one
+grouped aggregate over the user_id index (plus one lookup for the latest
+fingerprint). Recomputing instead of applying deltas keeps the row correct when
+a maximum goes down (clear / delete) without having to know the old values.
+"""
+
+from datetime import datetime
+from typing import Any, Dict, Iterable, Optional
+
+from sqlalchemy import case, func
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.orm import Session
+
+from db import FingerprintDB, UserRiskStateDB
+
+
+def _aggregates(session: Session, user_ids=None):
+    def count_status(status):
+        return func.sum(case((FingerprintDB.status == status, 1), else_=0))
+
+    def max_risk_where(condition):
+        return func.max(case((condition, FingerprintDB.risk_score), else_=0))
+
+    query = session.query(
+        FingerprintDB.user_id,
+        func.count(FingerprintDB.id),
+        count_status("ACTIVE"),
+        count_status("BLOCKED"),
+        count_status("PENDING"),
+        count_status("CLEARED"),
+        max_risk_where(FingerprintDB.status != "CLEARED"),
+        max_risk_where(FingerprintDB.status == "ACTIVE"),
+        max_risk_where(FingerprintDB.status == "BLOCKED"),
+        func.max(FingerprintDB.updated_at),
+    )
+    if user_ids is not None:
+        query = query.filter(FingerprintDB.user_id.in_(user_ids))
+    return query.group_by(FingerprintDB.user_id)
+
+
+def _latest_fingerprint_id(session: Session, user_id: str) -> Optional[str]:
+    row = session.query(FingerprintDB.fingerprint_id).filter(
+        FingerprintDB.user_id == user_id
+    ).order_by(FingerprintDB.updated_at.desc(), FingerprintDB.id.desc()).first()
+    return row[0] if row else None
+
+
+def _apply_aggregate(state: UserRiskStateDB, aggregate, last_fingerprint_id: Optional[str]) -> None:
+    (_, total, active, blocked, pending, cleared,
+     max_risk, max_active_risk, max_blocked_risk, last_seen_at) = aggregate
+    state.fingerprint_count = total
+    state.active_count = active or 0
+    state.blocked_count = blocked or 0
+    state.pending_count = pending or 0
+    state.cleared_count = cleared or 0
+    state.max_risk = max_risk or 0
+    state.max_active_risk = max_active_risk or 0
+    state.max_blocked_risk = max_blocked_risk or 0
+    state.status = "BLOCKED" if blocked else ("ACTIVE" if active else ("PENDING" if pending else "CLEARED"))
+    state.last_fingerprint_id = last_fingerprint_id
+    state.last_seen_at = last_seen_at
+    state.updated_at = datetime.utcnow()
+
+
+def refresh_user_risk_state(session: Session, user_ids: Iterable[str]) -> None:
+    """
+    Recompute the state rows of `user_ids` from their fingerprints.
+    Call inside the writer's transaction, before commit.
+    """
+    user_ids = sorted(set(user_ids))
+    if not user_ids:
+        return
+    session.flush()
+    aggregates = {row[0]: row for row in _aggregates(session, user_ids)}
+    for user_id in user_ids:
+        state = session.get(UserRiskStateDB, user_id)
+        aggregate = aggregates.get(user_id)
+        if aggregate is None:
+            # No fingerprints left (deleted)
+            if state is not None:
+                session.delete(state)
+            continue
+        last_fingerprint_id = _latest_fingerprint_id(session, user_id)
+        if state is not None:
+            _apply_aggregate(state, aggregate, last_fingerprint_id)
+            continue
+        state = UserRiskStateDB(user_id=user_id)
+        _apply_aggregate(state, aggregate, last_fingerprint_id)
+        try:
+            with session.begin_nested():
+                session.add(state)
+        except IntegrityError:
+            # Another process created the row meanwhile
+            state = session.get(UserRiskStateDB, user_id, populate_existing=True)
+            _apply_aggregate(state, aggregate, last_fingerprint_id)
+
+
+def backfill_user_risk_state(session: Session) -> int:
+    """Rebuild the whole table from the fingerprints table. Returns the number of users."""
+    session.query(UserRiskStateDB).delete(synchronize_session=False)
+    latest = {}
+    for user_id, fingerprint_id in session.query(
+        FingerprintDB.user_id, FingerprintDB.fingerprint_id
+    ).order_by(FingerprintDB.updated_at, FingerprintDB.id).yield_per(10000):
+        latest[user_id] = fingerprint_id
+    users = 0
+    for aggregate in _aggregates(session):
+        state = UserRiskStateDB(user_id=aggregate[0])
+        _apply_aggregate(state, aggregate, latest.get(aggregate[0]))
+        session.add(state)
+        users += 1
+    session.commit()
+    return users
+
+
+def read_user_risk_state(session: Session, user_id: str) -> Optional[Dict[str, Any]]:
+    """
+    State of one user as a dict, or None if the user has no fingerprints.
+    Without a row (fingerprints written by an older process, or a database
+    where user_risk_state does not exist yet) the state is aggregated from the
+    user's fingerprints instead; nothing is written.
+    """
+    try:
+        state = session.get(UserRiskStateDB, user_id)
+    except OperationalError:
+        session.rollback()
+        state = None
+    if state is not None:
+        return state.to_dict()
+    aggregate = _aggregates(session, [user_id]).first()
+    if aggregate is None:
+        return None
+    state = UserRiskStateDB(user_id=user_id)
+    _apply_aggregate(state, aggregate, _latest_fingerprint_id(session, user_id))
+    return state.to_dict()
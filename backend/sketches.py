@@ -0,0 +1,261 @@
+"""
+Approximate distinct counting with HyperLogLog sketches.
+
+Browser hopping counts distinct user agents and geo-jump counts distinct IPs
+and locations per user/device. Building Python sets from raw events costs
+memory proportional to what an attacker rotates through; a HyperLogLog sketch
+has a fixed size (2**precision registers) whatever the cardinality.
+
+- HyperLogLog: the sketch itself. Small cardinalities are kept exactly in a
+  sparse set of hashes and converted to registers once they grow, so the
+  "3 distinct values" style thresholds used by the engine stay exact.
+- WindowedDistinct: one sketch per time bucket; a query merges the buckets
+  that cover the window.
+- EntityDistinctCounters: WindowedDistinct per (dimension, entity), e.g.
+  ("user_agent", "device:abc"). Sketches of several entities are merged to
+  answer "user OR device" questions.
+"""
+
+import hashlib
+import math
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from concurrency import StripedLock
+
+DEFAULT_PRECISION = 10
+
+
+def _hash64(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def _alpha(m: int) -> float:
+    if m == 16:
+        return 0.673
+    if m == 32:
+        return 0.697
+    if m == 64:
+        return 0.709
+    return 0.7213 / (1.0 + 1.079 / m)
+
+
+class HyperLogLog:
+    """HyperLogLog distinct counter with 2**precision one-byte registers."""
+
+    __slots__ = ("precision", "m", "_registers", "_sparse")
+
+    def __init__(self, precision: int = DEFAULT_PRECISION):
+        if not 4 <= precision <= 16:
+            raise ValueError("precision must be between 4 and 16")
+        self.precision = precision
+        self.m = 1 << precision
+        self._registers: Optional[np.ndarray] = None
+        self._sparse: Optional[set] = set()
+
+    @property
+    def sparse_limit(self) -> int:
+        # A sparse set of 64-bit hashes stays smaller than the dense registers up to ~m/8 entries
+        return max(16, self.m // 8)
+
+    def add(self, value: str) -> None:
+        self._add_hash(_hash64(value))
+
+    def _add_hash(self, h: int) -> None:
+        if self._sparse is not None:
+            self._sparse.add(h)
+            if len(self._sparse) > self.sparse_limit:
+                self._densify()
+            return
+        self._set_register(h)
+
+    def _set_register(self, h: int) -> None:
+        p = self.precision
+        index = h >> (64 - p)
+        remaining = h & ((1 << (64 - p)) - 1)
+        rank = (64 - p) - remaining.bit_length() + 1
+        if rank > self._registers[index]:
+            self._registers[index] = rank
+
+    def _densify(self) -> None:
+        self._registers = np.zeros(self.m, dtype=np.uint8)
+        for h in self._sparse:
+            self._set_register(h)
+        self._sparse = None
+
+    def merge(self, other: "HyperLogLog") -> None:
+        """Union another sketch (of the same precision) into this one."""
+        if other.precision != self.precision:
+            raise ValueError("cannot merge sketches with different precision")
+        if other._sparse is not None:
+            for h in other._sparse:
+                self._add_hash(h)
+            return
+        if self._sparse is not None:
+            self._densify()
+        np.maximum(self._registers, other._registers, out=self._registers)
+
+    def count(self) -> int:
+        """Estimated number of distinct values added."""
+        if self._sparse is not None:
+            return len(self._sparse)
+
+        m = self.m
+        registers = self._registers
+        estimate = _alpha(m) * m * m / float(np.sum(np.power(2.0, -registers.astype(np.float64))))
+        zeros = int(np.count_nonzero(registers == 0))
+        if estimate <= 2.5 * m and zeros:
+            # Small-range correction (linear counting)
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def copy(self) -> "HyperLogLog":
+        clone = HyperLogLog(self.precision)
+        if self._sparse is not None:
+            clone._sparse = set(self._sparse)
+        else:
+            clone._sparse = None
+            clone._registers = self._registers.copy()
+        return clone
+
+    def memory_bytes(self) -> int:
+        if self._sparse is not None:
+            return 8 * len(self._sparse)
+        return self.m
+
+
+class WindowedDistinct:
+    """One HyperLogLog per `bucket_seconds` bucket, keeping `span_seconds` of history."""
+
+    __slots__ = ("bucket_seconds", "span_buckets", "precision", "_buckets", "last_seen")
+
+    def __init__(self, bucket_seconds: int, span_seconds: int, precision: int = DEFAULT_PRECISION):
+        self.bucket_seconds = bucket_seconds
+        self.span_buckets = max(1, math.ceil(span_seconds / bucket_seconds))
+        self.precision = precision
+        self._buckets: Dict[int, HyperLogLog] = {}
+        self.last_seen = 0.0
+
+    def add(self, value: str, epoch_seconds: float) -> None:
+        bucket_id = int(epoch_seconds // self.bucket_seconds)
+        if bucket_id <= int(self.last_seen // self.bucket_seconds) - self.span_buckets:
+            return  # older than the retained span
+        sketch = self._buckets.get(bucket_id)
+        if sketch is None:
+            sketch = self._buckets[bucket_id] = HyperLogLog(self.precision)
+        sketch.add(value)
+        if epoch_seconds > self.last_seen:
+            self.last_seen = epoch_seconds
+            self._prune(bucket_id)
+
+    def _prune(self, newest_bucket: int) -> None:
+        oldest = newest_bucket - self.span_buckets + 1
+        for bucket_id in [b for b in self._buckets if b < oldest]:
+            del self._buckets[bucket_id]
+
+    def merged(self, now_seconds: float, window_seconds: float, into: Optional[HyperLogLog] = None) -> HyperLogLog:
+        """
+        Merge the buckets that start within [now - window, now] into one sketch.
+        The bucket straddling now - window is left out, so the counted span never
+        exceeds the window (it is at least window - bucket_seconds).
+        """
+        result = into if into is not None else HyperLogLog(self.precision)
+        newest = int(now_seconds // self.bucket_seconds)
+        oldest = math.ceil((now_seconds - window_seconds) / self.bucket_seconds)
+        for bucket_id, sketch in self._buckets.items():
+            if oldest <= bucket_id <= newest:
+                result.merge(sketch)
+        return result
+
+    def memory_bytes(self) -> int:
+        return sum(sketch.memory_bytes() for sketch in self._buckets.values())
+
+
+class EntityDistinctCounters:
+    """
+    Windowed distinct-value sketches per dimension and entity.
+
+    dimensions maps a name (e.g. "user_agent") to (bucket_seconds, span_seconds).
+    Entities are strings such as "user:<id>" or "device:<id>".
+    """
+
+    def __init__(self, dimensions: Dict[str, Tuple[int, int]], precision: int = DEFAULT_PRECISION):
+        self.dimensions = dimensions
+        self.precision = precision
+        self._sketches: Dict[Tuple[str, str], WindowedDistinct] = {}
+        self._locks = StripedLock()
+        self._sweep_lock = threading.Lock()
+        self._since_sweep = 0
+
+    def add(self, dimension: str, entity: str, value: Optional[str], ts: datetime) -> None:
+        if not value or value in ("unknown", "Unknown") or not entity:
+            return
+        bucket_seconds, span_seconds = self.dimensions[dimension]
+        epoch = ts.timestamp()
+        with self._locks.hold(entity):
+            sketch = self._sketches.get((dimension, entity))
+            if sketch is None:
+                sketch = self._sketches[(dimension, entity)] = WindowedDistinct(
+                    bucket_seconds, span_seconds, self.precision
+                )
+            sketch.add(value, epoch)
+
+        self._since_sweep += 1
+        if self._since_sweep >= 10000:
+            self.sweep(epoch)
+
+    def record_event(self, event) -> None:
+        """Add an event's user agent, IP and location to its user's and device's sketches."""
+        values = {
+            "user_agent": getattr(event, "user_agent", None),
+            "ip": getattr(event, "ip_address", None),
+            "location": (event.location.strip().title() if getattr(event, "location", None) else None),
+        }
+        for entity in (f"user:{event.user_id}", f"device:{event.device_id}" if event.device_id else None):
+            if not entity:
+                continue
+            for dimension, value in values.items():
+                if dimension in self.dimensions:
+                    self.add(dimension, entity, value, event.timestamp1)
+
+    def count(self, dimension: str, entities: Iterable[str], now: datetime, window: timedelta) -> int:
+        """Approximate number of distinct values seen by ANY of the entities within the window."""
+        merged = HyperLogLog(self.precision)
+        now_seconds = now.timestamp()
+        window_seconds = window.total_seconds()
+        for entity in entities:
+            if not entity:
+                continue
+            with self._locks.hold(entity):
+                sketch = self._sketches.get((dimension, entity))
+                if sketch is not None:
+                    sketch.merged(now_seconds, window_seconds, into=merged)
+        return merged.count()
+
+    def forget(self, entity: str) -> None:
+        with self._locks.hold(entity):
+            for dimension in self.dimensions:
+                self._sketches.pop((dimension, entity), None)
+
+    def sweep(self, now_seconds: float) -> int:
+        """Drop sketches with nothing inside their span. Returns how many were removed."""
+        with self._sweep_lock:
+            self._since_sweep = 0
+            removed = 0
+            for key, sketch in list(self._sketches.items()):
+                span = sketch.bucket_seconds * sketch.span_buckets
+                if sketch.last_seen < now_seconds - span:
+                    self._sketches.pop(key, None)
+                    removed += 1
+            return removed
+
+    def stats(self) -> Dict[str, Any]:
+        sketches = list(self._sketches.values())
+        return {
+            "precision": self.precision,
+            "sketches": len(sketches),
+            "approx_memory_bytes": sum(s.memory_bytes() for s in sketches),
+        }
@@ -5,11 +5,31 @@ Uses SQLAlchemy database for fingerprints (instead of in-memory).
 Events are still kept in-memory for performance (temporary storage for behavioral analysis).
 """
 
-from typing import List, Optional
-from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+from datetime import datetime, timedelta
+import os
+import heapq
+import threading
 import json
+import base64
+from sqlalchemy import tuple_
+from sqlalchemy.exc import OperationalError
 from models import Event, ThreatFingerprint
-from db import FingerprintDB, get_db_session, Session
+from db import FingerprintDB, get_db_session, Session, feature_columns
+from event_time import EventTimeIndex, WatermarkTracker
+from windows import EntityWindows
+from sketches import EntityDistinctCounters
+from heavy_hitters import TopTalkers
+from reverse_index import EntityUserIndex
+from campaigns import CampaignGraph
+from write_behind import WriteBehindQueue
+from blocklist import BlockedUsers
+from risk_state import refresh_user_risk_state, read_user_risk_state
+from changes import backfill_change_seq, head_cursor, next_change_seq, prune_tombstones, read_changes, record_tombstones
+from fingerprint_stats import FingerprintStats
+from retention import FingerprintRetention, default_rules
+from fingerprint_cache import FingerprintCache
+import atexit
 
 # ========== GLOBAL IN-MEMORY STORES ==========
 
@@ -17,9 +37,120 @@ from db import FingerprintDB, get_db_session, Session
 # Events are kept in-memory temporarily for behavioral feature calculation
 EVENTS_STORE: List[Event] = []
 
-# Keep FINGERPRINTS_STORE as a legacy reference for backward compatibility
-# But it's now a read-only cache - actual storage is in database
-FINGERPRINTS_STORE: List[ThreatFingerprint] = []
+# Bounded read cache of fingerprints, indexed by fingerprint_id / user_id / status and
+# invalidated by the write functions below (see fingerprint_cache.py).
+FINGERPRINT_CACHE = FingerprintCache(
+    max_entries=int(os.environ.get("FINGERPRINT_CACHE_MAX_ENTRIES", 10000)),
+    ttl_seconds=float(os.environ.get("FINGERPRINT_CACHE_TTL_SECONDS", 30))
+)
+
+# Legacy name: list-like view of the cached fingerprints (not a copy of the table)
+FINGERPRINTS_STORE = FINGERPRINT_CACHE
+
+
+# Event-time indexes over EVENTS_STORE (sorted by timestamp1, per user and per device)
+# so time windows are answered with binary searches even when events arrive out of order.
+EVENTS_BY_USER = EventTimeIndex()
+EVENTS_BY_DEVICE = EventTimeIndex()
+
+# Per-user watermarks and lateness statistics
+EVENT_TIME = WatermarkTracker(
+    allowed_lateness=timedelta(seconds=int(os.environ.get("EVENT_ALLOWED_LATENESS_SECONDS", 300)))
+)
+
+# Multi-resolution (1s / 1m / 1h buckets) event counters per user, device and IP.
+# Answer "how many events in the last N minutes/hours" without keeping raw events.
+ENTITY_WINDOWS = EntityWindows()
+
+# Windowed HyperLogLog sketches of distinct user agents / IPs / locations per user and device.
+# dimension -> (bucket seconds, retained span seconds)
+DISTINCT_COUNTERS = EntityDistinctCounters(
+    {
+        "user_agent": (5, 120),
+        "ip": (60, 2 * 3600),
+        "location": (60, 2 * 3600),
+    },
+    precision=int(os.environ.get("DISTINCT_SKETCH_PRECISION", 10))
+)
+
+# Global (all users) heavy hitters by event volume for ip_address and device_id
+TOP_TALKERS = TopTalkers(
+    k=int(os.environ.get("TOP_TALKERS_K", 50)),
+    rotate_seconds=float(os.environ.get("TOP_TALKERS_WINDOW_SECONDS", 3600))
+)
+
+# device_id / ip_address -> user_ids seen recently, plus per-user summary features,
+# so multi-account linking looks only at the users sharing this device or IP
+USERS_BY_ENTITY = EntityUserIndex(
+    window=timedelta(seconds=int(os.environ.get("MULTI_ACCOUNT_WINDOW_SECONDS", 1800))),
+    max_users_per_entity=int(os.environ.get("MULTI_ACCOUNT_MAX_USERS_PER_ENTITY", 500))
+)
+
+# Union-find over user / device / IP nodes: which campaign an entity belongs to and its size.
+# Fed by events (user <-> device) and fingerprints (user, device, IP, linked and related users).
+CAMPAIGNS = CampaignGraph()
+
+# Write-behind fingerprint persistence (FINGERPRINT_WRITE_BEHIND=0 writes every fingerprint synchronously)
+FINGERPRINT_SYNC_MIN_RISK = int(os.environ.get("FINGERPRINT_SYNC_MIN_RISK", 85))
+FINGERPRINT_WRITER: Optional[WriteBehindQueue] = None
+if os.environ.get("FINGERPRINT_WRITE_BEHIND", "1") != "0":
+    FINGERPRINT_WRITER = WriteBehindQueue(
+        flush_batch=lambda batch: _flush_fingerprints(batch),
+        key=lambda fingerprint: fingerprint.fingerprint_id,
+        flush_interval_ms=float(os.environ.get("FINGERPRINT_FLUSH_INTERVAL_MS", 200)),
+        max_batch_rows=int(os.environ.get("FINGERPRINT_FLUSH_MAX_ROWS", 500)),
+        name="fingerprint-write-behind",
+        max_attempts=int(os.environ.get("FINGERPRINT_FLUSH_MAX_ATTEMPTS", 5)),
+        dead_letter_size=int(os.environ.get("FINGERPRINT_DEAD_LETTER_SIZE", 1000))
+    )
+    atexit.register(FINGERPRINT_WRITER.close)
+
+# Users with BLOCKED fingerprints, for the login gate (is_user_fingerprinted).
+# Kept in sync by the write functions below; other worker processes are invalidated
+# through the cache_versions counter, polled every BLOCKED_USERS_POLL_SECONDS.
+BLOCKED_USERS = BlockedUsers(
+    get_db_session,
+    poll_seconds=float(os.environ.get("BLOCKED_USERS_POLL_SECONDS", 1.0))
+)
+
+# /api/v1/database-stats: one grouped aggregate, cached for DATABASE_STATS_TTL_SECONDS
+# (queued write-behind fingerprints are flushed before each computation)
+FINGERPRINT_STATS = FingerprintStats(
+    get_db_session,
+    ttl_seconds=float(os.environ.get("DATABASE_STATS_TTL_SECONDS", 2.0)),
+    before_compute=lambda: flush_pending_fingerprints()
+)
+
+# Called with a fingerprint_id whenever a fingerprint's status changes or it is deleted
+# outside of store_fingerprint (admin actions), so in-memory state can be invalidated.
+_FINGERPRINT_CHANGE_LISTENERS: List[Callable[[str], None]] = []
+
+# Called with a user_id when all of a user's fingerprints changed at once (clear_user_fingerprints)
+_USER_FINGERPRINTS_CHANGE_LISTENERS: List[Callable[[str], None]] = []
+
+# Called (without arguments) after any fingerprint write commits, e.g. to wake the
+# /api/v1/fingerprints/stream broadcaster.
+_FINGERPRINTS_COMMITTED_LISTENERS: List[Callable[[], None]] = []
+
+# How long deletions stay visible to /api/v1/fingerprints/changes cursors (see changes.py)
+TOMBSTONE_RETENTION = timedelta(hours=float(os.environ.get("TOMBSTONE_RETENTION_HOURS", 168)))
+
+# Moves old CLEARED and low-risk NORMAL_VISIT_LOG fingerprints to fingerprints_archive
+# (see retention.py). A rule with 0 days is disabled.
+FINGERPRINT_RETENTION = FingerprintRetention(
+    get_db_session,
+    rules=default_rules(
+        cleared_days=float(os.environ.get("RETENTION_CLEARED_DAYS", 30)),
+        normal_visit_days=float(os.environ.get("RETENTION_NORMAL_VISIT_DAYS", 7))
+    ),
+    batch_rows=int(os.environ.get("RETENTION_BATCH_ROWS", 1000)),
+    tombstone_retention=TOMBSTONE_RETENTION,
+    before_run=lambda: flush_pending_fingerprints(),
+    on_archived=lambda fingerprint_ids: _fingerprints_archived(fingerprint_ids)
+)
+
+_indexed_events_count = 0
+_index_lock = threading.Lock()
 
 
 # ========== EVENT OPERATIONS ==========
@@ -29,16 +160,207 @@ def store_event(event: Event) -> None:
     Save a single Event object into the in-memory store.
     Events are used for behavioral feature calculation and are kept temporarily.
     """
-    EVENTS_STORE.append(event)
+    global _indexed_events_count
+    with _index_lock:
+        _sync_event_indexes()
+        EVENTS_STORE.append(event)
+        _index_event(event)
+        _indexed_events_count += 1
+
+
+def _index_event(event: Event) -> None:
+    EVENT_TIME.observe(event.user_id, event.timestamp1)
+    ENTITY_WINDOWS.record_event(event)
+    DISTINCT_COUNTERS.record_event(event)
+    TOP_TALKERS.record_event(event)
+    USERS_BY_ENTITY.record_event(event)
+    CAMPAIGNS.record_event(event)
+    EVENTS_BY_USER.insert(event.user_id, event)
+    if event.device_id:
+        EVENTS_BY_DEVICE.insert(event.device_id, event)
+
+
+def _sync_event_indexes() -> None:
+    """
+    Keep the indexes consistent with EVENTS_STORE when the list is reset
+    directly (e.g. `EVENTS_STORE[:] = []` in tests). Caller holds _index_lock.
+    """
+    global _indexed_events_count
+    if len(EVENTS_STORE) == _indexed_events_count:
+        return
+    EVENTS_BY_USER.clear()
+    EVENTS_BY_DEVICE.clear()
+    for event in EVENTS_STORE:
+        EVENTS_BY_USER.insert(event.user_id, event)
+        if event.device_id:
+            EVENTS_BY_DEVICE.insert(event.device_id, event)
+    _indexed_events_count = len(EVENTS_STORE)
+
+
+def get_events_in_window(user_id: str, device_id: Optional[str], start: datetime, end: Optional[datetime] = None) -> List[Event]:
+    """
+    Return events of a user OR a device with start <= timestamp1 <= end, ordered by event time.
+    Each event appears once even if it matches both the user and the device.
+    """
+    with _index_lock:
+        _sync_event_indexes()
+
+    events = EVENTS_BY_USER.window(user_id, start, end)
+    if device_id:
+        seen = {id(evt) for evt in events}
+        device_events = [evt for evt in EVENTS_BY_DEVICE.window(device_id, start, end) if id(evt) not in seen]
+        if device_events:
+            events = list(heapq.merge(events, device_events, key=lambda evt: evt.timestamp1))
+    return events
 
 
 # ========== FINGERPRINT OPERATIONS (Database-backed) ==========
 
+def add_fingerprint_change_listener(listener: Callable[[str], None]) -> None:
+    """Register a callback for admin-side fingerprint changes (status update, clear, delete)."""
+    _FINGERPRINT_CHANGE_LISTENERS.append(listener)
+
+
+def _notify_fingerprint_changed(fingerprint_id: str) -> None:
+    for listener in _FINGERPRINT_CHANGE_LISTENERS:
+        listener(fingerprint_id)
+
+
+def add_user_fingerprints_change_listener(listener: Callable[[str], None]) -> None:
+    """Register a callback for admin changes to all fingerprints of a user at once (unblock)."""
+    _USER_FINGERPRINTS_CHANGE_LISTENERS.append(listener)
+
+
+def _notify_user_fingerprints_changed(user_id: str) -> None:
+    for listener in _USER_FINGERPRINTS_CHANGE_LISTENERS:
+        listener(user_id)
+
+
+def add_fingerprints_committed_listener(listener: Callable[[], None]) -> None:
+    """Register a callback run after every committed fingerprint write (including inserts)."""
+    _FINGERPRINTS_COMMITTED_LISTENERS.append(listener)
+
+
+def _notify_fingerprints_committed() -> None:
+    for listener in _FINGERPRINTS_COMMITTED_LISTENERS:
+        listener()
+
+
+def _fingerprints_archived(fingerprint_ids: List[str]) -> None:
+    """A retention batch moved these fingerprints out of the live table."""
+    FINGERPRINT_CACHE.invalidate(fingerprint_ids)
+    for fingerprint_id in fingerprint_ids:
+        _notify_fingerprint_changed(fingerprint_id)
+    _notify_fingerprints_committed()
+
+
 def store_fingerprint(fingerprint: ThreatFingerprint) -> ThreatFingerprint:
     """
-    Save a ThreatFingerprint in the database (insert or update if exists).
-    Returns the stored fingerprint.
+    Save a ThreatFingerprint (insert or update if exists). Returns the stored fingerprint.
+
+    With write-behind enabled the fingerprint is queued and flushed in bulk by a
+    background thread; it is visible to the read functions below immediately.
+    Blocking-relevant fingerprints (BLOCKED, or an event with risk >= FINGERPRINT_SYNC_MIN_RISK)
+    are always written synchronously so block decisions are never lost. The risk
+    of the event being stored (event_risk_score) decides, not the maximum kept by a
+    rolling fingerprint: low-risk events folded into an already written high-risk
+    row are queued.
+    """
+    if FINGERPRINT_WRITER is None:
+        return _store_fingerprint_sync(fingerprint)
+    event_risk_score = getattr(fingerprint, "event_risk_score", fingerprint.risk_score)
+    if fingerprint.status == "BLOCKED" or event_risk_score >= FINGERPRINT_SYNC_MIN_RISK:
+        return FINGERPRINT_WRITER.write_sync(fingerprint, _store_fingerprint_sync)
+    FINGERPRINT_WRITER.submit(fingerprint)
+    return fingerprint
+
+
+def _fingerprint_row(fingerprint: ThreatFingerprint) -> dict:
+    """Column values of a fingerprint (without id / timestamps)."""
+    related = getattr(fingerprint, 'related_fingerprints', None)
+    return {
+        "fingerprint_id": fingerprint.fingerprint_id,
+        "user_id": fingerprint.user_id,
+        "device_id": fingerprint.device_id,
+        "ip_address": fingerprint.ip_address,
+        "user_agent": fingerprint.user_agent,
+        "risk_score": fingerprint.risk_score,
+        "status": fingerprint.status,
+        "behavioral_features_json": json.dumps(fingerprint.behavioral_features),
+        "related_fingerprints_json": json.dumps(related) if related else None,
+        **feature_columns(fingerprint.behavioral_features),
+    }
+
+
+def _flush_fingerprints(batch: List[ThreatFingerprint]) -> None:
     """
+    Write a batch of queued fingerprints in one transaction:
+    one SELECT for the existing ids, bulk INSERT for new rows, UPDATE for the rest.
+    """
+    session = get_db_session()
+    try:
+        now = datetime.utcnow()
+        existing = {
+            db_fp.fingerprint_id: db_fp
+            for db_fp in session.query(FingerprintDB).filter(
+                FingerprintDB.fingerprint_id.in_([fp.fingerprint_id for fp in batch])
+            )
+        }
+        change_seq = next_change_seq(session)
+        new_rows = []
+        blocked_changes = []
+        for fingerprint in batch:
+            row = _fingerprint_row(fingerprint)
+            db_fp = existing.get(fingerprint.fingerprint_id)
+            if "BLOCKED" in (getattr(db_fp, "status", None), fingerprint.status):
+                blocked_changes.append(
+                    (fingerprint.fingerprint_id, fingerprint.user_id, fingerprint.status, fingerprint.risk_score)
+                )
+            if db_fp is None:
+                new_rows.append({**row, "created_at": now, "updated_at": now, "change_seq": change_seq})
+                continue
+            if row["related_fingerprints_json"] is None:
+                del row["related_fingerprints_json"]  # keep existing related fingerprints
+            for column, value in row.items():
+                setattr(db_fp, column, value)
+            db_fp.updated_at = now
+            db_fp.change_seq = change_seq
+        if new_rows:
+            session.execute(FingerprintDB.__table__.insert(), new_rows)
+        refresh_user_risk_state(
+            session,
+            [fp.user_id for fp in batch] + [db_fp.user_id for db_fp in existing.values()]
+        )
+        blocked_version = BLOCKED_USERS.bump(session) if blocked_changes else None
+        session.commit()
+        FINGERPRINT_CACHE.invalidate(
+            [fp.fingerprint_id for fp in batch],
+            [fp.user_id for fp in batch] + [db_fp.user_id for db_fp in existing.values()]
+        )
+        if blocked_changes:
+            BLOCKED_USERS.apply(blocked_changes, blocked_version)
+        _notify_fingerprints_committed()
+    except Exception as e:
+        session.rollback()
+        print(f"❌ [DB] Error flushing {len(batch)} fingerprint(s): {e}")
+        raise
+    finally:
+        session.close()
+
+    for fingerprint in batch:
+        CAMPAIGNS.record_fingerprint(fingerprint, is_new=fingerprint.fingerprint_id not in existing)
+    print(f"   💾 [DB] Flushed {len(batch)} fingerprint(s) ({len(new_rows)} new)")
+
+
+def flush_pending_fingerprints() -> int:
+    """Write queued fingerprints now (before reading the fingerprints table directly)."""
+    if FINGERPRINT_WRITER is None:
+        return 0
+    return FINGERPRINT_WRITER.flush()
+
+
+def _store_fingerprint_sync(fingerprint: ThreatFingerprint) -> ThreatFingerprint:
+    """Insert or update one fingerprint in its own transaction."""
     session = get_db_session()
     try:
         # Check if fingerprint already exists
@@ -48,6 +370,11 @@ def store_fingerprint(fingerprint: ThreatFingerprint) -> ThreatFingerprint:
         
         if existing:
             # Update existing fingerprint
+            existing.change_seq = next_change_seq(session)
+            blocked_version = None
+            if "BLOCKED" in (existing.status, fingerprint.status):
+                blocked_version = BLOCKED_USERS.bump(session)
+            affected_users = {existing.user_id, fingerprint.user_id}
             existing.user_id = fingerprint.user_id
             existing.device_id = fingerprint.device_id
             existing.ip_address = fingerprint.ip_address
@@ -55,13 +382,24 @@ def store_fingerprint(fingerprint: ThreatFingerprint) -> ThreatFingerprint:
             existing.risk_score = fingerprint.risk_score
             existing.status = fingerprint.status
             existing.behavioral_features_json = json.dumps(fingerprint.behavioral_features)
+            for column, value in feature_columns(fingerprint.behavioral_features).items():
+                setattr(existing, column, value)
             existing.updated_at = datetime.utcnow()
             
             # Update related_fingerprints if present
             if hasattr(fingerprint, 'related_fingerprints') and fingerprint.related_fingerprints:
                 existing.related_fingerprints_json = json.dumps(fingerprint.related_fingerprints)
             
+            refresh_user_risk_state(session, affected_users)
             session.commit()
+            FINGERPRINT_CACHE.invalidate([fingerprint.fingerprint_id], affected_users)
+            if blocked_version is not None:
+                BLOCKED_USERS.apply(
+                    [(fingerprint.fingerprint_id, fingerprint.user_id, fingerprint.status, fingerprint.risk_score)],
+                    blocked_version
+                )
+            _notify_fingerprints_committed()
+            CAMPAIGNS.record_fingerprint(fingerprint, is_new=False)
             print(f"   💾 [DB] Updated fingerprint: {fingerprint.fingerprint_id}")
             return fingerprint
         else:
@@ -79,10 +417,22 @@ def store_fingerprint(fingerprint: ThreatFingerprint) -> ThreatFingerprint:
                 risk_score=fingerprint.risk_score,
                 status=fingerprint.status,
                 behavioral_features_json=json.dumps(fingerprint.behavioral_features),
-                related_fingerprints_json=related_fingerprints_json
+                related_fingerprints_json=related_fingerprints_json,
+                change_seq=next_change_seq(session),
+                **feature_columns(fingerprint.behavioral_features)
             )
             session.add(db_fingerprint)
+            refresh_user_risk_state(session, [fingerprint.user_id])
+            blocked_version = BLOCKED_USERS.bump(session) if fingerprint.status == "BLOCKED" else None
             session.commit()
+            FINGERPRINT_CACHE.invalidate([fingerprint.fingerprint_id], [fingerprint.user_id])
+            if blocked_version is not None:
+                BLOCKED_USERS.apply(
+                    [(fingerprint.fingerprint_id, fingerprint.user_id, fingerprint.status, fingerprint.risk_score)],
+                    blocked_version
+                )
+            _notify_fingerprints_committed()
+            CAMPAIGNS.record_fingerprint(fingerprint)
             print(f"   💾 [DB] Stored new fingerprint: {fingerprint.fingerprint_id}")
             return fingerprint
     except Exception as e:
@@ -93,51 +443,164 @@ def store_fingerprint(fingerprint: ThreatFingerprint) -> ThreatFingerprint:
         session.close()
 
 
+def _threat_fingerprint(db_fp: FingerprintDB) -> ThreatFingerprint:
+    """Convert a database row to a ThreatFingerprint."""
+    behavioral_features = {}
+    if db_fp.behavioral_features_json:
+        try:
+            behavioral_features = json.loads(db_fp.behavioral_features_json)
+        except json.JSONDecodeError:
+            behavioral_features = {}
+    
+    fp = ThreatFingerprint(
+        fingerprint_id=db_fp.fingerprint_id,
+        risk_score=db_fp.risk_score,
+        user_id=db_fp.user_id,
+        status=db_fp.status,
+        behavioral_features=behavioral_features,
+        device_id=db_fp.device_id,
+        ip_address=db_fp.ip_address,
+        user_agent=db_fp.user_agent
+    )
+    
+    # Add related_fingerprints if present
+    if db_fp.related_fingerprints_json:
+        try:
+            fp.related_fingerprints = json.loads(db_fp.related_fingerprints_json)  # Add as attribute
+        except json.JSONDecodeError:
+            pass
+    return fp
+
+
 def get_fingerprints() -> List[ThreatFingerprint]:
     """
     Return a list of all stored fingerprints from the database.
     Converts database models to ThreatFingerprint objects for compatibility.
+    The result is not cached: use get_fingerprints_page() for listings and
+    get_fingerprint_by_id() / get_user_fingerprints() for lookups.
     """
     session = get_db_session()
     try:
-        db_fingerprints = session.query(FingerprintDB).all()
-        result = []
-        
-        for db_fp in db_fingerprints:
-            # Convert database model to ThreatFingerprint
-            behavioral_features = {}
-            if db_fp.behavioral_features_json:
-                try:
-                    behavioral_features = json.loads(db_fp.behavioral_features_json)
-                except json.JSONDecodeError:
-                    behavioral_features = {}
-            
-            fp = ThreatFingerprint(
-                fingerprint_id=db_fp.fingerprint_id,
-                risk_score=db_fp.risk_score,
-                user_id=db_fp.user_id,
-                status=db_fp.status,
-                behavioral_features=behavioral_features,
-                device_id=db_fp.device_id,
-                ip_address=db_fp.ip_address,
-                user_agent=db_fp.user_agent
-            )
-            
-            # Add related_fingerprints if present
-            if db_fp.related_fingerprints_json:
-                try:
-                    related = json.loads(db_fp.related_fingerprints_json)
-                    fp.related_fingerprints = related  # Add as attribute
-                except json.JSONDecodeError:
-                    pass
-            
-            result.append(fp)
-        
-        # Update legacy FINGERPRINTS_STORE for backward compatibility
-        global FINGERPRINTS_STORE
-        FINGERPRINTS_STORE = result
-        
-        return result
+        result = [_threat_fingerprint(db_fp) for db_fp in session.query(FingerprintDB)]
+    finally:
+        session.close()
+
+    # Overlay fingerprints that are still queued for write-behind
+    if FINGERPRINT_WRITER is not None:
+        pending = {fp.fingerprint_id: fp for fp in FINGERPRINT_WRITER.pending()}
+        if pending:
+            result = [pending.pop(fp.fingerprint_id, fp) for fp in result] + list(pending.values())
+    return result
+
+
+def get_user_fingerprints(user_id: str, status: Optional[str] = None) -> List[ThreatFingerprint]:
+    """
+    Fingerprints of one user (optionally only one status), in no particular order. Served from
+    FINGERPRINT_CACHE once the user's list was loaded; queued write-behind
+    fingerprints are included.
+    """
+    cached = FINGERPRINT_CACHE.get_user(user_id)
+    if cached is None:
+        version = FINGERPRINT_CACHE.version
+        session = get_db_session()
+        try:
+            cached = [_threat_fingerprint(db_fp) for db_fp in session.query(FingerprintDB).filter(
+                FingerprintDB.user_id == user_id
+            )]
+        finally:
+            session.close()
+        FINGERPRINT_CACHE.put_user(user_id, cached, version)
+
+    result = {fp.fingerprint_id: fp for fp in cached}
+    if FINGERPRINT_WRITER is not None:
+        result.update({fp.fingerprint_id: fp for fp in FINGERPRINT_WRITER.pending() if fp.user_id == user_id})
+    return [fp for fp in result.values() if status is None or fp.status == status]
+
+
+def encode_fingerprint_cursor(created_at: datetime, row_id: int) -> str:
+    """Opaque keyset cursor for the (created_at, id) position of a row."""
+    raw = f"{created_at.isoformat()}|{row_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_fingerprint_cursor(cursor: str) -> Tuple[datetime, int]:
+    """Inverse of encode_fingerprint_cursor. Raises ValueError on a malformed cursor."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created_at, row_id = raw.rsplit("|", 1)
+        return datetime.fromisoformat(created_at), int(row_id)
+    except (UnicodeDecodeError, ValueError, TypeError) as e:
+        raise ValueError(f"invalid cursor: {cursor!r}") from e
+
+
+def get_fingerprints_page(limit: int = 50, cursor: Optional[str] = None, status: Optional[List[str]] = None,
+                          min_risk: Optional[int] = None, user_id: Optional[str] = None,
+                          platform: Optional[str] = None, since: Optional[datetime] = None,
+                          until: Optional[datetime] = None) -> Tuple[List[dict], Optional[str]]:
+    """
+    One page of fingerprints, newest first, ordered by (created_at, id) descending.
+    Only the requested page is loaded (keyset pagination: WHERE (created_at, id) < cursor).
+
+    Returns (fingerprint dicts, next_cursor); next_cursor is None on the last page.
+    Committed rows only, like the changes feed: queued write-behind fingerprints
+    appear once the writer flushes them, and a client following the page with its
+    changes_cursor receives them then.
+    """
+    session = get_db_session()
+    try:
+        query = session.query(FingerprintDB)
+        if status:
+            query = query.filter(FingerprintDB.status.in_(status))
+        if min_risk is not None:
+            query = query.filter(FingerprintDB.risk_score >= min_risk)
+        if user_id:
+            query = query.filter(FingerprintDB.user_id == user_id)
+        if platform:
+            query = query.filter(FingerprintDB.platform == platform)
+        if since is not None:
+            query = query.filter(FingerprintDB.created_at >= since)
+        if until is not None:
+            query = query.filter(FingerprintDB.created_at < until)
+        if cursor:
+            query = query.filter(tuple_(FingerprintDB.created_at, FingerprintDB.id) < decode_fingerprint_cursor(cursor))
+        rows = query.order_by(
+            FingerprintDB.created_at.desc(), FingerprintDB.id.desc()
+        ).limit(limit + 1).all()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_fingerprint_cursor(rows[-1].created_at, rows[-1].id)
+        return [row.to_dict() for row in rows], next_cursor
+    finally:
+        session.close()
+
+
+def get_fingerprint_changes(cursor: Optional[str] = None, limit: int = 500) -> dict:
+    """
+    Fingerprints inserted, updated and deleted after `cursor` (see changes.read_changes).
+    Without a cursor, returns no changes and the cursor of the current head.
+    Committed rows only: queued write-behind fingerprints appear once the writer
+    flushes them (at most FINGERPRINT_FLUSH_INTERVAL_MS), so readers and the
+    stream never force small flushes. Rows written without a position (by an
+    older process) get one first, so they are not skipped.
+    """
+    session = get_db_session()
+    try:
+        backfill_change_seq(session)
+        if not cursor:
+            return {"changes": [], "deleted": [], "cursor": head_cursor(session), "has_more": False, "reset": False}
+        return read_changes(session, cursor, limit)
+    finally:
+        session.close()
+
+
+def get_fingerprint_changes_cursor() -> str:
+    """Changes-feed cursor of the current head, taken before loading a list to follow it."""
+    session = get_db_session()
+    try:
+        backfill_change_seq(session)
+        return head_cursor(session)
     finally:
         session.close()
 
@@ -146,6 +609,16 @@ def get_fingerprint_by_id(fingerprint_id: str) -> Optional[ThreatFingerprint]:
     """
     Return a single fingerprint by its ID, or None if not found.
     """
+    if FINGERPRINT_WRITER is not None:
+        pending = FINGERPRINT_WRITER.get(fingerprint_id)
+        if pending is not None:
+            return pending
+
+    cached = FINGERPRINT_CACHE.get(fingerprint_id)
+    if cached is not None:
+        return cached
+
+    version = FINGERPRINT_CACHE.version
     session = get_db_session()
     try:
         db_fp = session.query(FingerprintDB).filter(
@@ -155,36 +628,11 @@ def get_fingerprint_by_id(fingerprint_id: str) -> Optional[ThreatFingerprint]:
         if not db_fp:
             return None
         
-        # Convert to ThreatFingerprint
-        behavioral_features = {}
-        if db_fp.behavioral_features_json:
-            try:
-                behavioral_features = json.loads(db_fp.behavioral_features_json)
-            except json.JSONDecodeError:
-                behavioral_features = {}
-        
-        fp = ThreatFingerprint(
-            fingerprint_id=db_fp.fingerprint_id,
-            risk_score=db_fp.risk_score,
-            user_id=db_fp.user_id,
-            status=db_fp.status,
-            behavioral_features=behavioral_features,
-            device_id=db_fp.device_id,
-            ip_address=db_fp.ip_address,
-            user_agent=db_fp.user_agent
-        )
-        
-        # Add related_fingerprints if present
-        if db_fp.related_fingerprints_json:
-            try:
-                related = json.loads(db_fp.related_fingerprints_json)
-                fp.related_fingerprints = related
-            except json.JSONDecodeError:
-                pass
-        
-        return fp
+        fp = _threat_fingerprint(db_fp)
     finally:
         session.close()
+    FINGERPRINT_CACHE.put(fp, version)
+    return fp
 
 
 def update_fingerprint_status(fingerprint_id: str, new_status: str) -> bool:
@@ -194,25 +642,35 @@ def update_fingerprint_status(fingerprint_id: str, new_status: str) -> bool:
     """
     session = get_db_session()
     try:
-        db_fp = session.query(FingerprintDB).filter(
+        flush_pending_fingerprints()
+        # Only the columns the caches need, no ORM object (and no JSON) loaded
+        row = session.query(FingerprintDB.user_id, FingerprintDB.status, FingerprintDB.risk_score).filter(
             FingerprintDB.fingerprint_id == fingerprint_id
         ).first()
+        if row is None:
+            return False
+        user_id, old_status, risk_score = row
         
-        if db_fp is None:
+        # Conditional on the status just read: 0 rows means a concurrent change won
+        updated = session.query(FingerprintDB).filter(
+            FingerprintDB.fingerprint_id == fingerprint_id, FingerprintDB.status == old_status
+        ).update({FingerprintDB.status: new_status, FingerprintDB.updated_at: datetime.utcnow(),
+                  FingerprintDB.change_seq: next_change_seq(session)}, synchronize_session=False)
+        if updated == 0:
+            session.rollback()
             return False
         
-        db_fp.status = new_status
-        db_fp.updated_at = datetime.utcnow()
+        blocked_version = None
+        if "BLOCKED" in (old_status, new_status):
+            blocked_version = BLOCKED_USERS.bump(session)
+        refresh_user_risk_state(session, [user_id])
         session.commit()
+        FINGERPRINT_CACHE.invalidate([fingerprint_id], [user_id])
+        if blocked_version is not None:
+            BLOCKED_USERS.apply([(fingerprint_id, user_id, new_status, risk_score)], blocked_version)
         print(f"   💾 [DB] Updated fingerprint {fingerprint_id} status to {new_status}")
-        
-        # Update FINGERPRINTS_STORE for backward compatibility
-        global FINGERPRINTS_STORE
-        for fp in FINGERPRINTS_STORE:
-            if fp.fingerprint_id == fingerprint_id:
-                fp.status = new_status
-                break
-        
+        _notify_fingerprint_changed(fingerprint_id)
+        _notify_fingerprints_committed()
         return True
     except Exception as e:
         session.rollback()
@@ -229,29 +687,33 @@ def clear_user_fingerprints(user_id: str) -> int:
     """
     session = get_db_session()
     try:
-        cleared_count = 0
+        flush_pending_fingerprints()
         print(f"🔓 [UNBLOCK] Clearing fingerprints for user_id: {user_id}")
         
-        db_fingerprints = session.query(FingerprintDB).filter(
-            FingerprintDB.user_id == user_id,
-            FingerprintDB.status.in_(("ACTIVE", "BLOCKED"))
-        ).all()
-        
-        for db_fp in db_fingerprints:
-            print(f"   - Changing fingerprint {db_fp.fingerprint_id} from {db_fp.status} to CLEARED")
-            db_fp.status = "CLEARED"
-            db_fp.updated_at = datetime.utcnow()
-            cleared_count += 1
+        # Two set-based UPDATEs over ix_fingerprints_user_status_risk; the BLOCKED rowcount
+        # tells whether the shared blocked-users version has to move
+        now = datetime.utcnow()
+        change_seq = next_change_seq(session)
+        cleared = {}
+        for status in ("BLOCKED", "ACTIVE"):
+            cleared[status] = session.query(FingerprintDB).filter(
+                FingerprintDB.user_id == user_id, FingerprintDB.status == status
+            ).update({FingerprintDB.status: "CLEARED", FingerprintDB.updated_at: now,
+                      FingerprintDB.change_seq: change_seq}, synchronize_session=False)
+        cleared_count = cleared["BLOCKED"] + cleared["ACTIVE"]
+        if not cleared_count:
+            session.rollback()
+            return 0
         
+        refresh_user_risk_state(session, [user_id])
+        blocked_version = BLOCKED_USERS.bump(session) if cleared["BLOCKED"] else None
         session.commit()
+        FINGERPRINT_CACHE.invalidate_user(user_id)
+        if blocked_version is not None:
+            BLOCKED_USERS.clear_user(user_id, blocked_version)
         print(f"✅ [UNBLOCK] Cleared {cleared_count} fingerprint(s) for user {user_id}")
-        
-        # Update FINGERPRINTS_STORE for backward compatibility
-        global FINGERPRINTS_STORE
-        for fp in FINGERPRINTS_STORE:
-            if fp.user_id == user_id and fp.status in ("ACTIVE", "BLOCKED"):
-                fp.status = "CLEARED"
-        
+        _notify_user_fingerprints_changed(user_id)
+        _notify_fingerprints_committed()
         return cleared_count
     except Exception as e:
         session.rollback()
@@ -268,6 +730,7 @@ def delete_fingerprint(fingerprint_id: str) -> bool:
     """
     session = get_db_session()
     try:
+        flush_pending_fingerprints()
         print(f"🗑️ [DELETE] Attempting to delete fingerprint: {fingerprint_id}")
         
         db_fp = session.query(FingerprintDB).filter(
@@ -276,9 +739,20 @@ def delete_fingerprint(fingerprint_id: str) -> bool:
         
         if db_fp:
             print(f"   - Found fingerprint {fingerprint_id} for user {db_fp.user_id}, status: {db_fp.status}")
+            was_blocked = db_fp.status == "BLOCKED"
+            blocked_change = (fingerprint_id, db_fp.user_id, "DELETED", 0)
             session.delete(db_fp)
+            record_tombstones(session, [(fingerprint_id, db_fp.user_id)])
+            prune_tombstones(session, TOMBSTONE_RETENTION)
+            refresh_user_risk_state(session, [blocked_change[1]])
+            blocked_version = BLOCKED_USERS.bump(session) if was_blocked else None
             session.commit()
+            FINGERPRINT_CACHE.invalidate([fingerprint_id], [blocked_change[1]])
+            if blocked_version is not None:
+                BLOCKED_USERS.apply([blocked_change], blocked_version)
             print(f"✅ [DELETE] Successfully deleted fingerprint {fingerprint_id}")
+            _notify_fingerprint_changed(fingerprint_id)
+            _notify_fingerprints_committed()
             return True
         else:
             print(f"⚠️ [DELETE] Fingerprint {fingerprint_id} not found")
@@ -291,6 +765,224 @@ def delete_fingerprint(fingerprint_id: str) -> bool:
         session.close()
 
 
+# ========== BULK ADMIN OPERATIONS ==========
+
+# Largest IN (...) list per statement (older SQLite builds allow 999 bound parameters)
+BULK_CHUNK_SIZE = 500
+
+# (row id, fingerprint_id, user_id, status, risk_score) of a fingerprint selected by a bulk operation
+BulkRow = Tuple[int, str, str, str, int]
+
+
+def _chunks(values: List, size: int = BULK_CHUNK_SIZE):
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def _select_bulk_rows(session: Session, fingerprint_ids: Optional[List[str]], user_ids: Optional[List[str]],
+                      statuses: Optional[Tuple[str, ...]] = None) -> List[BulkRow]:
+    """Fingerprints with one of `fingerprint_ids` or belonging to one of `user_ids` (optionally in `statuses`)."""
+    rows = {}
+    for column, values in ((FingerprintDB.fingerprint_id, fingerprint_ids), (FingerprintDB.user_id, user_ids)):
+        for chunk in _chunks(sorted(set(values or ()))):
+            query = session.query(
+                FingerprintDB.id, FingerprintDB.fingerprint_id, FingerprintDB.user_id,
+                FingerprintDB.status, FingerprintDB.risk_score
+            ).filter(column.in_(chunk))
+            if statuses is not None:
+                query = query.filter(FingerprintDB.status.in_(statuses))
+            for row in query:
+                rows[row[0]] = tuple(row)
+    return list(rows.values())
+
+
+def _refresh_risk_state_in_chunks(session: Session, user_ids) -> None:
+    for chunk in _chunks(sorted(set(user_ids))):
+        refresh_user_risk_state(session, chunk)
+
+
+def bulk_update_fingerprint_status(new_status: str, fingerprint_ids: Optional[List[str]] = None,
+                                   user_ids: Optional[List[str]] = None,
+                                   from_statuses: Optional[Tuple[str, ...]] = None) -> dict:
+    """
+    Set `new_status` on many fingerprints in one transaction: the ones listed in
+    `fingerprint_ids` plus all fingerprints of `user_ids` (limited to `from_statuses`
+    if given). Rows already in `new_status` are left alone. Set-based UPDATEs by
+    primary key (BULK_CHUNK_SIZE ids per statement); the blocked-users set, the
+    read cache and the listeners are updated once after the commit.
+    Returns {"updated": n, "matched": n, "not_found": [fingerprint_ids]}.
+    """
+    session = get_db_session()
+    try:
+        flush_pending_fingerprints()
+        matched = _select_bulk_rows(session, fingerprint_ids, user_ids, from_statuses)
+        rows = [row for row in matched if row[3] != new_status]
+        now = datetime.utcnow()
+        change_seq = next_change_seq(session) if rows else None
+        # Conditional on the status each row had in the SELECT (so still within from_statuses),
+        # as in update_fingerprint_status: a row changed since by someone else is left alone
+        ids_by_status = {}
+        for row in rows:
+            ids_by_status.setdefault(row[3], []).append(row[0])
+        updated = 0
+        for old_status, ids in ids_by_status.items():
+            for chunk in _chunks(ids):
+                updated += session.query(FingerprintDB).filter(
+                    FingerprintDB.id.in_(chunk), FingerprintDB.status == old_status
+                ).update({FingerprintDB.status: new_status, FingerprintDB.updated_at: now,
+                          FingerprintDB.change_seq: change_seq}, synchronize_session=False)
+        if updated != len(rows):
+            # Keep only the rows this transaction wrote (they carry its change_seq)
+            written = set()
+            for chunk in _chunks([row[0] for row in rows]):
+                written.update(row_id for (row_id,) in session.query(FingerprintDB.id).filter(
+                    FingerprintDB.id.in_(chunk), FingerprintDB.change_seq == change_seq
+                ))
+            rows = [row for row in rows if row[0] in written]
+        _refresh_risk_state_in_chunks(session, [row[2] for row in rows])
+        touches_blocked = any("BLOCKED" in (row[3], new_status) for row in rows)
+        blocked_version = BLOCKED_USERS.bump(session) if touches_blocked else None
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        print(f"❌ [DB] Error in bulk status update: {e}")
+        raise
+    finally:
+        session.close()
+
+    if blocked_version is not None:
+        BLOCKED_USERS.apply([(row[1], row[2], new_status, row[4]) for row in rows], blocked_version)
+    changed = {row[1] for row in rows}
+    if changed:
+        FINGERPRINT_CACHE.invalidate(changed, {row[2] for row in rows})
+    for fingerprint_id in changed:
+        _notify_fingerprint_changed(fingerprint_id)
+    if changed:
+        _notify_fingerprints_committed()
+    print(f"💾 [BULK] Set {updated} fingerprint(s) to {new_status} ({len(matched)} matched)")
+
+    found = {row[1] for row in matched}
+    return {
+        "updated": updated,
+        "matched": len(matched),
+        "not_found": sorted(set(fingerprint_ids or ()) - found),
+    }
+
+
+def bulk_delete_fingerprints(fingerprint_ids: Optional[List[str]] = None,
+                             user_ids: Optional[List[str]] = None) -> dict:
+    """
+    Delete the fingerprints listed in `fingerprint_ids` plus all fingerprints of
+    `user_ids` in one transaction (set-based DELETEs, tombstones for the changes feed).
+    Returns {"deleted": n, "not_found": [fingerprint_ids]}.
+    """
+    session = get_db_session()
+    try:
+        flush_pending_fingerprints()
+        rows = _select_bulk_rows(session, fingerprint_ids, user_ids)
+        deleted = 0
+        for chunk in _chunks([row[0] for row in rows]):
+            deleted += session.query(FingerprintDB).filter(
+                FingerprintDB.id.in_(chunk)
+            ).delete(synchronize_session=False)
+        record_tombstones(session, [(row[1], row[2]) for row in rows])
+        prune_tombstones(session, TOMBSTONE_RETENTION)
+        _refresh_risk_state_in_chunks(session, [row[2] for row in rows])
+        blocked_version = BLOCKED_USERS.bump(session) if any(row[3] == "BLOCKED" for row in rows) else None
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        print(f"❌ [DB] Error in bulk delete: {e}")
+        raise
+    finally:
+        session.close()
+
+    if blocked_version is not None:
+        BLOCKED_USERS.apply([(row[1], row[2], "DELETED", 0) for row in rows], blocked_version)
+    removed = {row[1] for row in rows}
+    if removed:
+        FINGERPRINT_CACHE.invalidate(removed, {row[2] for row in rows})
+    for fingerprint_id in removed:
+        _notify_fingerprint_changed(fingerprint_id)
+    if removed:
+        _notify_fingerprints_committed()
+    print(f"🗑️ [BULK] Deleted {deleted} fingerprint(s)")
+
+    return {"deleted": deleted, "not_found": sorted(set(fingerprint_ids or ()) - removed)}
+
+
+def get_user_risk_state(user_id: str) -> Optional[dict]:
+    """
+    Current risk state of a user (one primary-key lookup in user_risk_state),
+    or None if the user has no fingerprints. Fingerprints still queued by the
+    write-behind writer are counted once flushed (at most FINGERPRINT_FLUSH_INTERVAL_MS);
+    blocking-relevant ones are written synchronously and always included.
+    """
+    session = get_db_session()
+    try:
+        return read_user_risk_state(session, user_id)
+    finally:
+        session.close()
+
+
+# Columns read by similarity search (typed feature columns, no JSON)
+SIMILARITY_COLUMNS = ("fingerprint_id", "user_id", "status", "risk_score", "total_events",
+                      "events_per_minute", "update_mobile_attempt_count", "pages_visited_count")
+
+
+def get_fingerprint_feature_rows() -> List[dict]:
+    """
+    All fingerprints as dicts of SIMILARITY_COLUMNS, read from the typed
+    columns without loading or parsing behavioral_features_json.
+    Rows without typed values (written by an older process, total_events IS NULL)
+    or a table without the columns fall back to parsing the JSON.
+    Queued write-behind fingerprints are included.
+    """
+    session = get_db_session()
+    try:
+        try:
+            rows = session.query(*[getattr(FingerprintDB, column) for column in SIMILARITY_COLUMNS]).all()
+            result = {row[0]: dict(zip(SIMILARITY_COLUMNS, row)) for row in rows}
+            unfilled = [fingerprint_id for fingerprint_id, row in result.items() if row["total_events"] is None]
+        except OperationalError:
+            session.rollback()
+            result, unfilled = {}, None
+        if unfilled is None or unfilled:
+            result.update(_feature_rows_from_json(session, unfilled))
+    finally:
+        session.close()
+
+    if FINGERPRINT_WRITER is not None:
+        for fp in FINGERPRINT_WRITER.pending():
+            row = _fingerprint_row(fp)
+            result[fp.fingerprint_id] = {column: row[column] for column in SIMILARITY_COLUMNS}
+    return list(result.values())
+
+
+def _feature_rows_from_json(session: Session, fingerprint_ids: Optional[List[str]]) -> Dict[str, dict]:
+    """SIMILARITY_COLUMNS dicts parsed from behavioral_features_json (all rows if fingerprint_ids is None)."""
+    result = {}
+    base_columns = SIMILARITY_COLUMNS[:4]
+    chunks = [None] if fingerprint_ids is None else [
+        fingerprint_ids[i:i + 500] for i in range(0, len(fingerprint_ids), 500)
+    ]
+    for chunk in chunks:
+        query = session.query(*[getattr(FingerprintDB, column) for column in base_columns],
+                              FingerprintDB.behavioral_features_json)
+        if chunk is not None:
+            query = query.filter(FingerprintDB.fingerprint_id.in_(chunk))
+        for *values, features_json in query:
+            try:
+                features = json.loads(features_json) if features_json else {}
+            except json.JSONDecodeError:
+                features = {}
+            typed = feature_columns(features if isinstance(features, dict) else {})
+            row = dict(zip(base_columns, values))
+            row.update({column: typed[column] for column in SIMILARITY_COLUMNS[4:]})
+            result[row["fingerprint_id"]] = row
+    return result
+
+
 def get_all_fingerprints_db() -> List[FingerprintDB]:
     """
     Get all fingerprints as database models (for similarity detection).
@@ -298,6 +990,14 @@ def get_all_fingerprints_db() -> List[FingerprintDB]:
     """
     session = get_db_session()
     try:
-        return session.query(FingerprintDB).all()
+        db_fingerprints = session.query(FingerprintDB).all()
     finally:
         session.close()
+
+    # Include queued write-behind fingerprints as transient rows
+    if FINGERPRINT_WRITER is not None:
+        pending = {fp.fingerprint_id: FingerprintDB(**_fingerprint_row(fp)) for fp in FINGERPRINT_WRITER.pending()}
+        if pending:
+            db_fingerprints = [pending.pop(db_fp.fingerprint_id, db_fp) for db_fp in db_fingerprints]
+            db_fingerprints.extend(pending.values())
+    return db_fingerprints
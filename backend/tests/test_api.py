@@ -11,12 +11,17 @@ from datetime import datetime
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from main import app
-from storage import EVENTS_STORE, FINGERPRINTS_STORE, store_fingerprint
+from storage import EVENTS_STORE, FINGERPRINTS_STORE, store_fingerprint, delete_fingerprint, flush_pending_fingerprints
+from db import init_db
 from models import ThreatFingerprint
 
 
 class TestAPI(unittest.TestCase):
     """اختبارات API Endpoints"""
+
+    @classmethod
+    def setUpClass(cls):
+        init_db()
     
     def setUp(self):
         """تهيئة قبل كل اختبار"""
@@ -52,6 +57,95 @@ class TestAPI(unittest.TestCase):
         data = json.loads(response.data)
         self.assertEqual(data["status"], "ok")
     
+    def test_post_event_duplicate_event_id(self):
+        """اختبار تجاهل الحدث المكرر بنفس event_id"""
+        event_data = {
+            "event_id": "evt-dup-test-1",
+            "event_type": "page_view",
+            "user_id": "user-dup-test",
+            "device_id": "device-dup-test",
+            "timestamp1": datetime.now().isoformat(),
+            "platform": "hub"
+        }
+
+        first = self.app.post('/api/v1/event', data=json.dumps(event_data), content_type='application/json')
+        second = self.app.post('/api/v1/event', data=json.dumps(event_data), content_type='application/json')
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(second.status_code, 200)
+        self.assertNotIn("duplicate", json.loads(first.data))
+        self.assertTrue(json.loads(second.data)["duplicate"])
+        self.assertEqual(len([e for e in EVENTS_STORE if e.user_id == "user-dup-test"]), 1)
+
+    def test_post_event_invalid_event_id(self):
+        """event_id من نوع قائمة أو كائن يُرفض بـ 400، والرقم يُعامل كنص"""
+        event_data = {
+            "event_type": "page_view",
+            "user_id": "user-evtid-test",
+            "device_id": "device-evtid-test",
+            "timestamp1": datetime.now().isoformat(),
+            "platform": "hub"
+        }
+        for event_id in (["evt-1"], {"id": "evt-1"}, True):
+            response = self.app.post('/api/v1/event', data=json.dumps(dict(event_data, event_id=event_id)),
+                                     content_type='application/json')
+            self.assertEqual(response.status_code, 400)
+            self.assertEqual(json.loads(response.data)["status"], "error")
+
+        first = self.app.post('/api/v1/event', data=json.dumps(dict(event_data, event_id=424242)),
+                              content_type='application/json')
+        second = self.app.post('/api/v1/event', data=json.dumps(dict(event_data, event_id="424242")),
+                               content_type='application/json')
+        self.assertEqual(first.status_code, 200)
+        self.assertTrue(json.loads(second.data)["duplicate"])
+        self.assertEqual(json.loads(second.data)["event_id"], "424242")
+        self.assertEqual(len([e for e in EVENTS_STORE if e.user_id == "user-evtid-test"]), 1)
+    
+    def test_top_talkers(self):
+        """اختبار GET /api/v1/top-talkers"""
+        for i in range(5):
+            self.app.post('/api/v1/event', data=json.dumps({
+                "event_type": "page_view",
+                "user_id": f"user-talker-{i}",
+                "device_id": "device-talker",
+                "timestamp1": datetime.now().isoformat(),
+                "platform": "hub"
+            }), content_type='application/json')
+
+        response = self.app.get('/api/v1/top-talkers?kind=device&limit=5')
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        talker = next((t for t in data["device"] if t["key"] == "device-talker"), None)
+        self.assertIsNotNone(talker)
+        self.assertGreaterEqual(talker["count"], 5)
+
+        self.assertEqual(self.app.get('/api/v1/top-talkers?kind=bogus').status_code, 400)
+
+    def test_campaigns(self):
+        """اختبار GET /api/v1/campaigns و /api/v1/campaigns/lookup"""
+        for user_id in ("user-campaign-1", "user-campaign-2"):
+            self.app.post('/api/v1/event', data=json.dumps({
+                "event_type": "page_view",
+                "user_id": user_id,
+                "device_id": "device-campaign",
+                "timestamp1": datetime.now().isoformat(),
+                "platform": "hub"
+            }), content_type='application/json')
+
+        response = self.app.get('/api/v1/campaigns/lookup?user_id=user-campaign-1')
+        self.assertEqual(response.status_code, 200)
+        campaign = json.loads(response.data)["campaign"]
+        self.assertGreaterEqual(campaign["users"], 2)
+        self.assertIn("user-campaign-2", campaign["members"]["user"])
+
+        response = self.app.get('/api/v1/campaigns?min_users=2')
+        self.assertEqual(response.status_code, 200)
+        ids = [c["campaign_id"] for c in json.loads(response.data)["campaigns"]]
+        self.assertIn(campaign["campaign_id"], ids)
+
+        self.assertEqual(self.app.get('/api/v1/campaigns/lookup').status_code, 400)
+        self.assertEqual(self.app.get('/api/v1/campaigns/lookup?user_id=nobody-here').status_code, 404)
+    
     def test_get_fingerprints(self):
         """اختبار GET /api/v1/fingerprints"""
         # إضافة بصمة للاختبار
@@ -71,6 +165,149 @@ class TestAPI(unittest.TestCase):
         self.assertIsInstance(data, list)
         self.assertGreater(len(data), 0)
     
+    def test_debug_counts_database_fingerprints(self):
+        """اختبار GET /api/v1/debug: عدد البصمات من قاعدة البيانات لا من الذاكرة المؤقتة"""
+        store_fingerprint(ThreatFingerprint(
+            fingerprint_id="fp-debug-test",
+            risk_score=30,
+            user_id="user-debug-test",
+            status="PENDING",
+            behavioral_features={"total_events": 1}
+        ))
+        try:
+            flush_pending_fingerprints()
+            FINGERPRINTS_STORE[:] = []
+            response = self.app.get('/api/v1/debug')
+            self.assertEqual(response.status_code, 200)
+            data = json.loads(response.data)
+            self.assertGreaterEqual(data["fingerprints_count"], 1)
+            self.assertEqual(data["fingerprints_cached"], 0)
+        finally:
+            delete_fingerprint("fp-debug-test")
+
+    def test_fingerprints_pagination(self):
+        """اختبار GET /api/v1/fingerprints بالصفحات والمرشحات"""
+        ids = [f"fp-page-{i}" for i in range(5)]
+        for i, fingerprint_id in enumerate(ids):
+            store_fingerprint(ThreatFingerprint(
+                fingerprint_id=fingerprint_id,
+                risk_score=90 if i % 2 else 40,
+                user_id="user-page",
+                status="BLOCKED" if i % 2 else "PENDING",
+                behavioral_features={"platform": "absher" if i < 3 else "tawakkalna"}
+            ))
+        flush_pending_fingerprints()  # pages read committed rows only
+        try:
+            seen, cursor = [], None
+            while True:
+                url = '/api/v1/fingerprints?user_id=user-page&limit=2' + (f'&cursor={cursor}' if cursor else '')
+                response = self.app.get(url)
+                self.assertEqual(response.status_code, 200)
+                page = json.loads(response.data)
+                self.assertLessEqual(len(page["fingerprints"]), 2)
+                seen.extend((fp["created_at"], fp["fingerprint_id"]) for fp in page["fingerprints"])
+                cursor = page["next_cursor"]
+                if not cursor:
+                    break
+            # Every row exactly once, newest first
+            self.assertEqual(sorted(fingerprint_id for _, fingerprint_id in seen), ids)
+            created = [created_at for created_at, _ in seen]
+            self.assertEqual(created, sorted(created, reverse=True))
+
+            page = json.loads(self.app.get('/api/v1/fingerprints?user_id=user-page&status=blocked&min_risk=85').data)
+            self.assertEqual({fp["fingerprint_id"] for fp in page["fingerprints"]}, {"fp-page-1", "fp-page-3"})
+            page = json.loads(self.app.get('/api/v1/fingerprints?user_id=user-page&platform=tawakkalna').data)
+            self.assertEqual({fp["platform"] for fp in page["fingerprints"]}, {"tawakkalna"})
+            page = json.loads(self.app.get('/api/v1/fingerprints?user_id=user-page&since=2000-01-01T00:00:00Z').data)
+            self.assertEqual(len(page["fingerprints"]), 5)
+
+            self.assertEqual(self.app.get('/api/v1/fingerprints?cursor=not-a-cursor').status_code, 400)
+            self.assertEqual(self.app.get('/api/v1/fingerprints?min_risk=high').status_code, 400)
+            # Legacy array without parameters
+            self.assertIsInstance(json.loads(self.app.get('/api/v1/fingerprints').data), list)
+        finally:
+            for fingerprint_id in ids:
+                delete_fingerprint(fingerprint_id)
+    
+    def test_fingerprints_changes(self):
+        """اختبار GET /api/v1/fingerprints/changes"""
+        page = json.loads(self.app.get('/api/v1/fingerprints?limit=1').data)
+        cursor = page["changes_cursor"]
+        store_fingerprint(ThreatFingerprint(
+            fingerprint_id="fp-changes-api", risk_score=30, user_id="user-changes", status="PENDING",
+            behavioral_features={}
+        ))
+        flush_pending_fingerprints()  # the feed reads committed rows only
+        try:
+            response = self.app.get(f'/api/v1/fingerprints/changes?since={cursor}')
+            self.assertEqual(response.status_code, 200)
+            feed = json.loads(response.data)
+            self.assertEqual([fp["fingerprint_id"] for fp in feed["changes"]], ["fp-changes-api"])
+            self.assertFalse(feed["reset"])
+        finally:
+            delete_fingerprint("fp-changes-api")
+
+        feed = json.loads(self.app.get(f'/api/v1/fingerprints/changes?since={feed["cursor"]}').data)
+        self.assertEqual(feed["deleted"], ["fp-changes-api"])
+        self.assertIn("cursor", json.loads(self.app.get('/api/v1/fingerprints/changes').data))
+        self.assertEqual(self.app.get('/api/v1/fingerprints/changes?since=bad').status_code, 400)
+    
+    def test_fingerprints_stream(self):
+        """اختبار GET /api/v1/fingerprints/stream (Server-Sent Events)"""
+        response = self.app.get('/api/v1/fingerprints/stream', buffered=False)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.mimetype.startswith('text/event-stream'))
+        chunks = response.response
+        try:
+            self.assertTrue(next(chunks).startswith(b"retry:"))
+            self.assertTrue(next(chunks).startswith(b"event: ready"))
+            store_fingerprint(ThreatFingerprint(
+                fingerprint_id="fp-stream-api", risk_score=95, user_id="user-stream", status="BLOCKED",
+                behavioral_features={}
+            ))
+            message = next(chunks).decode()
+            self.assertTrue(message.startswith("event: fingerprints"))
+            payload = json.loads(message.split("data: ", 1)[1])
+            self.assertIn("fp-stream-api", [fp["fingerprint_id"] for fp in payload["changes"]])
+        finally:
+            response.close()
+            delete_fingerprint("fp-stream-api")
+    
+    def test_database_stats(self):
+        """اختبار GET /api/v1/database-stats"""
+        response = self.app.get('/api/v1/database-stats')
+        self.assertEqual(response.status_code, 200)
+        stats = json.loads(response.data)["statistics"]
+        self.assertEqual(set(stats["by_risk_level"]), {"high", "medium", "low"})
+        self.assertEqual(sum(stats["by_risk_level"].values()), stats["total_fingerprints"])
+        self.assertEqual(len(stats["risk_histogram"]), 10)
+        self.assertIn("by_platform", stats)
+    
+    def test_bulk_admin_operations(self):
+        """اختبار /api/v1/bulk/* (حظر ورفع حظر وحذف بصمات متعددة في طلب واحد)"""
+        ids = [f"fp-bulk-api-{i}" for i in range(3)]
+        for fingerprint_id in ids:
+            store_fingerprint(ThreatFingerprint(
+                fingerprint_id=fingerprint_id, risk_score=95, user_id="user-bulk-api", status="ACTIVE",
+                behavioral_features={}
+            ))
+        try:
+            post = lambda url, body: self.app.post(url, data=json.dumps(body), content_type='application/json')
+            result = json.loads(post('/api/v1/bulk/confirm-threat', {"fingerprint_ids": ids + ["fp-missing"]}).data)
+            self.assertEqual((result["updated"], result["not_found"]), (3, ["fp-missing"]))
+            self.assertFalse(json.loads(post('/api/v1/check-and-login', {"user_id": "user-bulk-api"}).data)["allowed"])
+
+            result = json.loads(post('/api/v1/bulk/unblock-user', {"user_ids": ["user-bulk-api"]}).data)
+            self.assertEqual(result["cleared_fingerprints"], 3)
+            self.assertTrue(json.loads(post('/api/v1/check-and-login', {"user_id": "user-bulk-api"}).data)["allowed"])
+
+            self.assertEqual(json.loads(post('/api/v1/bulk/delete-fingerprint', {"user_ids": ["user-bulk-api"]}).data)["deleted"], 3)
+            self.assertEqual(post('/api/v1/bulk/clear-fingerprint', {}).status_code, 400)
+            self.assertEqual(post('/api/v1/bulk/clear-fingerprint', {"fingerprint_ids": "fp-1"}).status_code, 400)
+        finally:
+            for fingerprint_id in ids:
+                delete_fingerprint(fingerprint_id)
+    
     def test_check_and_login_allowed(self):
         """اختبار POST /api/v1/check-and-login (مسموح)"""
         data = {
@@ -115,6 +352,32 @@ class TestAPI(unittest.TestCase):
         self.assertEqual(result["status"], "blocked")
         self.assertFalse(result["allowed"])
     
+    def test_check_user_status(self):
+        """اختبار POST /api/v1/check-user-status من جدول حالة المستخدم"""
+        store_fingerprint(ThreatFingerprint(
+            fingerprint_id="fp-status-test",
+            risk_score=92,
+            user_id="user-status",
+            status="ACTIVE",
+            behavioral_features={}
+        ))
+        try:
+            response = self.app.post('/api/v1/check-user-status', data=json.dumps({"user_id": "user-status"}),
+                                     content_type='application/json')
+            self.assertEqual(response.status_code, 200)
+            result = json.loads(response.data)
+            self.assertTrue(result["is_blocked"])
+            self.assertEqual(result["total_fingerprints"], 1)
+            self.assertEqual(result["risk_state"]["max_risk"], 92)
+
+            response = self.app.post('/api/v1/check-user-status', data=json.dumps({"user_id": "user-unknown"}),
+                                     content_type='application/json')
+            result = json.loads(response.data)
+            self.assertFalse(result["is_blocked"])
+            self.assertEqual(result["total_fingerprints"], 0)
+        finally:
+            delete_fingerprint("fp-status-test")
+    
     def test_confirm_threat(self):
         """اختبار POST /api/v1/confirm-threat"""
         # إضافة بصمة
@@ -0,0 +1,92 @@
+"""
+اختبارات مهمة تجميع الحملات (campaign_clustering.py)
+"""
+import unittest
+import sys
+import os
+import json
+
+# إضافة مسار backend إلى Python path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import init_db, get_db_session, FingerprintDB, FingerprintClusterDB, feature_columns
+from campaign_clustering import features_from_json, run_clustering, benchmark
+
+
+class TestCampaignClustering(unittest.TestCase):
+    """اختبارات التجميع على دفعات والكتابة المجمّعة"""
+
+    PROFILES = {
+        "slow": {"total_events": 3, "events_per_minute": 0.5, "update_mobile_attempt_count": 0, "pages_visited_count": 2},
+        "drain": {"total_events": 250, "events_per_minute": 80.0, "update_mobile_attempt_count": 9, "pages_visited_count": 1},
+    }
+
+    @classmethod
+    def setUpClass(cls):
+        init_db()
+
+    def setUp(self):
+        self.session = get_db_session()
+        self._cleanup()
+        for i in range(40):
+            profile = "slow" if i % 2 else "drain"
+            self.session.add(FingerprintDB(
+                fingerprint_id=f"fp-cluster-{profile}-{i}",
+                user_id=f"user-cluster-{i}",
+                device_id=f"device-cluster-{profile}",
+                ip_address="10.9.9.9",
+                risk_score=60,
+                status="PENDING",
+                behavioral_features_json=json.dumps(self.PROFILES[profile]),
+                **feature_columns(self.PROFILES[profile])
+            ))
+        self.session.commit()
+
+    def tearDown(self):
+        self._cleanup()
+        self.session.close()
+
+    def _cleanup(self):
+        self.session.query(FingerprintDB).filter(
+            FingerprintDB.fingerprint_id.like("fp-cluster-%")
+        ).delete(synchronize_session=False)
+        self.session.query(FingerprintClusterDB).delete(synchronize_session=False)
+        self.session.commit()
+
+    def _labels(self):
+        rows = self.session.query(FingerprintClusterDB).filter(
+            FingerprintClusterDB.fingerprint_id.like("fp-cluster-%")
+        ).all()
+        return {row.fingerprint_id: row.cluster_id for row in rows}
+
+    def test_features_from_json(self):
+        """استخراج الخصائص الرقمية مع تجاهل القيم غير الرقمية"""
+        self.assertEqual(features_from_json('{"total_events": 4, "events_per_minute": "x"}'), [4.0, 0.0, 0.0, 0.0])
+        self.assertEqual(features_from_json(None), [0.0, 0.0, 0.0, 0.0])
+
+    def test_minibatch_chunked_separates_profiles(self):
+        """التجميع على دفعات صغيرة يفصل السلوكين ويكتب تعييناً لكل بصمة"""
+        run_clustering("minibatch", n_clusters=2, chunk_size=7)
+        labels = self._labels()
+        self.assertEqual(len(labels), 40)
+        slow = {label for fp_id, label in labels.items() if "-slow-" in fp_id}
+        drain = {label for fp_id, label in labels.items() if "-drain-" in fp_id}
+        self.assertEqual(len(slow), 1)
+        self.assertEqual(len(drain), 1)
+        self.assertNotEqual(slow, drain)
+
+    def test_dbscan(self):
+        """DBSCAN يكتب نفس عدد التعيينات"""
+        result = run_clustering("dbscan", eps=0.3, min_samples=3)
+        self.assertEqual(len(self._labels()), 40)
+        self.assertGreaterEqual(result["fingerprints"], 40)
+
+    def test_benchmark_runs(self):
+        """وضع قياس الأداء يعمل على بيانات اصطناعية"""
+        result = benchmark(2000, n_clusters=4, chunk_size=500)
+        self.assertEqual(result["fingerprints"], 2000)
+        self.assertEqual(sum(result["largest_clusters"]), 2000)
+
+
+if __name__ == '__main__':
+    unittest.main()
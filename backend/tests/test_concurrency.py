@@ -0,0 +1,149 @@
+"""
+اختبارات التزامن (concurrency.py وحالة المحرك المشتركة)
+"""
+import unittest
+import sys
+import os
+import threading
+from datetime import datetime, timedelta
+
+# إضافة مسار backend إلى Python path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from concurrency import StripedLock
+from dispatcher import EventDispatcher
+from models import Event
+import engine
+
+
+class TestStripedLock(unittest.TestCase):
+    """اختبارات أقفال التقسيم"""
+
+    def test_same_key_same_lock(self):
+        """نفس المفتاح يعيد نفس القفل دائماً"""
+        locks = StripedLock(stripes=16)
+        self.assertIs(locks.lock_for("user-1"), locks.lock_for("user-1"))
+        self.assertEqual(len(locks), 16)
+
+    def test_invalid_stripes(self):
+        """عدد الأقسام يجب أن يكون موجباً"""
+        with self.assertRaises(ValueError):
+            StripedLock(stripes=0)
+
+
+class TestEngineConcurrency(unittest.TestCase):
+    """اختبار ضغط: لا يجب فقدان أي تحديث عند التشغيل المتوازي"""
+
+    THREADS = 8
+    CALLS_PER_THREAD = 250
+
+    def setUp(self):
+        self.user_ids = [f"user-stress-{i}" for i in range(3)]
+        for user_id in self.user_ids:
+            engine.reset_user_behavior_history(user_id)
+        # السجل محدود الطول؛ نرفع الحد حتى يمكن عدّ كل التحديثات
+        self._history_cap = engine.LOCATION_HISTORY_MAX_ENTRIES
+        engine.LOCATION_HISTORY_MAX_ENTRIES = self.THREADS * self.CALLS_PER_THREAD
+
+    def tearDown(self):
+        engine.LOCATION_HISTORY_MAX_ENTRIES = self._history_cap
+        for user_id in self.user_ids:
+            engine.reset_user_behavior_history(user_id)
+
+    def _run_threads(self, target):
+        start = threading.Barrier(self.THREADS)
+
+        def worker(thread_index):
+            start.wait()
+            target(thread_index)
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(self.THREADS)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+    def test_location_history_no_lost_updates(self):
+        """كل استدعاء لـ detect_geographic_jump يجب أن يُسجَّل في السجل"""
+        base_time = datetime.now()
+
+        def target(thread_index):
+            for i in range(self.CALLS_PER_THREAD):
+                user_id = self.user_ids[i % len(self.user_ids)]
+                ts = base_time + timedelta(milliseconds=thread_index * self.CALLS_PER_THREAD + i)
+                engine.detect_geographic_jump(user_id, f"10.0.{thread_index}.{i % 2}", None, ts)
+
+        self._run_threads(target)
+
+        total = sum(len(engine.fingerprint_location_history[u]) for u in self.user_ids)
+        self.assertEqual(total, self.THREADS * self.CALLS_PER_THREAD)
+
+    def test_device_history_consistent(self):
+        """آخر نوع جهاز لكل مستخدم يجب أن يكون أحد القيم المكتوبة"""
+        def target(thread_index):
+            for i in range(self.CALLS_PER_THREAD):
+                user_id = self.user_ids[i % len(self.user_ids)]
+                engine.detect_device_change(user_id, "mobile" if thread_index % 2 else "desktop")
+
+        self._run_threads(target)
+
+        for user_id in self.user_ids:
+            self.assertIn(engine.fingerprint_last_device[user_id], ("mobile", "desktop"))
+
+
+class TestEventDispatcher(unittest.TestCase):
+    """اختبارات موزّع الأحداث حسب المستخدم"""
+
+    def setUp(self):
+        self.seen = {}
+        self.seen_lock = threading.Lock()
+
+        def handler(event):
+            with self.seen_lock:
+                self.seen.setdefault(event.user_id, []).append(event.event_type)
+            return event.event_type
+
+        self.dispatcher = EventDispatcher(handler, workers=4)
+
+    def tearDown(self):
+        self.dispatcher.shutdown()
+
+    def test_per_user_order_preserved(self):
+        """أحداث المستخدم الواحد تُعالَج بنفس ترتيب وصولها"""
+        now = datetime.now()
+        futures = []
+        for i in range(200):
+            user_id = f"user-{i % 5}"
+            futures.append(self.dispatcher.submit(Event(f"evt-{i}", user_id, "device-1", now)))
+        results = [f.result(timeout=5) for f in futures]
+
+        self.assertEqual(results, [f"evt-{i}" for i in range(200)])
+        for u in range(5):
+            expected = [f"evt-{i}" for i in range(200) if i % 5 == u]
+            self.assertEqual(self.seen[f"user-{u}"], expected)
+
+    def test_stats(self):
+        """مقاييس الطوابير تعكس عدد الأحداث المعالجة"""
+        now = datetime.now()
+        for f in [self.dispatcher.submit(Event("login_attempt", f"user-{i}", "d", now)) for i in range(20)]:
+            f.result(timeout=5)
+
+        stats = self.dispatcher.stats()
+        self.assertEqual(stats["workers"], 4)
+        self.assertEqual(stats["total_processed"], 20)
+        self.assertEqual(len(stats["queues"]), 4)
+        self.assertEqual(stats["total_depth"], 0)
+
+    def test_handler_exception_propagates(self):
+        """أخطاء المعالج تصل إلى المستدعي ولا توقف العامل"""
+        failing = EventDispatcher(lambda event: 1 / 0, workers=1)
+        try:
+            with self.assertRaises(ZeroDivisionError):
+                failing.submit(Event("x", "user-1", "d", datetime.now())).result(timeout=5)
+            self.assertEqual(failing.stats()["queues"][0]["failed"], 1)
+        finally:
+            failing.shutdown()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -9,13 +9,19 @@ from datetime import datetime, timedelta
 # إضافة مسار backend إلى Python path
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from engine import process_event, is_user_fingerprinted, calculate_behavioral_features
+from engine import process_event, is_user_fingerprinted, calculate_behavioral_features, find_linked_account, FINGERPRINT_COALESCER
+from db import init_db
 from models import Event, ThreatFingerprint
-from storage import EVENTS_STORE, FINGERPRINTS_STORE, store_event, store_fingerprint
+from storage import EVENTS_STORE, FINGERPRINTS_STORE, USERS_BY_ENTITY, store_event, store_fingerprint, update_fingerprint_status
+from coalescing import FingerprintCoalescer, risk_tier
 
 
 class TestEngine(unittest.TestCase):
     """اختبارات محرك التحليل"""
+
+    @classmethod
+    def setUpClass(cls):
+        init_db()
     
     def setUp(self):
         """تهيئة قبل كل اختبار"""
@@ -185,6 +191,122 @@ class TestEngine(unittest.TestCase):
         self.assertIsNotNone(fingerprint)
         self.assertGreaterEqual(fingerprint.risk_score, 80)
 
+    def test_multi_account_linked_without_fingerprint(self):
+        """ربط الحسابات عبر نفس الجهاز قبل وجود أي بصمة للحساب الأول"""
+        base_time = datetime.now()
+        for i in range(5):
+            store_event(Event(
+                event_type="update_mobile_attempt",
+                user_id="user-linked-a",
+                device_id="device-linked",
+                timestamp1=base_time + timedelta(seconds=i * 10),
+                ip_address="10.20.30.40"
+            ))
+        features_a = calculate_behavioral_features("user-linked-a", "device-linked", base_time + timedelta(seconds=40))
+        USERS_BY_ENTITY.update_summary("user-linked-a", features_a, 90, base_time + timedelta(seconds=40))
+
+        event_b = Event(
+            event_type="update_mobile_attempt",
+            user_id="user-linked-b",
+            device_id="device-linked",
+            timestamp1=base_time + timedelta(seconds=45),
+            ip_address="10.20.30.40"
+        )
+        store_event(event_b)
+        fingerprint = process_event(event_b)
+
+        self.assertIsNotNone(fingerprint)
+        self.assertGreaterEqual(fingerprint.risk_score, 95)
+        self.assertEqual(fingerprint.behavioral_features["linked_user_id"], "user-linked-a")
+        USERS_BY_ENTITY.forget_user("user-linked-a")
+        USERS_BY_ENTITY.forget_user("user-linked-b")
+
+    def test_find_linked_account_uses_reverse_index(self):
+        """الربط عبر الفهرس العكسي: نفس الجهاز وخطورة كافية وسلوك متشابه فقط"""
+        now = datetime.now()
+        features = {"events_per_minute": 10.0, "update_mobile_attempt_count": 3,
+                    "total_events": 25, "pages_visited_count": 4}
+        for user_id, device_id, risk in (("user-ri-risky", "device-ri", 90), ("user-ri-calm", "device-ri", 10),
+                                         ("user-ri-other", "device-ri-other", 90)):
+            USERS_BY_ENTITY.record_event(Event(event_type="login_attempt", user_id=user_id,
+                                               device_id=device_id, timestamp1=now))
+            USERS_BY_ENTITY.update_summary(user_id, features, risk, now)
+        event = Event(event_type="login_attempt", user_id="user-ri-new", device_id="device-ri", timestamp1=now)
+        try:
+            linked = find_linked_account(event, features)
+            self.assertEqual((linked["user_id"], linked["shared"]), ("user-ri-risky", ["device"]))
+            # Different behaviour: not linked
+            self.assertIsNone(find_linked_account(event, {"events_per_minute": 100.0, "total_events": 400,
+                                                          "update_mobile_attempt_count": 0, "pages_visited_count": 40}))
+        finally:
+            for user_id in ("user-ri-risky", "user-ri-calm", "user-ri-other"):
+                USERS_BY_ENTITY.forget_user(user_id)
+
+
+class TestFingerprintCoalescing(unittest.TestCase):
+    """اختبارات دمج البصمات في بصمة متجددة لكل مستخدم ونافذة زمنية"""
+
+    @classmethod
+    def setUpClass(cls):
+        init_db()
+
+    def _event(self, user_id, ts, event_type="page_view"):
+        return Event(event_type=event_type, user_id=user_id, device_id=f"device-{user_id}", timestamp1=ts)
+
+    def test_risk_tiers(self):
+        """حدود فئات الخطورة"""
+        self.assertEqual([risk_tier(r) for r in (10, 49, 50, 74, 75, 84, 85, 100)], [0, 0, 1, 1, 2, 2, 3, 3])
+
+    def test_merge_keeps_max_risk_and_reasons(self):
+        """الدمج يحتفظ بأعلى خطورة وبكل الأسباب وآخر الخصائص"""
+        coalescer = FingerprintCoalescer(window_seconds=3600)
+        now = datetime(2024, 1, 1, 10, 0, 0)
+        fp = ThreatFingerprint(fingerprint_id="fp-roll", risk_score=60, user_id="u1",
+                               behavioral_features={"total_events": 1, "detection_reasons": ["device_change"]})
+        self.assertIsNone(coalescer.merge("u1", now, 60, {}, []))
+        coalescer.start(fp, now)
+
+        merged = coalescer.merge("u1", now + timedelta(minutes=5), 55, {"total_events": 2}, ["geographic_jump"],
+                                 device_id="device-2")
+        self.assertEqual(merged.fingerprint_id, "fp-roll")
+        self.assertEqual((merged.risk_score, merged.device_id), (60, "device-2"))
+        self.assertEqual(merged.behavioral_features["total_events"], 2)
+        self.assertEqual(merged.behavioral_features["detection_reasons"], ["device_change", "geographic_jump"])
+        self.assertEqual(merged.behavioral_features["coalesced_events"], 2)
+        # The previous version (possibly queued for writing) is left untouched
+        self.assertIsNot(merged, fp)
+        self.assertEqual(fp.behavioral_features["total_events"], 1)
+        self.assertIsNone(fp.device_id)
+        # The next event folds into the new version
+        merged_again = coalescer.merge("u1", now + timedelta(minutes=5), 58, {}, [])
+        self.assertEqual(merged_again.behavioral_features["coalesced_events"], 3)
+        self.assertEqual(merged.behavioral_features["coalesced_events"], 2)
+
+        # Higher tier or next bucket → new row
+        self.assertIsNone(coalescer.merge("u1", now + timedelta(minutes=6), 80, {}, []))
+        self.assertIsNone(coalescer.merge("u1", now + timedelta(hours=1), 10, {}, []))
+        coalescer.forget_fingerprint("fp-roll")
+        self.assertIsNone(coalescer.merge("u1", now + timedelta(minutes=7), 10, {}, []))
+
+    @unittest.skipIf(FINGERPRINT_COALESCER is None, "coalescing disabled")
+    def test_process_event_reuses_rolling_fingerprint(self):
+        """الزيارات العادية لنفس المستخدم تحدّث بصمة واحدة حتى يغيّر المشرف حالتها"""
+        base_time = datetime.now()
+        fingerprints = []
+        for i in range(3):
+            event = self._event("user-rolling", base_time + timedelta(seconds=i * 20))
+            store_event(event)
+            fingerprints.append(process_event(event))
+
+        self.assertEqual(len({fp.fingerprint_id for fp in fingerprints}), 1)
+        self.assertEqual(fingerprints[-1].behavioral_features["coalesced_events"], 3)
+
+        update_fingerprint_status(fingerprints[0].fingerprint_id, "CLEARED")
+        event = self._event("user-rolling", base_time + timedelta(seconds=70))
+        store_event(event)
+        self.assertNotEqual(process_event(event).fingerprint_id, fingerprints[0].fingerprint_id)
+        FINGERPRINT_COALESCER.forget_user("user-rolling")
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,179 @@
+"""
+اختبارات خطط الاستعلام (EXPLAIN QUERY PLAN) لاستعلامات البصمات الساخنة على SQLite.
+يفشل الاختبار إذا عاد أحد الاستعلامات إلى مسح كامل للجدول.
+"""
+import unittest
+import sys
+import os
+import re
+
+# إضافة مسار backend إلى Python path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import shutil
+import tempfile
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, text, tuple_
+from sqlalchemy.orm import sessionmaker
+
+from db import Base, FingerprintDB, feature_columns, make_engine
+from risk_state import _aggregates, _latest_fingerprint_id
+
+# "SCAN fingerprints" without "USING ... INDEX" = full table scan
+FULL_SCAN = re.compile(r"^SCAN (TABLE )?fingerprints\b(?!.*\bINDEX\b)")
+
+
+def _seed_rows(count=5000, users=500):
+    """Representative fingerprints: many users, mostly ACTIVE/CLEARED, some BLOCKED."""
+    statuses = ("ACTIVE", "ACTIVE", "CLEARED", "CLEARED", "PENDING", "BLOCKED")
+    platforms = ("absher", "tawakkalna", "nafath", None)
+    start = datetime(2025, 1, 1)
+    rows = []
+    for i in range(count):
+        features = {"total_events": i % 40, "platform": platforms[i % len(platforms)]}
+        created_at = start + timedelta(minutes=i)
+        rows.append({
+            "fingerprint_id": f"fp-plan-{i}",
+            "user_id": f"user-{i % users}",
+            "risk_score": (i * 37) % 100,
+            "status": statuses[i % len(statuses)],
+            "behavioral_features_json": "{}",
+            "created_at": created_at,
+            "updated_at": created_at,
+            "change_seq": i + 1,
+            **feature_columns(features),
+        })
+    return rows
+
+
+class TestQueryPlans(unittest.TestCase):
+    """كل استعلام ساخن يستخدم فهرساً بدل المسح الكامل"""
+
+    @classmethod
+    def setUpClass(cls):
+        # Own temporary database: the plans must not depend on (or rewrite) the app's database file
+        cls.directory = tempfile.mkdtemp()
+        cls.engine = make_engine(f"sqlite:///{os.path.join(cls.directory, 'plans.db')}", profile="default")
+        Base.metadata.create_all(bind=cls.engine)
+        with cls.engine.begin() as connection:
+            connection.execute(FingerprintDB.__table__.insert(), _seed_rows())
+            # Statistics of the seeded data, so the plans don't depend on planner defaults
+            connection.execute(text("ANALYZE"))
+        cls.Session = sessionmaker(bind=cls.engine)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.engine.dispose()
+        shutil.rmtree(cls.directory, ignore_errors=True)
+
+    def setUp(self):
+        self.session = self.Session()
+
+    def tearDown(self):
+        self.session.close()
+
+    def _plan(self, query):
+        sql = str(query.statement.compile(self.engine, compile_kwargs={"literal_binds": True}))
+        rows = self.session.execute(text("EXPLAIN QUERY PLAN " + sql)).fetchall()
+        return [row[-1] for row in rows]
+
+    def assertUsesIndex(self, query):
+        plan = self._plan(query)
+        scans = [detail for detail in plan if FULL_SCAN.search(detail)]
+        self.assertEqual(scans, [], f"full table scan in plan: {plan}")
+
+    def _fp(self):
+        return self.session.query(FingerprintDB)
+
+    def test_lookup_by_fingerprint_id(self):
+        """البحث بمعرف البصمة"""
+        self.assertUsesIndex(self._fp().filter(FingerprintDB.fingerprint_id == "fp-x"))
+
+    def test_user_blocked_check(self):
+        """فحص الحظر: user_id + status + risk_score"""
+        self.assertUsesIndex(self._fp().filter(
+            FingerprintDB.user_id == "user-x",
+            FingerprintDB.status == "BLOCKED",
+            FingerprintDB.risk_score >= 85
+        ))
+
+    def test_clear_user_fingerprints(self):
+        """مسح بصمات مستخدم: user_id + status IN"""
+        self.assertUsesIndex(self._fp().filter(
+            FingerprintDB.user_id == "user-x",
+            FingerprintDB.status.in_(("ACTIVE", "BLOCKED"))
+        ))
+
+    def test_status_counts(self):
+        """العدّ حسب الحالة"""
+        for status in ("ACTIVE", "BLOCKED", "CLEARED"):
+            self.assertUsesIndex(
+                self.session.query(func.count(FingerprintDB.id)).filter(FingerprintDB.status == status)
+            )
+
+    def test_risk_level_counts(self):
+        """العدّ حسب مستوى الخطورة"""
+        self.assertUsesIndex(self.session.query(func.count(FingerprintDB.id)).filter(FingerprintDB.risk_score >= 85))
+        self.assertUsesIndex(self.session.query(func.count(FingerprintDB.id)).filter(
+            FingerprintDB.risk_score >= 50, FingerprintDB.risk_score < 85
+        ))
+        self.assertUsesIndex(self.session.query(func.count(FingerprintDB.id)).filter(FingerprintDB.risk_score < 50))
+
+    def test_database_stats_aggregate(self):
+        """إحصائيات /api/v1/database-stats: تجميع واحد من فهرس مغطٍّ بدون جدول مؤقت"""
+        query = self.session.query(
+            FingerprintDB.status, FingerprintDB.risk_score, FingerprintDB.platform, func.count()
+        ).group_by(FingerprintDB.status, FingerprintDB.risk_score, FingerprintDB.platform)
+        self.assertUsesIndex(query)
+        plan = self._plan(query)
+        self.assertFalse([detail for detail in plan if "TEMP B-TREE" in detail], plan)
+
+    def test_blocked_set_load(self):
+        """تحميل مجموعة المستخدمين المحظورين"""
+        self.assertUsesIndex(self.session.query(
+            FingerprintDB.fingerprint_id, FingerprintDB.user_id, FingerprintDB.risk_score
+        ).filter(FingerprintDB.status == "BLOCKED"))
+
+    def test_listings_sorted_by_created_at(self):
+        """عرض البصمات مرتبة بتاريخ الإنشاء (view_database.py)"""
+        self.assertUsesIndex(self._fp().order_by(FingerprintDB.created_at.desc()))
+        plan = self._plan(self._fp().filter(
+            FingerprintDB.user_id == "user-x"
+        ).order_by(FingerprintDB.created_at.desc()))
+        self.assertFalse([detail for detail in plan if FULL_SCAN.search(detail)], plan)
+        self.assertFalse([detail for detail in plan if "TEMP B-TREE" in detail], plan)
+
+    def test_fingerprint_pages(self):
+        """صفحات /api/v1/fingerprints: بدون مرشح ومع الحالة / المستخدم / المنصة بعد المؤشر"""
+        after = tuple_(FingerprintDB.created_at, FingerprintDB.id) < (datetime(2030, 1, 1), 1000)
+        newest_first = (FingerprintDB.created_at.desc(), FingerprintDB.id.desc())
+        for condition in (None, FingerprintDB.status.in_(("BLOCKED",)), FingerprintDB.user_id == "user-x",
+                          FingerprintDB.platform == "absher"):
+            query = self._fp().filter(after)
+            if condition is not None:
+                query = query.filter(condition)
+            self.assertUsesIndex(query.order_by(*newest_first).limit(51))
+
+    def test_changes_feed(self):
+        """سجل التغييرات: (change_seq, id) بعد المؤشر"""
+        self.assertUsesIndex(self._fp().filter(
+            tuple_(FingerprintDB.change_seq, FingerprintDB.id) > (1000, 5)
+        ).order_by(FingerprintDB.change_seq, FingerprintDB.id).limit(501))
+
+    def test_user_risk_state_refresh(self):
+        """تحديث حالة المستخدم: التجميع وآخر بصمة"""
+        self.assertUsesIndex(_aggregates(self.session, ["user-x", "user-y"]))
+        self.assertUsesIndex(self._fp().filter(
+            FingerprintDB.user_id == "user-x"
+        ).order_by(FingerprintDB.updated_at.desc(), FingerprintDB.id.desc()))
+        self.assertIsNone(_latest_fingerprint_id(self.session, "user-nobody"))
+        self.assertEqual(_latest_fingerprint_id(self.session, "user-1"), "fp-plan-4501")
+
+    def test_keyset_chunks(self):
+        """القراءة على دفعات بالمفتاح (campaign_clustering.py)"""
+        self.assertUsesIndex(self._fp().filter(FingerprintDB.id > 100).order_by(FingerprintDB.id).limit(500))
+
+
+if __name__ == '__main__':
+    unittest.main()
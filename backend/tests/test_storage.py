@@ -2,9 +2,14 @@
 اختبارات نظام التخزين (storage.py)
 """
 import unittest
+import base64
+import json
+import threading
+import time
 import sys
 import os
-from datetime import datetime
+from unittest import mock
+from datetime import datetime, timedelta
 
 # إضافة مسار backend إلى Python path
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -17,9 +22,25 @@ from storage import (
     clear_user_fingerprints,
     delete_fingerprint,
     get_fingerprint_by_id,
+    get_events_in_window,
     EVENTS_STORE,
     FINGERPRINTS_STORE
 )
+from event_time import EventTimeIndex, WatermarkTracker, IN_ORDER, OUT_OF_ORDER, LATE
+from windows import EntityWindows
+from sketches import HyperLogLog, EntityDistinctCounters
+from reverse_index import EntityUserIndex
+from campaigns import CampaignGraph
+from write_behind import WriteBehindQueue
+from blocklist import BlockedUsers
+from broadcast import ChangeBroadcaster
+from fingerprint_stats import FingerprintStats, aggregate_fingerprint_stats
+from retention import FingerprintRetention, default_rules
+from fingerprint_cache import FingerprintCache
+from db import init_db, get_db_session, FingerprintDB, FingerprintArchiveDB, UserRiskStateDB, engine_options, make_engine, _backfill_feature_columns
+from risk_state import backfill_user_risk_state, read_user_risk_state
+from changes import prune_tombstones
+import storage
 from models import Event, ThreatFingerprint
 
 
@@ -228,6 +249,1011 @@ class TestStorage(unittest.TestCase):
         self.assertFalse(result)
 
 
+class TestEventTime(unittest.TestCase):
+    """اختبارات معالجة زمن الحدث (الأحداث المتأخرة)"""
+
+    def setUp(self):
+        EVENTS_STORE[:] = []
+
+    def tearDown(self):
+        EVENTS_STORE[:] = []
+
+    def test_late_event_inserted_in_order(self):
+        """الحدث المتأخر يُدرج في موضعه الزمني داخل النافذة"""
+        base = datetime.now()
+        for offset in (0, 30, 60):
+            store_event(Event("view_service", "user-late", "device-late", base + timedelta(seconds=offset)))
+        store_event(Event("replayed", "user-late", "device-late", base + timedelta(seconds=10)))
+
+        window = get_events_in_window("user-late", "device-late", base, base + timedelta(seconds=60))
+        self.assertEqual([e.timestamp1 for e in window], sorted(e.timestamp1 for e in window))
+        self.assertEqual(len(window), 4)
+        self.assertEqual(window[1].event_type, "replayed")
+
+        # نافذة بحد أعلى لا تتضمن الأحداث الأحدث
+        self.assertEqual(len(get_events_in_window("user-late", None, base, base + timedelta(seconds=10))), 2)
+
+    def test_index_bounded(self):
+        """الفهرس يحتفظ بعدد محدود من الأحداث لكل مفتاح"""
+        index = EventTimeIndex(retention=timedelta(minutes=1), max_events_per_key=5)
+        base = datetime.now()
+        for i in range(10):
+            index.insert("k", Event("e", "k", "d", base + timedelta(seconds=i)))
+        self.assertEqual(len(index.window("k", base)), 5)
+        index.insert("k", Event("e", "k", "d", base + timedelta(minutes=5)))
+        self.assertEqual(len(index.window("k", base)), 1)
+
+    def test_watermark_classification(self):
+        """تصنيف الأحداث حسب العلامة المائية وإحصاءات التأخير"""
+        tracker = WatermarkTracker(allowed_lateness=timedelta(seconds=30))
+        base = datetime.now()
+        self.assertEqual(tracker.observe("u", base), IN_ORDER)
+        self.assertEqual(tracker.observe("u", base - timedelta(seconds=10)), OUT_OF_ORDER)
+        self.assertEqual(tracker.observe("u", base - timedelta(seconds=120)), LATE)
+        self.assertTrue(tracker.is_late("u", base - timedelta(seconds=31)))
+
+        stats = tracker.stats()
+        self.assertEqual((stats["in_order"], stats["out_of_order"], stats["late"]), (1, 1, 1))
+        self.assertEqual(stats["max_lateness_seconds"], 120.0)
+
+
+class TestEntityWindows(unittest.TestCase):
+    """اختبارات العدادات الزمنية متعددة الدقة"""
+
+    def test_counts_per_resolution(self):
+        """العدّ عبر نوافذ 1 دقيقة و 10 دقائق و 24 ساعة"""
+        windows = EntityWindows()
+        now = datetime(2025, 1, 1, 12, 0, 0)
+        for minutes_ago in (0, 0, 5, 30, 180, 23 * 60):
+            windows.record("user", "u-1", now - timedelta(minutes=minutes_ago))
+
+        self.assertEqual(windows.count("user", "u-1", now, timedelta(minutes=1)), 2)
+        self.assertEqual(windows.count("user", "u-1", now, timedelta(minutes=10)), 3)
+        self.assertEqual(windows.count("user", "u-1", now, timedelta(hours=1)), 4)
+        self.assertEqual(windows.count("user", "u-1", now, timedelta(hours=24)), 6)
+        self.assertEqual(windows.count("user", "u-other", now, timedelta(hours=24)), 0)
+
+    def test_sweep_evicts_idle_entities(self):
+        """إزالة الكيانات الخاملة لأكثر من 24 ساعة"""
+        windows = EntityWindows()
+        now = datetime(2025, 1, 1, 12, 0, 0)
+        windows.record("ip", "10.0.0.1", now - timedelta(days=2))
+        windows.record("ip", "10.0.0.2", now)
+        self.assertEqual(windows.sweep(now.timestamp()), 1)
+        self.assertEqual(windows.stats()["tracked_entities"]["ip"], 1)
+
+
+class TestDistinctSketches(unittest.TestCase):
+    """اختبارات عدّادات القيم المميزة التقريبية (HyperLogLog)"""
+
+    def test_small_counts_exact(self):
+        """الأعداد الصغيرة دقيقة تماماً"""
+        hll = HyperLogLog(precision=10)
+        for value in ["a", "b", "c", "a", "b"]:
+            hll.add(value)
+        self.assertEqual(hll.count(), 3)
+
+    def test_large_count_bounded_error(self):
+        """خطأ التقدير للأعداد الكبيرة ضمن 10%"""
+        hll = HyperLogLog(precision=10)
+        for i in range(20000):
+            hll.add(f"10.0.{i // 256}.{i % 256}")
+        self.assertLess(abs(hll.count() - 20000) / 20000, 0.10)
+        self.assertEqual(hll.memory_bytes(), 1024)
+
+    def test_merge_user_or_device(self):
+        """دمج مخطط المستخدم والجهاز يعطي عدد الاتحاد"""
+        counters = EntityDistinctCounters({"user_agent": (10, 120)})
+        now = datetime.now()
+        counters.add("user_agent", "user:u1", "UA-1", now)
+        counters.add("user_agent", "user:u1", "UA-2", now)
+        counters.add("user_agent", "device:d1", "UA-2", now)
+        counters.add("user_agent", "device:d1", "UA-3", now - timedelta(minutes=10))
+
+        self.assertEqual(counters.count("user_agent", ["user:u1", "device:d1"], now, timedelta(seconds=60)), 2)
+        counters.add("user_agent", "device:d1", "UA-3", now)
+        self.assertEqual(counters.count("user_agent", ["user:u1", "device:d1"], now, timedelta(seconds=60)), 3)
+
+    def test_window_not_widened_by_buckets(self):
+        """قيمة أقدم من النافذة لا تُحسب حتى لو وقعت في نفس الدلو مع بداية النافذة"""
+        counters = EntityDistinctCounters({"user_agent": (10, 120)})
+        now = datetime.fromtimestamp(1_000_005)
+        counters.add("user_agent", "user:u1", "UA-old", now - timedelta(seconds=65))
+        counters.add("user_agent", "user:u1", "UA-1", now - timedelta(seconds=50))
+        counters.add("user_agent", "user:u1", "UA-2", now)
+        self.assertEqual(counters.count("user_agent", ["user:u1"], now, timedelta(seconds=60)), 2)
+
+
+class TestEntityUserIndex(unittest.TestCase):
+    """اختبارات الفهرس العكسي من الجهاز/IP إلى المستخدمين"""
+
+    def _event(self, user_id, device_id, ip, ts):
+        return Event(event_type="login_attempt", user_id=user_id, device_id=device_id,
+                     timestamp1=ts, ip_address=ip)
+
+    def test_linked_users_by_device_and_ip(self):
+        """المستخدمون الآخرون على نفس الجهاز أو IP ضمن النافذة فقط"""
+        index = EntityUserIndex(window=timedelta(minutes=30))
+        now = datetime.now()
+        index.record_event(self._event("u1", "d1", "10.0.0.1", now - timedelta(minutes=5)))
+        index.record_event(self._event("u2", "d2", "10.0.0.1", now - timedelta(minutes=1)))
+        index.record_event(self._event("u3", "d1", "10.0.0.9", now - timedelta(hours=2)))
+
+        linked = index.linked_users(self._event("u4", "d1", "10.0.0.1", now))
+        self.assertEqual(linked, {"u1": ["device", "ip"], "u2": ["ip"]})
+
+    def test_users_per_entity_bounded(self):
+        """عدد المستخدمين لكل IP محدود (يُحذف الأقدم)"""
+        index = EntityUserIndex(max_users_per_entity=3)
+        now = datetime.now()
+        for i in range(10):
+            index.record("ip", "10.0.0.1", f"u{i}", now + timedelta(seconds=i))
+        self.assertEqual(index.users_for("ip", "10.0.0.1", now + timedelta(seconds=10)), ["u7", "u8", "u9"])
+
+    def test_late_summary_ignored(self):
+        """الملخص الأقدم لا يستبدل الأحدث"""
+        index = EntityUserIndex()
+        now = datetime.now()
+        index.update_summary("u1", {"total_events": 5}, 90, now, fingerprint_id="fp-1")
+        index.update_summary("u1", {"total_events": 1}, 10, now - timedelta(minutes=1))
+        self.assertEqual(index.summary("u1")["risk_score"], 90)
+        index.update_summary("u1", {"total_events": 6}, 40, now + timedelta(seconds=1))
+        self.assertEqual(index.summary("u1")["fingerprint_id"], "fp-1")
+
+    def test_sweep_drops_idle_only(self):
+        """التنظيف يحذف الملخصات والكيانات الخاملة فقط"""
+        index = EntityUserIndex(window=timedelta(minutes=30))
+        now = datetime.now()
+        index.record_event(self._event("u-idle", "d-idle", None, now - timedelta(hours=1)))
+        index.update_summary("u-idle", {"total_events": 1}, 60, now - timedelta(hours=1))
+        index.record_event(self._event("u-live", "d-live", None, now - timedelta(minutes=1)))
+        index.update_summary("u-live", {"total_events": 1}, 60, now - timedelta(minutes=1))
+
+        self.assertEqual(index.sweep(now), 1)
+        self.assertIsNone(index.summary("u-idle"))
+        self.assertIsNotNone(index.summary("u-live"))
+        self.assertEqual(index.stats()["entities"], {"device": 1, "ip": 0})
+
+
+class TestCampaignGraph(unittest.TestCase):
+    """اختبارات رسم الحملات (union-find)"""
+
+    def test_links_users_through_device_and_fingerprints(self):
+        """المستخدمون على نفس الجهاز أو المرتبطون ببصمة في حملة واحدة"""
+        graph = CampaignGraph()
+        now = datetime.now()
+        graph.record_event(Event(event_type="login_attempt", user_id="u1", device_id="d1", timestamp1=now))
+        graph.record_event(Event(event_type="login_attempt", user_id="u2", device_id="d1", timestamp1=now))
+        graph.record_event(Event(event_type="login_attempt", user_id="u3", device_id="d3", timestamp1=now))
+        self.assertEqual(graph.campaign_of("user", "u1")["users"], 2)
+        self.assertEqual(graph.campaign_of("user", "u3")["users"], 1)
+
+        graph.record_fingerprint(ThreatFingerprint(
+            fingerprint_id="fp-c1", risk_score=95, user_id="u3", device_id="d3", ip_address="10.0.0.1",
+            behavioral_features={"linked_user_id": "u2"}
+        ))
+        campaign = graph.campaign_of("ip", "10.0.0.1")
+        self.assertEqual((campaign["users"], campaign["devices"], campaign["ips"]), (3, 2, 1))
+        self.assertEqual((campaign["events"], campaign["fingerprints"], campaign["max_risk_score"]), (3, 1, 95))
+        self.assertEqual(sorted(campaign["members"]["user"]), ["u1", "u2", "u3"])
+        self.assertEqual([c["users"] for c in graph.campaigns(min_users=2)], [3])
+
+    def test_snapshot_roundtrip(self):
+        """حفظ الرسم واستعادته يحافظ على الحملات"""
+        graph = CampaignGraph()
+        now = datetime.now()
+        for user_id in ("u1", "u2"):
+            graph.record_event(Event(event_type="login_attempt", user_id=user_id, device_id="d1", timestamp1=now))
+
+        restored = CampaignGraph()
+        self.assertEqual(restored.load_dict(json.loads(json.dumps(graph.to_dict()))), 1)
+        self.assertEqual(restored.campaign_of("user", "u2"), graph.campaign_of("user", "u2"))
+        restored.record_event(Event(event_type="login_attempt", user_id="u3", device_id="d1", timestamp1=now))
+        self.assertEqual(restored.campaign_of("device", "d1")["users"], 3)
+
+    def test_campaign_id_survives_reload(self):
+        """معرّف الحملة يبقى كما هو بعد الاستعادة مهما كان ترتيب الأعضاء"""
+        graph = CampaignGraph()
+        now = datetime.now()
+        for user_id in ("u1", "u2", "u3"):
+            graph.record_event(Event(event_type="login_attempt", user_id=user_id, device_id="d1", timestamp1=now))
+        campaign_id = graph.campaign_of("user", "u3")["campaign_id"]
+
+        snapshot = graph.to_dict()
+        snapshot["components"][0]["members"].reverse()
+        restored = CampaignGraph()
+        restored.load_dict(snapshot)
+        self.assertEqual(restored.campaign_of("user", "u3")["campaign_id"], campaign_id)
+        self.assertEqual(restored.campaigns(min_users=2)[0]["campaign_id"], campaign_id)
+
+
+class TestWriteBehind(unittest.TestCase):
+    """اختبارات الكتابة المؤجلة للبصمات (write-behind)"""
+
+    def test_queue_coalesces_and_reads_own_writes(self):
+        """الكتابات المتكررة لنفس المعرف تُدمج وتُقرأ قبل التفريغ"""
+        batches = []
+        queue = WriteBehindQueue(batches.append, key=lambda item: item["id"], flush_interval_ms=60000)
+        queue.submit({"id": "a", "v": 1})
+        queue.submit({"id": "b", "v": 1})
+        queue.submit({"id": "a", "v": 2})
+        self.assertEqual(queue.get("a")["v"], 2)
+        self.assertEqual(queue.flush(), 2)
+        self.assertEqual(batches, [[{"id": "b", "v": 1}, {"id": "a", "v": 2}]])
+        self.assertIsNone(queue.get("a"))
+        queue.close()
+
+    def test_failed_flush_requeued(self):
+        """فشل التفريغ يعيد الصفوف إلى الطابور دون فقدان"""
+        def failing(batch):
+            raise RuntimeError("db down")
+        queue = WriteBehindQueue(failing, key=lambda item: item["id"], flush_interval_ms=60000)
+        queue.submit({"id": "a"})
+        self.assertEqual(queue.flush(), 0)
+        self.assertEqual(len(queue), 1)
+        self.assertEqual(queue.stats()["failed_flushes"], 1)
+
+    def test_poison_row_isolated(self):
+        """صف لا يمكن كتابته لا يعطّل بقية الصفوف وينتقل إلى قائمة الرسائل الميتة"""
+        written = []
+        def write(batch):
+            if any(item["id"] == "bad" for item in batch):
+                raise RuntimeError("constraint violated")
+            written.extend(item["id"] for item in batch)
+        queue = WriteBehindQueue(write, key=lambda item: item["id"], flush_interval_ms=60000, max_attempts=2)
+        for item_id in ("a", "bad", "b"):
+            queue.submit({"id": item_id})
+        self.assertEqual(queue.flush(), 2)
+        self.assertEqual(written, ["a", "b"])
+        self.assertIsNotNone(queue.get("bad"))
+
+        queue.submit({"id": "c"})
+        self.assertEqual(queue.flush(), 1)
+        self.assertEqual(written, ["a", "b", "c"])
+        self.assertIsNone(queue.get("bad"))
+        self.assertEqual(len(queue), 0)
+        self.assertEqual([letter["key"] for letter in queue.dead_letters()], ["bad"])
+        self.assertEqual(queue.stats()["dead_letters"], 1)
+        self.assertEqual(queue.flush(), 0)
+
+    def test_background_flush_by_rows(self):
+        """الخيط الخلفي يفرّغ عند بلوغ الحد الأقصى للصفوف"""
+        flushed = threading.Event()
+        queue = WriteBehindQueue(lambda batch: flushed.set(), key=lambda item: item, flush_interval_ms=60000, max_batch_rows=3)
+        for i in range(3):
+            queue.submit(i)
+        self.assertTrue(flushed.wait(5))
+        queue.close()
+
+    @unittest.skipIf(storage.FINGERPRINT_WRITER is None, "write-behind disabled")
+    def test_store_fingerprint_write_behind(self):
+        """البصمة منخفضة الخطورة تؤجَّل، والعالية تُكتب فوراً"""
+        init_db()
+        low = ThreatFingerprint(fingerprint_id="fp-wb-low", risk_score=40, user_id="user-wb", status="PENDING",
+                                behavioral_features={"total_events": 3})
+        high = ThreatFingerprint(fingerprint_id="fp-wb-high", risk_score=95, user_id="user-wb", status="PENDING",
+                                 behavioral_features={"total_events": 30})
+        sync_before = storage.FINGERPRINT_WRITER.stats()["sync_writes"]
+        try:
+            store_fingerprint(low)
+            store_fingerprint(high)
+            self.assertEqual(storage.FINGERPRINT_WRITER.stats()["sync_writes"], sync_before + 1)
+            self.assertIsNotNone(get_fingerprint_by_id("fp-wb-low"))
+            self.assertIn("fp-wb-low", [fp.fingerprint_id for fp in get_fingerprints()])
+
+            storage.flush_pending_fingerprints()
+            session = get_db_session()
+            try:
+                stored = {fp.fingerprint_id for fp in session.query(FingerprintDB).filter(FingerprintDB.user_id == "user-wb")}
+            finally:
+                session.close()
+            self.assertEqual(stored, {"fp-wb-low", "fp-wb-high"})
+        finally:
+            delete_fingerprint("fp-wb-low")
+            delete_fingerprint("fp-wb-high")
+
+    @unittest.skipIf(storage.FINGERPRINT_WRITER is None, "write-behind disabled")
+    def test_low_risk_event_on_high_risk_rolling_row_queued(self):
+        """حدث منخفض الخطورة مدمج في بصمة متجددة عالية الخطورة يؤجَّل ولا يُكتب فوراً"""
+        init_db()
+        rolling = ThreatFingerprint(fingerprint_id="fp-wb-roll", risk_score=95, user_id="user-wb", status="PENDING",
+                                    behavioral_features={"total_events": 30})
+        rolling.event_risk_score = 20
+        sync_before = storage.FINGERPRINT_WRITER.stats()["sync_writes"]
+        try:
+            store_fingerprint(rolling)
+            self.assertEqual(storage.FINGERPRINT_WRITER.stats()["sync_writes"], sync_before)
+            rolling.event_risk_score = 90
+            store_fingerprint(rolling)
+            self.assertEqual(storage.FINGERPRINT_WRITER.stats()["sync_writes"], sync_before + 1)
+        finally:
+            delete_fingerprint("fp-wb-roll")
+
+
+class TestBlockedUsers(unittest.TestCase):
+    """اختبارات مجموعة المستخدمين المحظورين في الذاكرة"""
+
+    @classmethod
+    def setUpClass(cls):
+        init_db()
+
+    def tearDown(self):
+        delete_fingerprint("fp-blk-1")
+
+    def _blocked(self, status="BLOCKED"):
+        return ThreatFingerprint(fingerprint_id="fp-blk-1", risk_score=95, user_id="user-blk", status=status,
+                                 behavioral_features={"total_events": 10})
+
+    def test_block_and_clear_update_set(self):
+        """الحظر ثم المسح يحدّثان المجموعة دون إعادة تحميل"""
+        store_fingerprint(self._blocked())
+        self.assertTrue(storage.BLOCKED_USERS.is_blocked("user-blk", min_risk=85))
+        self.assertFalse(storage.BLOCKED_USERS.is_blocked("user-blk", min_risk=99))
+        clear_user_fingerprints("user-blk")
+        self.assertFalse(storage.BLOCKED_USERS.is_blocked("user-blk"))
+
+    def test_status_update_and_delete(self):
+        """تغيير الحالة إلى BLOCKED ثم الحذف"""
+        store_fingerprint(self._blocked(status="PENDING"))
+        self.assertFalse(storage.BLOCKED_USERS.is_blocked("user-blk"))
+        update_fingerprint_status("fp-blk-1", "BLOCKED")
+        self.assertTrue(storage.BLOCKED_USERS.is_blocked("user-blk"))
+        delete_fingerprint("fp-blk-1")
+        self.assertFalse(storage.BLOCKED_USERS.is_blocked("user-blk"))
+
+    def test_clear_user_without_reload(self):
+        """رفع الحظر يحدّث المجموعة ويُبطل نسخة الذاكرة المؤقتة دون إعادة تحميل"""
+        store_fingerprint(self._blocked())
+        self.assertEqual(get_fingerprint_by_id("fp-blk-1").status, "BLOCKED")
+        self.assertTrue(storage.BLOCKED_USERS.is_blocked("user-blk"))
+        reloads = storage.BLOCKED_USERS.stats()["reloads"]
+
+        self.assertEqual(clear_user_fingerprints("user-blk"), 1)
+        self.assertEqual(clear_user_fingerprints("user-blk"), 0)  # nothing left to clear
+        self.assertFalse(storage.BLOCKED_USERS.is_blocked("user-blk"))
+        self.assertEqual(storage.BLOCKED_USERS.stats()["reloads"], reloads)
+        self.assertIsNone(storage.FINGERPRINT_CACHE.get("fp-blk-1"))
+        self.assertEqual(get_fingerprint_by_id("fp-blk-1").status, "CLEARED")
+
+    def test_other_process_change_invalidates(self):
+        """تغيير من عملية أخرى (عبر رقم الإصدار) يفرض إعادة التحميل"""
+        other_process = BlockedUsers(get_db_session, poll_seconds=0)
+        self.assertFalse(other_process.is_blocked("user-blk"))
+        reloads = other_process.stats()["reloads"]
+
+        store_fingerprint(self._blocked())
+        self.assertTrue(other_process.is_blocked("user-blk"))
+        self.assertEqual(other_process.stats()["reloads"], reloads + 1)
+        # Unchanged version: no reload
+        other_process.is_blocked("user-blk")
+        self.assertEqual(other_process.stats()["reloads"], reloads + 1)
+
+    def test_missing_version_table_falls_back_to_full_load(self):
+        """قاعدة قديمة دون جدول cache_versions: تحميل كامل بدل الخطأ"""
+        import tempfile
+        from sqlalchemy.orm import sessionmaker
+        with tempfile.TemporaryDirectory() as directory:
+            old_engine = make_engine(f"sqlite:///{os.path.join(directory, 'old.db')}", "default")
+            try:
+                FingerprintDB.__table__.create(bind=old_engine)
+                Session = sessionmaker(bind=old_engine)
+                session = Session()
+                session.add(FingerprintDB(fingerprint_id="fp-old", user_id="user-old", risk_score=90,
+                                          status="BLOCKED", behavioral_features_json="{}"))
+                session.commit()
+                session.close()
+
+                blocked = BlockedUsers(Session, poll_seconds=0)
+                self.assertTrue(blocked.is_blocked("user-old"))
+                self.assertFalse(blocked.is_blocked("user-other"))
+            finally:
+                old_engine.dispose()
+
+
+class TestUserRiskState(unittest.TestCase):
+    """اختبارات جدول الحالة المجمّعة لكل مستخدم (user_risk_state)"""
+
+    IDS = ("fp-rs-1", "fp-rs-2", "fp-rs-3")
+
+    @classmethod
+    def setUpClass(cls):
+        init_db()
+
+    def tearDown(self):
+        for fingerprint_id in self.IDS:
+            delete_fingerprint(fingerprint_id)
+
+    def _store(self, fingerprint_id, risk, status):
+        storage._store_fingerprint_sync(ThreatFingerprint(
+            fingerprint_id=fingerprint_id, risk_score=risk, user_id="user-rs", status=status,
+            behavioral_features={"total_events": 1}
+        ))
+
+    def test_state_follows_writes(self):
+        """الحالة تُحدَّث مع كل كتابة: الإدراج، الحظر، المسح، الحذف"""
+        self._store("fp-rs-1", 40, "PENDING")
+        self._store("fp-rs-2", 70, "ACTIVE")
+        state = storage.get_user_risk_state("user-rs")
+        self.assertEqual(state["fingerprint_count"], 2)
+        self.assertEqual(state["max_risk"], 70)
+        self.assertEqual(state["status"], "ACTIVE")
+        self.assertEqual(state["last_fingerprint_id"], "fp-rs-2")
+
+        update_fingerprint_status("fp-rs-1", "BLOCKED")
+        state = storage.get_user_risk_state("user-rs")
+        self.assertEqual(state["status"], "BLOCKED")
+        self.assertEqual(state["max_blocked_risk"], 40)
+        self.assertEqual(state["last_fingerprint_id"], "fp-rs-1")
+
+        clear_user_fingerprints("user-rs")
+        state = storage.get_user_risk_state("user-rs")
+        self.assertEqual((state["status"], state["max_risk"], state["cleared_count"]), ("CLEARED", 0, 2))
+
+        delete_fingerprint("fp-rs-1")
+        delete_fingerprint("fp-rs-2")
+        self.assertIsNone(storage.get_user_risk_state("user-rs"))
+
+    def test_backfill_matches_incremental(self):
+        """إعادة البناء الكاملة تعطي نفس الحالة المحدَّثة أثناء الكتابة"""
+        self._store("fp-rs-1", 90, "BLOCKED")
+        self._store("fp-rs-3", 30, "PENDING")
+        before = storage.get_user_risk_state("user-rs")
+        session = get_db_session()
+        try:
+            backfill_user_risk_state(session)
+            self.assertGreaterEqual(session.query(UserRiskStateDB).count(), 1)
+        finally:
+            session.close()
+        after = storage.get_user_risk_state("user-rs")
+        before.pop("updated_at")
+        after.pop("updated_at")
+        self.assertEqual(before, after)
+
+    def test_missing_row_or_table_aggregates_fingerprints(self):
+        """دون صف (أو دون الجدول في قاعدة قديمة) تُحسب الحالة من البصمات"""
+        self._store("fp-rs-1", 90, "BLOCKED")
+        self._store("fp-rs-3", 30, "PENDING")
+        before = storage.get_user_risk_state("user-rs")
+        session = get_db_session()
+        try:
+            session.query(UserRiskStateDB).filter(UserRiskStateDB.user_id == "user-rs").delete()
+            session.commit()
+        finally:
+            session.close()
+        after = storage.get_user_risk_state("user-rs")
+        before.pop("updated_at")
+        after.pop("updated_at")
+        self.assertEqual(before, after)
+        self.assertIsNone(storage.get_user_risk_state("user-rs-none"))
+
+        import tempfile
+        from sqlalchemy.orm import sessionmaker
+        with tempfile.TemporaryDirectory() as directory:
+            old_engine = make_engine(f"sqlite:///{os.path.join(directory, 'old.db')}", "default")
+            try:
+                FingerprintDB.__table__.create(bind=old_engine)
+                session = sessionmaker(bind=old_engine)()
+                try:
+                    session.add(FingerprintDB(fingerprint_id="fp-old", user_id="user-old", risk_score=90,
+                                              status="BLOCKED", behavioral_features_json="{}"))
+                    session.commit()
+                    state = read_user_risk_state(session, "user-old")
+                finally:
+                    session.close()
+                self.assertEqual((state["status"], state["max_blocked_risk"], state["fingerprint_count"]),
+                                 ("BLOCKED", 90, 1))
+            finally:
+                old_engine.dispose()
+
+
+class TestFeatureColumns(unittest.TestCase):
+    """اختبارات أعمدة الخصائص المنمّطة بدل قراءة JSON"""
+
+    @classmethod
+    def setUpClass(cls):
+        init_db()
+
+    def tearDown(self):
+        delete_fingerprint("fp-cols-1")
+        delete_fingerprint("fp-cols-legacy")
+
+    def _row(self, fingerprint_id):
+        session = get_db_session()
+        try:
+            return session.query(FingerprintDB).filter(FingerprintDB.fingerprint_id == fingerprint_id).first()
+        finally:
+            session.close()
+
+    def test_store_fills_columns(self):
+        """حفظ البصمة يملأ الأعمدة المنمّطة"""
+        storage._store_fingerprint_sync(ThreatFingerprint(
+            fingerprint_id="fp-cols-1", risk_score=60, user_id="user-cols", status="PENDING",
+            behavioral_features={"total_events": 12, "events_per_minute": 4.5, "pages_visited_count": "x",
+                                 "attack_mode": "credential_stuffing", "trigger_source": "ML_HIGH_RISK"}
+        ))
+        row = self._row("fp-cols-1")
+        self.assertEqual((row.total_events, row.events_per_minute), (12, 4.5))
+        self.assertEqual((row.update_mobile_attempt_count, row.pages_visited_count), (0, 0))
+        self.assertEqual((row.attack_mode, row.trigger_source), ("credential_stuffing", "ML_HIGH_RISK"))
+        features = {r["fingerprint_id"]: r for r in storage.get_fingerprint_feature_rows()}["fp-cols-1"]
+        self.assertEqual(features["events_per_minute"], 4.5)
+
+    def test_backfill_legacy_rows(self):
+        """الصفوف القديمة (أعمدة فارغة) تُملأ من JSON عند التهيئة"""
+        session = get_db_session()
+        try:
+            session.add(FingerprintDB(fingerprint_id="fp-cols-legacy", user_id="user-cols", risk_score=10,
+                                      status="PENDING", behavioral_features_json=json.dumps({"total_events": 7})))
+            session.commit()
+        finally:
+            session.close()
+        self.assertIsNone(self._row("fp-cols-legacy").total_events)
+        # Before the backfill the similarity rows are parsed from JSON
+        features = {r["fingerprint_id"]: r for r in storage.get_fingerprint_feature_rows()}["fp-cols-legacy"]
+        self.assertEqual((features["total_events"], features["events_per_minute"], features["risk_score"]), (7, 0.0, 10))
+        _backfill_feature_columns()
+        row = self._row("fp-cols-legacy")
+        self.assertEqual((row.total_events, row.events_per_minute), (7, 0.0))
+
+
+class TestFingerprintChanges(unittest.TestCase):
+    """اختبارات سجل التغييرات (الإدراج والتحديث والحذف بعد المؤشر)"""
+
+    IDS = ("fp-chg-1", "fp-chg-2")
+
+    @classmethod
+    def setUpClass(cls):
+        init_db()
+
+    def tearDown(self):
+        for fingerprint_id in self.IDS:
+            delete_fingerprint(fingerprint_id)
+
+    def _store(self, fingerprint_id, status="PENDING"):
+        storage._store_fingerprint_sync(ThreatFingerprint(
+            fingerprint_id=fingerprint_id, risk_score=50, user_id="user-chg", status=status, behavioral_features={}
+        ))
+
+    def test_changes_after_cursor(self):
+        """فقط ما تغيّر بعد المؤشر، والحذف عبر شواهد القبور"""
+        self._store("fp-chg-1")
+        cursor = storage.get_fingerprint_changes()["cursor"]
+        self.assertEqual(storage.get_fingerprint_changes(cursor)["changes"], [])
+
+        self._store("fp-chg-2")
+        update_fingerprint_status("fp-chg-1", "BLOCKED")
+        feed = storage.get_fingerprint_changes(cursor)
+        self.assertEqual([(fp["fingerprint_id"], fp["status"]) for fp in feed["changes"]],
+                         [("fp-chg-2", "PENDING"), ("fp-chg-1", "BLOCKED")])
+        self.assertFalse(feed["has_more"])
+
+        delete_fingerprint("fp-chg-1")
+        feed = storage.get_fingerprint_changes(feed["cursor"])
+        self.assertEqual((feed["changes"], feed["deleted"]), ([], ["fp-chg-1"]))
+
+        # Deletion followed by a new store of the same id: reported as a change only
+        cursor = feed["cursor"]
+        delete_fingerprint("fp-chg-2")
+        self._store("fp-chg-2")
+        feed = storage.get_fingerprint_changes(cursor)
+        self.assertEqual([fp["fingerprint_id"] for fp in feed["changes"]], ["fp-chg-2"])
+        self.assertEqual(feed["deleted"], [])
+
+    def test_commit_order_not_clock(self):
+        """الترتيب حسب الالتزام: كتابة بطابع زمني أقدم من المؤشر لا تضيع"""
+        self._store("fp-chg-1")
+        cursor = storage.get_fingerprint_changes()["cursor"]
+        self._store("fp-chg-2")
+        # A writer whose clock is behind (or that started before the cursor was taken)
+        session = get_db_session()
+        try:
+            session.query(FingerprintDB).filter(FingerprintDB.fingerprint_id == "fp-chg-2").update(
+                {FingerprintDB.updated_at: datetime(2000, 1, 1)}, synchronize_session=False)
+            session.commit()
+        finally:
+            session.close()
+        feed = storage.get_fingerprint_changes(cursor)
+        self.assertEqual([fp["fingerprint_id"] for fp in feed["changes"]], ["fp-chg-2"])
+
+    def test_rows_without_change_seq_reported(self):
+        """صف كتبته عملية قديمة دون change_seq يظهر في السجل بدل أن يضيع"""
+        self._store("fp-chg-1")
+        cursor = storage.get_fingerprint_changes()["cursor"]
+        session = get_db_session()
+        try:
+            session.add(FingerprintDB(fingerprint_id="fp-chg-2", user_id="user-chg", risk_score=50,
+                                      status="PENDING", behavioral_features_json="{}"))
+            session.commit()
+        finally:
+            session.close()
+        feed = storage.get_fingerprint_changes(cursor)
+        self.assertEqual([fp["fingerprint_id"] for fp in feed["changes"]], ["fp-chg-2"])
+        self.assertEqual(storage.get_fingerprint_changes(feed["cursor"])["changes"], [])
+
+    @unittest.skipIf(storage.FINGERPRINT_WRITER is None, "write-behind disabled")
+    def test_feed_does_not_flush(self):
+        """قراءة السجل لا تفرض تفريغ قائمة الكتابة المؤجلة"""
+        with mock.patch.object(storage.FINGERPRINT_WRITER, "flush") as flush:
+            cursor = storage.get_fingerprint_changes()["cursor"]
+            storage.get_fingerprint_changes(cursor)
+        flush.assert_not_called()
+
+    def test_limit_and_reset(self):
+        """has_more عند تجاوز الحد، وreset بعد حذف شواهد قديمة"""
+        cursor = storage.get_fingerprint_changes()["cursor"]
+        self._store("fp-chg-1")
+        self._store("fp-chg-2")
+        feed = storage.get_fingerprint_changes(cursor, limit=1)
+        self.assertEqual(len(feed["changes"]), 1)
+        self.assertTrue(feed["has_more"])
+        feed = storage.get_fingerprint_changes(feed["cursor"], limit=1)
+        self.assertEqual([fp["fingerprint_id"] for fp in feed["changes"]], ["fp-chg-2"])
+
+        delete_fingerprint("fp-chg-1")
+        session = get_db_session()
+        try:
+            self.assertGreaterEqual(prune_tombstones(session, timedelta(0)), 1)
+            session.commit()
+        finally:
+            session.close()
+        feed = storage.get_fingerprint_changes(cursor)
+        self.assertTrue(feed["reset"])
+        self.assertFalse(storage.get_fingerprint_changes(feed["cursor"])["reset"])
+        # Cursor of the former (updated_at, id, tombstone id) format
+        legacy = base64.urlsafe_b64encode(b"2024-01-01T00:00:00|5|3").decode().rstrip("=")
+        self.assertTrue(storage.get_fingerprint_changes(legacy)["reset"])
+        with self.assertRaises(ValueError):
+            storage.get_fingerprint_changes("not-a-cursor")
+
+
+class TestChangeBroadcaster(unittest.TestCase):
+    """اختبارات بث التغييرات للمشتركين (قارئ واحد لكل المشاهدين)"""
+
+    def setUp(self):
+        self.feeds = []
+        self.reads = []
+
+        def read_changes(cursor):
+            self.reads.append(cursor)
+            if cursor is None or not self.feeds:
+                return {"changes": [], "deleted": [], "cursor": cursor or "c0", "has_more": False, "reset": False}
+            return self.feeds.pop(0)
+
+        self.broadcaster = ChangeBroadcaster(read_changes, poll_seconds=0.05, buffer_size=2)
+
+    def _feed(self, cursor, fingerprint_id):
+        return {"changes": [{"fingerprint_id": fingerprint_id}], "deleted": [], "cursor": cursor,
+                "has_more": False, "reset": False}
+
+    def test_fan_out_with_one_reader(self):
+        """كل المشتركين يستلمون الدفعة نفسها من قراءة واحدة"""
+        first, second = self.broadcaster.subscribe(), self.broadcaster.subscribe()
+        self.feeds.append(self._feed("c1", "fp-1"))
+        self.broadcaster.wake()
+        for subscription in (first, second):
+            message = subscription.get(timeout=2)
+            self.assertTrue(message.startswith("event: fingerprints\n"))
+            self.assertEqual(json.loads(message.split("data: ", 1)[1])["changes"][0]["fingerprint_id"], "fp-1")
+        self.assertEqual(self.reads[0], None)  # head read once, at the first subscribe
+        self.assertEqual(self.reads.count(None), 1)
+
+    def test_slow_consumer_dropped(self):
+        """المشترك البطيء يُفصل دون التأثير على الآخرين"""
+        slow, fast = self.broadcaster.subscribe(), self.broadcaster.subscribe()
+        for i in range(3):
+            self.broadcaster.publish("fingerprints", {"n": i})
+            self.assertTrue(fast.get(timeout=1))
+        self.assertTrue(slow.dropped)
+        self.assertTrue(slow.get(timeout=1).startswith("event: dropped"))
+        self.assertIsNone(slow.get(timeout=1))
+        self.assertEqual(self.broadcaster.stats()["subscribers"], 1)
+        self.assertEqual(self.broadcaster.stats()["dropped_subscribers"], 1)
+
+    def test_idle_without_subscribers(self):
+        """بدون مشتركين يتوقف القارئ ولا توجد استعلامات"""
+        subscription = self.broadcaster.subscribe()
+        self.broadcaster.unsubscribe(subscription)
+        deadline = time.time() + 2
+        while self.broadcaster.stats()["running"] and time.time() < deadline:
+            time.sleep(0.02)
+        self.assertFalse(self.broadcaster.stats()["running"])
+        reads = len(self.reads)
+        time.sleep(0.2)
+        self.assertEqual(len(self.reads), reads)
+
+
+class TestFingerprintStats(unittest.TestCase):
+    """اختبارات الإحصائيات المجمّعة في استعلام واحد"""
+
+    IDS = ("fp-stats-1", "fp-stats-2", "fp-stats-3")
+
+    @classmethod
+    def setUpClass(cls):
+        init_db()
+
+    def tearDown(self):
+        for fingerprint_id in self.IDS:
+            delete_fingerprint(fingerprint_id)
+
+    def test_single_aggregate_matches_counts(self):
+        """النتائج تطابق استعلامات العدّ المنفصلة"""
+        for fingerprint_id, risk, status, platform in zip(
+                self.IDS, (95, 60, 100), ("BLOCKED", "ACTIVE", "CLEARED"), ("absher", "absher", "tawakkalna")):
+            storage._store_fingerprint_sync(ThreatFingerprint(
+                fingerprint_id=fingerprint_id, risk_score=risk, user_id="user-stats", status=status,
+                behavioral_features={"platform": platform}
+            ))
+        session = get_db_session()
+        try:
+            stats = aggregate_fingerprint_stats(session, 85)
+            count = lambda *conditions: session.query(FingerprintDB).filter(*conditions).count()
+            self.assertEqual(stats["total_fingerprints"], session.query(FingerprintDB).count())
+            self.assertEqual(stats["by_status"]["blocked"], count(FingerprintDB.status == "BLOCKED"))
+            self.assertEqual(stats["by_risk_level"]["high"], count(FingerprintDB.risk_score >= 85))
+            self.assertEqual(stats["by_risk_level"]["medium"],
+                             count(FingerprintDB.risk_score >= 50, FingerprintDB.risk_score < 85))
+            self.assertEqual(sum(bucket["count"] for bucket in stats["risk_histogram"]), stats["total_fingerprints"])
+            self.assertEqual(stats["risk_histogram"][9]["count"], count(FingerprintDB.risk_score >= 90))
+            self.assertEqual(stats["risk_histogram"][6]["count"],
+                             count(FingerprintDB.risk_score >= 60, FingerprintDB.risk_score < 70))
+            self.assertEqual(stats["by_platform"]["tawakkalna"]["by_status"]["cleared"],
+                             count(FingerprintDB.platform == "tawakkalna", FingerprintDB.status == "CLEARED"))
+        finally:
+            session.close()
+
+    def test_ttl_cache(self):
+        """النتيجة مخزنة مؤقتاً حتى انتهاء المدة أو الإبطال"""
+        cache = FingerprintStats(get_db_session, ttl_seconds=60)
+        first = cache.get(85)
+        self.assertIs(cache.get(85), first)
+        self.assertEqual(cache.stats()["computes"], 1)
+        cache.invalidate()
+        self.assertIsNot(cache.get(85), first)
+        cache.get(80)  # another threshold is another result
+        self.assertEqual(cache.stats()["computes"], 3)
+
+
+class TestBulkOperations(unittest.TestCase):
+    """اختبارات العمليات الجماعية (تحديث الحالة والحذف في معاملة واحدة)"""
+
+    IDS = tuple(f"fp-bulk-{i}" for i in range(4))
+
+    @classmethod
+    def setUpClass(cls):
+        init_db()
+
+    def tearDown(self):
+        storage.bulk_delete_fingerprints(list(self.IDS))
+
+    def _store_all(self):
+        for i, fingerprint_id in enumerate(self.IDS):
+            storage._store_fingerprint_sync(ThreatFingerprint(
+                fingerprint_id=fingerprint_id, risk_score=70, user_id=f"user-bulk-{i % 2}", status="ACTIVE",
+                behavioral_features={}
+            ))
+
+    def test_bulk_status_and_delete(self):
+        """تحديث الحالة بالمعرفات أو بالمستخدمين، مع تحديث حالة المخاطر وقائمة المحظورين"""
+        self._store_all()
+        result = storage.bulk_update_fingerprint_status("BLOCKED", fingerprint_ids=["fp-bulk-0", "fp-bulk-missing"],
+                                                        user_ids=["user-bulk-1"])
+        self.assertEqual((result["updated"], result["matched"], result["not_found"]), (3, 3, ["fp-bulk-missing"]))
+        self.assertTrue(storage.BLOCKED_USERS.is_blocked("user-bulk-1"))
+        self.assertEqual(storage.get_user_risk_state("user-bulk-1")["blocked_count"], 2)
+
+        # Already BLOCKED rows are not rewritten
+        self.assertEqual(storage.bulk_update_fingerprint_status("BLOCKED", user_ids=["user-bulk-1"])["updated"], 0)
+
+        result = storage.bulk_update_fingerprint_status("CLEARED", user_ids=["user-bulk-0", "user-bulk-1"],
+                                                        from_statuses=("ACTIVE", "BLOCKED"))
+        self.assertEqual(result["updated"], 4)
+        self.assertFalse(storage.BLOCKED_USERS.is_blocked("user-bulk-1"))
+        self.assertEqual(get_fingerprint_by_id("fp-bulk-2").status, "CLEARED")
+
+        cursor = storage.get_fingerprint_changes()["cursor"]
+        self.assertEqual(storage.bulk_delete_fingerprints(user_ids=["user-bulk-0"])["deleted"], 2)
+        self.assertEqual(storage.get_fingerprint_changes(cursor)["deleted"], ["fp-bulk-0", "fp-bulk-2"])
+        self.assertIsNone(storage.get_user_risk_state("user-bulk-0"))
+
+    def test_concurrent_status_change_not_overwritten(self):
+        """صف تغيّرت حالته بين القراءة والتحديث لا يُكتب فوقه"""
+        self._store_all()
+        select_rows = storage._select_bulk_rows
+
+        def select_then_concurrent_change(*args, **kwargs):
+            rows = select_rows(*args, **kwargs)
+            update_fingerprint_status("fp-bulk-1", "CONFIRMED_THREAT")  # an admin acts meanwhile
+            return rows
+
+        with mock.patch.object(storage, "_select_bulk_rows", select_then_concurrent_change):
+            result = storage.bulk_update_fingerprint_status("CLEARED", user_ids=["user-bulk-1"],
+                                                            from_statuses=("ACTIVE", "BLOCKED"))
+        self.assertEqual(result["updated"], 1)
+        self.assertEqual(get_fingerprint_by_id("fp-bulk-1").status, "CONFIRMED_THREAT")
+        self.assertEqual(get_fingerprint_by_id("fp-bulk-3").status, "CLEARED")
+
+    def test_large_id_lists_are_chunked(self):
+        """قوائم أطول من BULK_CHUNK_SIZE تُقسّم على عدة عبارات"""
+        self._store_all()
+        fingerprint_ids = list(self.IDS) + [f"fp-bulk-none-{i}" for i in range(storage.BULK_CHUNK_SIZE * 2)]
+        result = storage.bulk_update_fingerprint_status("PENDING", fingerprint_ids=fingerprint_ids)
+        self.assertEqual(result["updated"], len(self.IDS))
+        self.assertEqual(len(result["not_found"]), storage.BULK_CHUNK_SIZE * 2)
+
+
+class TestRetention(unittest.TestCase):
+    """اختبارات أرشفة البصمات القديمة على دفعات"""
+
+    USER = "user-retention"
+    IDS = ("fp-ret-cleared", "fp-ret-visit", "fp-ret-blocked", "fp-ret-recent")
+
+    @classmethod
+    def setUpClass(cls):
+        init_db()
+
+    def tearDown(self):
+        for fingerprint_id in self.IDS:
+            delete_fingerprint(fingerprint_id)
+        session = get_db_session()
+        try:
+            session.query(FingerprintArchiveDB).filter(FingerprintArchiveDB.user_id == self.USER).delete()
+            session.commit()
+        finally:
+            session.close()
+
+    def _store(self, fingerprint_id, status, risk, trigger_source, age_days):
+        storage._store_fingerprint_sync(ThreatFingerprint(
+            fingerprint_id=fingerprint_id, risk_score=risk, user_id=self.USER, status=status,
+            behavioral_features={"trigger_source": trigger_source}
+        ))
+        session = get_db_session()
+        try:
+            session.query(FingerprintDB).filter(FingerprintDB.fingerprint_id == fingerprint_id).update(
+                {FingerprintDB.updated_at: datetime.utcnow() - timedelta(days=age_days)}, synchronize_session=False)
+            session.commit()
+        finally:
+            session.close()
+
+    def test_archives_old_rows_in_batches(self):
+        """CLEARED والزيارات العادية القديمة تُنقل للأرشيف، والمحظورة والحديثة تبقى"""
+        self._store("fp-ret-cleared", "CLEARED", 90, "ML_HIGH_RISK", 40)
+        self._store("fp-ret-visit", "ACTIVE", 10, "NORMAL_VISIT_LOG", 10)
+        self._store("fp-ret-blocked", "BLOCKED", 10, "NORMAL_VISIT_LOG", 400)
+        self._store("fp-ret-recent", "ACTIVE", 10, "NORMAL_VISIT_LOG", 1)
+        cursor = storage.get_fingerprint_changes()["cursor"]
+
+        retention = FingerprintRetention(get_db_session, default_rules(30, 7), batch_rows=1)
+        self.assertGreaterEqual(retention.pending()["normal_visit"], 1)
+        result = retention.run()
+        self.assertGreaterEqual(result["batches"], 2)
+        self.assertIsNotNone(result["compaction"])
+
+        self.assertIsNone(get_fingerprint_by_id("fp-ret-cleared"))
+        self.assertIsNone(get_fingerprint_by_id("fp-ret-visit"))
+        self.assertEqual(get_fingerprint_by_id("fp-ret-blocked").status, "BLOCKED")
+        self.assertIsNotNone(get_fingerprint_by_id("fp-ret-recent"))
+
+        session = get_db_session()
+        try:
+            archived = {row.fingerprint_id: row for row in session.query(FingerprintArchiveDB).filter(
+                FingerprintArchiveDB.user_id == self.USER)}
+            self.assertEqual(set(archived), {"fp-ret-cleared", "fp-ret-visit"})
+            self.assertEqual(archived["fp-ret-cleared"].archive_rule, "cleared")
+            self.assertEqual(archived["fp-ret-visit"].to_dict()["behavioral_features"]["trigger_source"],
+                             "NORMAL_VISIT_LOG")
+            state = session.get(UserRiskStateDB, self.USER)
+            self.assertEqual(state.fingerprint_count, 2)
+        finally:
+            session.close()
+
+        # The changes feed reports the archived rows as deleted
+        self.assertEqual(storage.get_fingerprint_changes(cursor)["deleted"], ["fp-ret-cleared", "fp-ret-visit"])
+
+
+class TestFingerprintCache(unittest.TestCase):
+    """اختبارات ذاكرة القراءة المؤقتة للبصمات"""
+
+    @staticmethod
+    def _fp(fingerprint_id, user_id="user-cache", status="ACTIVE"):
+        return ThreatFingerprint(fingerprint_id=fingerprint_id, risk_score=70, user_id=user_id, status=status)
+
+    def test_lru_bound(self):
+        """الذاكرة محدودة الحجم وتُخرج الأقدم استخداماً أولاً"""
+        cache = FingerprintCache(max_entries=2)
+        for fingerprint_id in ("fp-1", "fp-2"):
+            cache.put(self._fp(fingerprint_id), cache.version)
+        cache.get("fp-1")
+        cache.put(self._fp("fp-3"), cache.version)
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get("fp-2"))
+        self.assertIsNotNone(cache.get("fp-1"))
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+    def test_stale_put_ignored(self):
+        """قراءة بدأت قبل كتابة لا تُخزَّن بعدها"""
+        cache = FingerprintCache()
+        version = cache.version
+        cache.invalidate(["fp-1"], ["user-cache"])
+        cache.put(self._fp("fp-1"), version)
+        self.assertIsNone(cache.get("fp-1"))
+
+    def test_user_index_and_invalidation(self):
+        """قائمة المستخدم تُخدم فقط إذا كانت كاملة، مع التصفية حسب الحالة"""
+        cache = FingerprintCache()
+        self.assertIsNone(cache.get_user("user-cache"))
+        cache.put_user("user-cache", [self._fp("fp-1"), self._fp("fp-2", status="BLOCKED")], cache.version)
+        cache.put(self._fp("fp-9", user_id="user-other"), cache.version)
+        self.assertEqual(len(cache.get_user("user-cache")), 2)
+        self.assertEqual([fp.fingerprint_id for fp in cache.get_user("user-cache", "BLOCKED")], ["fp-2"])
+
+        # A new fingerprint of the user makes the cached list incomplete
+        cache.invalidate(["fp-3"], ["user-cache"])
+        self.assertIsNone(cache.get_user("user-cache"))
+        self.assertIsNotNone(cache.get("fp-1"))
+
+        cache.invalidate_user("user-cache")
+        self.assertIsNone(cache.get("fp-1"))
+        self.assertIsNotNone(cache.get("fp-9"))
+
+    def test_ttl(self):
+        """العناصر تنتهي صلاحيتها (تغييرات العمليات الأخرى)"""
+        cache = FingerprintCache(ttl_seconds=0.01)
+        cache.put(self._fp("fp-1"), cache.version)
+        time.sleep(0.02)
+        self.assertIsNone(cache.get("fp-1"))
+        self.assertEqual(len(cache), 0)
+
+    def test_storage_reads_and_write_invalidation(self):
+        """القراءات من storage تملأ الذاكرة ومسارات الكتابة تُبطلها"""
+        init_db()
+        storage._store_fingerprint_sync(self._fp("fp-cache-1"))
+        storage._store_fingerprint_sync(self._fp("fp-cache-2", status="BLOCKED"))
+        try:
+            self.assertEqual(len(storage.get_user_fingerprints("user-cache")), 2)
+            self.assertEqual([fp.fingerprint_id for fp in storage.get_user_fingerprints("user-cache", "BLOCKED")],
+                             ["fp-cache-2"])
+            self.assertIsNotNone(storage.FINGERPRINT_CACHE.get_user("user-cache"))
+
+            update_fingerprint_status("fp-cache-1", "CONFIRMED_THREAT")
+            self.assertIsNone(storage.FINGERPRINT_CACHE.get_user("user-cache"))
+            self.assertEqual(get_fingerprint_by_id("fp-cache-1").status, "CONFIRMED_THREAT")
+            self.assertIs(get_fingerprint_by_id("fp-cache-1"), storage.FINGERPRINT_CACHE.get("fp-cache-1"))
+
+            delete_fingerprint("fp-cache-1")
+            self.assertIsNone(get_fingerprint_by_id("fp-cache-1"))
+            self.assertEqual([fp.fingerprint_id for fp in storage.get_user_fingerprints("user-cache")],
+                             ["fp-cache-2"])
+        finally:
+            delete_fingerprint("fp-cache-1")
+            delete_fingerprint("fp-cache-2")
+
+
+class TestStorageProfile(unittest.TestCase):
+    """اختبارات ملف تعريف التخزين (WAL وإعدادات الاتصال)"""
+
+    def test_sqlite_file_pragmas(self):
+        """ملف SQLite يعمل بوضع WAL مع synchronous=NORMAL"""
+        import tempfile
+        from sqlalchemy import text
+        with tempfile.TemporaryDirectory() as directory:
+            test_engine = make_engine(f"sqlite:///{os.path.join(directory, 'p.db')}", "production")
+            try:
+                with test_engine.connect() as connection:
+                    self.assertEqual(connection.execute(text("PRAGMA journal_mode")).scalar(), "wal")
+                    self.assertEqual(connection.execute(text("PRAGMA synchronous")).scalar(), 1)
+                    self.assertEqual(connection.execute(text("PRAGMA busy_timeout")).scalar(), 5000)
+            finally:
+                test_engine.dispose()
+
+    def test_pool_options(self):
+        """إعدادات المجمّع لـ PostgreSQL، ولا شيء لقاعدة الذاكرة أو الملف الافتراضي"""
+        options = engine_options("postgresql://u:p@localhost/predictai", "production")
+        self.assertTrue(options["pool_pre_ping"])
+        self.assertIn("pool_size", options)
+        self.assertNotIn("pool_size", engine_options("sqlite://", "production"))
+        self.assertNotIn("pool_size", engine_options("sqlite:///x.db", "default"))
+
+
 if __name__ == '__main__':
     unittest.main()
 
@@ -17,7 +17,7 @@ if sys.platform == 'win32':
 # Add backend to path
 sys.path.insert(0, os.path.dirname(__file__))
 
-from db import get_db_session, FingerprintDB, init_db
+from db import get_db_session, FingerprintDB, FingerprintArchiveDB, init_db
 from sqlalchemy import func
 
 def print_header(text):
@@ -107,7 +107,10 @@ def view_statistics():
         ).count()
         low_risk = session.query(FingerprintDB).filter(FingerprintDB.risk_score < 50).count()
         
+        archived = session.query(FingerprintArchiveDB).count()
+        
         print(f"📦 إجمالي البصمات:      {total}")
+        print(f"🗄️  في الأرشيف:          {archived} (--archive للعرض)")
         print(f"\n📊 حسب الحالة:")
         print(f"   ✅ نشطة (ACTIVE):     {active}")
         print(f"   🚫 محظورة (BLOCKED):  {blocked}")
@@ -148,6 +151,38 @@ def view_by_user(user_id):
     finally:
         session.close()
 
+def view_archive(user_id=None, limit=50):
+    """View fingerprints moved to the archive by the retention job (retention.py)"""
+    print_header(f"🗄️ أرشيف البصمات{f' للمستخدم: {user_id}' if user_id else ''}")
+    
+    session = get_db_session()
+    try:
+        query = session.query(FingerprintArchiveDB)
+        if user_id:
+            query = query.filter(FingerprintArchiveDB.user_id == user_id)
+        
+        by_rule = query.with_entities(
+            FingerprintArchiveDB.archive_rule, func.count()
+        ).group_by(FingerprintArchiveDB.archive_rule).all()
+        total = sum(count for _, count in by_rule)
+        if not total:
+            print("⚠️  لا توجد بصمات مؤرشفة")
+            return
+        
+        print(f"📦 إجمالي البصمات المؤرشفة: {total}")
+        for rule, count in by_rule:
+            print(f"   • {rule}: {count}")
+        
+        order = FingerprintArchiveDB.created_at.desc() if user_id else FingerprintArchiveDB.archived_at.desc()
+        archived = query.order_by(order).limit(limit).all()
+        print(f"\n🕒 آخر {len(archived)} بصمة:\n")
+        for idx, fp in enumerate(archived, 1):
+            print(f"{idx}. {fp.fingerprint_id} | User: {fp.user_id} | Risk: {fp.risk_score} | Status: {fp.status} | "
+                  f"Created: {format_datetime(fp.created_at)} | Archived: {format_datetime(fp.archived_at)} ({fp.archive_rule})")
+            
+    finally:
+        session.close()
+
 def export_to_json(output_file="fingerprints_export.json"):
     """Export all fingerprints to JSON file"""
     print_header(f"💾 تصدير البيانات إلى JSON: {output_file}")
@@ -177,6 +212,8 @@ def main():
     parser = argparse.ArgumentParser(description='عرض قاعدة بيانات PredictAI')
     parser.add_argument('--user', type=str, help='عرض بصمات مستخدم معين')
     parser.add_argument('--stats', action='store_true', help='عرض الإحصائيات فقط')
+    parser.add_argument('--archive', action='store_true', help='عرض البصمات المؤرشفة (مع --user لمستخدم معين)')
+    parser.add_argument('--limit', type=int, default=50, help='عدد البصمات المؤرشفة المعروضة')
     parser.add_argument('--export', type=str, metavar='FILE', help='تصدير البيانات إلى ملف JSON')
     
     args = parser.parse_args()
@@ -186,6 +223,8 @@ def main():
     
     if args.export:
         export_to_json(args.export)
+    elif args.archive:
+        view_archive(args.user, args.limit)
     elif args.user:
         view_by_user(args.user)
     elif args.stats:
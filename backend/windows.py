@@ -0,0 +1,138 @@
+"""
+Multi-resolution bucketed event counters per entity (user, device, IP).
+
+Each entity keeps three fixed rings of buckets:
+- 60 one-second buckets   (windows up to 1 minute)
+- 60 one-minute buckets   (windows up to 1 hour)
+- 24 one-hour buckets     (windows up to 24 hours)
+
+Every event increments one bucket per level ("rolled up" as it is recorded),
+so the count over any window up to 24h is a sum over at most 60 buckets and no
+raw events have to be kept. Windows are rounded up to the granularity of the
+finest level that covers them (e.g. a 10-minute window sums 10 minute buckets).
+"""
+
+import math
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from concurrency import StripedLock
+
+# (bucket width in seconds, number of buckets), finest level first
+LEVELS: Tuple[Tuple[int, int], ...] = ((1, 60), (60, 60), (3600, 24))
+
+MAX_WINDOW_SECONDS = LEVELS[-1][0] * LEVELS[-1][1]
+
+
+def to_epoch_seconds(ts: datetime) -> float:
+    """Convert a (naive or aware) datetime to epoch seconds."""
+    return ts.timestamp()
+
+
+class BucketedCounter:
+    """Event counter for one entity over fixed multi-resolution rings."""
+
+    __slots__ = ("_ids", "_counts", "last_seen")
+
+    def __init__(self):
+        # For each level: bucket id stored in each slot (to detect stale slots) and its count
+        self._ids: List[List[int]] = [[-1] * size for _, size in LEVELS]
+        self._counts: List[List[int]] = [[0] * size for _, size in LEVELS]
+        self.last_seen = 0.0
+
+    def add(self, epoch_seconds: float, amount: int = 1) -> None:
+        for level, (width, size) in enumerate(LEVELS):
+            bucket_id = int(epoch_seconds // width)
+            slot = bucket_id % size
+            ids = self._ids[level]
+            if ids[slot] == bucket_id:
+                self._counts[level][slot] += amount
+            elif ids[slot] < bucket_id:
+                # Slot holds an expired bucket: recycle it
+                ids[slot] = bucket_id
+                self._counts[level][slot] = amount
+            # else: event is older than this level's span, nothing to do
+        self.last_seen = max(self.last_seen, epoch_seconds)
+
+    def count(self, now_seconds: float, window_seconds: float) -> int:
+        """Number of events in (now - window, now], at the finest level covering the window."""
+        window_seconds = min(window_seconds, MAX_WINDOW_SECONDS)
+        for level, (width, size) in enumerate(LEVELS):
+            if window_seconds <= width * size:
+                break
+        buckets = max(1, math.ceil(window_seconds / width))
+        newest = int(now_seconds // width)
+        oldest = newest - buckets + 1
+        ids = self._ids[level]
+        counts = self._counts[level]
+        return sum(
+            counts[slot] for slot in range(size)
+            if oldest <= ids[slot] <= newest
+        )
+
+
+class EntityWindows:
+    """
+    BucketedCounter per (kind, key), e.g. ("user", "u-1"), ("ip", "10.0.0.1").
+
+    Entities idle for longer than the largest window are evicted periodically,
+    so memory is proportional to the number of recently active entities.
+    """
+
+    KINDS = ("user", "device", "ip")
+
+    def __init__(self, sweep_every: int = 10000):
+        self._counters: Dict[Tuple[str, str], BucketedCounter] = {}
+        self._locks = StripedLock()
+        self._sweep_every = sweep_every
+        self._since_sweep = 0
+        self._sweep_lock = threading.Lock()
+
+    def record(self, kind: str, key: Optional[str], ts: datetime, amount: int = 1) -> None:
+        if not key or key == "unknown":
+            return
+        epoch = to_epoch_seconds(ts)
+        with self._locks.hold(f"{kind}:{key}"):
+            counter = self._counters.get((kind, key))
+            if counter is None:
+                counter = self._counters[(kind, key)] = BucketedCounter()
+            counter.add(epoch, amount)
+
+        self._since_sweep += 1
+        if self._since_sweep >= self._sweep_every:
+            self.sweep(epoch)
+
+    def record_event(self, event) -> None:
+        """Count an event against its user, device and IP."""
+        self.record("user", event.user_id, event.timestamp1)
+        self.record("device", event.device_id, event.timestamp1)
+        self.record("ip", getattr(event, "ip_address", None), event.timestamp1)
+
+    def count(self, kind: str, key: Optional[str], now: datetime, window: timedelta) -> int:
+        if not key:
+            return 0
+        with self._locks.hold(f"{kind}:{key}"):
+            counter = self._counters.get((kind, key))
+            if counter is None:
+                return 0
+            return counter.count(to_epoch_seconds(now), window.total_seconds())
+
+    def sweep(self, now_seconds: float) -> int:
+        """Evict entities with no events in the last 24 hours. Returns how many were removed."""
+        with self._sweep_lock:
+            self._since_sweep = 0
+            cutoff = now_seconds - MAX_WINDOW_SECONDS
+            stale = [key for key, counter in list(self._counters.items()) if counter.last_seen < cutoff]
+            for key in stale:
+                self._counters.pop(key, None)
+            return len(stale)
+
+    def forget(self, kind: str, key: str) -> None:
+        self._counters.pop((kind, key), None)
+
+    def stats(self) -> Dict[str, Any]:
+        by_kind = {kind: 0 for kind in self.KINDS}
+        for kind, _ in list(self._counters.keys()):
+            by_kind[kind] = by_kind.get(kind, 0) + 1
+        return {"tracked_entities": by_kind}
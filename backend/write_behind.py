@@ -0,0 +1,238 @@
+"""
+Write-behind queue for fingerprint persistence.
+
+store_fingerprint used to run a SELECT + INSERT/UPDATE + COMMIT (one fsync-bound
+transaction) per fingerprint in the request path. WriteBehindQueue acknowledges
+writes immediately into an in-memory pending map keyed by id, and a background
+thread flushes them in one bulk transaction every `flush_interval_ms`, or as
+soon as `max_batch_rows` are pending.
+
+- Read-your-writes: get() / pending() expose rows that are queued or being
+  flushed, so readers can overlay them on database results.
+- Coalescing: several writes to the same id before a flush become one row.
+- write_sync(): writes one row synchronously, ordered after any in-flight batch
+  (used for blocking-relevant fingerprints, so block decisions are never lost).
+- Failure isolation: when a batch fails, its rows are retried one at a time.
+  Rows that fail again are re-queued (unless a newer version was queued
+  meanwhile); after `max_attempts` failed writes a row moves to a bounded
+  dead-letter list (logged, see dead_letters()) so one row that can never be
+  written does not fail every later flush. flush() itself does not raise for
+  failed rows.
+"""
+
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+class WriteBehindQueue:
+    """Pending writes keyed by id, flushed in bulk by a daemon thread."""
+
+    def __init__(self, flush_batch: Callable[[List[Any]], None], key: Callable[[Any], str],
+                 flush_interval_ms: float = 200, max_batch_rows: int = 500, name: str = "write-behind",
+                 max_attempts: int = 5, dead_letter_size: int = 1000):
+        self.flush_batch = flush_batch
+        self.key = key
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.max_batch_rows = max_batch_rows
+        self.name = name
+        self.max_attempts = max_attempts
+
+        self._pending: "OrderedDict[str, Any]" = OrderedDict()
+        self._in_flight: Dict[str, Any] = {}
+        self._attempts: Dict[str, int] = {}  # failed writes of the queued version, by id
+        self._dead_letters: deque = deque(maxlen=dead_letter_size)
+        # Guards _pending / _in_flight; _flush_lock serializes database writes
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._closed = False
+        self._thread: Optional[threading.Thread] = None
+
+        self._submitted = 0
+        self._flushed_rows = 0
+        self._flushes = 0
+        self._sync_writes = 0
+        self._failed_flushes = 0
+        self._failed_rows = 0
+        self._dead_lettered = 0
+        self._last_error: Optional[str] = None
+
+    # ---------- writes ----------
+
+    def submit(self, item: Any) -> None:
+        """Queue an item; it is readable through get() immediately."""
+        with self._cond:
+            self._ensure_thread()
+            item_key = self.key(item)
+            self._pending[item_key] = item
+            self._pending.move_to_end(item_key)
+            self._attempts.pop(item_key, None)
+            self._submitted += 1
+            if len(self._pending) >= self.max_batch_rows:
+                self._cond.notify()
+
+    def write_sync(self, item: Any, write: Callable[[Any], Any]) -> Any:
+        """
+        Persist one item synchronously with `write(item)`. A queued version of the
+        same id is dropped (this one is newer) and any in-flight batch finishes first.
+        """
+        with self._flush_lock:
+            with self._cond:
+                self._pending.pop(self.key(item), None)
+            result = write(item)
+            self._sync_writes += 1
+            return result
+
+    def flush(self) -> int:
+        """
+        Synchronously write everything queued so far. Returns the number of rows written.
+        Rows that could not be written stay queued (or are dead-lettered), see above.
+        """
+        with self._flush_lock:
+            with self._cond:
+                if not self._pending:
+                    return 0
+                batch = self._pending
+                self._pending = OrderedDict()
+                self._in_flight = dict(batch)
+            failed: Dict[str, Tuple[Any, str]] = {}
+            try:
+                self.flush_batch(list(batch.values()))
+            except Exception as e:
+                self._failed_flushes += 1
+                self._last_error = str(e)
+                if len(batch) == 1:
+                    failed = {item_key: (item, str(e)) for item_key, item in batch.items()}
+                else:
+                    failed = self._write_one_by_one(batch)
+            with self._cond:
+                self._in_flight = {}
+                for item_key in batch:
+                    if item_key not in failed:
+                        self._attempts.pop(item_key, None)
+                for item_key, (item, error) in failed.items():
+                    self._retry_or_dead_letter(item_key, item, error)
+            written = len(batch) - len(failed)
+            self._flushes += 1
+            self._flushed_rows += written
+            return written
+
+    def _write_one_by_one(self, batch: "OrderedDict[str, Any]") -> Dict[str, Tuple[Any, str]]:
+        """Retry a failed batch row by row. Returns {id: (item, error)} of the rows that failed again."""
+        failed = {}
+        for item_key, item in batch.items():
+            try:
+                self.flush_batch([item])
+            except Exception as e:
+                failed[item_key] = (item, str(e))
+        return failed
+
+    def _retry_or_dead_letter(self, item_key: str, item: Any, error: str) -> None:
+        # Caller holds self._cond
+        self._failed_rows += 1
+        if item_key in self._pending:
+            # A newer version was queued during the flush and replaces this one
+            return
+        attempts = self._attempts.get(item_key, 0) + 1
+        if attempts < self.max_attempts:
+            self._attempts[item_key] = attempts
+            self._pending[item_key] = item
+            return
+        self._attempts.pop(item_key, None)
+        self._dead_letters.append({"key": item_key, "item": item, "error": error, "attempts": attempts,
+                                   "failed_at": time.time()})
+        self._dead_lettered += 1
+        print(f"☠️ [WRITE-BEHIND] Dropped {item_key} after {attempts} failed writes: {error}")
+
+    def dead_letters(self) -> List[Dict[str, Any]]:
+        """Rows given up on (newest last): {"key", "item", "error", "attempts", "failed_at"}."""
+        with self._cond:
+            return list(self._dead_letters)
+
+    def retry_dead_letters(self) -> int:
+        """Queue the dead-lettered rows again (e.g. after fixing the cause). Returns how many."""
+        with self._cond:
+            letters = list(self._dead_letters)
+            self._dead_letters.clear()
+        for letter in letters:
+            if self.get(letter["key"]) is None:
+                self.submit(letter["item"])
+        return len(letters)
+
+    # ---------- reads ----------
+
+    def get(self, item_key: str) -> Optional[Any]:
+        """Newest queued or in-flight version of an item, if any."""
+        with self._cond:
+            item = self._pending.get(item_key)
+            return item if item is not None else self._in_flight.get(item_key)
+
+    def pending(self) -> List[Any]:
+        """All queued / in-flight items (newest version per id)."""
+        with self._cond:
+            merged = dict(self._in_flight)
+            merged.update(self._pending)
+            return list(merged.values())
+
+    def discard(self, item_key: str) -> None:
+        """Drop a queued write (e.g. the row is being deleted)."""
+        with self._cond:
+            self._pending.pop(item_key, None)
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    # ---------- background thread ----------
+
+    def _ensure_thread(self) -> None:
+        # Caller holds self._cond
+        if self._thread is None and not self._closed:
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                if not self._closed and len(self._pending) < self.max_batch_rows:
+                    self._cond.wait(self.flush_interval)
+                if self._closed:
+                    return
+            failed_before = self._failed_flushes
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"❌ [WRITE-BEHIND] Flush failed, will retry: {e}")
+            if self._failed_flushes != failed_before:
+                # Back off instead of retrying the re-queued rows in a tight loop
+                time.sleep(self.flush_interval)
+
+    def close(self) -> None:
+        """Stop the background thread and flush what is left."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout=5)
+        self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "flush_interval_ms": self.flush_interval * 1000,
+                "max_batch_rows": self.max_batch_rows,
+                "pending": len(self._pending),
+                "in_flight": len(self._in_flight),
+                "submitted": self._submitted,
+                "flushes": self._flushes,
+                "flushed_rows": self._flushed_rows,
+                "sync_writes": self._sync_writes,
+                "failed_flushes": self._failed_flushes,
+                "failed_rows": self._failed_rows,
+                "retrying": len(self._attempts),
+                "max_attempts": self.max_attempts,
+                "dead_letters": len(self._dead_letters),
+                "dead_lettered": self._dead_lettered,
+                "last_error": self._last_error,
+            }
@@ -17,6 +17,51 @@ const API_BASE = (function() {
 
 console.log("🔌 Dashboard connected to:", API_BASE);
 
+// الترقيم بالمؤشر: الخادم يعيد صفحة واحدة (الأحدث أولاً) ومؤشر الصفحة التالية
+const PAGE_SIZE = 50;
+let pageCursors = [null];
+let nextPageCursor = null;
+let pageRows = [];
+
+function fingerprintsUrl() {
+    const params = new URLSearchParams({ limit: PAGE_SIZE });
+    const cursor = pageCursors[pageCursors.length - 1];
+    if (cursor) params.set('cursor', cursor);
+    return `${API_BASE}/api/v1/fingerprints?${params}`;
+}
+
+function nextPage() {
+    if (!nextPageCursor) return;
+    pageCursors.push(nextPageCursor);
+    loadFingerprints();
+}
+
+function previousPage() {
+    if (pageCursors.length <= 1) return;
+    pageCursors.pop();
+    loadFingerprints();
+}
+
+// شريط الصفحات يُنشأ بعد الجدول عند أول تحميل
+function updatePager(table) {
+    let pager = document.getElementById("fingerprints-pager");
+    if (!pager && table && table.parentNode) {
+        pager = document.createElement("div");
+        pager.id = "fingerprints-pager";
+        pager.style.cssText = "display:flex; gap:10px; align-items:center; justify-content:center; margin-top:15px;";
+        pager.innerHTML = `
+            <button id="prev-page" onclick="previousPage()">→ السابق</button>
+            <span id="page-number"></span>
+            <button id="next-page" onclick="nextPage()">التالي ←</button>
+        `;
+        table.parentNode.insertBefore(pager, table.nextSibling);
+    }
+    if (!pager) return;
+    document.getElementById("prev-page").disabled = pageCursors.length <= 1;
+    document.getElementById("next-page").disabled = !nextPageCursor;
+    document.getElementById("page-number").textContent = `صفحة ${pageCursors.length}`;
+}
+
 async function loadFingerprints() {
     const loadingMessage = document.getElementById("loading-message");
     const emptyState = document.getElementById("empty-state");
@@ -27,97 +72,151 @@ async function loadFingerprints() {
     if (!tbody.hasChildNodes() && loadingMessage) loadingMessage.style.display = "block";
     
     try {
-        const response = await fetch(`${API_BASE}/api/v1/fingerprints`);
+        const response = await fetch(fingerprintsUrl());
         if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
         
-        const fingerprints = await response.json();
+        const page = await response.json();
+        pageRows = page.fingerprints || [];
+        nextPageCursor = page.next_cursor || null;
         
         if (loadingMessage) loadingMessage.style.display = "none";
         
-        // تحديث الإحصائيات
-        updateStats(fingerprints);
-        
-        // تفريغ الجدول لإعادة بنائه
-        if (tbody) tbody.innerHTML = "";
+        // تحديث الإحصائيات (لكل البصمات وليس للصفحة فقط)
+        loadStats();
+        updatePager(table);
+        renderRows();
+            
+    } catch (error) {
+        console.error("Error loading fingerprints:", error);
+        if (loadingMessage) loadingMessage.innerHTML = `<span style="color:red">Error connecting to API: ${error.message}</span>`;
+    }
+}
+
+function renderRows() {
+    const emptyState = document.getElementById("empty-state");
+    const table = document.getElementById("fingerprints-table");
+    const tbody = document.getElementById("fingerprints-tbody");
+    const fingerprints = pageRows;
+    
+    // تفريغ الجدول لإعادة بنائه
+    if (tbody) tbody.innerHTML = "";
+    
+    if (fingerprints.length === 0) {
+        if (emptyState) emptyState.style.display = "block";
+        if (table) table.style.display = "none";
+    } else {
+        if (emptyState) emptyState.style.display = "none";
+        if (table) table.style.display = "table";
         
-        if (fingerprints.length === 0) {
-            if (emptyState) emptyState.style.display = "block";
-            if (table) table.style.display = "none";
-        } else {
-            if (emptyState) emptyState.style.display = "none";
-            if (table) table.style.display = "table";
+        // الصفحة مرتبة من الخادم: الأحدث أولاً
+        fingerprints.forEach(fp => {
+            const tr = document.createElement("tr");
             
-            // ترتيب: الأحدث أولاً أو الأعلى خطورة
-            const sortedFingerprints = fingerprints.sort((a, b) => new Date(b.timestamp) - new Date(a.timestamp));
-
-            sortedFingerprints.forEach(fp => {
-                const tr = document.createElement("tr");
-                
-                // تحديد الألوان حسب الخطورة والحالة
-                let riskClass = "risk-low";
-                if (fp.risk_score >= 80) riskClass = "risk-high";
-                else if (fp.risk_score >= 50) riskClass = "risk-medium";
-                
-                // تحديد حالة الزر (هل النظام قام بالحظر تلقائياً؟)
-                const isBlocked = (fp.status === "BLOCKED");
-                
-                let actionButtonsHtml = '';
-
-                // --- منطق التحكم اليدوي ---
-                // زر الحظر (يظهر فقط إذا لم يكن محظوراً)
-                if (!isBlocked) {
-                    actionButtonsHtml += `
-                        <button class="action-button block-now-button" 
-                                onclick="manualAction('block', '${fp.fingerprint_id}', '${fp.user_id}')"
-                                style="background-color: #dc3545; color: white;"
-                                title="فرض الحظر يدوياً">
-                            🚫 منع
-                        </button>
-                    `;
-                }
-
-                // زر السماح/رفع الحظر (يظهر دائماً لمنحك السيطرة)
-                actionButtonsHtml += `
-                    <button class="action-button unblock-user-button" 
-                            onclick="manualAction('unblock', '${fp.fingerprint_id}', '${fp.user_id}')"
-                            style="background-color: #28a745; color: white;"
-                            title="إجبار النظام على السماح">
-                        ✅ سماح / رفع حظر
-                    </button>
-                `;
+            // تحديد الألوان حسب الخطورة والحالة
+            let riskClass = "risk-low";
+            if (fp.risk_score >= 80) riskClass = "risk-high";
+            else if (fp.risk_score >= 50) riskClass = "risk-medium";
+            
+            // تحديد حالة الزر (هل النظام قام بالحظر تلقائياً؟)
+            const isBlocked = (fp.status === "BLOCKED");
+            
+            let actionButtonsHtml = '';
 
-                // زر الحذف
+            // --- منطق التحكم اليدوي ---
+            // زر الحظر (يظهر فقط إذا لم يكن محظوراً)
+            if (!isBlocked) {
                 actionButtonsHtml += `
-                    <button class="action-button delete-button" 
-                            onclick="manualAction('delete', '${fp.fingerprint_id}')"
-                            style="background-color: #6c757d; color: white;">
-                        🗑️ حذف
+                    <button class="action-button block-now-button" 
+                            onclick="manualAction('block', '${fp.fingerprint_id}', '${fp.user_id}')"
+                            style="background-color: #dc3545; color: white;"
+                            title="فرض الحظر يدوياً">
+                        🚫 منع
                     </button>
                 `;
-                
-                // عرض الميزات السلوكية
-                const featuresHtml = formatBehavioralFeatures(fp.behavioral_features);
-                
-                tr.innerHTML = `
-                    <td><code>${fp.fingerprint_id.substring(0, 8)}...</code></td>
-                    <td>${fp.user_id || 'Unknown'}</td>
-                    <td><span class="risk-score ${riskClass}">${fp.risk_score}</span> <br> <small>${fp.status}</small></td>
-                    <td class="behavioral-features">${featuresHtml}</td>
-                    <td><div class="action-buttons" style="display:flex; gap:5px;">${actionButtonsHtml}</div></td>
-                `;
-                
-                tbody.appendChild(tr);
-            });
-        }
-        
-        const now = new Date();
-        const lastUp = document.getElementById("last-updated");
-        if(lastUp) lastUp.textContent = `Last updated: ${now.toLocaleTimeString()}`;
+            }
+
+            // زر السماح/رفع الحظر (يظهر دائماً لمنحك السيطرة)
+            actionButtonsHtml += `
+                <button class="action-button unblock-user-button" 
+                        onclick="manualAction('unblock', '${fp.fingerprint_id}', '${fp.user_id}')"
+                        style="background-color: #28a745; color: white;"
+                        title="إجبار النظام على السماح">
+                    ✅ سماح / رفع حظر
+                </button>
+            `;
+
+            // زر الحذف
+            actionButtonsHtml += `
+                <button class="action-button delete-button" 
+                        onclick="manualAction('delete', '${fp.fingerprint_id}')"
+                        style="background-color: #6c757d; color: white;">
+                    🗑️ حذف
+                </button>
+            `;
             
-    } catch (error) {
-        console.error("Error loading fingerprints:", error);
-        if (loadingMessage) loadingMessage.innerHTML = `<span style="color:red">Error connecting to API: ${error.message}</span>`;
+            // عرض الميزات السلوكية
+            const featuresHtml = formatBehavioralFeatures(fp.behavioral_features);
+            
+            tr.innerHTML = `
+                <td><code>${fp.fingerprint_id.substring(0, 8)}...</code></td>
+                <td>${fp.user_id || 'Unknown'}</td>
+                <td><span class="risk-score ${riskClass}">${fp.risk_score}</span> <br> <small>${fp.status}</small></td>
+                <td class="behavioral-features">${featuresHtml}</td>
+                <td><div class="action-buttons" style="display:flex; gap:5px;">${actionButtonsHtml}</div></td>
+            `;
+            
+            tbody.appendChild(tr);
+        });
+    }
+    
+    const now = new Date();
+    const lastUp = document.getElementById("last-updated");
+    if(lastUp) lastUp.textContent = `Last updated: ${now.toLocaleTimeString()}`;
+}
+
+// دمج التغييرات المرسلة من الخادم في الصفحة الحالية
+function mergeChanges(feed) {
+    const deleted = new Set(feed.deleted || []);
+    const oldestShown = pageRows.length ? pageRows[pageRows.length - 1].created_at : null;
+    pageRows = pageRows.filter(fp => !deleted.has(fp.fingerprint_id));
+    (feed.changes || []).forEach(fp => {
+        const index = pageRows.findIndex(row => row.fingerprint_id === fp.fingerprint_id);
+        if (index !== -1) pageRows[index] = fp;
+        else if (pageCursors.length === 1 && (!oldestShown || fp.created_at >= oldestShown || !nextPageCursor)) pageRows.push(fp);
+    });
+    pageRows.sort((a, b) => (b.created_at || '').localeCompare(a.created_at || ''));
+}
+
+// التحديث الفوري عبر Server-Sent Events، والتحديث الدوري كل 5 ثوانٍ عند عدم توفره
+let pollTimer = null;
+
+function startPolling() {
+    if (!pollTimer) pollTimer = setInterval(loadFingerprints, 5000);
+}
+
+function stopPolling() {
+    if (pollTimer) clearInterval(pollTimer);
+    pollTimer = null;
+}
+
+function startLiveUpdates() {
+    if (!window.EventSource) {
+        startPolling();
+        return;
     }
+    const stream = new EventSource(`${API_BASE}/api/v1/fingerprints/stream`);
+    stream.addEventListener('ready', () => {
+        stopPolling();
+        loadFingerprints(); // تحميل ما فات أثناء الانقطاع
+    });
+    stream.addEventListener('fingerprints', event => {
+        mergeChanges(JSON.parse(event.data));
+        renderRows();
+        loadStats();
+    });
+    stream.addEventListener('reset', loadFingerprints);
+    stream.addEventListener('dropped', loadFingerprints);
+    stream.onerror = () => startPolling();
 }
 
 // دالة موحدة للتحكم اليدوي وإرسال الأوامر
@@ -160,10 +259,22 @@ async function manualAction(action, fingerprintId, userId) {
     }
 }
 
-function updateStats(fingerprints) {
-    const totalCount = fingerprints.length;
-    const highRiskCount = fingerprints.filter(fp => fp.risk_score >= 80).length;
-    const mediumRiskCount = fingerprints.filter(fp => fp.risk_score >= 50 && fp.risk_score < 80).length;
+async function loadStats() {
+    try {
+        const response = await fetch(`${API_BASE}/api/v1/database-stats`);
+        if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
+        const data = await response.json();
+        updateStats(data.statistics);
+    } catch (error) {
+        console.error("Error loading stats:", error);
+    }
+}
+
+function updateStats(stats) {
+    const byRisk = stats.by_risk_level || {};
+    const totalCount = stats.total_fingerprints || 0;
+    const highRiskCount = byRisk.high || 0;
+    const mediumRiskCount = byRisk.medium || 0;
     
     if(document.getElementById("total-count")) document.getElementById("total-count").textContent = totalCount;
     if(document.getElementById("high-risk-count")) document.getElementById("high-risk-count").textContent = highRiskCount;
@@ -182,6 +293,6 @@ function formatBehavioralFeatures(features) {
 if (typeof window !== "undefined") {
     window.addEventListener('DOMContentLoaded', () => {
         loadFingerprints();
-        setInterval(loadFingerprints, 5000);
+        startLiveUpdates();
     });
 }
\ No newline at end of file
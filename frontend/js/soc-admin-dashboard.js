@@ -10,6 +10,93 @@ const API_BASE = (window.location.hostname === 'localhost' || window.location.ho
 let previousFingerprintCount = 0;
 let previousFingerprintIds = new Set();
 
+// Keyset pagination: the server returns one page (newest first) and a cursor for the next one.
+// pageCursors holds the cursor of every page visited so far (null = first page).
+const PAGE_SIZE = 50;
+let pageCursors = [null];
+let nextPageCursor = null;
+
+// Delta sync: the rows of the current page, and the changes-feed cursor to follow them.
+// Polls ask /api/v1/fingerprints/changes for what changed since the cursor and merge it
+// locally instead of reloading the page.
+let pageRows = [];
+let changesCursor = null;
+
+// Bulk triage: fingerprint_ids ticked in the table (kept across pages), sent in one
+// /api/v1/bulk/* request instead of one request per fingerprint.
+let selectedIds = new Set();
+
+/**
+ * Query string for the current page and filters
+ */
+function fingerprintsQuery() {
+    const params = new URLSearchParams({ limit: PAGE_SIZE });
+    const cursor = pageCursors[pageCursors.length - 1];
+    if (cursor) params.set('cursor', cursor);
+
+    const filters = {
+        status: document.getElementById('filter-status'),
+        min_risk: document.getElementById('filter-min-risk'),
+        user_id: document.getElementById('filter-user-id'),
+        platform: document.getElementById('filter-platform')
+    };
+    Object.entries(filters).forEach(([name, input]) => {
+        if (input && input.value.trim() !== '') params.set(name, input.value.trim());
+    });
+    return params.toString();
+}
+
+function currentFilters() {
+    const value = id => {
+        const input = document.getElementById(id);
+        return input ? input.value.trim() : '';
+    };
+    return {
+        status: value('filter-status').toUpperCase().split(',').map(s => s.trim()).filter(Boolean),
+        minRisk: value('filter-min-risk') === '' ? null : Number(value('filter-min-risk')),
+        userId: value('filter-user-id'),
+        platform: value('filter-platform')
+    };
+}
+
+/**
+ * Whether a fingerprint belongs in the current (filtered) list
+ */
+function matchesFilters(fp, filters) {
+    if (filters.status.length && !filters.status.includes(fp.status)) return false;
+    if (filters.minRisk !== null && fp.risk_score < filters.minRisk) return false;
+    if (filters.userId && fp.user_id !== filters.userId) return false;
+    if (filters.platform && fp.platform !== filters.platform) return false;
+    return true;
+}
+
+function applyFilters(event) {
+    if (event) event.preventDefault();
+    pageCursors = [null];
+    loadFingerprints();
+}
+
+function nextPage() {
+    if (!nextPageCursor) return;
+    pageCursors.push(nextPageCursor);
+    loadFingerprints();
+}
+
+function previousPage() {
+    if (pageCursors.length <= 1) return;
+    pageCursors.pop();
+    loadFingerprints();
+}
+
+function updatePager() {
+    const prev = document.getElementById('prev-page');
+    const next = document.getElementById('next-page');
+    const label = document.getElementById('page-number');
+    if (prev) prev.disabled = pageCursors.length <= 1;
+    if (next) next.disabled = !nextPageCursor;
+    if (label) label.textContent = `صفحة ${pageCursors.length}`;
+}
+
 /**
  * Load fingerprints from the API and display them in the SOC admin dashboard
  */
@@ -22,7 +109,7 @@ async function loadFingerprints() {
     if (previousFingerprintCount === 0 && loadingMessage) loadingMessage.style.display = "block";
     
     try {
-        const response = await fetch(`${API_BASE}/api/v1/fingerprints`, {
+        const response = await fetch(`${API_BASE}/api/v1/fingerprints?${fingerprintsQuery()}`, {
             method: 'GET',
             headers: {
                 'Content-Type': 'application/json',
@@ -35,94 +122,25 @@ async function loadFingerprints() {
             throw new Error(`HTTP error! status: ${response.status} - ${response.statusText}`);
         }
         
-        const fingerprints = await response.json();
+        const page = await response.json();
         
-        // Validate response is an array
-        if (!Array.isArray(fingerprints)) {
-            console.warn('Expected array but got:', typeof fingerprints);
-            throw new Error('Invalid response format: expected array');
+        // Validate response is a page of fingerprints
+        if (!page || !Array.isArray(page.fingerprints)) {
+            console.warn('Expected a fingerprints page but got:', page);
+            throw new Error('Invalid response format: expected fingerprints page');
         }
+        pageRows = page.fingerprints;
+        changesCursor = page.changes_cursor || null;
+        nextPageCursor = page.next_cursor || null;
+        updatePager();
         
         if (loadingMessage) loadingMessage.style.display = "none";
-        updateStats(fingerprints);
-        if (tbody) tbody.innerHTML = "";
-        
-        if (fingerprints.length === 0) {
-            if (emptyState) emptyState.style.display = "block";
-            if (table) table.style.display = "none";
-        } else {
-            if (emptyState) emptyState.style.display = "none";
-            if (table) table.style.display = "table";
-            
-            const sortedFingerprints = fingerprints.sort((a, b) => new Date(b.timestamp || 0) - new Date(a.timestamp || 0));
-            
-            sortedFingerprints.forEach(fp => {
-                const tr = document.createElement("tr");
-                
-                // Styling Logic
-                let riskClass = fp.risk_score >= 80 ? "risk-high" : (fp.risk_score >= 50 ? "risk-medium" : "risk-low");
-                let statusText = "نشطة";
-                let statusStyle = "background-color: #ffec99; color: #e67700;";
-                
-                if (fp.status === "BLOCKED") { statusText = "محظورة"; statusStyle = "background-color: #ffa8a8; color: #c92a2a;"; }
-                else if (fp.status === "CLEARED") { statusText = "مُزال المنع"; statusStyle = "background-color: #b2f2bb; color: #2b8a3e;"; }
-                else if (fp.status === "PENDING") { statusText = "قيد المراجعة"; statusStyle = "background-color: #e7f5ff; color: #1c7ed6;"; }
-
-                // REASONS LOGIC: Extract and display reasons at the top of features
-                let reasonsHtml = '';
-                if (fp.behavioral_features && fp.behavioral_features.detection_reasons) {
-                    const reasons = fp.behavioral_features.detection_reasons;
-                    if (Array.isArray(reasons) && reasons.length > 0) {
-                        reasonsHtml = `<div class="reasons-container">
-                            ${reasons.map(r => `<div class="reason-badge">⚠️ ${formatReasonText(r)}</div>`).join('')}
-                        </div>`;
-                    }
-                }
-
-                // Vertical Buttons Logic
-                const isBlocked = (fp.status === "BLOCKED");
-                let actionButtonsHtml = '';
-                
-                if (isBlocked) {
-                    actionButtonsHtml += `<button class="soc-action-btn btn-green" data-action="unblock-user" data-user-id="${fp.user_id}" data-fingerprint-id="${fp.fingerprint_id}"><i>🔓</i> إزالة المنع</button>`;
-                } else {
-                    actionButtonsHtml += `<button class="soc-action-btn btn-red" data-action="block-now" data-fingerprint-id="${fp.fingerprint_id}"><i>✋</i> تأكيد التهديد</button>`;
-                }
-                actionButtonsHtml += `<button class="soc-action-btn btn-grey" data-action="delete" data-fingerprint-id="${fp.fingerprint_id}"><i>🗑️</i> حذف</button>`;
-
-                const featuresHtml = formatBehavioralFeatures(fp.behavioral_features);
-                
-                tr.innerHTML = `
-                    <td style="text-align:center;">
-                        <span class="fingerprint-id-badge">${fp.fingerprint_id.substring(0, 10)}...</span>
-                        <div style="font-size:11px; color:#999; margin-top:5px;">${new Date(fp.timestamp || Date.now()).toLocaleTimeString('ar-SA')}</div>
-                    </td>
-                    <td style="text-align:center;">
-                        <div class="user-info">${fp.user_id || 'Unknown'}</div>
-                        <small style="color:#666;">${fp.platform || 'System'}</small>
-                    </td>
-                    <td style="text-align:center;">
-                        <div class="risk-box ${riskClass}">${fp.risk_score}</div>
-                    </td>
-                    <td style="text-align:center;">
-                        <span style="padding: 5px 12px; border-radius: 20px; font-weight: bold; font-size: 13px; ${statusStyle}">${statusText}</span>
-                    </td>
-                    <td class="behavioral-features">
-                        ${reasonsHtml}
-                        ${featuresHtml}
-                    </td>
-                    <td>
-                        <div class="action-buttons-vertical">${actionButtonsHtml}</div>
-                    </td>
-                `;
-                tbody.appendChild(tr);
-            });
-        }
-        if(document.getElementById("last-updated")) document.getElementById("last-updated").textContent = `آخر تحديث: ${new Date().toLocaleTimeString('ar-SA')}`;
+        loadStats();
+        renderRows();
         
         // Update previous count for notifications
-        previousFingerprintCount = fingerprints.length;
-        previousFingerprintIds = new Set(fingerprints.map(fp => fp.fingerprint_id));
+        previousFingerprintCount = pageRows.length;
+        previousFingerprintIds = new Set(pageRows.map(fp => fp.fingerprint_id));
         
     } catch (error) {
         console.error("Error loading fingerprints:", error);
@@ -141,14 +159,260 @@ async function loadFingerprints() {
     }
 }
 
+/**
+ * Render pageRows into the fingerprints table
+ */
+function renderRows() {
+    const emptyState = document.getElementById("empty-state");
+    const table = document.getElementById("fingerprints-table");
+    const tbody = document.getElementById("fingerprints-tbody");
+    if (tbody) tbody.innerHTML = "";
+    
+    if (pageRows.length === 0) {
+        if (emptyState) emptyState.style.display = "block";
+        if (table) table.style.display = "none";
+    } else {
+        if (emptyState) emptyState.style.display = "none";
+        if (table) table.style.display = "table";
+        // Sorted newest first (by the server, kept by mergeChanges)
+        pageRows.forEach(fp => tbody.appendChild(renderFingerprintRow(fp)));
+    }
+    updateBulkActions();
+    if(document.getElementById("last-updated")) document.getElementById("last-updated").textContent = `آخر تحديث: ${new Date().toLocaleTimeString('ar-SA')}`;
+}
+
+/**
+ * Build the table row of one fingerprint
+ */
+function renderFingerprintRow(fp) {
+    const tr = document.createElement("tr");
+    
+    // Styling Logic
+    let riskClass = fp.risk_score >= 80 ? "risk-high" : (fp.risk_score >= 50 ? "risk-medium" : "risk-low");
+    let statusText = "نشطة";
+    let statusStyle = "background-color: #ffec99; color: #e67700;";
+    
+    if (fp.status === "BLOCKED") { statusText = "محظورة"; statusStyle = "background-color: #ffa8a8; color: #c92a2a;"; }
+    else if (fp.status === "CLEARED") { statusText = "مُزال المنع"; statusStyle = "background-color: #b2f2bb; color: #2b8a3e;"; }
+    else if (fp.status === "PENDING") { statusText = "قيد المراجعة"; statusStyle = "background-color: #e7f5ff; color: #1c7ed6;"; }
+
+    // REASONS LOGIC: Extract and display reasons at the top of features
+    let reasonsHtml = '';
+    if (fp.behavioral_features && fp.behavioral_features.detection_reasons) {
+        const reasons = fp.behavioral_features.detection_reasons;
+        if (Array.isArray(reasons) && reasons.length > 0) {
+            reasonsHtml = `<div class="reasons-container">
+                ${reasons.map(r => `<div class="reason-badge">⚠️ ${formatReasonText(r)}</div>`).join('')}
+            </div>`;
+        }
+    }
+
+    // Vertical Buttons Logic
+    const isBlocked = (fp.status === "BLOCKED");
+    let actionButtonsHtml = '';
+    
+    if (isBlocked) {
+        actionButtonsHtml += `<button class="soc-action-btn btn-green" data-action="unblock-user" data-user-id="${fp.user_id}" data-fingerprint-id="${fp.fingerprint_id}"><i>🔓</i> إزالة المنع</button>`;
+    } else {
+        actionButtonsHtml += `<button class="soc-action-btn btn-red" data-action="block-now" data-fingerprint-id="${fp.fingerprint_id}"><i>✋</i> تأكيد التهديد</button>`;
+    }
+    actionButtonsHtml += `<button class="soc-action-btn btn-grey" data-action="delete" data-fingerprint-id="${fp.fingerprint_id}"><i>🗑️</i> حذف</button>`;
+
+    const featuresHtml = formatBehavioralFeatures(fp.behavioral_features);
+    
+    tr.innerHTML = `
+        <td style="text-align:center;">
+            <input type="checkbox" class="select-fingerprint" ${selectedIds.has(fp.fingerprint_id) ? 'checked' : ''}
+                   onchange="toggleSelection('${fp.fingerprint_id}', this.checked)">
+        </td>
+        <td style="text-align:center;">
+            <span class="fingerprint-id-badge">${fp.fingerprint_id.substring(0, 10)}...</span>
+            <div style="font-size:11px; color:#999; margin-top:5px;">${fp.created_at ? new Date(fp.created_at + 'Z').toLocaleTimeString('ar-SA') : ''}</div>
+        </td>
+        <td style="text-align:center;">
+            <div class="user-info">${fp.user_id || 'Unknown'}</div>
+            <small style="color:#666;">${fp.platform || 'System'}</small>
+        </td>
+        <td style="text-align:center;">
+            <div class="risk-box ${riskClass}">${fp.risk_score}</div>
+        </td>
+        <td style="text-align:center;">
+            <span style="padding: 5px 12px; border-radius: 20px; font-weight: bold; font-size: 13px; ${statusStyle}">${statusText}</span>
+        </td>
+        <td class="behavioral-features">
+            ${reasonsHtml}
+            ${featuresHtml}
+        </td>
+        <td>
+            <div class="action-buttons-vertical">${actionButtonsHtml}</div>
+        </td>
+    `;
+    return tr;
+}
+
+/**
+ * Apply a changes-feed response to pageRows. Returns the fingerprints that are new to the page.
+ */
+function mergeChanges(feed) {
+    const filters = currentFilters();
+    const deleted = new Set(feed.deleted || []);
+    const onFirstPage = pageCursors.length === 1;
+    const oldestShown = pageRows.length ? pageRows[pageRows.length - 1].created_at : null;
+    const added = [];
+
+    pageRows = pageRows.filter(fp => !deleted.has(fp.fingerprint_id));
+    deleted.forEach(id => selectedIds.delete(id));
+    (feed.changes || []).forEach(fp => {
+        const index = pageRows.findIndex(row => row.fingerprint_id === fp.fingerprint_id);
+        if (!matchesFilters(fp, filters)) {
+            if (index !== -1) pageRows.splice(index, 1);
+        } else if (index !== -1) {
+            pageRows[index] = fp;
+        } else if (onFirstPage && (!oldestShown || fp.created_at >= oldestShown || !nextPageCursor)) {
+            // New fingerprint inside the range shown on the first page
+            pageRows.push(fp);
+            added.push(fp);
+        }
+    });
+    pageRows.sort((a, b) => (b.created_at || '').localeCompare(a.created_at || ''));
+    return added;
+}
+
+/**
+ * Merge a batch of changes (polled or streamed) and refresh the table once
+ */
+function applyChanges(feeds) {
+    const changed = feeds.filter(feed => feed.changes.length || feed.deleted.length);
+    if (!changed.length) return;
+    const added = changed.reduce((all, feed) => all.concat(mergeChanges(feed)), []);
+    renderRows();
+    loadStats();
+    if (added.length) showNewFingerprintNotification(added);
+}
+
+/**
+ * Poll the changes feed and merge it into the table (falls back to a full reload)
+ */
+async function pollChanges() {
+    if (!changesCursor) {
+        loadFingerprints();
+        return;
+    }
+    try {
+        const feeds = [];
+        let feed;
+        do {
+            const response = await fetch(`${API_BASE}/api/v1/fingerprints/changes?since=${encodeURIComponent(changesCursor)}`, { cache: 'no-store' });
+            if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
+            feed = await response.json();
+            if (feed.reset) {
+                loadFingerprints();
+                return;
+            }
+            changesCursor = feed.cursor;
+            feeds.push(feed);
+        } while (feed.has_more);
+        applyChanges(feeds);
+    } catch (error) {
+        console.error("Error polling fingerprint changes:", error);
+    }
+}
+
+// Live updates: Server-Sent Events from /api/v1/fingerprints/stream, with polling of the
+// changes feed as a fallback while the stream is unavailable (or EventSource is unsupported).
+const POLL_INTERVAL_MS = 5000;
+let changesStream = null;
+let pollTimer = null;
+
+function startPolling() {
+    if (!pollTimer) pollTimer = setInterval(pollChanges, POLL_INTERVAL_MS);
+}
+
+function stopPolling() {
+    if (pollTimer) clearInterval(pollTimer);
+    pollTimer = null;
+}
+
+function startLiveUpdates() {
+    if (!window.EventSource) {
+        startPolling();
+        return;
+    }
+    changesStream = new EventSource(`${API_BASE}/api/v1/fingerprints/stream`);
+    changesStream.addEventListener('ready', () => {
+        // (Re)connected: stop polling and catch up on anything missed from our own cursor
+        stopPolling();
+        if (changesCursor) pollChanges();
+    });
+    changesStream.addEventListener('fingerprints', event => {
+        const feed = JSON.parse(event.data);
+        changesCursor = feed.cursor;
+        applyChanges([feed]);
+    });
+    // The server lost track (pruned deletions) or dropped us for falling behind: reload
+    changesStream.addEventListener('reset', () => loadFingerprints());
+    changesStream.addEventListener('dropped', () => loadFingerprints());
+    // EventSource reconnects by itself (unless the server refused it); poll meanwhile
+    changesStream.onerror = () => startPolling();
+}
+
+/**
+ * Load the largest multi-user campaigns (users linked through devices, IPs and fingerprints)
+ */
+async function loadCampaigns() {
+    const section = document.getElementById("campaigns-section");
+    const tbody = document.getElementById("campaigns-tbody");
+    if (!section || !tbody) return;
+
+    try {
+        const response = await fetch(`${API_BASE}/api/v1/campaigns?min_users=2&limit=10`, { cache: 'no-store' });
+        if (!response.ok) {
+            throw new Error(`HTTP error! status: ${response.status}`);
+        }
+        const data = await response.json();
+        const campaigns = data.campaigns || [];
+
+        section.style.display = campaigns.length > 0 ? "block" : "none";
+        tbody.innerHTML = campaigns.map(c => {
+            const riskClass = c.max_risk_score >= 80 ? "risk-high" : (c.max_risk_score >= 50 ? "risk-medium" : "risk-low");
+            return `
+                <tr>
+                    <td style="text-align:center;"><span class="fingerprint-id-badge">${c.campaign_id}</span></td>
+                    <td style="text-align:center;">${c.users}</td>
+                    <td style="text-align:center;">${c.devices}</td>
+                    <td style="text-align:center;">${c.ips}</td>
+                    <td style="text-align:center;">${c.fingerprints}</td>
+                    <td style="text-align:center;"><div class="risk-box ${riskClass}">${c.max_risk_score}</div></td>
+                </tr>`;
+        }).join('');
+    } catch (error) {
+        console.error("Error loading campaigns:", error);
+    }
+}
+
+/**
+ * Load statistics for all fingerprints (the table only holds one page)
+ */
+async function loadStats() {
+    try {
+        const response = await fetch(`${API_BASE}/api/v1/database-stats`, { cache: 'no-store' });
+        if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
+        const data = await response.json();
+        updateStats(data.statistics);
+    } catch (error) {
+        console.error("Error loading statistics:", error);
+    }
+}
+
 /**
  * Update statistics cards
  */
-function updateStats(fingerprints) {
-    const totalCount = fingerprints.length;
-    const activeCount = fingerprints.filter(fp => fp.status === "ACTIVE" || fp.status === "PENDING").length;
-    const blockedCount = fingerprints.filter(fp => fp.status === "BLOCKED").length;
-    const clearedCount = fingerprints.filter(fp => fp.status === "CLEARED").length;
+function updateStats(statistics) {
+    const byStatus = statistics.by_status || {};
+    const totalCount = statistics.total_fingerprints || 0;
+    const activeCount = (byStatus.active || 0) + (byStatus.pending || 0);
+    const blockedCount = byStatus.blocked || 0;
+    const clearedCount = byStatus.cleared || 0;
     
     const totalEl = document.getElementById("total-count");
     const activeEl = document.getElementById("active-count");
@@ -324,11 +588,87 @@ async function unblockUser(userId, fingerprintId) {
     }
 }
 
+/**
+ * Select / unselect one fingerprint for a bulk action
+ */
+function toggleSelection(fingerprintId, checked) {
+    if (checked) selectedIds.add(fingerprintId);
+    else selectedIds.delete(fingerprintId);
+    updateBulkActions();
+}
+
+/**
+ * Select / unselect every fingerprint of the current page
+ */
+function toggleSelectAll(checked) {
+    pageRows.forEach(fp => checked ? selectedIds.add(fp.fingerprint_id) : selectedIds.delete(fp.fingerprint_id));
+    renderRows();
+}
+
+/**
+ * Selection counter and bulk buttons
+ */
+function updateBulkActions() {
+    const count = document.getElementById("selected-count");
+    if (count) count.textContent = `${selectedIds.size} محددة`;
+    document.querySelectorAll("#bulk-actions button").forEach(button => {
+        button.disabled = selectedIds.size === 0;
+    });
+    const selectAll = document.getElementById("select-all-fingerprints");
+    if (selectAll) selectAll.checked = pageRows.length > 0 && pageRows.every(fp => selectedIds.has(fp.fingerprint_id));
+}
+
+/**
+ * Apply one action to all selected fingerprints in a single request
+ * (confirm-threat, clear-fingerprint or delete-fingerprint)
+ */
+async function bulkAction(action) {
+    const fingerprintIds = Array.from(selectedIds);
+    if (fingerprintIds.length === 0) return;
+    const labels = {
+        'confirm-threat': 'تأكيد التهديد',
+        'clear-fingerprint': 'إزالة التنبيه',
+        'delete-fingerprint': 'حذف'
+    };
+    if (!confirm(`هل أنت متأكد من ${labels[action]} لـ ${fingerprintIds.length} بصمة؟`)) {
+        return;
+    }
+
+    try {
+        const response = await fetch(`${API_BASE}/api/v1/bulk/${action}`, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json'
+            },
+            body: JSON.stringify({
+                fingerprint_ids: fingerprintIds
+            })
+        });
+
+        if (!response.ok) {
+            throw new Error(`HTTP error! status: ${response.status}`);
+        }
+
+        const data = await response.json();
+        console.log(`✅ [BULK] ${action}:`, data);
+        const done = action === 'delete-fingerprint' ? data.deleted : data.updated;
+        alert(`✅ تم تنفيذ ${labels[action]} على ${done} بصمة`);
+
+        selectedIds.clear();
+        refreshDashboard();
+
+    } catch (error) {
+        console.error(`Error in bulk ${action}:`, error);
+        alert(`خطأ في العملية الجماعية: ${error.message}`);
+    }
+}
+
 /**
  * Refresh dashboard - reloads fingerprints and updates stats
  */
 function refreshDashboard() {
     loadFingerprints();
+    loadCampaigns();
 }
 
 /**
@@ -513,8 +853,10 @@ if (typeof window !== "undefined") {
         }
         
         loadFingerprints();
+        loadCampaigns();
         
-        // Auto-refresh every 5 seconds for real-time monitoring
-        setInterval(loadFingerprints, 5000);
+        // Real-time monitoring: pushed changes, polling only as a fallback
+        startLiveUpdates();
+        setInterval(loadCampaigns, 5000);
     });
 }
\ No newline at end of file